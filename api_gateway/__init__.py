@@ -2,20 +2,14 @@ import sys
 import json
 import os
 import logging
-from dotenv import load_dotenv
-load_dotenv()  # Load environment variables from .env file
 
-from azure.identity import ClientSecretCredential
-from azure.mgmt.web import WebSiteManagementClient
 import azure.functions as func
+from shared_code import arm_usage, bootstrap, function_keys
 
 #https://medium.com/@ssbmqtjt/how-to-connect-an-azure-function-with-an-azure-key-vault-azure-portal-and-python-bd5140178a7
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting application initialization...")
 
@@ -30,37 +24,17 @@ API_DEFAULT_DOMAIN = os.getenv("API_DEFAULT_DOMAIN")
 AZURE_APP_CLIENT_ID = os.getenv("AZURE_APP_CLIENT_ID")
 AZURE_APP_CLIENT_SECRET = os.getenv("AZURE_APP_CLIENT_SECRET")
 
-def get_function_keys(function_name):
+def get_function_keys(function_name, refresh=False):
     try:
-        credentials = ClientSecretCredential(
-            client_id=AZURE_APP_CLIENT_ID,
-            client_secret=AZURE_APP_CLIENT_SECRET,
-            tenant_id=AZURE_TENANT_ID
-        )
-        client = WebSiteManagementClient(credentials, SUBSCRIPTION_ID)
-
-        keys = client.web_apps.list_function_keys(
-            API_RESOURCE_GROUP,
-            API_NAME,
-            function_name
-        )
-
-
-        # keys is a dict-like object, get keys as dict
-        function_keys = {}
-        if keys:
-            if hasattr(keys, 'additional_properties'):
-                function_keys = keys.additional_properties
-            else:
-                function_keys = dict(keys)
-
-        logger.info(f"Retrieved keys: {list(function_keys.keys())}")
-        return function_keys
+        keys = function_keys.get(API_RESOURCE_GROUP, API_NAME, function_name, refresh=refresh)
+        logger.info(f"Retrieved keys: {list(keys.keys())}")
+        return keys
 
     except Exception as e:
         logger.error(f"Exception fetching keys for function '{function_name}': {e}", exc_info=True)
         return None
 
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info("Processing request to retrieve function keys")
 
@@ -91,7 +65,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             status_code=400
         )
 
-    keys = get_function_keys(function_name)
+    # Pass refresh=true after rotating a key; otherwise keys are served from the worker's cache
+    refresh = str(req_body.get('refresh') or req.params.get('refresh') or '').lower() in ('1', 'true', 'yes')
+    keys = get_function_keys(function_name, refresh=refresh)
     if not keys:
         return func.HttpResponse(
             f"No keys found for function '{function_name}' or error occurred.",
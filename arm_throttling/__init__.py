@@ -0,0 +1,34 @@
+import logging
+import json
+import azure.functions as func
+from shared_code import arm_throttle, arm_usage
+
+
+@arm_usage.metered
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Processing request for ARM throttling metrics.')
+
+    try:
+        # Metrics are per worker process: every function in this app shares the scheduler
+        result = {
+            "settings": {
+                "low_priority_rate": arm_throttle.LOW_PRIORITY_RATE,
+                "low_priority_burst": arm_throttle.LOW_PRIORITY_BURST,
+                "low_priority_reserve": arm_throttle.LOW_PRIORITY_RESERVE,
+                "max_wait_seconds": arm_throttle.MAX_WAIT_SECONDS
+            },
+            "subscriptions": arm_throttle.scheduler.metrics()
+        }
+        return func.HttpResponse(
+            json.dumps(result),
+            status_code=200,
+            mimetype="application/json"
+        )
+
+    except Exception as ex:
+        logging.exception("Unhandled error:")
+        return func.HttpResponse(
+            json.dumps({"error": str(ex)}),
+            status_code=500,
+            mimetype="application/json"
+        )
@@ -0,0 +1,533 @@
+"""In-process fake of the Azure management clients and the blob data plane.
+
+Operation groups are generic: writes store the last positional argument as the
+resource under the preceding arguments, reads and deletes look it up by the
+same arguments, and list calls match on the leading arguments. Every call
+counts as one ARM request, sleeps the configured latency and may fail with
+the configured probability. begin_* calls return a poller whose result()
+sleeps the LRO latency and counts one poll per POLL_INTERVAL of it.
+"""
+import base64
+import collections
+import itertools
+import math
+import random
+import threading
+import time
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+SUBSCRIPTION_ID = '00000000-0000-0000-0000-000000000000'
+POLL_INTERVAL = 0.05
+
+# Operation group -> (provider, resource type) for resource ids
+RESOURCE_TYPES = {
+    'virtual_machines': ('Microsoft.Compute', 'virtualMachines'),
+    'disks': ('Microsoft.Compute', 'disks'),
+    'snapshots': ('Microsoft.Compute', 'snapshots'),
+    'galleries': ('Microsoft.Compute', 'galleries'),
+    'gallery_images': ('Microsoft.Compute', 'galleries'),
+    'gallery_image_versions': ('Microsoft.Compute', 'galleries'),
+    'virtual_machine_extensions': ('Microsoft.Compute', 'virtualMachines'),
+    'virtual_networks': ('Microsoft.Network', 'virtualNetworks'),
+    'public_ip_addresses': ('Microsoft.Network', 'publicIPAddresses'),
+    'network_security_groups': ('Microsoft.Network', 'networkSecurityGroups'),
+    'network_interfaces': ('Microsoft.Network', 'networkInterfaces'),
+    'security_rules': ('Microsoft.Network', 'networkSecurityGroups'),
+    'zones': ('Microsoft.Network', 'dnszones'),
+    'record_sets': ('Microsoft.Network', 'dnszones'),
+    'storage_accounts': ('Microsoft.Storage', 'storageAccounts'),
+}
+WRITE_METHODS = ('begin_create_or_update', 'create_or_update', 'begin_create', 'create')
+DELETE_METHODS = ('begin_delete', 'delete')
+READ_METHODS = ('get', 'get_properties')
+# Keyword arguments that are options, not parts of a resource's address
+OPTION_KWARGS = {'expand', 'top', 'filter', 'api_version', 'polling', 'if_match', 'if_none_match', 'etag', 'match_condition', 'recordsetnamesuffix', 'record_set_name_suffix'}
+
+
+class FakeModel:
+    """Attribute view of a dict, recursively; unset attributes are None like SDK models"""
+
+    def __init__(self, data=None, **extra):
+        for key, value in {**(data or {}), **extra}.items():
+            setattr(self, key, _wrap(value))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+    def as_dict(self):
+        return {k: _unwrap(v) for k, v in self.__dict__.items()}
+
+
+def _sdk_fields(value):
+    """Attribute names of an SDK model (typespec or msrest generation), None for anything else"""
+    if isinstance(value, type):
+        return None
+    fields = getattr(type(value), '_attr_to_rest_field', None)
+    if fields is None:
+        fields = getattr(value, '_attribute_map', None)
+    return list(fields) if fields is not None else None
+
+
+def _wrap(value):
+    if isinstance(value, FakeModel):
+        return value
+    fields = _sdk_fields(value)
+    if fields is not None:
+        data = {}
+        for name in fields:
+            try:
+                field = getattr(value, name)
+            except Exception:
+                continue
+            if field is None:
+                continue
+            if name == 'properties':
+                # Flattened the way the SDK exposes them (vm.storage_profile)
+                data.update(_wrap(field).__dict__)
+            else:
+                data[name] = field
+        return FakeModel(data)
+    if isinstance(value, dict):
+        return FakeModel(value)
+    if isinstance(value, (list, tuple)):
+        return [_wrap(v) for v in value]
+    return value
+
+
+def _unwrap(value):
+    if isinstance(value, FakeModel):
+        return value.as_dict()
+    if isinstance(value, list):
+        return [_unwrap(v) for v in value]
+    return value
+
+
+class FakePoller:
+    def __init__(self, fake, operation, result):
+        self._fake = fake
+        self._operation = operation
+        self._result = result
+        self._done = False
+
+    def result(self, timeout=None):
+        if not self._done:
+            self._fake.lro_wait(self._operation)
+            self._done = True
+        return self._result
+
+    def wait(self, timeout=None):
+        self.result()
+
+    def done(self):
+        return self._done
+
+    def status(self):
+        return 'Succeeded' if self._done else 'InProgress'
+
+
+class FakeAzure:
+    """Shared state and accounting behind every fake client of one benchmark run"""
+
+    def __init__(self, latency=0.0, lro_latency=0.0, failure_rate=0.0, seed=0, latencies=None):
+        self.latency = latency
+        self.lro_latency = lro_latency
+        self.failure_rate = failure_rate
+        self.latencies = latencies or {}      # "group.method" -> seconds, overrides latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ip_counter = itertools.count(4)
+        self.resources = {}                   # (group, key...) -> FakeModel
+        self.blobs = {}                       # (account, container, blob) -> bytes
+        self.calls = collections.Counter()
+        self.arm_calls = 0
+        self.lro_polls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.in_flight_peak = 0
+        self.threads_peak = 0
+
+    # ---------- accounting ----------
+
+    def call(self, operation, func):
+        with self._lock:
+            self.arm_calls += 1
+            self.calls[operation] += 1
+            self.in_flight += 1
+            self.in_flight_peak = max(self.in_flight_peak, self.in_flight)
+            self.threads_peak = max(self.threads_peak, threading.active_count())
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+        try:
+            delay = self.latencies.get(operation, self.latency)
+            if delay:
+                time.sleep(delay)
+            if fail:
+                with self._lock:
+                    self.failures += 1
+                raise HttpResponseError(message=f"Injected failure in {operation}")
+            return func()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def lro_wait(self, operation):
+        delay = self.latencies.get(f"{operation}:lro", self.lro_latency)
+        polls = max(1, math.ceil(delay / POLL_INTERVAL)) if delay else 1
+        with self._lock:
+            self.lro_polls += polls
+            self.arm_calls += polls
+        if delay:
+            time.sleep(delay)
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.arm_calls = self.lro_polls = self.failures = 0
+            self.in_flight_peak = self.threads_peak = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "arm_calls": self.arm_calls,
+                "lro_polls": self.lro_polls,
+                "injected_failures": self.failures,
+                "in_flight_peak": self.in_flight_peak,
+                "threads_peak": self.threads_peak,
+                "calls": dict(sorted(self.calls.items()))
+            }
+
+    # ---------- resources ----------
+
+    def resource_id(self, group, key):
+        provider, resource_type = RESOURCE_TYPES.get(group, ('Microsoft.Fake', group))
+        resource_group, *names = key
+        path = '/'.join(str(n) for n in names)
+        return f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{resource_group}/providers/{provider}/{resource_type}/{path}"
+
+    def next_ip(self):
+        n = next(self._ip_counter)
+        return f"20.0.{n // 250}.{n % 250 + 1}"
+
+    def store(self, group, key, params):
+        model = _wrap(params) if params is not None else FakeModel()
+        if not isinstance(model, FakeModel):
+            model = FakeModel()
+        model.name = str(key[-1]) if group != 'record_sets' else str(key[2])
+        model.id = self.resource_id(group, key)
+        model.type = '/'.join(RESOURCE_TYPES.get(group, ('Microsoft.Fake', group)))
+        model.provisioning_state = 'Succeeded'
+        if group == 'record_sets':
+            model.type = f"Microsoft.Network/dnszones/{key[3]}"
+        elif group == 'public_ip_addresses' and not model.ip_address:
+            model.ip_address = self.next_ip()
+        elif group == 'virtual_networks':
+            for subnet in (model.subnets or []):
+                subnet.id = f"{model.id}/subnets/{subnet.name}"
+        elif group == 'network_security_groups':
+            model.security_rules = model.security_rules or []
+        elif group == 'zones':
+            model.name_servers = [f"ns{i}-01.azure-dns.com." for i in range(1, 5)]
+        elif group == 'virtual_machines':
+            model.vm_id = model.vm_id or f"{abs(hash(model.id)):032x}"[:32]
+            os_disk = model.storage_profile.os_disk if model.storage_profile else None
+            if os_disk is not None:
+                os_disk.name = os_disk.name or f"{key[-1]}_OsDisk"
+                os_disk.managed_disk = os_disk.managed_disk or FakeModel()
+                os_disk.managed_disk.id = self.resource_id('disks', (key[0], os_disk.name))
+                self.resources[('disks', key[0].lower(), os_disk.name.lower())] = FakeModel(
+                    name=os_disk.name, id=os_disk.managed_disk.id, type='Microsoft.Compute/disks',
+                    location=model.location, tags=model.tags
+                )
+            model.instance_view = FakeModel(statuses=[
+                {"code": "ProvisioningState/succeeded"}, {"code": "PowerState/running"}
+            ])
+        with self._lock:
+            self.resources[(group, *[str(k).lower() for k in key])] = model
+        return model
+
+    def lookup(self, group, key):
+        model = self.resources.get((group, *[str(k).lower() for k in key]))
+        if model is None:
+            raise ResourceNotFoundError(message=f"{group} {'/'.join(map(str, key))} not found")
+        return model
+
+    def remove(self, group, key):
+        with self._lock:
+            self.resources.pop((group, *[str(k).lower() for k in key]), None)
+
+    def matching(self, group, prefix):
+        prefix = tuple(str(k).lower() for k in prefix)
+        with self._lock:
+            return [
+                model for stored_key, model in self.resources.items()
+                if stored_key[0] == group and stored_key[1:1 + len(prefix)] == prefix
+            ]
+
+
+class FakeOperations:
+    """One operation group (client.virtual_machines, client.record_sets, ...)"""
+
+    def __init__(self, fake, group):
+        self._fake = fake
+        self._group = group
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        operation = f"{self._group}.{method}"
+        handler = getattr(self, f"_op_{method}", None)
+
+        def call(*args, **kwargs):
+            address = list(args) + [v for k, v in kwargs.items() if k not in OPTION_KWARGS and k != 'parameters']
+            if 'parameters' in kwargs:
+                address.append(kwargs['parameters'])
+            if handler is not None:
+                work = lambda: handler(address, kwargs)
+            else:
+                work = lambda: self._generic(method, address, kwargs)
+            result = self._fake.call(operation, work)
+            if method.startswith('begin_'):
+                return FakePoller(self._fake, operation, result)
+            return result
+
+        return call
+
+    def _generic(self, method, address, kwargs):
+        group = self._group
+        if method in ('begin_update', 'update'):
+            # PATCH: merge into the stored resource
+            current = self._fake.lookup(group, address[:-1])
+            patch = _wrap(address[-1])
+            merged = current.as_dict()
+            merged.update({k: v for k, v in patch.as_dict().items() if v is not None})
+            return self._fake.store(group, address[:-1], merged)
+        if method in WRITE_METHODS:
+            return self._fake.store(group, address[:-1], address[-1])
+        if method in READ_METHODS:
+            return self._fake.lookup(group, address)
+        if method in DELETE_METHODS:
+            self._fake.remove(group, address)
+            return None
+        if method.startswith('list'):
+            return self._fake.matching(group, address)
+        if method.startswith('begin_'):
+            return FakeModel(status='Succeeded', access_sas='https://fake.blob.core.windows.net/sas')
+        return FakeModel()
+
+    # ---------- group specifics ----------
+
+    def _op_list_keys(self, address, kwargs):
+        key = base64.b64encode(b'fake-storage-account-key-000000').decode()
+        return FakeModel(keys=[{"key_name": "key1", "value": key}, {"key_name": "key2", "value": key}])
+
+    def _op_check_name_availability(self, address, kwargs):
+        return FakeModel(name_available=True)
+
+    def _op_list_by_type(self, address, kwargs):
+        resource_group, zone, record_type = address[:3]
+        return [r for r in self._fake.matching('record_sets', (resource_group, zone)) if r.type.endswith(f"/{record_type}")]
+
+    def _op_list_all_by_dns_zone(self, address, kwargs):
+        return self._fake.matching('record_sets', address[:2])
+
+    def _op_list_by_dns_zone(self, address, kwargs):
+        return self._fake.matching('record_sets', address[:2])
+
+
+class FakeResources(FakeOperations):
+    """resource_client.resources: generic resources by resource group and id"""
+
+    def _op_list_by_resource_group(self, address, kwargs):
+        resource_group = str(address[0]).lower()
+        with self._fake._lock:
+            models = [
+                model for key, model in self._fake.resources.items()
+                if key[1] == resource_group and key[0] in RESOURCE_TYPES and key[0] not in (
+                    'virtual_machine_extensions', 'security_rules', 'record_sets', 'gallery_images', 'gallery_image_versions'
+                )
+            ]
+        return [FakeModel(id=m.id, name=m.name, type=m.type, tags=m.tags, location=m.location) for m in models]
+
+    def _op_begin_delete_by_id(self, address, kwargs):
+        resource_id = str(address[0]).lower()
+        with self._fake._lock:
+            for key, model in list(self._fake.resources.items()):
+                if (model.id or '').lower() == resource_id:
+                    del self._fake.resources[key]
+                    return None
+        raise ResourceNotFoundError(message=f"{resource_id} not found")
+
+
+class FakeResourceSkus(FakeOperations):
+    SIZES = {
+        'Standard_D2s_v3': (2, 8, 0), 'Standard_D4s_v3': (4, 16, 0), 'Standard_D8s_v3': (8, 32, 0),
+        'Standard_NV6ads_A10_v5': (6, 55, 1), 'Standard_NC4as_T4_v3': (4, 28, 1), 'Standard_B2s': (2, 4, 0),
+    }
+
+    @staticmethod
+    def family(name):
+        """Standard_D4s_v3 -> standardDSv3Family, the way resource_skus.list names families"""
+        parts = name.split('_')
+        return f"standard{''.join(c for c in parts[1] if not c.isdigit()).upper()}{''.join(parts[2:])}Family"
+
+    def _op_list(self, address, kwargs):
+        location = 'uksouth'
+        if 'filter' in kwargs and "'" in kwargs['filter']:
+            location = kwargs['filter'].split("'")[1]
+        skus = []
+        for name, (vcpus, memory, gpus) in self.SIZES.items():
+            skus.append(FakeModel(
+                name=name, resource_type='virtualMachines', family=self.family(name),
+                locations=[location], location_info=[{"location": location, "zones": ["1", "2", "3"]}],
+                restrictions=[],
+                capabilities=[{"name": k, "value": v} for k, v in {
+                    "vCPUs": str(vcpus), "MemoryGB": str(memory), "GPUs": str(gpus),
+                    "PremiumIO": "True", "EphemeralOSDiskSupported": "True",
+                    "CachedDiskBytes": str(128 * 1024 ** 3), "MaxResourceVolumeMB": str(64 * 1024),
+                    "AcceleratedNetworkingEnabled": "True", "CpuArchitectureType": "x64",
+                    "HyperVGenerations": "V1,V2"
+                }.items()]
+            ))
+        return skus
+
+
+class FakeUsage(FakeOperations):
+    def _op_list(self, address, kwargs):
+        return [
+            FakeModel(name={"value": name, "localized_value": name}, current_value=0, limit=1000)
+            for name in ('cores', 'standardDSv3Family', 'standardNVADSA10v5Family', 'standardNCASv3_T4Family', 'standardBSFamily')
+        ]
+
+
+class FakeClient:
+    """Any azure-mgmt-* client: attributes are operation groups"""
+
+    SPECIAL = {'resources': FakeResources, 'resource_skus': FakeResourceSkus, 'usage': FakeUsage}
+
+    def __init__(self, fake, credentials=None, subscription_id=None, **kwargs):
+        self._fake = fake
+        self._groups = {}
+
+    def __getattr__(self, group):
+        if group.startswith('_'):
+            raise AttributeError(group)
+        if group not in self._groups:
+            self._groups[group] = self.SPECIAL.get(group, FakeOperations)(self._fake, group)
+        return self._groups[group]
+
+    def close(self):
+        pass
+
+
+def client_class(fake):
+    """A drop-in for ComputeManagementClient & co. bound to fake"""
+    return lambda credentials=None, subscription_id=None, *args, **kwargs: FakeClient(fake, credentials, subscription_id)
+
+
+# ====================== BLOB DATA PLANE ======================
+
+class FakeBlobClient:
+    def __init__(self, fake, account, container, blob):
+        self._fake = fake
+        self._address = (account, container, blob)
+        self.url = f"https://{account}.blob.core.windows.net/{container}/{blob}"
+        self.container_name = container
+        self.blob_name = blob
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        def work():
+            self._fake.blobs[self._address] = data.encode() if isinstance(data, str) else bytes(data)
+        return self._fake.call('blob.upload_blob', work)
+
+    def download_blob(self, **kwargs):
+        def work():
+            if self._address not in self._fake.blobs:
+                raise ResourceNotFoundError(message=f"Blob {self.url} not found")
+            return FakeModel(content=self._fake.blobs[self._address])
+        stream = self._fake.call('blob.download_blob', work)
+        stream.readall = lambda: stream.content
+        return stream
+
+    def delete_blob(self, **kwargs):
+        return self._fake.call('blob.delete_blob', lambda: self._fake.blobs.pop(self._address, None))
+
+    def exists(self):
+        return self._address in self._fake.blobs
+
+
+class FakeContainerClient:
+    def __init__(self, fake, account, container):
+        self._fake = fake
+        self._account = account
+        self.container_name = container
+        self.url = f"https://{account}.blob.core.windows.net/{container}"
+
+    def create_container(self, **kwargs):
+        return self._fake.call('blob.create_container', lambda: None)
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self._fake, self._account, self.container_name, blob)
+
+    def upload_blob(self, name, data, overwrite=False, **kwargs):
+        return self.get_blob_client(name).upload_blob(data, overwrite=overwrite)
+
+    def download_blob(self, name, **kwargs):
+        return self.get_blob_client(name).download_blob()
+
+    def delete_blob(self, name, **kwargs):
+        return self.get_blob_client(name).delete_blob()
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        prefix = name_starts_with or ''
+        return self._fake.call('blob.list_blobs', lambda: [
+            FakeModel(name=blob) for (account, container, blob) in list(self._fake.blobs)
+            if account == self._account and container == self.container_name and blob.startswith(prefix)
+        ])
+
+    def exists(self):
+        return True
+
+
+class FakeBlobServiceClient:
+    def __init__(self, fake, account_url='https://fake.blob.core.windows.net', credential=None, **kwargs):
+        self._fake = fake
+        self.account_name = account_url.split('//')[-1].split('.')[0]
+        self.url = account_url
+
+    def get_container_client(self, container):
+        return FakeContainerClient(self._fake, self.account_name, container)
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self._fake, self.account_name, container, blob)
+
+    def create_container(self, container, **kwargs):
+        self._fake.call('blob.create_container', lambda: None)
+        return self.get_container_client(container)
+
+    def delete_container(self, container, **kwargs):
+        return self._fake.call('blob.delete_container', lambda: None)
+
+
+def blob_service_class(fake):
+    """A drop-in for BlobServiceClient (constructor and from_connection_string) bound to fake"""
+
+    class BoundBlobServiceClient(FakeBlobServiceClient):
+        def __init__(self, account_url='https://fake.blob.core.windows.net', credential=None, **kwargs):
+            super().__init__(fake, account_url, credential)
+
+        @classmethod
+        def from_connection_string(cls, connection_string, **kwargs):
+            parts = dict(p.split('=', 1) for p in connection_string.split(';') if '=' in p)
+            return cls(f"https://{parts.get('AccountName', 'fake')}.blob.core.windows.net")
+
+    return BoundBlobServiceClient
+
+
+class FakeCredential:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_token(self, *scopes, **kwargs):
+        return FakeModel(token='fake-token', expires_on=int(time.time()) + 3600)
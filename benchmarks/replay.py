@@ -0,0 +1,113 @@
+"""Replay a recorded invocation offline and report its ARM call count and latency profile.
+
+Record on a function app (or `func start`) by setting ARM_RECORD_DIR; every
+invocation writes one JSON lines file of its ARM and blob exchanges, with
+credentials scrubbed. Then run the same function against that file:
+
+    python -m benchmarks.replay recordings/20260101T120000-1a2b3c.jsonl list_vm_html \\
+        --payload '{"resource_group": "rtx"}'
+    python -m benchmarks.replay recordings/...jsonl create_vm_s_plane --payload @plane.json --speed 0
+
+The handler runs with the real SDK clients on a transport answering from the
+recording, so a change that adds, drops or reorders calls shows up as missed
+or unused exchanges and a different call count.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+
+from benchmarks.run import BENCH_ENV, ROOT, Harness, drain, request
+
+
+def load_payload(value):
+    if not value:
+        return {}
+    if value.startswith('@'):
+        with open(value[1:], encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+async def replay_function(args):
+    from shared_code import arm_recorder
+
+    module = importlib.import_module(args.function)
+    harness = Harness(None, args.sleep_scale, email_latency=0)
+    harness.patch()
+    replay = arm_recorder.replay()
+
+    start = time.perf_counter()
+    response = module.main(request(load_payload(args.payload), dict(p.split('=', 1) for p in args.param)))
+    if asyncio.iscoroutine(response):
+        response = await response
+    finished = await drain(args.timeout)
+    wall = time.perf_counter() - start
+
+    final = harness.status_events[-1] if harness.status_events else {}
+    unused = replay.unused()
+    return {
+        "function": args.function,
+        "recording": args.recording,
+        "http_status": response.status_code,
+        "final_status": final.get("status"),
+        "timed_out": not finished,
+        "wall_seconds": round(wall, 3),
+        "speed": replay.speed,
+        "arm_calls": replay.stats["served"] + replay.stats["missed"],
+        "served": replay.stats["served"],
+        "repeated": replay.stats["repeated"],
+        "missed": replay.stats["missed"],
+        "recorded_arm_ms": round(replay.stats["recorded_ms"], 1),
+        "missing": replay.stats["missing"],
+        "unused": unused,
+        "status_events": len(harness.status_events),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='JSON lines file written under ARM_RECORD_DIR')
+    parser.add_argument('function', help='function folder to run, e.g. list_vm_html')
+    parser.add_argument('--payload', help='JSON request body, or @file')
+    parser.add_argument('--param', action='append', default=[], help='query parameter as name=value')
+    parser.add_argument('--speed', type=float, default=1.0, help='factor applied to recorded latencies (0 = none)')
+    parser.add_argument('--sleep-scale', type=float, default=0.001, help='factor applied to the handlers\' own sleeps')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds the invocation may take')
+    parser.add_argument('--output', help='also write the result to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help='show the handlers\' logging')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ.update(BENCH_ENV)
+    os.environ.setdefault('AZURE_STORAGE_CONNECTION_STRING',
+                          'DefaultEndpointsProtocol=https;AccountName=replay;AccountKey=cmVwbGF5;EndpointSuffix=core.windows.net')
+    os.environ['ARM_REPLAY_PATH'] = os.path.abspath(args.recording)
+    os.environ['ARM_REPLAY_SPEED'] = str(args.speed)
+    os.environ.pop('ARM_RECORD_DIR', None)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    result = asyncio.run(replay_function(args))
+    print(
+        f"{result['function']}: HTTP {result['http_status']} {result['final_status'] or ''} "
+        f"{result['wall_seconds']:.3f}s arm={result['arm_calls']} served={result['served']} "
+        f"repeated={result['repeated']} missed={result['missed']} unused={sum(result['unused'].values())} "
+        f"recorded_arm={result['recorded_arm_ms']:.0f}ms"
+    )
+    for key in result["missing"]:
+        print(f"  not recorded: {key}")
+    for key, count in result["unused"].items():
+        print(f"  not requested: {key} (x{count})")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if result["missed"] or result["timed_out"] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""End-to-end provisioning benchmarks against the in-process fake Azure.
+
+Drives the real function handlers (create_vm, one create_vm_s_* service,
+clone_vm and delete_vm) through main() and waits for their background work.
+Reports wall time, ARM calls (including LRO polls), peak concurrent ARM calls
+and threads, and status events per scenario, and compares them with a saved
+JSON baseline.
+
+    python -m benchmarks.run                      # run and compare with benchmarks/baseline.json
+    python -m benchmarks.run --update-baseline    # run and save as the new baseline
+    python -m benchmarks.run --latency 0.05 --lro-latency 0.5 --failure-rate 0.02
+"""
+import argparse
+import asyncio
+import collections
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Environment the handlers expect; nothing here reaches a real service
+BENCH_ENV = {
+    'AZURE_SUBSCRIPTION_ID': '00000000-0000-0000-0000-000000000000',
+    'AZURE_TENANT_ID': 'bench-tenant',
+    'AZURE_APP_CLIENT_ID': 'bench-client',
+    'AZURE_APP_CLIENT_SECRET': 'bench-secret',
+    'AZURE_APP_TENANT_ID': 'bench-tenant',
+    'AZURE_STORAGE_URL': 'https://benchstorage.blob.core.windows.net',
+    'SENDER_EMAIL': 'bench@example.com',
+    'SMTP_HOST': 'smtp.invalid',
+    'SMTP_PORT': '587',
+    'SMTP_USER': 'bench',
+    'SMTP_PASS': 'bench',
+    'TLS_CERT_SERVICE': 'false',
+    'TRACING_EXPORT': 'false',
+    'WARM_POOL_TARGETS': '',
+    'SKU_CATALOG_PATH': os.path.join(tempfile.gettempdir(), 'rtxapi_bench_sku_catalog.json'),
+}
+
+# Class names replaced in every loaded repo module
+CLIENT_NAMES = (
+    'ComputeManagementClient', 'NetworkManagementClient', 'DnsManagementClient',
+    'StorageManagementClient', 'ResourceManagementClient', 'WebSiteManagementClient'
+)
+
+RESOURCE_GROUP = 'bench-rg'
+DOMAIN = 'benchexample.com'
+LOCATION = 'uksouth'
+GALLERY = ('bench-gallery-rg', 'benchgallery', 'win10-rtx')
+CLONE_IMAGE = 'benchwin-image'
+# Handlers skip some updates without a hook URL; status updates never leave the process
+HOOK_URL = 'https://hooks.invalid/bench'
+
+# Metrics compared with the baseline; wall time gets a relative tolerance
+EXACT_METRICS = ('arm_calls', 'status_events')
+
+
+def repo_modules():
+    benchmarks = os.path.join(ROOT, 'benchmarks')
+    return [m for m in list(sys.modules.values())
+            if (getattr(m, '__file__', None) or '').startswith(ROOT) and not m.__file__.startswith(benchmarks)]
+
+
+class Harness:
+    """Patches the loaded handler modules onto one FakeAzure and records status events.
+
+    Without a FakeAzure the real SDK clients stay in place (for replaying
+    recorded traffic); credentials, DNS checks, email and status hooks are
+    still kept offline.
+    """
+
+    def __init__(self, fake, sleep_scale, email_latency):
+        self.fake = fake
+        self.sleep_scale = sleep_scale
+        self.email_latency = email_latency
+        self.status_events = []
+        self.emails = 0
+        self._scaled_asyncio = self._make_scaled_asyncio()
+
+    def _make_scaled_asyncio(self):
+        proxy = types.ModuleType('asyncio')
+        proxy.__dict__.update(asyncio.__dict__)
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay, result=None):
+            return await real_sleep(delay * self.sleep_scale, result)
+
+        proxy.sleep = sleep
+        return proxy
+
+    def patch(self):
+        from azure.core.exceptions import ResourceNotFoundError  # noqa: F401 - fail early without azure-core
+        from benchmarks import fake_azure
+
+        harness = self
+
+        for module in repo_modules():
+            if self.fake is not None:
+                client = fake_azure.client_class(self.fake)
+                for name in CLIENT_NAMES:
+                    if hasattr(module, name):
+                        setattr(module, name, client)
+                if hasattr(module, 'BlobServiceClient'):
+                    module.BlobServiceClient = fake_azure.blob_service_class(self.fake)
+            if hasattr(module, 'ClientSecretCredential'):
+                module.ClientSecretCredential = fake_azure.FakeCredential
+            if getattr(module, 'asyncio', None) is asyncio and not module.__name__.startswith('shared_code'):
+                module.asyncio = self._scaled_asyncio
+            if hasattr(module, 'time') and isinstance(module.time, types.ModuleType) and not module.__name__.startswith('shared_code'):
+                module.time = self._scaled_time()
+            # Name server delegation is checked against public DNS
+            for name in ('check_ns_delegation', 'check_ns_delegation_with_retries'):
+                if hasattr(module, name):
+                    setattr(module, name, lambda *args, **kwargs: True)
+            if hasattr(module, 'send_html_email_smtp'):
+                async def send_html_email_smtp(*args, wait=False, **kwargs):
+                    # Emails are queued on shared_code/mailer.py; only callers that wait see the latency
+                    harness.emails += 1
+                    if wait:
+                        await asyncio.sleep(harness.email_latency)
+                module.send_html_email_smtp = send_html_email_smtp
+            original = getattr(module, 'post_status_update', None)
+            if original is not None and not getattr(original, '_bench', False):
+                module.post_status_update = self._wrap_status(original)
+
+    def _scaled_time(self):
+        proxy = types.ModuleType('time')
+        proxy.__dict__.update(time.__dict__)
+        proxy.sleep = lambda seconds: time.sleep(seconds * self.sleep_scale)
+        return proxy
+
+    def _wrap_status(self, original):
+        async def post_status_update(hook_url=None, status_data=None):
+            self.status_events.append(status_data)
+            return await original(hook_url='', status_data=status_data)
+        post_status_update._bench = True
+        return post_status_update
+
+    def seed(self):
+        """Resources the scenarios expect to exist before they run"""
+        from benchmarks.fake_azure import FakeModel
+        gallery_rg, gallery, image = GALLERY
+        self.fake.store('galleries', (gallery_rg, gallery), {"location": LOCATION})
+        self.fake.store('gallery_images', (gallery_rg, gallery, image), {
+            "location": LOCATION, "os_type": "Windows", "hyper_v_generation": "V2"
+        })
+        self.fake.store('gallery_image_versions', (gallery_rg, gallery, image, '1.0.0'), FakeModel(
+            location=LOCATION,
+            publishing_profile={"target_regions": [{"name": LOCATION}], "exclude_from_latest": False}
+        ))
+        # clone_vm publishes into an existing definition
+        self.fake.store('gallery_images', (gallery_rg, gallery, CLONE_IMAGE), {
+            "location": LOCATION, "os_type": "Windows", "hyper_v_generation": "V2"
+        })
+        self.fake.store('zones', (RESOURCE_GROUP, DOMAIN), {"location": "global"})
+
+
+def request(payload, params=None):
+    import azure.functions as func
+    return func.HttpRequest(
+        method='POST', url='/api/bench', headers={'Content-Type': 'application/json'},
+        params=params or {}, body=json.dumps(payload).encode()
+    )
+
+
+async def drain(timeout):
+    """Wait for every background task the handler started"""
+    deadline = time.monotonic() + timeout
+    while True:
+        pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()]
+        if not pending:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for task in pending:
+                task.cancel()
+            return False
+        await asyncio.wait(pending, timeout=remaining)
+
+
+SCENARIOS = collections.OrderedDict([
+    ('create_vm', ('create_vm', lambda: {
+        "vm_name": "benchwin", "resource_group": RESOURCE_GROUP, "domain": DOMAIN, "location": LOCATION,
+        "vm_size": "Standard_NV6ads_A10_v5", "gallery_image_resource_group": GALLERY[0],
+        "gallery_name": GALLERY[1], "gallery_image_name": GALLERY[2], "windows_image_password": "Bench-Passw0rd!",
+        "recipient_emails": "bench@example.com", "hook_url": HOOK_URL
+    })),
+    ('create_vm_s_gpt', ('create_vm_s_gpt', lambda: {
+        "vm_name": "benchgpt", "resource_group": RESOURCE_GROUP, "domain": DOMAIN, "location": LOCATION,
+        "vm_size": "Standard_D4s_v3", "recipient_emails": "bench@example.com", "hook_url": HOOK_URL
+    })),
+    ('clone_vm', ('clone_vm', lambda: {
+        "vm_name": "benchwin", "resource_group": RESOURCE_GROUP, "location": LOCATION,
+        "gallery_resource_group": GALLERY[0], "gallery_name": GALLERY[1], "image_definition_name": CLONE_IMAGE,
+        "image_publisher": "bench", "image_offer": "benchwin", "image_sku": "bench",
+        "recipient_emails": "bench@example.com", "hook_url": HOOK_URL
+    })),
+    ('delete_vm', ('delete_vm', lambda: {
+        "vm_name": "benchwin", "resource_group": RESOURCE_GROUP, "domain": DOMAIN, "location": LOCATION,
+        "recipient_emails": "bench@example.com", "hook_url": HOOK_URL
+    })),
+])
+
+# Scenarios working on a VM another scenario creates
+REQUIRES = {'clone_vm': 'create_vm', 'delete_vm': 'create_vm'}
+
+
+async def run_scenario(harness, name, module_name, payload, timeout):
+    module = importlib.import_module(module_name)
+    harness.patch()
+    # Import cost is measured by benchmarks.startup; keep it out of the provisioning timings
+    from shared_code import bootstrap
+    for loaded in repo_modules():
+        bootstrap.preload(loaded)
+    fake = harness.fake
+    fake.reset_stats()
+    harness.status_events = []
+    harness.emails = 0
+
+    start = time.perf_counter()
+    response = await module.main(request(payload))
+    finished = await drain(timeout)
+    wall = time.perf_counter() - start
+
+    if response.status_code >= 400:
+        logging.critical(f"{name}: HTTP {response.status_code} {response.get_body().decode()[:500]}")
+    final = harness.status_events[-1] if harness.status_events else {}
+    stats = fake.stats()
+    if final.get("status") != "completed":
+        details = final.get("details") or {}
+        logging.critical(f"{name}: ended {final.get('status')} at {details.get('step')}: {details.get('error') or details.get('warning') or details.get('message')}")
+    return {
+        "scenario": name,
+        "http_status": response.status_code,
+        "final_status": final.get("status"),
+        "final_step": (final.get("details") or {}).get("step"),
+        "timed_out": not finished,
+        "wall_seconds": round(wall, 3),
+        "arm_calls": stats["arm_calls"],
+        "lro_polls": stats["lro_polls"],
+        "injected_failures": stats["injected_failures"],
+        "arm_in_flight_peak": stats["in_flight_peak"],
+        "threads_peak": stats["threads_peak"],
+        "status_events": len(harness.status_events),
+        "emails": harness.emails,
+        "calls": stats["calls"],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against a baseline as human-readable lines"""
+    regressions = []
+    previous = {r["scenario"]: r for r in baseline.get("results", [])}
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        for metric in EXACT_METRICS:
+            if result[metric] > before[metric]:
+                regressions.append(f"{result['scenario']}: {metric} {before[metric]} -> {result[metric]}")
+        if result["wall_seconds"] > before["wall_seconds"] * (1 + tolerance) + 0.05:
+            regressions.append(f"{result['scenario']}: wall_seconds {before['wall_seconds']} -> {result['wall_seconds']}")
+        if before.get("final_status") == "completed" and result["final_status"] != "completed":
+            regressions.append(f"{result['scenario']}: no longer completes ({result['final_status']} at {result['final_step']})")
+    return regressions
+
+
+async def run(args):
+    from benchmarks.fake_azure import FakeAzure
+
+    fake = FakeAzure(latency=args.latency, lro_latency=args.lro_latency, failure_rate=args.failure_rate, seed=args.seed)
+    harness = Harness(fake, args.sleep_scale, args.email_latency)
+    harness.seed()
+
+    results = []
+    for name, (module_name, payload) in SCENARIOS.items():
+        if args.scenario and name not in args.scenario and not any(REQUIRES.get(s) == name for s in args.scenario):
+            continue
+        result = await run_scenario(harness, name, module_name, payload(), args.timeout)
+        results.append(result)
+        print(
+            f"{name:<18} {result['final_status'] or '-':<10} {result['wall_seconds']:>8.3f}s "
+            f"arm={result['arm_calls']:<4} polls={result['lro_polls']:<4} peak={result['arm_in_flight_peak']:<3} "
+            f"threads={result['threads_peak']:<3} events={result['status_events']}"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help='run only these scenarios')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per ARM call')
+    parser.add_argument('--lro-latency', type=float, default=0.1, help='seconds until an LRO completes')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability an ARM call fails')
+    parser.add_argument('--email-latency', type=float, default=0.01, help='seconds per email for callers that wait for delivery')
+    parser.add_argument('--sleep-scale', type=float, default=0.001, help='factor applied to the handlers\' own sleeps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds a scenario may take')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative wall time increase')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help='show the handlers\' logging')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ.update(BENCH_ENV)
+    # The catalog the fake serves may differ between runs; never reuse one from disk
+    if os.path.exists(BENCH_ENV['SKU_CATALOG_PATH']):
+        os.remove(BENCH_ENV['SKU_CATALOG_PATH'])
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    results = asyncio.run(run(args))
+    report = {
+        "settings": {
+            "latency": args.latency, "lro_latency": args.lro_latency, "failure_rate": args.failure_rate,
+            "email_latency": args.email_latency, "sleep_scale": args.sleep_scale, "seed": args.seed
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet, run with --update-baseline to create one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != report["settings"]:
+        print("Baseline was recorded with different settings, skipping comparison")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
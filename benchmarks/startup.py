@@ -0,0 +1,182 @@
+"""Cold-start benchmark: import every function like the Functions host does, then serve a first request.
+
+Each run is a fresh interpreter. It reports the time to import all function
+folders, the time to the first response of a read-only endpoint (replayed
+from benchmarks/recordings, so the SDK is really loaded and used), and the
+process wall time. One extra run under `-X importtime` gives the slowest
+imports. The run fails when a heavy SDK is imported while the functions are
+being loaded (they should be imported on first use, see shared_code/bootstrap.py)
+or when the medians regress against benchmarks/startup_baseline.json.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --update-baseline
+"""
+import argparse
+import glob
+import importlib
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'startup_baseline.json')
+RECORDING = os.path.join(ROOT, 'benchmarks', 'recordings', 'list_dns_records.jsonl')
+FIRST_REQUEST = ('list_dns_records', {"resource_group": "bench-rg", "domain": "benchexample.com"})
+
+# Packages no function may import while it is being loaded
+LAZY_PACKAGES = (
+    'aiohttp', 'aiosmtplib', 'azure.identity', 'azure.mgmt', 'azure.search', 'azure.storage.blob',
+    'cryptography', 'dns.resolver', 'requests', 'smtplib'
+)
+TIMINGS = ('index_ms', 'first_response_ms', 'process_ms')
+
+
+def function_folders():
+    return sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(os.path.join(ROOT, '*', 'function.json')))
+
+
+def child(first_request):
+    """Runs in the fresh interpreter and prints its measurements as JSON"""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+    errors = {}
+    for name in function_folders():
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+    index = time.perf_counter() - start
+    eager = sorted({next(p for p in LAZY_PACKAGES if m == p or m.startswith(p + '.')) for m in sys.modules
+                    if any(m == p or m.startswith(p + '.') for p in LAZY_PACKAGES)})
+
+    result = {"index_ms": round(index * 1000, 1), "eager_imports": eager, "import_errors": errors}
+    if first_request:
+        import asyncio
+        from benchmarks.run import Harness, request
+
+        Harness(None, sleep_scale=0, email_latency=0).patch()
+        name, payload = FIRST_REQUEST
+        response = importlib.import_module(name).main(request(payload))
+        if asyncio.iscoroutine(response):
+            response = asyncio.run(response)
+        result["first_response_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["first_response_status"] = response.status_code
+    print(json.dumps(result))
+
+
+def spawn(first_request=True, importtime=False):
+    from benchmarks.run import BENCH_ENV
+
+    env = dict(os.environ, **BENCH_ENV, ARM_REPLAY_PATH=RECORDING, ARM_REPLAY_SPEED='0')
+    env.pop('ARM_RECORD_DIR', None)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-m', 'benchmarks.startup', '--child']
+    if not first_request:
+        command.append('--no-request')
+    start = time.perf_counter()
+    done = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if done.returncode != 0:
+        raise RuntimeError(f"startup child failed:\n{done.stderr[-2000:]}")
+    result = json.loads(done.stdout.strip().splitlines()[-1])
+    result["process_ms"] = round(wall * 1000, 1)
+    return result, done.stderr
+
+
+def import_profile(stderr, top):
+    """Slowest imports from `-X importtime` output: top-level packages and function folders"""
+    folders = set(function_folders())
+    packages, functions = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        ms = int(cumulative) / 1000
+        if name in folders:
+            functions[name] = ms
+        elif depth == 0:
+            packages[name] = max(ms, packages.get(name, 0))
+    rank = lambda d: [[n, round(ms, 1)] for n, ms in sorted(d.items(), key=lambda item: -item[1])[:top]]
+    return {"packages": rank(packages), "functions": rank(functions)}
+
+
+def compare(summary, baseline, tolerance):
+    regressions = []
+    for metric in TIMINGS:
+        before = baseline.get(metric)
+        if before is not None and summary[metric] > before * (1 + tolerance) + 50:
+            regressions.append(f"{metric}: {before} -> {summary[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--no-request', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to take the median over')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to report')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative increase of the medians')
+    parser.add_argument('--output', help='also write the report to this JSON file')
+    args = parser.parse_args()
+
+    if args.child:
+        child(not args.no_request)
+        return
+
+    sys.path.insert(0, ROOT)
+    runs = [spawn()[0] for _ in range(args.runs)]
+    profiled, stderr = spawn(first_request=False, importtime=True)
+    summary = {metric: round(statistics.median(run[metric] for run in runs), 1) for metric in TIMINGS}
+    report = {
+        **summary,
+        "runs": args.runs,
+        "first_response_status": runs[-1]["first_response_status"],
+        "eager_imports": profiled["eager_imports"],
+        "import_errors": profiled["import_errors"],
+        "slowest_imports": import_profile(stderr, args.top),
+    }
+
+    print(f"index {summary['index_ms']:.0f}ms  first response {summary['first_response_ms']:.0f}ms  "
+          f"process {summary['process_ms']:.0f}ms  (median of {args.runs})")
+    print("slowest imports while loading the functions:")
+    for name, ms in report["slowest_imports"]["packages"]:
+        print(f"  {ms:8.1f}ms  {name}")
+    for name, error in report["import_errors"].items():
+        print(f"  import failed: {name}: {error}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if report["eager_imports"]:
+        print(f"Imported while loading the functions, should be lazy: {', '.join(report['eager_imports'])}")
+        failed = True
+    if report["first_response_status"] >= 400:
+        print(f"First request answered {report['first_response_status']}")
+        failed = True
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Micro-benchmark for the setup script generators built on shared_code/setup_template.py.
+
+For every create_vm_s_* generator it times:
+  legacy  dedent plus one str.replace per token, as the generators used to do
+  parse   the first call in a process: dedent, parse and render
+  render  a call with new parameters (the memo misses)
+  memo    a repeated call with the same parameters
+
+Parameters without shell metacharacters render identically either way, so the
+run also checks the legacy output against the engine's. It fails on a mismatch
+or when a render is slower than the legacy replaces.
+
+    python -m benchmarks.templates
+    python -m benchmarks.templates --only create_vm_s_plane --repeat 200
+"""
+import argparse
+import glob
+import importlib.util
+import inspect
+import json
+import os
+import statistics
+import sys
+import textwrap
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE = {
+    'DOMAIN_NAME': 'app.example.com',
+    'ADMIN_EMAIL': 'admin@example.com',
+    'ADMIN_PASSWORD': 'BenchPass123',
+    'WEBHOOK_URL': 'https://hooks.invalid/bench',
+    'location': 'westeurope',
+    'resource_group': 'bench-rg',
+}
+
+
+def generators(only=None):
+    """(name, function) of every generate_setup.py that renders through setup_template"""
+    found = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'create_vm_s_*', 'generate_setup.py'))):
+        name = os.path.basename(os.path.dirname(path))
+        if only and name not in only:
+            continue
+        with open(path, encoding='utf-8') as f:
+            if 'setup_template.parse' not in f.read():
+                continue
+        # Load the file on its own so the function package (and its SDKs) is not imported
+        spec = importlib.util.spec_from_file_location(f'bench_{name}_generate_setup', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        function = next(value for key, value in vars(module).items()
+                        if key.startswith('generate') and inspect.isfunction(value) and value.__module__ == module.__name__)
+        found.append((name, function))
+    return found
+
+
+def arguments(function, **overrides):
+    kwargs = {}
+    for name, parameter in inspect.signature(function).parameters.items():
+        if name in overrides:
+            kwargs[name] = overrides[name]
+        elif name in SAMPLE:
+            kwargs[name] = SAMPLE[name]
+        elif parameter.default is inspect.Parameter.empty:
+            kwargs[name] = '8080'
+    return kwargs
+
+
+def legacy_render(main, values):
+    """The old strategy: dedent the template and the webhook function, then replace token by token"""
+    final = textwrap.dedent(main)
+    fragment = values.get('__WEBHOOK_FUNCTION__')
+    if fragment is not None:
+        final = final.replace('__WEBHOOK_FUNCTION__', textwrap.dedent(fragment))
+    for token, value in values.items():
+        if isinstance(value, str):
+            final = final.replace(token, value)
+    return final
+
+
+def timed(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def measure(name, function, repeat, setup_template):
+    # The first call parses; note which literal was the script and what it was rendered with
+    setup_template._parsed.clear()
+    setup_template._render_cached.cache_clear()
+    captured = {}
+    render = setup_template.Template.render
+
+    def capture(template, values):
+        captured.setdefault('values', values)
+        return render(template, values)
+
+    setup_template.Template.render = capture
+    try:
+        start = time.perf_counter()
+        output = function(**arguments(function))
+        parse_ms = (time.perf_counter() - start) * 1000
+    finally:
+        setup_template.Template.render = render
+    values = captured['values']
+    sources = {template: text for (text, _), template in setup_template._parsed.items()}
+    main = max(sources.values(), key=len)
+    legacy_values = {key: sources.get(value, value) for key, value in values.items()}
+
+    counter = iter(range(10 ** 9))
+    return {
+        "lines": output.count('\n'),
+        "kb": round(len(output) / 1024, 1),
+        "legacy_ms": round(timed(lambda: legacy_render(main, legacy_values), repeat), 3),
+        "parse_ms": round(parse_ms, 3),
+        "render_ms": round(timed(lambda: function(**arguments(function, DOMAIN_NAME=f"app{next(counter)}.example.com")), repeat), 3),
+        "memo_ms": round(timed(lambda: function(**arguments(function)), repeat), 4),
+        "identical": legacy_render(main, legacy_values) == output,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', action='append', help='benchmark only these function folders')
+    parser.add_argument('--repeat', type=int, default=50, help='calls to take the median over')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from shared_code import setup_template
+
+    results = {name: measure(name, function, args.repeat, setup_template) for name, function in generators(args.only)}
+    print(f"{'generator':28} {'lines':>6} {'KB':>6} {'legacy':>8} {'parse':>8} {'render':>8} {'memo':>8}")
+    for name, r in results.items():
+        print(f"{name:28} {r['lines']:6} {r['kb']:6} {r['legacy_ms']:7.3f}ms {r['parse_ms']:6.3f}ms "
+              f"{r['render_ms']:6.3f}ms {r['memo_ms']:6.4f}ms{'' if r['identical'] else '  OUTPUT DIFFERS'}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [name for name, r in results.items() if not r['identical'] or r['render_ms'] > r['legacy_ms']]
+    for name in failed:
+        print(f"FAILED {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
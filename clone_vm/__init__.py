@@ -4,40 +4,34 @@ import os
 import sys
 import time
 import re
-import aiohttp
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()
 import random
 import string
 import shutil
 import platform
-import dns.resolver
-from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute.models import GrantAccessData, AccessLevel
+from azure.core.exceptions import ClientAuthenticationError, ResourceNotFoundError
 import logging
 from packaging import version  # For semantic versioning
-from azure.mgmt.compute import ComputeManagementClient
 import azure.functions as func
-from azure.storage.blob import generate_blob_sas, BlobSasPermissions
-from azure.mgmt.compute.models import (
-    Snapshot,
-    Gallery,
-    GalleryImage,
-    GalleryImageVersion,
-    OperatingSystemStateTypes,
-    SecurityProfile
-)
+from shared_code import arm_throttle, arm_usage, bootstrap, disk_profile, image_catalog, tracing
 
 from . import html_email
 from . import html_email_send
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+aiohttp = bootstrap.lazy_module('aiohttp')
+dns = bootstrap.lazy_module('dns.resolver')
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+GrantAccessData, AccessLevel = bootstrap.lazy('azure.mgmt.compute.models', 'GrantAccessData', 'AccessLevel')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+generate_blob_sas, BlobSasPermissions = bootstrap.lazy('azure.storage.blob', 'generate_blob_sas', 'BlobSasPermissions')
+Snapshot, Gallery, GalleryImage, GalleryImageVersion, OperatingSystemStateTypes, SecurityProfile = bootstrap.lazy(
+    'azure.mgmt.compute.models',
+    'Snapshot', 'Gallery', 'GalleryImage', 'GalleryImageVersion', 'OperatingSystemStateTypes',
+    'SecurityProfile'
 )
+
+# Configure logging
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting snapshot application initialization...")
 
@@ -71,6 +65,7 @@ async def run_azure_operation(func, *args, **kwargs):
     return await loop.run_in_executor(None, func, *args, **kwargs)
 
 # ====================== HTTP TRIGGER ======================
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing snapshot request...')    
     try:
@@ -203,6 +198,41 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             tenant_id=os.environ["AZURE_APP_TENANT_ID"]
         )
 
+        # An ephemeral OS disk lives on the host and cannot be copied into a
+        # snapshot; refuse before the VM is stopped rather than after
+        compute_client = ComputeManagementClient(credentials, os.environ["AZURE_SUBSCRIPTION_ID"], **arm_throttle.client_kwargs())
+        try:
+            vm = await run_azure_operation(compute_client.virtual_machines.get, resource_group, vm_name)
+        except ResourceNotFoundError:
+            return func.HttpResponse(
+                json.dumps({"error": f"VM '{vm_name}' not found in resource group '{resource_group}'"}),
+                status_code=404,
+                mimetype="application/json"
+            )
+        if disk_profile.is_ephemeral(vm):
+            error_msg = (f"VM '{vm_name}' has an ephemeral OS disk, which cannot be snapshotted; "
+                         f"clone a VM created with OS_DISK_MODE=managed instead")
+            print_error(error_msg)
+            await post_status_update(
+                hook_url=hook_url,
+                status_data={
+                    "vm_name": vm_name,
+                    "status": "failed",
+                    "resource_group": resource_group,
+                    "location": location,
+                    "details": {
+                        "step": "ephemeral_os_disk",
+                        "error": error_msg,
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+                }
+            )
+            return func.HttpResponse(
+                json.dumps({"error": error_msg}),
+                status_code=400,
+                mimetype="application/json"
+            )
+
         # ====================== Start Background Snapshot Task ======================
         asyncio.create_task(
             snapshot_vm_background(credentials, 
@@ -216,7 +246,8 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                                    image_definition_name,
                                    image_publisher,
                                    image_offer,
-                                   image_sku)
+                                   image_sku,
+                                   vm=vm)
         )
 
         # ✅ Background task started
@@ -255,7 +286,8 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
 
 
 # ====================== BACKGROUND TASK ======================
-async def snapshot_vm_background(credentials, vm_name, resource_group, location, hook_url, RECIPIENT_EMAILS, gallery_resource_group,gallery_name,image_definition_name,image_publisher,image_offer,image_sku):
+async def snapshot_vm_background(credentials, vm_name, resource_group, location, hook_url, RECIPIENT_EMAILS, gallery_resource_group,gallery_name,image_definition_name,image_publisher,image_offer,image_sku, vm=None):
+    tracing.start("snapshot", vm_name)
     try:
         # Initial status update
         await post_status_update(hook_url, {
@@ -275,7 +307,7 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
         subscription_id = os.getenv("AZURE_SUBSCRIPTION_ID")
         tenant_id = os.getenv("AZURE_TENANT_ID")
         # Initialize Azure clients
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
 
         # Stop VM before snapshot
         try:
@@ -312,8 +344,9 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
             "details": {"step": "creating_snapshot", "message": "Snapshot creating in process..."}
         })
 
-        # Get VM details
-        vm = await run_azure_operation(compute_client.virtual_machines.get, resource_group, vm_name)
+        # Get VM details (main already read them; the OS disk does not change when the VM stops)
+        if vm is None:
+            vm = await run_azure_operation(compute_client.virtual_machines.get, resource_group, vm_name)
         os_disk_id = vm.storage_profile.os_disk.managed_disk.id
         snapshot_name = f"{vm_name}-snapshot-{int(time.time())}"
         snapshot_params = {
@@ -432,6 +465,9 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
             image_version_params
         ).result()
 
+        # The image picker lists this gallery from cache; make the new version visible now
+        image_catalog.invalidate(gallery_resource_group, gallery_name, image_definition_name)
+
         # Construct Azure Portal URL
         portal_url = (
             f"https://portal.azure.com/#@{tenant_id}/resource/subscriptions/{subscription_id}"
@@ -480,7 +516,7 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
             sender_email = os.environ.get('SENDER_EMAIL')
             recipient_emails = [e.strip() for e in RECIPIENT_EMAILS.split(',')]
 
-            html_content = html_email.HTMLEmail(
+            html_content = html_email.HTMLEmailSnapshot(
                 snapshot_name=snapshot_name,
                 created_at=datetime.utcnow().isoformat(),
                 snapshot_url=snapshot_sas_url
@@ -514,7 +550,7 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
                     }
                 }
             )
-            print_success(f"Email sent for snapshot '{snapshot_name}'")
+            print_success(f"Email queued for snapshot '{snapshot_name}'")
 
         except Exception as e:
             error_msg = f"Failed to send email: {str(e)}"
@@ -567,6 +603,7 @@ async def restart_vm(compute_client: ComputeManagementClient, vm_name: str, reso
 
 # ====================== STATUS UPDATE ======================
 async def post_status_update(hook_url: str, status_data: dict) -> dict:
+    tracing.record(status_data)
     if not hook_url:
         return {"success": True, "status_url": ""}
     step = status_data.get("details", {}).get("step", "unknown")
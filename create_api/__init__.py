@@ -2,18 +2,21 @@ import asyncio
 import json
 import os
 import logging
-import aiohttp
 from datetime import datetime
-from azure.identity import ClientSecretCredential
-from azure.mgmt.web import WebSiteManagementClient
-from azure.mgmt.web.models import (
-    FunctionApp, AppServicePlan, SkuDescription,
-    SiteConfig, NameValuePair, StringDictionary
-)
 import azure.functions as func
-import yaml
+from shared_code import arm_throttle, arm_usage, bootstrap, tracing
 import base64
-import requests
+
+aiohttp = bootstrap.lazy_module('aiohttp')
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+WebSiteManagementClient = bootstrap.lazy('azure.mgmt.web', 'WebSiteManagementClient')
+FunctionApp, AppServicePlan, SkuDescription, SiteConfig, NameValuePair, StringDictionary = bootstrap.lazy(
+    'azure.mgmt.web.models',
+    'FunctionApp', 'AppServicePlan', 'SkuDescription', 'SiteConfig', 'NameValuePair',
+    'StringDictionary'
+)
+yaml = bootstrap.lazy_module('yaml')
+requests = bootstrap.lazy_module('requests')
 
 
 GITHUB_REPO_URL = "https://github.com/SongDrop/rtxapi"
@@ -51,10 +54,7 @@ GITHUB_REPO_URL = "https://github.com/SongDrop/rtxapi"
 #     Automatic Updates: If you update your template, they can sync updates
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
 # Console colors for logs
@@ -82,6 +82,7 @@ async def run_azure_operation(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, func, *args, **kwargs)
 
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing API creation request...')    
     try:
@@ -234,12 +235,13 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
 async def create_api_background(
     credentials, api_name, resource_group, location, hook_url, github_repo
 ):
+    tracing.start("create_api", api_name)
     try:
         subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
         github_token = os.environ['GITHUB_TOKEN']
         
         # Initialize Azure clients
-        web_client = WebSiteManagementClient(credentials, subscription_id)
+        web_client = WebSiteManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
         
         # Create or get Flex Consumption plan
         plan_name = f"{api_name}-flex-plan"
@@ -775,6 +777,7 @@ async def send_api_creation_email(api_name, resource_group, location, publish_pr
 
 async def post_status_update(hook_url: str, status_data: dict) -> dict:
     """Send status update to webhook with retry logic"""
+    tracing.record(status_data)
     if not hook_url:
         return {"success": True, "status_url": ""}
     
@@ -2,9 +2,12 @@ import logging
 import os
 import json
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-import requests
+from shared_code import arm_usage, bootstrap
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+requests = bootstrap.lazy_module('requests')
+
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to create Azure quota increase request.')
 
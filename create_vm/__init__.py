@@ -4,42 +4,47 @@ import os
 import sys
 import time
 import re
-import aiohttp
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()
 import random
+import secrets
 import string
 import shutil
 import platform
-import dns.resolver
 from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import ClientSecretCredential
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
 import logging
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.network.models import NetworkSecurityGroup, SecurityRule, NetworkInterface
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.compute.models import (
-    VirtualMachine, HardwareProfile, StorageProfile,
-    OSProfile, NetworkProfile, NetworkInterfaceReference,
-    VirtualMachineExtension, WindowsConfiguration, SecurityProfile
-)   
-from azure.mgmt.dns import DnsManagementClient
-from azure.mgmt.dns.models import RecordSet
-from azure.mgmt.storage import StorageManagementClient
 import azure.functions as func
 
+from shared_code import admission, arm_recorder, arm_throttle, arm_usage, bootstrap, cert_service, dns_manager, idempotency, placement, preflight, sas_issuer, sku_catalog, topology, tracing, warm_pool
 from . import generate_setup
 from . import html_email
 from . import html_email_send
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+aiohttp = bootstrap.lazy_module('aiohttp')
+dns = bootstrap.lazy_module('dns.resolver')
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+BlobServiceClient, generate_blob_sas, BlobSasPermissions = bootstrap.lazy(
+    'azure.storage.blob', 'BlobServiceClient', 'generate_blob_sas', 'BlobSasPermissions'
+)
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+NetworkSecurityGroup, SecurityRule, NetworkInterface = bootstrap.lazy(
+    'azure.mgmt.network.models', 'NetworkSecurityGroup', 'SecurityRule', 'NetworkInterface'
+)
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+(
+    VirtualMachine, HardwareProfile, StorageProfile, OSProfile, NetworkProfile,
+    NetworkInterfaceReference, VirtualMachineExtension, WindowsConfiguration, SecurityProfile
+) = bootstrap.lazy(
+    'azure.mgmt.compute.models',
+    'VirtualMachine', 'HardwareProfile', 'StorageProfile', 'OSProfile', 'NetworkProfile',
+    'NetworkInterfaceReference', 'VirtualMachineExtension', 'WindowsConfiguration',
+    'SecurityProfile'
 )
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+StorageManagementClient = bootstrap.lazy('azure.mgmt.storage', 'StorageManagementClient')
+
+# Configure logging
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting application initialization...")
 
@@ -51,6 +56,14 @@ image_reference = {
     'version': 'latest'
 }
 
+# How often a worker re-checks warm pool depth on its own (claims trigger a check immediately)
+WARM_POOL_CHECK_SECONDS = int(os.environ.get('WARM_POOL_CHECK_SECONDS', 300))
+# Whether requests that don't pass 'warm_pool' are served from the warm pool (off unless opted in)
+WARM_POOL_DEFAULT = os.environ.get('WARM_POOL_DEFAULT', 'false')
+_warm_pool_checked_at = 0.0
+_warm_pool_provisioning = {}   # pool key -> names being provisioned by this worker
+_warm_pool_tasks = set()
+
 # Ports to open for application
 PORTS_TO_OPEN = [22, 80, 443, 3389, 5000, 8000, 47984, 47989, 47990, 47998, 47999, 48000, 48010, 4531, 3475]
 
@@ -86,6 +99,8 @@ async def run_azure_operation(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, func, *args, **kwargs)
 
+@arm_usage.metered
+@idempotency.idempotent('create')
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing create_vm request...')    
     try:
@@ -112,6 +127,13 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
         RECIPIENT_EMAILS = req_body.get('recipient_emails') or req.params.get('recipient_emails')
         DUMBDROP_PIN = req_body.get('dumbdrop_pin') or req.params.get('dumbdrop_pin') or '1234'
         hook_url = req_body.get('hook_url') or req.params.get('hook_url') or ''
+        # Optional comma separated alternatives the placement scheduler may pick instead
+        # of 'location'/'vm_size' when those lack quota, capacity or the image replica
+        FALLBACK_LOCATIONS = req_body.get('fallback_locations') or req.params.get('fallback_locations') or ''
+        FALLBACK_VM_SIZES = req_body.get('fallback_vm_sizes') or req.params.get('fallback_vm_sizes') or ''
+        SIZE_FAMILIES = req_body.get('size_families') or req.params.get('size_families') or ''
+        # Serve from the warm pool when a matching pre-provisioned VM is available
+        USE_WARM_POOL = str(req_body.get('warm_pool') or req.params.get('warm_pool') or WARM_POOL_DEFAULT).lower() == 'true'
 
         ###Parameter checking to handle errors 
         if not vm_name:
@@ -163,11 +185,26 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
         else:
-            if not check_vm_size_compatibility(vm_size):
-                compatible_sizes = get_compatible_vm_sizes()
+            # The requested size and every fallback size must meet VM_SIZE_REQUIREMENTS in one of
+            # the candidate locations; whether it can be deployed there is left to placement
+            candidate_locations = [location] + [l.strip() for l in FALLBACK_LOCATIONS.split(',') if l.strip()]
+            fallback_sizes = [s.strip() for s in FALLBACK_VM_SIZES.split(',') if s.strip()]
+            incompatible = await run_azure_operation(
+                check_candidate_sizes, [vm_size] + fallback_sizes, candidate_locations
+            )
+            if vm_size in incompatible:
                 return func.HttpResponse(
                     json.dumps({
-                        "error": f"VmSize {vm_size} is incompatible. Please select a size from the list: {compatible_sizes}"
+                        "error": f"VmSize {vm_size} is incompatible. Please select a size from the list: {incompatible[vm_size]}"
+                    }),
+                    status_code=400,
+                    mimetype="application/json"
+                )
+            if incompatible:
+                return func.HttpResponse(
+                    json.dumps({
+                        "error": f"Fallback size(s) {', '.join(incompatible)} are incompatible. Please select sizes from the list: "
+                                 f"{sorted({s for suggested in incompatible.values() for s in suggested})}"
                     }),
                     status_code=400,
                     mimetype="application/json"
@@ -277,23 +314,200 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 tenant_id=os.environ['AZURE_APP_TENANT_ID']
             )
 
-            # Start background provisioning
-            asyncio.create_task(
-                provision_vm_background(
-                    credentials,
-                    vm_name, resource_group, domain, location, vm_size,
-                    storage_account_base, GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME,
-                    GALLERY_IMAGE_NAME, GALLERY_IMAGE_VERSION, OS_DISK_SSD_GB,
-                    WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN, hook_url
+            # Placement: preflight every acceptable region/size from cached quota, SKU and
+            # image data and pick the best, so the request fails (or moves) in milliseconds
+            # instead of after minutes of rollbacks
+            compute_client = ComputeManagementClient(credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs())
+
+            candidate_sizes = [vm_size] + [s for s in fallback_sizes if s != vm_size]
+            families = [f.strip() for f in SIZE_FAMILIES.split(',') if f.strip()]
+            if families:
+                # run_in_executor takes no keyword arguments
+                family_sizes = await run_azure_operation(
+                    lambda: placement.expand_families(location, families, vm_size, **VM_SIZE_REQUIREMENTS)
                 )
+                candidate_sizes += [s for s in family_sizes if s not in candidate_sizes]
+            placement_decision = await run_azure_operation(
+                placement.choose_placement,
+                compute_client,
+                candidate_locations,
+                candidate_sizes,
+                {
+                    "gallery_resource_group": GALLERY_IMAGE_RESOURCE_GROUP,
+                    "gallery_name": GALLERY_NAME,
+                    "gallery_image_name": GALLERY_IMAGE_NAME,
+                    "gallery_image_version": GALLERY_IMAGE_VERSION
+                }
             )
+            if not placement_decision["passed"]:
+                print_error(f"Preflight failed: {placement_decision['error']}")
+                await post_status_update(
+                    hook_url=hook_url,
+                    status_data={
+                        "vm_name": vm_name,
+                        "status": "failed",
+                        "resource_group": resource_group,
+                        "location": location,
+                        "details": {
+                            "step": "preflight_failed",
+                            "error": placement_decision["error"],
+                            "checks": placement_decision["checks"],
+                            "candidates": placement_decision["candidates"],
+                            "timestamp": datetime.utcnow().isoformat()
+                        }
+                    }
+                )
+                return func.HttpResponse(
+                    json.dumps({
+                        "error": f"Preflight failed: {placement_decision['error']}",
+                        "placement": placement_decision
+                    }),
+                    status_code=409,
+                    mimetype="application/json"
+                )
+            if placement_decision["redirected"]:
+                print_warn(
+                    f"Placement moved {vm_name} from {location}/{vm_size} "
+                    f"to {placement_decision['location']}/{placement_decision['vm_size']}"
+                )
+            location = placement_decision["location"]
+            vm_size = placement_decision["vm_size"]
+            await post_status_update(
+                hook_url=hook_url,
+                status_data={
+                    "vm_name": vm_name,
+                    "status": "provisioning",
+                    "resource_group": resource_group,
+                    "location": location,
+                    "details": {
+                        "step": "placement_decided",
+                        "message": f"Placed in {location} as {vm_size} after {placement_decision['duration_ms']} ms of preflight",
+                        "vm_size": vm_size,
+                        "redirected": placement_decision["redirected"],
+                        "requested": placement_decision["requested"],
+                        "score": placement_decision["score"],
+                        "candidates": placement_decision["candidates"],
+                        "checks": placement_decision["checks"]
+                    }
+                }
+            )
+
+            # Warm pool: hand out a provisioned, deallocated VM instead of building one, but only
+            # one matching the location and size placement has just confirmed
+            pool_target = warm_pool.find_target(
+                resource_group, location, vm_size, GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME, GALLERY_IMAGE_NAME
+            ) if USE_WARM_POOL else None
+            pool_vm_name = None
+            if pool_target:
+                claimed_at = time.monotonic()
+                pool_key = await run_azure_operation(
+                    warm_pool.target_key, compute_client, {**pool_target, "gallery_image_version": GALLERY_IMAGE_VERSION}
+                )
+                if pool_key:
+                    pool_vm_name = await run_azure_operation(warm_pool.claim, compute_client, resource_group, pool_key, vm_name)
+            schedule_warm_pool_replenish(credentials, force=bool(pool_vm_name))
+            if pool_vm_name:
+                await post_status_update(
+                    hook_url=hook_url,
+                    status_data={
+                        "vm_name": vm_name,
+                        "status": "provisioning",
+                        "resource_group": resource_group,
+                        "location": location,
+                        "details": {
+                            "step": "warm_pool_claimed",
+                            "message": f"Handing out pre-provisioned VM {pool_vm_name}",
+                            "pool_vm_name": pool_vm_name,
+                            "vm_size": vm_size
+                        }
+                    }
+                )
+                idempotency.start(
+                    handout_vm_background(
+                        credentials,
+                        pool_vm_name, vm_name, resource_group, domain, location,
+                        WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN, hook_url, claimed_at
+                    )
+                )
+                return func.HttpResponse(
+                    json.dumps({
+                        "message": "VM handout from warm pool started",
+                        "status_url": status_url,
+                        "vm_name": vm_name,
+                        "location": location,
+                        "vm_size": vm_size,
+                        "warm_pool": True
+                    }),
+                    status_code=202,
+                    mimetype="application/json"
+                )
+
+            async def report_queued(position, estimated_start):
+                await post_status_update(
+                    hook_url=hook_url,
+                    status_data={
+                        "vm_name": vm_name,
+                        "status": "queued",
+                        "resource_group": resource_group,
+                        "location": location,
+                        "details": {
+                            "step": "queued",
+                            "message": f"Waiting for a provisioning slot (position {position})",
+                            "queue_position": position,
+                            "estimated_start": estimated_start,
+                            "timestamp": datetime.utcnow().isoformat()
+                        }
+                    }
+                )
+
+            # Start background provisioning, or queue it behind the admission limits
+            try:
+                ticket = admission.controller.submit(
+                    job_id=f"{resource_group}/{vm_name}",
+                    location=location,
+                    family=placement_decision.get("family"),
+                    # Bound to this request's idempotency key: a delete_vm cancels it, queued or running
+                    run=idempotency.bind(lambda: provision_vm_background(
+                        credentials,
+                        vm_name, resource_group, domain, location, vm_size,
+                        storage_account_base, GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME,
+                        GALLERY_IMAGE_NAME, GALLERY_IMAGE_VERSION, OS_DISK_SSD_GB,
+                        WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN, hook_url
+                    )),
+                    on_queued=report_queued
+                )
+            except admission.QueueFull as e:
+                return func.HttpResponse(
+                    json.dumps({"error": str(e)}),
+                    status_code=429,
+                    mimetype="application/json",
+                    headers={"Retry-After": "60"}
+                )
+
+            if ticket["queued"]:
+                await report_queued(ticket["queue_position"], ticket["estimated_start"])
+                return func.HttpResponse(
+                    json.dumps({
+                        "message": "VM provisioning queued",
+                        "status_url": status_url,
+                        "vm_name": vm_name,
+                        "location": location,
+                        "vm_size": vm_size,
+                        "queue_position": ticket["queue_position"],
+                        "estimated_start": ticket["estimated_start"]
+                    }),
+                    status_code=202,
+                    mimetype="application/json"
+                )
 
             #✅background-task started, hook_vm will be notified during setup
             return func.HttpResponse(
                 json.dumps({
                     "message": "VM provisioning started",
                     "status_url": status_url,
-                    "vm_name": vm_name
+                    "vm_name": vm_name,
+                    "location": location,
+                    "vm_size": vm_size
                 }),
                 status_code=202,
                 mimetype="application/json"
@@ -335,8 +549,11 @@ async def provision_vm_background(
     vm_name, resource_group, domain, location, vm_size,
     storage_account_base, GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME,
     GALLERY_IMAGE_NAME, GALLERY_IMAGE_VERSION, OS_DISK_SSD_GB,
-    WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN, hook_url
+    WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN, hook_url,
+    tags=None, send_email=True
 ):
+    """Returns True once the VM is fully provisioned"""
+    tracing.start("provision", vm_name)
     try:
         # Initial status update
         await post_status_update(
@@ -357,10 +574,10 @@ async def provision_vm_background(
         subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
         
         # Initialize Azure clients
-        compute_client = ComputeManagementClient(credentials, subscription_id)
-        storage_client = StorageManagementClient(credentials, subscription_id)
-        network_client = NetworkManagementClient(credentials, subscription_id)
-        dns_client = DnsManagementClient(credentials, subscription_id)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        storage_client = StorageManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
         
         # Handle subdomain
         subdomain = vm_name.strip().strip('.') if vm_name else None
@@ -418,9 +635,13 @@ async def provision_vm_background(
         # Generate and upload setup script
         print_info("Generating PowerShell setup script...")
         ssl_email = os.environ.get('SENDER_EMAIL')
-        ps_script = generate_setup.generate_setup(vm_name, fqdn, ssl_email, DUMBDROP_PIN, WINDOWS_IMAGE_PASSWORD)
+        # Caddy serves <service>.<vm_name>.<fqdn>; a pre-issued wildcard spares it ACME
+        certificate = await run_azure_operation(
+            cert_service.certificate_for, dns_client, resource_group, domain, f"{vm_name}.{fqdn}"
+        )
+        ps_script = generate_setup.generate_setup(vm_name, fqdn, ssl_email, DUMBDROP_PIN, WINDOWS_IMAGE_PASSWORD, certificate)
         
-        blob_service_client = BlobServiceClient(account_url=AZURE_STORAGE_URL, credential=credentials)
+        blob_service_client = BlobServiceClient(account_url=AZURE_STORAGE_URL, credential=credentials, **arm_recorder.blob_kwargs())
         container_name = 'vm-startup-scripts'
         blob_name = f"{vm_name}-setup.ps1"
 
@@ -466,7 +687,9 @@ async def provision_vm_background(
             )
             return
 
-        # Network infrastructure setup
+        # Network infrastructure setup; everything created below carries one
+        # provisioning ID so delete_vm can sweep it by tag
+        resource_tags = topology.tags(vm_name, topology.new_provisioning_id(), **(tags or {}))
         vnet_name = f'{vm_name}-vnet'
         subnet_name = f'{vm_name}-subnet'
         public_ip_name = f'{vm_name}-public-ip'
@@ -474,13 +697,15 @@ async def provision_vm_background(
         
         # Create virtual network
         try:            
-            vnet_operation = network_client.virtual_networks.begin_create_or_update(
+            vnet_operation = await run_azure_operation(
+                network_client.virtual_networks.begin_create_or_update,
                 resource_group,
                 vnet_name,
                 {
                     'location': location,
                     'address_space': {'address_prefixes': ['10.1.0.0/16']},
-                    'subnets': [{'name': subnet_name, 'address_prefix': '10.1.0.0/24'}]
+                    'subnets': [{'name': subnet_name, 'address_prefix': '10.1.0.0/24'}],
+                    'tags': resource_tags
                 }
             )
             await run_azure_operation(vnet_operation.result)
@@ -521,9 +746,12 @@ async def provision_vm_background(
         try:            
             public_ip_params = {
                 'location': location,
-                'public_ip_allocation_method': 'Dynamic'
+                'public_ip_allocation_method': 'Dynamic',
+                'delete_option': 'Delete',
+                'tags': resource_tags
             }
-            ip_operation = network_client.public_ip_addresses.begin_create_or_update(
+            ip_operation = await run_azure_operation(
+                network_client.public_ip_addresses.begin_create_or_update,
                 resource_group,
                 public_ip_name,
                 public_ip_params
@@ -588,8 +816,9 @@ async def provision_vm_background(
                     }
                 )
             except Exception:
-                nsg_params = NetworkSecurityGroup(location=location, security_rules=[])
-                nsg_operation = network_client.network_security_groups.begin_create_or_update(
+                nsg_params = NetworkSecurityGroup(location=location, security_rules=[], tags=resource_tags)
+                nsg_operation = await run_azure_operation(
+                    network_client.network_security_groups.begin_create_or_update,
                     resource_group, 
                     nsg_name, 
                     nsg_params
@@ -653,7 +882,9 @@ async def provision_vm_background(
                     existing_priorities.add(priority)
                     priority += 1
 
-            nsg_operation = network_client.network_security_groups.begin_create_or_update(
+            nsg_operation = await run_azure_operation(
+
+                network_client.network_security_groups.begin_create_or_update,
                 resource_group,
                 nsg_name,
                 nsg
@@ -701,9 +932,11 @@ async def provision_vm_background(
                     'subnet': {'id': subnet_id},
                     'public_ip_address': {'id': public_ip_id}
                 }],
-                'network_security_group': {'id': nsg.id}
+                'network_security_group': {'id': nsg.id},
+                'tags': resource_tags
             }
-            nic_operation = network_client.network_interfaces.begin_create_or_update(
+            nic_operation = await run_azure_operation(
+                network_client.network_interfaces.begin_create_or_update,
                 resource_group, 
                 f'{vm_name}-nic', 
                 nic_params
@@ -785,7 +1018,7 @@ async def provision_vm_background(
                 return
             
             # Pick the latest version
-            latest_version = sorted(versions, key=lambda v: v.name)[-1].name
+            latest_version = max(versions, key=lambda v: preflight.version_key(v.name)).name
             print_info(f"Latest gallery image version found: {latest_version}")
 
             image_version_id = (
@@ -813,6 +1046,7 @@ async def provision_vm_background(
                 'name': f'{vm_name}-os-disk',
                 'managed_disk': {'storage_account_type': 'Standard_LRS'},
                 'create_option': 'FromImage',
+                'delete_option': 'Delete',
                 'disk_size_gb': OS_DISK_SSD_GB
             }
 
@@ -829,17 +1063,21 @@ async def provision_vm_background(
                 location=location,
                 hardware_profile=HardwareProfile(vm_size=vm_size),
                 storage_profile=StorageProfile(os_disk=os_disk, image_reference=image_reference),
-                network_profile=NetworkProfile(network_interfaces=[NetworkInterfaceReference(id=nic.id)]),
+                network_profile=NetworkProfile(network_interfaces=[NetworkInterfaceReference(id=nic.id, delete_option='Delete')]),
                 security_profile=security_profile,
-                zones=None
+                zones=None,
+                tags=resource_tags
             )
             
-            vm_operation = compute_client.virtual_machines.begin_create_or_update(
+            vm_operation = await run_azure_operation(
+            
+                compute_client.virtual_machines.begin_create_or_update,
                 resource_group, 
                 vm_name, 
                 vm_parameters
             )
             vm = await run_azure_operation(vm_operation.result)
+            placement.record_allocation(location, vm_size, True)
             
             await post_status_update(
                 hook_url=hook_url,
@@ -859,6 +1097,9 @@ async def provision_vm_background(
         except Exception as e:
             error_msg = f"Failed to create virtual machine: {str(e)}"
             print_error(error_msg)
+            # Cached quota/SKU data may be stale if ARM rejected the allocation
+            preflight.invalidate(location)
+            placement.record_allocation(location, vm_size, False)
             await post_status_update(
                 hook_url=hook_url,
                 status_data={
@@ -878,7 +1119,7 @@ async def provision_vm_background(
         # Wait for VM initialization
         await asyncio.sleep(30)
 
-        a_records = [f'pin.{subdomain}',f'drop.{subdomain}',f'web.{subdomain}']
+        a_records = dns_manager.record_names(subdomain)
         # Verify public IP assignment
         try:            
             nic_client = await run_azure_operation(
@@ -1035,20 +1276,10 @@ async def provision_vm_background(
                 return
 
 
-            # Create DNS A records
-            for a_record in a_records:
-                a_record_set = RecordSet(
-                    ttl=3600, 
-                    a_records=[{'ipv4_address': public_ip}]
-                )
-                await run_azure_operation(
-                    dns_client.record_sets.create_or_update,
-                    resource_group, 
-                    domain, 
-                    a_record, 
-                    'A', 
-                    a_record_set
-                )
+            # Create DNS A records (unchanged ones are skipped)
+            await run_azure_operation(
+                dns_manager.set_records, dns_client, resource_group, domain, a_records, public_ip
+            )
                 
             await post_status_update(
                 hook_url=hook_url,
@@ -1123,7 +1354,8 @@ async def provision_vm_background(
                     'commandToExecute': f'powershell -ExecutionPolicy Unrestricted -File {blob_name}'
                 },
             }
-            extension_operation = compute_client.virtual_machine_extensions.begin_create_or_update(
+            extension_operation = await run_azure_operation(
+                compute_client.virtual_machine_extensions.begin_create_or_update,
                 resource_group,
                 vm_name,
                 'customScriptExtension',
@@ -1224,90 +1456,54 @@ async def provision_vm_background(
         # Final wait
         await asyncio.sleep(30)
 
-        # Send completion email
-        try:
-            await post_status_update(
-                hook_url=hook_url,
-                status_data={
-                    "vm_name": vm_name,
-                    "status": "provisioning",
-                    "resource_group": resource_group,
-                    "location": location,
-                    "details": {
-                        "step": "sending_email",
-                        "message": "Sending completion email"
+        # Send completion email (not for warm pool VMs, their owner gets one at handout)
+        if send_email:
+            try:
+                await post_status_update(
+                    hook_url=hook_url,
+                    status_data={
+                        "vm_name": vm_name,
+                        "status": "provisioning",
+                        "resource_group": resource_group,
+                        "location": location,
+                        "details": {
+                            "step": "sending_email",
+                            "message": "Sending completion email"
+                        }
                     }
-                }
-            )
-            
-            smtp_host = os.environ.get('SMTP_HOST')
-            smtp_port = int(os.environ.get('SMTP_PORT', 587))
-            smtp_user = os.environ.get('SMTP_USER')
-            smtp_password = os.environ.get('SMTP_PASS')
-            sender_email = os.environ.get('SENDER_EMAIL')
-            recipient_emails = [e.strip() for e in RECIPIENT_EMAILS.split(',')]
-            
-            html_content = html_email.HTMLEmail(
-                ip_address=public_ip,
-                background_image_url="",
-                title=f"{vm_name}",
-                main_heading=f"{vm_name}",
-                main_description="Your virtual machine is ready to play games.",
-                youtube_embed_src="https://youtu.be/PeVxO56lCBs",
-                image_left_src="",
-                image_right_src="",
-                logo_src="https://i.postimg.cc/XJCSdSNc/rtxazure.png",
-                company_src="https://i.postimg.cc/XJCSdSNc/rtxazure.png",
-                discord_widget_src="https://discord.com/widget?id=1363815250742480927&theme=dark",
-                windows_password=WINDOWS_IMAGE_PASSWORD,
-                credentials_sunshine="Username: <strong>sunshine</strong><br>Password: <strong>sunshine</strong>",
-                form_description="Fill our form, so we can match your team with investors/publishers",
-                form_link="https://forms.gle/QgFZQhaehZLs9sySA",
-                new_vm_url="https://rtxdevstation.xyz/requestvm",
-                dash_url="https://rtxdevstation.xyz"
-            )
-
-            await html_email_send.send_html_email_smtp(
-                    smtp_host=smtp_host,
-                    smtp_port=smtp_port,
-                    smtp_user=smtp_user,
-                    smtp_password=smtp_password,
-                    sender_email=sender_email,
-                    recipient_emails=recipient_emails,
-                    subject=f"Azure VM '{vm_name}' Completed",
-                    html_content=html_content,
-                    use_tls=True
                 )
             
-            await post_status_update(
-                hook_url=hook_url,
-                status_data={
-                    "vm_name": vm_name,
-                    "status": "provisioning",
-                    "resource_group": resource_group,
-                    "location": location,
-                    "details": {
-                        "step": "email_sent",
-                        "message": "Completion email sent"
+                await send_vm_ready_email(vm_name, public_ip, WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS)
+            
+                await post_status_update(
+                    hook_url=hook_url,
+                    status_data={
+                        "vm_name": vm_name,
+                        "status": "provisioning",
+                        "resource_group": resource_group,
+                        "location": location,
+                        "details": {
+                            "step": "email_sent",
+                            "message": "Completion email queued"
+                        }
                     }
-                }
-            )
-        except Exception as e:
-            error_msg = f"Failed to send email: {str(e)}"
-            print_warn(error_msg)
-            await post_status_update(
-                hook_url=hook_url,
-                status_data={
-                    "vm_name": vm_name,
-                    "status": "provisioning",
-                    "resource_group": resource_group,
-                    "location": location,
-                    "details": {
-                        "step": "email_failed",
-                        "warning": error_msg
+                )
+            except Exception as e:
+                error_msg = f"Failed to send email: {str(e)}"
+                print_warn(error_msg)
+                await post_status_update(
+                    hook_url=hook_url,
+                    status_data={
+                        "vm_name": vm_name,
+                        "status": "provisioning",
+                        "resource_group": resource_group,
+                        "location": location,
+                        "details": {
+                            "step": "email_failed",
+                            "warning": error_msg
+                        }
                     }
-                }
-            )
+                )
 
         # Wait for cleanup finishing
         await asyncio.sleep(10)
@@ -1334,6 +1530,7 @@ async def provision_vm_background(
         print_success(f"Pin moonlight service at: https://pin.{subdomain}.{domain}")
         print_success(f"Drop files service at: https://drop.{subdomain}.{domain}")
         print_success(f"Pin: {DUMBDROP_PIN}")
+        return True
         
     except Exception as e:
         # Top-level error handler for background task
@@ -1370,8 +1567,269 @@ async def provision_vm_background(
             storage_account_name
         )
 
+# ====================== WARM POOL ======================
+
+async def handout_vm_background(
+    credentials,
+    pool_vm_name, vm_name, resource_group, domain, location,
+    WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN, hook_url, claimed_at
+):
+    """Start a claimed warm pool VM and make it vm_name's: DNS, Caddy hosts, PIN and password"""
+    subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
+    compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+    network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+    dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+    a_records = dns_manager.record_names(vm_name)
+    pool_a_records = dns_manager.all_record_names(pool_vm_name)
+    step = "starting_vm"
+
+    try:
+        # Start the deallocated VM
+        await run_azure_operation(lambda: compute_client.virtual_machines.begin_start(resource_group, pool_vm_name).result())
+        await post_status_update(
+            hook_url=hook_url,
+            status_data={
+                "vm_name": vm_name,
+                "status": "provisioning",
+                "resource_group": resource_group,
+                "location": location,
+                "details": {
+                    "step": "vm_started",
+                    "message": f"Warm pool VM {pool_vm_name} started"
+                }
+            }
+        )
+
+        # A dynamic public IP is assigned again on start
+        step = "public_ip_verification"
+        public_ip_info = await run_azure_operation(
+            network_client.public_ip_addresses.get, resource_group, f'{pool_vm_name}-public-ip'
+        )
+        public_ip = public_ip_info.ip_address
+        if not public_ip:
+            raise Exception("No public IP assigned after start")
+
+        # Point vm_name's records at the VM and drop the pool name's
+        step = "dns_configuration"
+        await run_azure_operation(dns_manager.set_records, dns_client, resource_group, domain, a_records, public_ip)
+        await run_azure_operation(dns_manager.delete_records, dns_client, resource_group, domain, pool_a_records)
+        await post_status_update(
+            hook_url=hook_url,
+            status_data={
+                "vm_name": vm_name,
+                "status": "provisioning",
+                "resource_group": resource_group,
+                "location": location,
+                "details": {
+                    "step": "dns_records_created",
+                    "message": "DNS records configured successfully"
+                }
+            }
+        )
+
+        # Caddy host names, DumbDrop PIN and password rotation in one run command
+        step = "personalizing"
+        certificate = await run_azure_operation(
+            cert_service.certificate_for, dns_client, resource_group, domain, f"{vm_name}.{vm_name}.{domain}"
+        )
+        claim_script = generate_setup.generate_claim(
+            vm_name, f"{vm_name}.{domain}", os.environ.get('SENDER_EMAIL'), DUMBDROP_PIN, WINDOWS_IMAGE_PASSWORD, certificate
+        )
+        await run_azure_operation(
+            lambda: compute_client.virtual_machines.begin_run_command(
+                resource_group,
+                pool_vm_name,
+                {'command_id': 'RunPowerShellScript', 'script': claim_script.splitlines()}
+            ).result()
+        )
+        await post_status_update(
+            hook_url=hook_url,
+            status_data={
+                "vm_name": vm_name,
+                "status": "provisioning",
+                "resource_group": resource_group,
+                "location": location,
+                "details": {
+                    "step": "vm_personalized",
+                    "message": "Host names, PIN and password updated"
+                }
+            }
+        )
+    except Exception as e:
+        error_msg = f"Warm pool handout failed at {step}: {str(e)}"
+        print_error(error_msg)
+        warm_pool.metrics.record("handouts_failed")
+        await post_status_update(
+            hook_url=hook_url,
+            status_data={
+                "vm_name": vm_name,
+                "status": "failed",
+                "resource_group": resource_group,
+                "location": location,
+                "details": {
+                    "step": "warm_pool_handout_failed",
+                    "error": error_msg,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            }
+        )
+        await cleanup_resources_on_failure(
+            network_client, compute_client, None, None, None, None, dns_client,
+            resource_group, domain, a_records + pool_a_records, pool_vm_name, None
+        )
+        return
+
+    claim_latency = time.monotonic() - claimed_at
+    warm_pool.metrics.record_claim_latency(claim_latency)
+
+    try:
+        await send_vm_ready_email(vm_name, public_ip, WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS)
+    except Exception as e:
+        print_warn(f"Failed to send email: {str(e)}")
+
+    await post_status_update(
+        hook_url=hook_url,
+        status_data={
+            "vm_name": vm_name,
+            "status": "completed",
+            "resource_group": resource_group,
+            "location": location,
+            "details": {
+                "step": "completed",
+                "message": f"VM handed out from warm pool in {claim_latency:.0f}s",
+                "public_ip": public_ip,
+                "pool_vm_name": pool_vm_name,
+                "url": f"https://cdn.sdappnet.cloud/rtx/rtxvmrun.html?url={public_ip}&vm_name={vm_name}",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        }
+    )
+    print_success(f"Warm pool VM {pool_vm_name} handed out as {vm_name} in {claim_latency:.0f}s")
+    return True
+
+async def provision_pool_vm(credentials, target, key, name):
+    """Provision one warm pool VM, deallocate it and mark it ready"""
+    resource_group = target["resource_group"]
+    try:
+        provisioned = await provision_vm_background(
+            credentials,
+            name, resource_group, target["domain"], target["location"], target["vm_size"],
+            name, target["gallery_image_resource_group"], target["gallery_name"],
+            target["gallery_image_name"], key.rsplit('/', 1)[-1], int(target.get("os_disk_ssd_gb", 256)),
+            # Placeholder password until handout rotates it
+            f"{secrets.token_urlsafe(12)}aA1!", target.get("recipient_emails", ""), '1234', '',
+            tags={warm_pool.TAG_POOL: key, warm_pool.TAG_STATE: warm_pool.PROVISIONING},
+            send_email=False
+        )
+        if not provisioned:
+            warm_pool.metrics.record("replenish_failed")
+            return
+        compute_client = ComputeManagementClient(credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs(arm_throttle.LOW))
+        await run_azure_operation(lambda: compute_client.virtual_machines.begin_deallocate(resource_group, name).result())
+        await run_azure_operation(warm_pool.set_state, compute_client, resource_group, name, warm_pool.READY)
+        warm_pool.metrics.record("replenished")
+        print_success(f"Warm pool VM {name} ready ({key})")
+    except Exception as e:
+        warm_pool.metrics.record("replenish_failed")
+        print_error(f"Warm pool VM {name} failed: {e}")
+    finally:
+        _warm_pool_provisioning.get(key, set()).discard(name)
+
+async def replenish_warm_pool(credentials=None, force=False):
+    """Start provisioning for every configured pool below its target depth; returns the new VM names"""
+    global _warm_pool_checked_at
+    if not force and time.monotonic() - _warm_pool_checked_at < WARM_POOL_CHECK_SECONDS:
+        return []
+    _warm_pool_checked_at = time.monotonic()
+    targets = warm_pool.targets()
+    if not targets:
+        return []
+    if credentials is None:
+        credentials = ClientSecretCredential(
+            client_id=os.environ['AZURE_APP_CLIENT_ID'],
+            client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+            tenant_id=os.environ['AZURE_APP_TENANT_ID']
+        )
+    compute_client = ComputeManagementClient(credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs(arm_throttle.LOW))
+    resource_client = ResourceManagementClient(credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs(arm_throttle.LOW))
+
+    started = []
+    for target in targets:
+        try:
+            key = await run_azure_operation(warm_pool.target_key, compute_client, target)
+            if not key:
+                print_warn(f"Warm pool target has no image version: {target}")
+                continue
+            pool = await run_azure_operation(warm_pool.list_pool, compute_client, target["resource_group"])
+            pending = _warm_pool_provisioning.setdefault(key, set())
+            ready = sum(1 for vm in pool if vm["key"] == key and vm["state"] == warm_pool.READY)
+            # Builds of other workers count too, or every worker tops the pool up on its own
+            in_flight = await run_azure_operation(warm_pool.in_flight, resource_client, target["resource_group"], key)
+            provisioning = pending | in_flight
+            for _ in range(int(target["count"]) - ready - len(provisioning)):
+                name = warm_pool.new_vm_name()
+                pending.add(name)
+                task = asyncio.create_task(provision_pool_vm(credentials, target, key, name))
+                _warm_pool_tasks.add(task)
+                task.add_done_callback(_warm_pool_tasks.discard)
+                started.append(name)
+        except Exception as e:
+            print_warn(f"Warm pool replenish failed for {target.get('resource_group')}/{target.get('vm_size')}: {e}")
+    if started:
+        print_info(f"Warm pool: provisioning {', '.join(started)}")
+    return started
+
+def schedule_warm_pool_replenish(credentials=None, force=False):
+    """Run replenish_warm_pool in the background"""
+    if not warm_pool.targets():
+        return
+    task = asyncio.create_task(replenish_warm_pool(credentials, force))
+    _warm_pool_tasks.add(task)
+    task.add_done_callback(_warm_pool_tasks.discard)
+
 # ====================== HELPER FUNCTIONS ======================
 
+async def send_vm_ready_email(vm_name, public_ip, WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS):
+    """Send the 'VM ready' email"""
+    smtp_host = os.environ.get('SMTP_HOST')
+    smtp_port = int(os.environ.get('SMTP_PORT', 587))
+    smtp_user = os.environ.get('SMTP_USER')
+    smtp_password = os.environ.get('SMTP_PASS')
+    sender_email = os.environ.get('SENDER_EMAIL')
+    recipient_emails = [e.strip() for e in RECIPIENT_EMAILS.split(',')]
+
+    html_content = html_email.HTMLEmail(
+        ip_address=public_ip,
+        background_image_url="",
+        title=f"{vm_name}",
+        main_heading=f"{vm_name}",
+        main_description="Your virtual machine is ready to play games.",
+        youtube_embed_src="https://youtu.be/PeVxO56lCBs",
+        image_left_src="",
+        image_right_src="",
+        logo_src="https://i.postimg.cc/XJCSdSNc/rtxazure.png",
+        company_src="https://i.postimg.cc/XJCSdSNc/rtxazure.png",
+        discord_widget_src="https://discord.com/widget?id=1363815250742480927&theme=dark",
+        windows_password=WINDOWS_IMAGE_PASSWORD,
+        credentials_sunshine="Username: <strong>sunshine</strong><br>Password: <strong>sunshine</strong>",
+        form_description="Fill our form, so we can match your team with investors/publishers",
+        form_link="https://forms.gle/QgFZQhaehZLs9sySA",
+        new_vm_url="https://rtxdevstation.xyz/requestvm",
+        dash_url="https://rtxdevstation.xyz"
+    )
+
+    await html_email_send.send_html_email_smtp(
+            smtp_host=smtp_host,
+            smtp_port=smtp_port,
+            smtp_user=smtp_user,
+            smtp_password=smtp_password,
+            sender_email=sender_email,
+            recipient_emails=recipient_emails,
+            subject=f"Azure VM '{vm_name}' Completed",
+            html_content=html_content,
+            use_tls=True
+        )
+
 def create_storage_account(storage_client, resource_group_name, storage_name, location):
     """Create or get storage account"""
     print_info(f"Creating storage account '{storage_name}'...")
@@ -1392,9 +1850,10 @@ def create_storage_account(storage_client, resource_group_name, storage_name, lo
             )
             poller.result()
             print_success(f"Storage account '{storage_name}' created.")
+            # A re-created account has new keys
+            sas_issuer.invalidate(resource_group_name, storage_name)
 
-        keys = storage_client.storage_accounts.list_keys(resource_group_name, storage_name)
-        storage_key = keys.keys[0].value
+        storage_key = sas_issuer.account_key(storage_client, resource_group_name, storage_name)
         storage_url = f"https://{storage_name}.blob.core.windows.net"
 
         return {
@@ -1433,23 +1892,33 @@ def upload_blob_and_generate_sas(blob_service_client, container_name, blob_name,
     return f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
 
 # ====================== VM_SIZE COMPATIBILITY FUNCTIONS ======================
-# ===== NVIDIA GPU BASED INSTANCES =====
-def get_compatible_vm_sizes():
-    return [
-        'Standard_NV4as_v4',
-        'Standard_NV6ads_A10_v5',
-        'Standard_NV8as_v4',
-        'Standard_NV12ads_A10_v5',
-        'Standard_NV12s_v3',
-        'Standard_NV16as_v4',
-        'Standard_NV18ads_A10_v5',
-        'Standard_NV32as_v4',
-        'Standard_NV36adms_A10_v5',
-        'Standard_NV36ads_A10_v5'
-    ]
-
-def check_vm_size_compatibility(vm_size):
-    return vm_size in get_compatible_vm_sizes()
+# ===== NVIDIA GPU BASED INSTANCES (NV series) =====
+VM_SIZE_REQUIREMENTS = {"gpu": True, "arm64": False, "families": ["standardNV"]}
+
+def get_compatible_vm_sizes(location):
+    """Return the sizes offered in location that meet VM_SIZE_REQUIREMENTS"""
+    return [size["name"] for size in sku_catalog.get_catalog().query(location, **VM_SIZE_REQUIREMENTS)]
+
+def check_vm_size_compatibility(vm_size, location):
+    """Return (compatible, suggested_sizes) using the live SKU catalog"""
+    return sku_catalog.check_vm_size(location, vm_size, **VM_SIZE_REQUIREMENTS)
+
+def check_candidate_sizes(vm_sizes, locations):
+    """{vm_size: suggested_sizes} for the sizes that meet VM_SIZE_REQUIREMENTS in none of the locations.
+
+    Restricted sizes pass: placement skips the locations where they cannot be deployed.
+    """
+    incompatible = {}
+    for vm_size in dict.fromkeys(vm_sizes):
+        suggestions = []
+        for location in locations:
+            size_ok, suggested = sku_catalog.check_vm_size(location, vm_size, include_restricted=True, **VM_SIZE_REQUIREMENTS)
+            if size_ok:
+                break
+            suggestions += [s for s in suggested if s not in suggestions]
+        else:
+            incompatible[vm_size] = suggestions[:10]
+    return incompatible
 
 def check_ns_delegation_with_retries(dns_client, resource_group, domain, retries=5, delay=10):
     """Check NS delegation with retries"""
@@ -1532,12 +2001,7 @@ async def cleanup_resources_on_failure(
         pass
     
     # Delete DNS records
-    for record_name in a_records:
-        record_to_delete = record_name if record_name else '@'
-        try:
-            dns_client.record_sets.delete(resource_group, domain, record_to_delete, 'A')
-        except Exception:
-            pass
+    dns_manager.delete_records(dns_client, resource_group, domain, a_records)
     
 
 
@@ -1545,6 +2009,8 @@ async def cleanup_resources_on_failure(
 # ====================== STATUS UPDATE FUNCTION ======================
 async def post_status_update(hook_url: str, status_data: dict) -> dict:
     """Send status update to webhook with retry logic"""
+    tracing.record(status_data)
+    idempotency.registry.record_status(status_data)
     if not hook_url:
         return {"success": True, "status_url": ""}
     
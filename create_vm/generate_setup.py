@@ -1,26 +1,53 @@
-def generate_setup(PC_NAME: str, DOMAIN_NAME: str, SSL_EMAIL: str, PIN_CODE: str = "123456", NEW_PASSWORD: str = None) -> str:
-    safe_pc_name = PC_NAME.replace('"', '`"')
-    safe_domain = DOMAIN_NAME.replace('"', '`"')
-    safe_pin = PIN_CODE.replace('"', '`"')
-    safe_password = NEW_PASSWORD.replace('"', '`"') if NEW_PASSWORD and NEW_PASSWORD.strip() != "" else None
-    
-    superf4_url = "https://github.com/SongDrop/SuperF4/releases/download/1.0/SuperF4.zip"
-    vc_redist_url = "https://github.com/SongDrop/dumbdropwindows/releases/download/windows/VC_redist.x64.exe"
-    reset_sunshine_url = "https://github.com/SongDrop/resetsunshine/releases/download/v1.0/resetsunshine.exe"
-    dumbdrop_url = "https://github.com/SongDrop/dumbdropwindows/releases/download/windows/DumbDrop.exe"
-    
-    # New URLs for the images to replace
-    force_quit_img_url = "https://github.com/SongDrop/win10dev/raw/main/forcequit.png"
-    restart_img_url = "https://github.com/SongDrop/win10dev/raw/main/restart.png"
-    taskmanager_img_url = "https://github.com/SongDrop/win10dev/raw/main/taskmanager.png"
+def _caddy_config(safe_pc_name, safe_domain, SSL_EMAIL, tls=False):
+    # Pre-issued certificate written by _tls_files_script; Caddy skips ACME for these hosts
+    tls_line = "tls C:/Caddy/certs/fullchain.pem C:/Caddy/certs/privkey.pem" if tls else ""
+    return f'''
+    # Caddyfile for {safe_pc_name}.{safe_domain}
+    # HTTP to HTTPS redirect for all hosts
+    {{
+        email {SSL_EMAIL}
+        auto_https disable_redirects
+    }}
+
+    # Route for DumbDrop
+    drop.{safe_pc_name}.{safe_domain} {{
+        {tls_line}
+        reverse_proxy localhost:3475
+        log {{
+            output file "C:\\Caddy\\logs\\dumbdrop.log"
+        }}
+    }}
+
+    # Route for Sunshine PIN and UI
+    pin.{safe_pc_name}.{safe_domain} {{
+        {tls_line}
+        reverse_proxy localhost:47990
+        log {{
+            output file "C:\\Caddy\\logs\\sunshine.log"
+        }}
+    }}
+    '''
 
-    # --- NEW: Caddy Downloads ---
-    caddy_url = "https://github.com/caddyserver/caddy/releases/download/v2.7.6/caddy_2.7.6_windows_amd64.zip"
-    winsw_url = "https://github.com/winsw/winsw/releases/download/v3.0.0-alpha.11/WinSW-x64.exe"
 
-    password_change_script = ""
-    if safe_password:
-        password_change_script = f'''
+def _tls_files_script(TLS_CERT):
+    """PowerShell writing a cert_service bundle to C:\\Caddy\\certs"""
+    if not TLS_CERT:
+        return ""
+    return f'''
+New-Item -Path "C:\\Caddy\\certs" -ItemType Directory -Force | Out-Null
+@'
+{TLS_CERT["fullchain"].strip()}
+'@ | Out-File -FilePath "C:\\Caddy\\certs\\fullchain.pem" -Encoding ascii
+@'
+{TLS_CERT["key"].strip()}
+'@ | Out-File -FilePath "C:\\Caddy\\certs\\privkey.pem" -Encoding ascii
+'''
+
+
+def _password_change_script(safe_password):
+    if not safe_password:
+        return ""
+    return f'''
         try {{
             $UserName = "source"
             Write-Host "Changing password for user $UserName"
@@ -53,34 +80,33 @@ def generate_setup(PC_NAME: str, DOMAIN_NAME: str, SSL_EMAIL: str, PIN_CODE: str
             throw
         }}
         '''
-    else:
-        password_change_script = ""
 
-    # --- NEW: Caddy Configuration String ---
-    caddy_config = f'''
-    # Caddyfile for {safe_pc_name}.{safe_domain}
-    # HTTP to HTTPS redirect for all hosts
-    {{
-        email {SSL_EMAIL}
-        auto_https disable_redirects
-    }}
 
-    # Route for DumbDrop
-    drop.{safe_pc_name}.{safe_domain} {{
-        reverse_proxy localhost:3475
-        log {{
-            output file "C:\\Caddy\\logs\\dumbdrop.log"
-        }}
-    }}
+def generate_setup(PC_NAME: str, DOMAIN_NAME: str, SSL_EMAIL: str, PIN_CODE: str = "123456", NEW_PASSWORD: str = None, TLS_CERT: dict = None) -> str:
+    safe_pc_name = PC_NAME.replace('"', '`"')
+    safe_domain = DOMAIN_NAME.replace('"', '`"')
+    safe_pin = PIN_CODE.replace('"', '`"')
+    safe_password = NEW_PASSWORD.replace('"', '`"') if NEW_PASSWORD and NEW_PASSWORD.strip() != "" else None
+    
+    superf4_url = "https://github.com/SongDrop/SuperF4/releases/download/1.0/SuperF4.zip"
+    vc_redist_url = "https://github.com/SongDrop/dumbdropwindows/releases/download/windows/VC_redist.x64.exe"
+    reset_sunshine_url = "https://github.com/SongDrop/resetsunshine/releases/download/v1.0/resetsunshine.exe"
+    dumbdrop_url = "https://github.com/SongDrop/dumbdropwindows/releases/download/windows/DumbDrop.exe"
+    
+    # New URLs for the images to replace
+    force_quit_img_url = "https://github.com/SongDrop/win10dev/raw/main/forcequit.png"
+    restart_img_url = "https://github.com/SongDrop/win10dev/raw/main/restart.png"
+    taskmanager_img_url = "https://github.com/SongDrop/win10dev/raw/main/taskmanager.png"
 
-    # Route for Sunshine PIN and UI
-    pin.{safe_pc_name}.{safe_domain} {{
-        reverse_proxy localhost:47990
-        log {{
-            output file "C:\\Caddy\\logs\\sunshine.log"
-        }}
-    }}
-    '''
+    # --- NEW: Caddy Downloads ---
+    caddy_url = "https://github.com/caddyserver/caddy/releases/download/v2.7.6/caddy_2.7.6_windows_amd64.zip"
+    winsw_url = "https://github.com/winsw/winsw/releases/download/v3.0.0-alpha.11/WinSW-x64.exe"
+
+    password_change_script = _password_change_script(safe_password)
+
+    # --- NEW: Caddy Configuration String ---
+    caddy_config = _caddy_config(safe_pc_name, safe_domain, SSL_EMAIL, tls=bool(TLS_CERT))
+    tls_files_script = _tls_files_script(TLS_CERT)
     
     script = f'''# Check for admin privileges and relaunch as admin if needed
 $currentPrincipal = New-Object Security.Principal.WindowsPrincipal([Security.Principal.WindowsIdentity]::GetCurrent())
@@ -163,6 +189,7 @@ try {{
     [System.IO.Compression.ZipFile]::ExtractToDirectory($caddyZipPath, $caddyDir)
 
     Write-Host "Creating Caddyfile..."
+{tls_files_script}
     @'
 {caddy_config}
 '@ | Out-File -FilePath $caddyfilePath -Encoding utf8
@@ -452,4 +479,49 @@ if ($needRestart) {{
 }}
 '''
 
-    return script
\ No newline at end of file
+    return script
+
+def generate_claim(PC_NAME: str, DOMAIN_NAME: str, SSL_EMAIL: str, PIN_CODE: str = "123456", NEW_PASSWORD: str = None, TLS_CERT: dict = None) -> str:
+    """Run-command script that hands a warm-pool VM over to its new owner:
+    Caddy host names, DumbDrop PIN and the 'source' password"""
+    safe_pc_name = PC_NAME.replace('"', '`"')
+    safe_domain = DOMAIN_NAME.replace('"', '`"')
+    safe_pin = PIN_CODE.replace('"', '`"')
+    safe_password = NEW_PASSWORD.replace('"', '`"') if NEW_PASSWORD and NEW_PASSWORD.strip() != "" else None
+
+    caddy_config = _caddy_config(safe_pc_name, safe_domain, SSL_EMAIL, tls=bool(TLS_CERT))
+    tls_files_script = _tls_files_script(TLS_CERT)
+    password_change_script = _password_change_script(safe_password)
+
+    return f'''$ErrorActionPreference = "Stop"
+$installLog = "C:\\Program Files\\Logs\\install_log.txt"
+Add-Content -Path $installLog -Value "=== Warm pool claim for {safe_pc_name}.{safe_domain} $(Get-Date) ==="
+
+# Caddy routes for the new host names
+{tls_files_script}
+@'
+{caddy_config}
+'@ | Out-File -FilePath "C:\\Caddy\\Caddyfile" -Encoding utf8
+Restart-Service -Name "caddy" -ErrorAction SilentlyContinue
+Add-Content -Path $installLog -Value "[SUCCESS] Caddyfile rewritten for {safe_pc_name}.{safe_domain}."
+
+# DumbDrop PIN
+try {{
+    $dumbdropExePath = "C:\\Program Files\\DumbDrop\\DumbDrop.exe"
+    $WScriptShell = New-Object -ComObject WScript.Shell
+    $Shortcut = $WScriptShell.CreateShortcut("$env:Public\\Desktop\\DumbDrop.lnk")
+    if ($Shortcut.TargetPath) {{ $dumbdropExePath = $Shortcut.TargetPath }}
+    $Shortcut.Arguments = "{safe_pin}"
+    $Shortcut.Save()
+    $action = New-ScheduledTaskAction -Execute $dumbdropExePath -Argument "{safe_pin}"
+    Set-ScheduledTask -TaskName "RunDumbDropOnce" -Action $action -ErrorAction SilentlyContinue | Out-Null
+    Add-Content -Path $installLog -Value "[SUCCESS] DumbDrop PIN updated."
+}} catch {{
+    Write-Warning "DumbDrop PIN update failed: $_"
+    Add-Content -Path $installLog -Value "[ERROR] DumbDrop PIN update failed: $_"
+}}
+
+{password_change_script}
+
+Add-Content -Path $installLog -Value "=== Warm pool claim finished $(Get-Date) ==="
+'''
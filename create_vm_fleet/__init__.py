@@ -0,0 +1,628 @@
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+import logging
+import azure.functions as func
+
+from shared_code import admission, arm_recorder, arm_throttle, arm_usage, bootstrap, cert_service, dns_manager, idempotency, placement, preflight, topology
+# The per-VM pieces (setup script, NSG ports, size check, status hook) are the
+# create_vm ones; a fleet is the same VM created N times with the shared work done once
+from create_vm import (
+    PORTS_TO_OPEN, generate_setup, html_email_send,
+    check_ns_delegation_with_retries, check_vm_size_compatibility, create_storage_account,
+    ensure_container_exists, post_status_update, run_azure_operation,
+    print_info, print_success, print_warn, print_error
+)
+from . import html_email
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+BlobServiceClient, generate_blob_sas, BlobSasPermissions = bootstrap.lazy(
+    'azure.storage.blob', 'BlobServiceClient', 'generate_blob_sas', 'BlobSasPermissions'
+)
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+NetworkSecurityGroup, SecurityRule = bootstrap.lazy('azure.mgmt.network.models', 'NetworkSecurityGroup', 'SecurityRule')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+(
+    VirtualMachine, HardwareProfile, StorageProfile, NetworkProfile, NetworkInterfaceReference,
+    SecurityProfile
+) = bootstrap.lazy(
+    'azure.mgmt.compute.models',
+    'VirtualMachine', 'HardwareProfile', 'StorageProfile', 'NetworkProfile',
+    'NetworkInterfaceReference', 'SecurityProfile'
+)
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+StorageManagementClient = bootstrap.lazy('azure.mgmt.storage', 'StorageManagementClient')
+
+# Configure logging
+bootstrap.configure()
+logger = logging.getLogger(__name__)
+
+FLEET_MAX_SIZE = int(os.environ.get('FLEET_MAX_SIZE', 50))
+# VMs of one fleet being created at the same time
+FLEET_MAX_PARALLEL = int(os.environ.get('FLEET_MAX_PARALLEL', 5))
+
+VM_NAME_PATTERN = re.compile(r'^[a-z][a-z0-9-]{0,14}$')
+
+
+def fleet_member_names(vm_name, count, vm_names):
+    """Explicit names win; otherwise vm_name01..vm_nameNN"""
+    if vm_names:
+        if isinstance(vm_names, str):
+            vm_names = [n.strip() for n in vm_names.split(',')]
+        return [n.lower() for n in vm_names if n]
+    width = len(str(count))
+    return [f"{vm_name}{i:0{width}d}" for i in range(1, count + 1)]
+
+
+@arm_usage.metered
+@idempotency.idempotent('create')
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Processing create_vm_fleet request...')
+    try:
+        try:
+            req_body = req.get_json()
+        except ValueError:
+            req_body = {}
+
+        # Extract parameters with defaults
+        vm_name = req_body.get('vm_name') or req.params.get('vm_name')   # fleet name and member prefix
+        resource_group = req_body.get('resource_group') or req.params.get('resource_group')
+        domain = req_body.get('domain') or req.params.get('domain')
+        location = req_body.get('location') or req.params.get('location')
+        vm_size = req_body.get('vm_size') or req.params.get('vm_size')
+        count = req_body.get('count') or req.params.get('count')
+        vm_names = req_body.get('vm_names') or req.params.get('vm_names')
+        max_parallel = int(req_body.get('max_parallel') or req.params.get('max_parallel') or FLEET_MAX_PARALLEL)
+
+        # Image/Windows configuration
+        GALLERY_IMAGE_RESOURCE_GROUP = req_body.get('gallery_image_resource_group') or req.params.get('gallery_image_resource_group')
+        GALLERY_NAME = req_body.get('gallery_name') or req.params.get('gallery_name')
+        GALLERY_IMAGE_NAME = req_body.get('gallery_image_name') or req.params.get('gallery_image_name')
+        GALLERY_IMAGE_VERSION = req_body.get('gallery_image_version') or req.params.get('gallery_image_version') or 'latest'
+        OS_DISK_SSD_GB = int(req_body.get('os_disk_ssd_gb') or req.params.get('os_disk_ssd_gb') or 256)
+        WINDOWS_IMAGE_PASSWORD = req_body.get('windows_image_password') or req.params.get('windows_image_password')
+        RECIPIENT_EMAILS = req_body.get('recipient_emails') or req.params.get('recipient_emails')
+        DUMBDROP_PIN = req_body.get('dumbdrop_pin') or req.params.get('dumbdrop_pin') or '1234'
+        hook_url = req_body.get('hook_url') or req.params.get('hook_url') or ''
+
+        ###Parameter checking to handle errors
+        for param, value in (
+            ('vm_name', vm_name), ('resource_group', resource_group), ('domain', domain),
+            ('location', location), ('vm_size', vm_size),
+            ('gallery_image_resource_group', GALLERY_IMAGE_RESOURCE_GROUP), ('gallery_name', GALLERY_NAME),
+            ('gallery_image_name', GALLERY_IMAGE_NAME), ('windows_image_password', WINDOWS_IMAGE_PASSWORD),
+            ('recipient_emails', RECIPIENT_EMAILS)
+        ):
+            if not value:
+                return func.HttpResponse(
+                    json.dumps({"error": f"Missing '{param}' parameter"}),
+                    status_code=400,
+                    mimetype="application/json"
+                )
+        if '.' not in domain or domain.startswith('.') or len(domain.split('.')) > 2:
+            return func.HttpResponse(
+                json.dumps({
+                    "error": f"Domain '{domain}' is invalid. Please enter the root domain only (e.g., 'example.com')."
+                }),
+                status_code=400,
+                mimetype="application/json"
+            )
+        if GALLERY_IMAGE_VERSION.lower() != 'latest' and not re.match(r'^\d+\.\d+\.\d+$', GALLERY_IMAGE_VERSION):
+            return func.HttpResponse(
+                json.dumps({
+                    "error": f"Invalid 'gallery_image_version' format: '{GALLERY_IMAGE_VERSION}'. Must be 'latest' or semantic version 'X.Y.Z' like '1.0.0'."
+                }),
+                status_code=400,
+                mimetype="application/json"
+            )
+        if not count and not vm_names:
+            return func.HttpResponse(
+                json.dumps({"error": "Missing 'count' or 'vm_names' parameter"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        try:
+            members = fleet_member_names(vm_name, int(count or 0), vm_names)
+        except ValueError:
+            return func.HttpResponse(
+                json.dumps({"error": f"Invalid 'count' parameter: '{count}'"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        if not members or len(members) > FLEET_MAX_SIZE:
+            return func.HttpResponse(
+                json.dumps({"error": f"A fleet must have between 1 and {FLEET_MAX_SIZE} VMs, got {len(members)}"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        invalid = [n for n in members if not VM_NAME_PATTERN.match(n)]
+        if invalid or len(set(members)) != len(members):
+            return func.HttpResponse(
+                json.dumps({"error": f"VM names must be unique, lowercase, start with a letter and be at most 15 characters: {invalid or members}"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        size_ok, compatible_sizes = await run_azure_operation(check_vm_size_compatibility, vm_size, location)
+        if not size_ok:
+            return func.HttpResponse(
+                json.dumps({
+                    "error": f"VmSize {vm_size} is incompatible. Please select a size from the list: {compatible_sizes}"
+                }),
+                status_code=400,
+                mimetype="application/json"
+            )
+
+        # Initial status update: one status document for the whole fleet
+        fleet = {name: {"vm_name": name, "status": "pending", "step": "pending"} for name in members}
+        hook_response = await post_fleet_status(hook_url, vm_name, resource_group, location, fleet, "provisioning", "init")
+
+        if not hook_response.get("success") and hook_url:
+            error_msg = hook_response.get("error", "Unknown error posting status")
+            print_error(f"Initial status update failed: {error_msg}")
+            return func.HttpResponse(
+                json.dumps({"error": f"Status update failed: {error_msg}"}),
+                status_code=500,
+                mimetype="application/json"
+            )
+
+        status_url = hook_response.get("status_url", "")
+
+        # Validate environment variables
+        required_vars = ['AZURE_APP_CLIENT_ID', 'AZURE_APP_CLIENT_SECRET',
+                        'AZURE_APP_TENANT_ID', 'AZURE_SUBSCRIPTION_ID']
+        missing = [var for var in required_vars if not os.environ.get(var)]
+        if missing:
+            raise Exception(f"Missing environment variables: {', '.join(missing)}")
+
+        credentials = ClientSecretCredential(
+            client_id=os.environ['AZURE_APP_CLIENT_ID'],
+            client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+            tenant_id=os.environ['AZURE_APP_TENANT_ID']
+        )
+
+        # Preflight the whole fleet at once: quota for N VMs, SKU and image replica
+        compute_client = ComputeManagementClient(credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs())
+        placement_decision = await run_azure_operation(
+            placement.choose_placement,
+            compute_client,
+            [location],
+            [vm_size],
+            {
+                "gallery_resource_group": GALLERY_IMAGE_RESOURCE_GROUP,
+                "gallery_name": GALLERY_NAME,
+                "gallery_image_name": GALLERY_IMAGE_NAME,
+                "gallery_image_version": GALLERY_IMAGE_VERSION
+            },
+            len(members)
+        )
+        if not placement_decision["passed"]:
+            print_error(f"Fleet preflight failed: {placement_decision['error']}")
+            await post_fleet_status(
+                hook_url, vm_name, resource_group, location, fleet, "failed", "preflight_failed",
+                error=placement_decision["error"], checks=placement_decision["checks"]
+            )
+            return func.HttpResponse(
+                json.dumps({
+                    "error": f"Preflight failed: {placement_decision['error']}",
+                    "placement": placement_decision
+                }),
+                status_code=409,
+                mimetype="application/json"
+            )
+
+        async def report_queued(position, estimated_start):
+            await post_fleet_status(
+                hook_url, vm_name, resource_group, location, fleet, "queued", "queued",
+                queue_position=position, estimated_start=estimated_start
+            )
+
+        # The fleet takes one admission slot; it bounds its own concurrency with max_parallel
+        try:
+            ticket = admission.controller.submit(
+                job_id=f"{resource_group}/{vm_name}",
+                location=location,
+                family=placement_decision.get("family"),
+                run=idempotency.bind(lambda: provision_fleet_background(
+                    credentials,
+                    vm_name, members, resource_group, domain, location, vm_size,
+                    GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME, GALLERY_IMAGE_NAME, GALLERY_IMAGE_VERSION,
+                    OS_DISK_SSD_GB, WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN,
+                    hook_url, max(1, max_parallel), fleet
+                )),
+                on_queued=report_queued
+            )
+        except admission.QueueFull as e:
+            return func.HttpResponse(
+                json.dumps({"error": str(e)}),
+                status_code=429,
+                mimetype="application/json",
+                headers={"Retry-After": "60"}
+            )
+
+        if ticket["queued"]:
+            await report_queued(ticket["queue_position"], ticket["estimated_start"])
+
+        return func.HttpResponse(
+            json.dumps({
+                "message": "Fleet provisioning queued" if ticket["queued"] else "Fleet provisioning started",
+                "status_url": status_url,
+                "vm_name": vm_name,
+                "vm_names": members,
+                "location": location,
+                "vm_size": vm_size,
+                "queue_position": ticket["queue_position"],
+                "estimated_start": ticket["estimated_start"]
+            }),
+            status_code=202,
+            mimetype="application/json"
+        )
+
+    except Exception as ex:
+        logging.exception("Unhandled error:")
+        return func.HttpResponse(
+            json.dumps({"error": str(ex)}),
+            status_code=500,
+            mimetype="application/json"
+        )
+
+
+async def post_fleet_status(hook_url, fleet_name, resource_group, location, fleet, status, step, **extra):
+    """Post the aggregated fleet status document"""
+    counts = {}
+    for member in fleet.values():
+        counts[member["status"]] = counts.get(member["status"], 0) + 1
+    return await post_status_update(
+        hook_url=hook_url,
+        status_data={
+            "vm_name": fleet_name,
+            "status": status,
+            "resource_group": resource_group,
+            "location": location,
+            "details": {
+                "step": step,
+                "total": len(fleet),
+                "counts": counts,
+                "vms": list(fleet.values()),
+                **extra,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        }
+    )
+
+
+async def provision_fleet_background(
+    credentials,
+    fleet_name, members, resource_group, domain, location, vm_size,
+    GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME, GALLERY_IMAGE_NAME, GALLERY_IMAGE_VERSION,
+    OS_DISK_SSD_GB, WINDOWS_IMAGE_PASSWORD, RECIPIENT_EMAILS, DUMBDROP_PIN,
+    hook_url, max_parallel, fleet
+):
+    subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
+
+    # Initialize Azure clients
+    compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+    storage_client = StorageManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+    network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+    dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+
+    storage_account_name = f"{fleet_name.replace('-', '')[:14]}{int(time.time()) % 10000}temp"
+    container_name = 'vm-startup-scripts'
+    blob_service_client = None
+    fleet_id = topology.new_provisioning_id()
+
+    async def fail(step, error_msg):
+        print_error(error_msg)
+        for member in fleet.values():
+            member.update({"status": "failed", "step": step, "error": error_msg})
+        await post_fleet_status(hook_url, fleet_name, resource_group, location, fleet, "failed", step, error=error_msg)
+
+    # ---------- shared work, done once for the fleet ----------
+    try:
+        await post_fleet_status(hook_url, fleet_name, resource_group, location, fleet, "provisioning", "starting_provisioning")
+
+        # Temporary storage for the setup scripts
+        storage_config = await run_azure_operation(
+            create_storage_account, storage_client, resource_group, storage_account_name, location
+        )
+        storage_key = storage_config["AZURE_STORAGE_KEY"]
+        blob_service_client = BlobServiceClient(account_url=storage_config["AZURE_STORAGE_URL"], credential=credentials, **arm_recorder.blob_kwargs())
+        await run_azure_operation(ensure_container_exists, blob_service_client, container_name)
+
+        # Gallery image version
+        image_version = GALLERY_IMAGE_VERSION
+        if image_version == 'latest':
+            versions = await run_azure_operation(
+                lambda: list(compute_client.gallery_image_versions.list_by_gallery_image(
+                    GALLERY_IMAGE_RESOURCE_GROUP, GALLERY_NAME, GALLERY_IMAGE_NAME
+                ))
+            )
+            if not versions:
+                await fail("image_lookup_failed", f"No image versions found in gallery '{GALLERY_NAME}' for image '{GALLERY_IMAGE_NAME}'.")
+                await cleanup_fleet_shared(network_client, storage_client, resource_group, fleet_name, storage_account_name, True)
+                return
+            image_version = max(versions, key=lambda v: preflight.version_key(v.name)).name
+        image_version_id = (
+            f"/subscriptions/{subscription_id}/resourceGroups/{GALLERY_IMAGE_RESOURCE_GROUP}"
+            f"/providers/Microsoft.Compute/galleries/{GALLERY_NAME}"
+            f"/images/{GALLERY_IMAGE_NAME}/versions/{image_version}"
+        )
+        print_info(f"Fleet {fleet_name} uses image version {image_version}")
+
+        # One virtual network and one NSG for every VM of the fleet, tagged as
+        # the fleet's; every VM gets a provisioning ID of its own and the fleet
+        # ID, so deleting the last member takes the shared network with it
+        shared_tags = topology.tags(fleet_name, fleet_id, **{topology.TAG_FLEET_ID: fleet_id})
+        vnet_name = f'{fleet_name}-vnet'
+        subnet_name = f'{fleet_name}-subnet'
+        vnet_operation = network_client.virtual_networks.begin_create_or_update(
+            resource_group,
+            vnet_name,
+            {
+                'location': location,
+                'address_space': {'address_prefixes': ['10.1.0.0/16']},
+                'subnets': [{'name': subnet_name, 'address_prefix': '10.1.0.0/22'}],
+                'tags': shared_tags
+            }
+        )
+        await run_azure_operation(vnet_operation.result)
+
+        security_rules = [
+            SecurityRule(
+                name=f'AllowAnyCustom{port}Inbound',
+                access='Allow',
+                direction='Inbound',
+                priority=100 + index,
+                protocol='*',
+                source_address_prefix='*',
+                destination_address_prefix='*',
+                destination_port_range=str(port),
+                source_port_range='*'
+            )
+            for index, port in enumerate(PORTS_TO_OPEN)
+        ]
+        nsg_operation = network_client.network_security_groups.begin_create_or_update(
+            resource_group,
+            f'{fleet_name}-nsg',
+            NetworkSecurityGroup(location=location, security_rules=security_rules, tags=shared_tags)
+        )
+        nsg = await run_azure_operation(nsg_operation.result)
+
+        # DNS zone and NS delegation
+        try:
+            await run_azure_operation(dns_client.zones.get, resource_group, domain)
+        except Exception:
+            zone_operation = dns_client.zones.create_or_update(resource_group, domain, {'location': 'global'})
+            await run_azure_operation(zone_operation.result)
+            await asyncio.sleep(5)  # Wait for DNS zone initialization
+        if not await run_azure_operation(check_ns_delegation_with_retries, dns_client, resource_group, domain):
+            await fail("ns_delegation_failed", "Incorrect NS delegation for DNS zone")
+            await cleanup_fleet_shared(network_client, storage_client, resource_group, fleet_name, storage_account_name, True)
+            return
+
+        await post_fleet_status(
+            hook_url, fleet_name, resource_group, location, fleet, "provisioning", "shared_resources_ready",
+            message="Storage, image, network, NSG and DNS zone ready", image_version=image_version
+        )
+    except Exception as e:
+        await fail("shared_setup_failed", f"Fleet setup failed: {str(e)}")
+        await cleanup_fleet_shared(network_client, storage_client, resource_group, fleet_name, storage_account_name, True)
+        return
+
+    # ---------- per-VM work, fanned out ----------
+    subnet_id = f'/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers/Microsoft.Network/virtualNetworks/{vnet_name}/subnets/{subnet_name}'
+    semaphore = asyncio.Semaphore(max_parallel)
+    ssl_email = os.environ.get('SENDER_EMAIL')
+
+    async def provision_member(name):
+        member = fleet[name]
+        async with semaphore:
+            try:
+                member.update({"status": "provisioning", "step": "starting"})
+                fqdn = f"{name}.{domain}"
+
+                # Setup script (rendered per VM: it embeds the host name)
+                blob_name = f"{name}-setup.ps1"
+                certificate = await run_azure_operation(
+                    cert_service.certificate_for, dns_client, resource_group, domain, f"{name}.{fqdn}"
+                )
+                ps_script = generate_setup.generate_setup(name, fqdn, ssl_email, DUMBDROP_PIN, WINDOWS_IMAGE_PASSWORD, certificate)
+                blob_url_with_sas = await run_azure_operation(
+                    upload_fleet_script, blob_service_client, container_name, blob_name, ps_script, storage_key
+                )
+
+                member["step"] = "network"
+                resource_tags = topology.tags(name, topology.new_provisioning_id(), **{topology.TAG_FLEET_ID: fleet_id})
+                ip_operation = network_client.public_ip_addresses.begin_create_or_update(
+                    resource_group,
+                    f'{name}-public-ip',
+                    {
+                        'location': location,
+                        'public_ip_allocation_method': 'Static',
+                        'delete_option': 'Delete',
+                        'tags': resource_tags
+                    }
+                )
+                public_ip = await run_azure_operation(ip_operation.result)
+                nic_operation = network_client.network_interfaces.begin_create_or_update(
+                    resource_group,
+                    f'{name}-nic',
+                    {
+                        'location': location,
+                        'ip_configurations': [{
+                            'name': f'{name}-ip-config',
+                            'subnet': {'id': subnet_id},
+                            'public_ip_address': {'id': public_ip.id}
+                        }],
+                        'network_security_group': {'id': nsg.id},
+                        'tags': resource_tags
+                    }
+                )
+                nic = await run_azure_operation(nic_operation.result)
+
+                member["step"] = "creating_virtual_machine"
+                vm_parameters = VirtualMachine(
+                    location=location,
+                    hardware_profile=HardwareProfile(vm_size=vm_size),
+                    storage_profile=StorageProfile(
+                        os_disk={
+                            'name': f'{name}-os-disk',
+                            'managed_disk': {'storage_account_type': 'Standard_LRS'},
+                            'create_option': 'FromImage',
+                            'delete_option': 'Delete',
+                            'disk_size_gb': OS_DISK_SSD_GB
+                        },
+                        image_reference={'id': image_version_id}
+                    ),
+                    network_profile=NetworkProfile(network_interfaces=[NetworkInterfaceReference(id=nic.id, delete_option='Delete')]),
+                    security_profile=SecurityProfile(security_type="TrustedLaunch"),
+                    zones=None,
+                    tags=resource_tags
+                )
+                try:
+                    vm_operation = compute_client.virtual_machines.begin_create_or_update(resource_group, name, vm_parameters)
+                    await run_azure_operation(vm_operation.result)
+                    placement.record_allocation(location, vm_size, True)
+                except Exception:
+                    preflight.invalidate(location)
+                    placement.record_allocation(location, vm_size, False)
+                    raise
+                await post_fleet_status(hook_url, fleet_name, resource_group, location, fleet, "provisioning", "vm_created", vm=name)
+
+                # Static IP is known once the NIC is attached
+                public_ip_info = await run_azure_operation(
+                    network_client.public_ip_addresses.get, resource_group, f'{name}-public-ip'
+                )
+                ip_address = public_ip_info.ip_address
+                member["public_ip"] = ip_address
+
+                member["step"] = "dns"
+                await run_azure_operation(
+                    dns_manager.set_records, dns_client, resource_group, domain,
+                    [name] + dns_manager.record_names(name), ip_address
+                )
+
+                member["step"] = "installing_extension"
+                extension_operation = compute_client.virtual_machine_extensions.begin_create_or_update(
+                    resource_group,
+                    name,
+                    'customScriptExtension',
+                    {
+                        'location': location,
+                        'publisher': 'Microsoft.Compute',
+                        'type': 'CustomScriptExtension',
+                        'type_handler_version': '1.10',
+                        'settings': {
+                            'fileUris': [blob_url_with_sas],
+                            'commandToExecute': f'powershell -ExecutionPolicy Unrestricted -File {blob_name}'
+                        },
+                    }
+                )
+                await run_azure_operation(extension_operation.result)
+
+                member.update({
+                    "status": "completed",
+                    "step": "completed",
+                    "url": f"https://cdn.sdappnet.cloud/rtx/rtxvmrun.html?url={ip_address}&vm_name={name}"
+                })
+                print_success(f"Fleet {fleet_name}: {name} ready at {ip_address}")
+            except Exception as e:
+                error_msg = f"{member['step']} failed: {str(e)}"
+                print_error(f"Fleet {fleet_name}: {name} {error_msg}")
+                member.update({"status": "failed", "error": error_msg})
+                await run_azure_operation(
+                    cleanup_member_on_failure, network_client, compute_client, dns_client, resource_group, domain, name
+                )
+            await post_fleet_status(
+                hook_url, fleet_name, resource_group, location, fleet, "provisioning", f"vm_{member['status']}", vm=name
+            )
+
+    await asyncio.gather(*(provision_member(name) for name in members))
+
+    succeeded = [m for m in fleet.values() if m["status"] == "completed"]
+    await cleanup_fleet_shared(network_client, storage_client, resource_group, fleet_name, storage_account_name, not succeeded)
+
+    # One summary email for the fleet
+    try:
+        await html_email_send.send_html_email_smtp(
+            smtp_host=os.environ.get('SMTP_HOST'),
+            smtp_port=int(os.environ.get('SMTP_PORT', 587)),
+            smtp_user=os.environ.get('SMTP_USER'),
+            smtp_password=os.environ.get('SMTP_PASS'),
+            sender_email=os.environ.get('SENDER_EMAIL'),
+            recipient_emails=[e.strip() for e in RECIPIENT_EMAILS.split(',')],
+            subject=f"Azure VM fleet '{fleet_name}' completed: {len(succeeded)}/{len(fleet)} ready",
+            html_content=html_email.HTMLFleetEmail(
+                title=fleet_name,
+                fleet_name=fleet_name,
+                domain=domain,
+                members=list(fleet.values()),
+                windows_password=WINDOWS_IMAGE_PASSWORD,
+                logo_src="https://i.postimg.cc/XJCSdSNc/rtxazure.png",
+                dash_url="https://rtxdevstation.xyz"
+            ),
+            use_tls=True
+        )
+    except Exception as e:
+        print_warn(f"Failed to send fleet email: {str(e)}")
+
+    # Final fleet update
+    await post_fleet_status(
+        hook_url, fleet_name, resource_group, location, fleet,
+        "completed" if succeeded else "failed", "completed" if succeeded else "fleet_failed",
+        message=f"{len(succeeded)} of {len(fleet)} VMs provisioned"
+    )
+    print_success(f"Fleet {fleet_name} finished: {len(succeeded)}/{len(fleet)} VMs provisioned")
+
+# ====================== HELPER FUNCTIONS ======================
+
+def upload_fleet_script(blob_service_client, container_name, blob_name, data, account_key, sas_expiry_hours=2):
+    """Upload a setup script to the fleet container and return its SAS URL"""
+    blob_client = blob_service_client.get_container_client(container_name).get_blob_client(blob_name)
+    blob_client.upload_blob(data, overwrite=True)
+    sas_token = generate_blob_sas(
+        blob_service_client.account_name,
+        container_name,
+        blob_name,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.utcnow() + timedelta(hours=sas_expiry_hours),
+        account_key=account_key
+    )
+    return f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
+
+def cleanup_member_on_failure(network_client, compute_client, dns_client, resource_group, domain, name):
+    """Delete one fleet VM and its own resources; shared network is left alone"""
+    try:
+        vm = compute_client.virtual_machines.get(resource_group, name)
+        os_disk_name = vm.storage_profile.os_disk.name
+        compute_client.virtual_machines.begin_delete(resource_group, name).wait()
+        compute_client.disks.begin_delete(resource_group, os_disk_name).wait()
+    except Exception:
+        pass
+    for resource_type, resource_name in [
+        (network_client.network_interfaces, f"{name}-nic"),
+        (network_client.public_ip_addresses, f"{name}-public-ip")
+    ]:
+        try:
+            resource_type.begin_delete(resource_group, resource_name).wait()
+        except Exception:
+            pass
+    dns_manager.delete_records(dns_client, resource_group, domain, dns_manager.all_record_names(name))
+
+async def cleanup_fleet_shared(network_client, storage_client, resource_group, fleet_name, storage_account_name, include_network):
+    """Delete the temporary script storage, and the shared network when no VM uses it"""
+    try:
+        await run_azure_operation(storage_client.storage_accounts.delete, resource_group, storage_account_name)
+    except Exception as e:
+        print_warn(f"Temp storage cleanup failed: {str(e)}")
+    if include_network:
+        for resource_type, name in [
+            (network_client.network_security_groups, f"{fleet_name}-nsg"),
+            (network_client.virtual_networks, f"{fleet_name}-vnet")
+        ]:
+            try:
+                await run_azure_operation(lambda: resource_type.begin_delete(resource_group, name).wait())
+            except Exception:
+                pass
@@ -0,0 +1,60 @@
+def HTMLFleetEmail(title: str,
+                   fleet_name: str,
+                   domain: str,
+                   members: list,
+                   windows_password: str,
+                   logo_src: str,
+                   dash_url: str):
+    """One summary email for a whole fleet: a row per VM with its links"""
+    rows = ""
+    for member in members:
+        if member.get("status") == "completed":
+            ip_address = member.get("public_ip", "")
+            status_cell = '<span style="color:#76b900;">ready</span>'
+            links = (
+                f'<a href="{member.get("url", "")}" style="color:#76b900;">Connect</a> &middot; '
+                f'<a href="https://{ip_address}:47990/pin" style="color:#76b900;">Pin</a> &middot; '
+                f'<a href="https://{ip_address}:3475" style="color:#76b900;">Drop</a>'
+            )
+        else:
+            ip_address = ""
+            status_cell = f'<span style="color:#e74c3c;">failed</span><br><small>{member.get("error", "")}</small>'
+            links = ""
+        rows += f"""
+            <tr>
+                <td style="padding:8px;border-bottom:1px solid #333;">{member["vm_name"]}.{domain}</td>
+                <td style="padding:8px;border-bottom:1px solid #333;">{ip_address}</td>
+                <td style="padding:8px;border-bottom:1px solid #333;">{status_cell}</td>
+                <td style="padding:8px;border-bottom:1px solid #333;">{links}</td>
+            </tr>"""
+
+    ready = sum(1 for member in members if member.get("status") == "completed")
+
+    return f"""<!DOCTYPE html>
+<html lang="en">
+
+<head>
+    <meta charset="UTF-8" />
+    <title>{title}</title>
+</head>
+
+<body style="margin:0;padding:0;background:#111;color:#eee;font-family:Arial,Helvetica,sans-serif;">
+    <div style="max-width:800px;margin:0 auto;padding:24px;">
+        <img src="{logo_src}" alt="logo" style="height:48px;">
+        <h1 style="color:#76b900;">{fleet_name}</h1>
+        <p>{ready} of {len(members)} virtual machines are ready.</p>
+        <p>Windows password: <strong>{windows_password}</strong><br>
+           Sunshine: Username <strong>sunshine</strong> / Password <strong>sunshine</strong></p>
+        <table style="width:100%;border-collapse:collapse;font-size:14px;">
+            <tr>
+                <th style="text-align:left;padding:8px;border-bottom:2px solid #76b900;">Host</th>
+                <th style="text-align:left;padding:8px;border-bottom:2px solid #76b900;">IP</th>
+                <th style="text-align:left;padding:8px;border-bottom:2px solid #76b900;">Status</th>
+                <th style="text-align:left;padding:8px;border-bottom:2px solid #76b900;">Links</th>
+            </tr>{rows}
+        </table>
+        <p style="margin-top:24px;"><a href="{dash_url}" style="color:#76b900;">Dashboard</a></p>
+    </div>
+</body>
+
+</html>"""
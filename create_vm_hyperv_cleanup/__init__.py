@@ -2,13 +2,9 @@ import os
 import json
 import logging
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.dns import DnsManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap
 import asyncio
 import concurrent.futures
-import aiohttp
 from datetime import datetime
 # Use relative imports to load local modules from the same function folder.
 # This ensures Python finds these files (generate_setup.py, html_email.py, html_email_send.py)
@@ -17,8 +13,14 @@ from datetime import datetime
 from . import html_email
 from . import html_email_send
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+aiohttp = bootstrap.lazy_module('aiohttp')
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
 executor = concurrent.futures.ThreadPoolExecutor()
@@ -59,6 +61,7 @@ def print_error(msg):
 
 
 
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info("Processing request to delete VM and related resources.")
 
@@ -191,9 +194,9 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        compute_client = ComputeManagementClient(credentials, subscription_id)
-        network_client = NetworkManagementClient(credentials, subscription_id)
-        dns_client = DnsManagementClient(credentials, subscription_id)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
 
         response_log = []
 
@@ -424,7 +427,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
                 "location": location,
                 "details": {
                     "step": "email_sent",
-                    "message": "Completion email sent"
+                    "message": "Completion email queued"
                 }
             }
         )
@@ -4,32 +4,29 @@ import os
 import sys
 import time
 import re
-import aiohttp
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()
 import urllib.parse
 import random
 import string
 import shutil
 import platform
-import dns.resolver
 from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute.models import GrantAccessData, AccessLevel
 import logging
-from azure.mgmt.compute import ComputeManagementClient
 import azure.functions as func
-from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+from shared_code import arm_throttle, arm_usage, bootstrap
 
 from . import html_email
 from . import html_email_send
 
+aiohttp = bootstrap.lazy_module('aiohttp')
+dns = bootstrap.lazy_module('dns.resolver')
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+GrantAccessData, AccessLevel = bootstrap.lazy('azure.mgmt.compute.models', 'GrantAccessData', 'AccessLevel')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+generate_blob_sas, BlobSasPermissions = bootstrap.lazy('azure.storage.blob', 'generate_blob_sas', 'BlobSasPermissions')
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting snapshot application initialization...")
 
@@ -63,6 +60,7 @@ async def run_azure_operation(func, *args, **kwargs):
     return await loop.run_in_executor(None, func, *args, **kwargs)
 
 # ====================== HTTP TRIGGER ======================
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing snapshot request...')    
     try:
@@ -220,7 +218,7 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
        
         subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
         # Initialize Azure clients
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
 
         # Stop VM before snapshot
         try:
@@ -401,7 +399,7 @@ async def snapshot_vm_background(credentials, vm_name, resource_group, location,
                     }
                 }
             )
-            print_success(f"Email sent for snapshot '{snapshot_name}'")
+            print_success(f"Email queued for snapshot '{snapshot_name}'")
 
         except Exception as e:
             error_msg = f"Failed to send email: {str(e)}"
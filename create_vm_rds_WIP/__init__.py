@@ -3,36 +3,37 @@ import json
 import os
 import time
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()
-import dns.resolver
 from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import ClientSecretCredential
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
 import logging
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.network.models import NetworkSecurityGroup, SecurityRule
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.compute.models import (
-    VirtualMachine, HardwareProfile, StorageProfile,
-    OSProfile, NetworkProfile, NetworkInterfaceReference,
-    LinuxConfiguration
-)   
-from azure.mgmt.dns import DnsManagementClient
-from azure.mgmt.dns.models import RecordSet
-from azure.mgmt.storage import StorageManagementClient
 import azure.functions as func
-import aiohttp
+from shared_code import arm_recorder, arm_throttle, arm_usage, bootstrap, cert_service, dns_manager, idempotency, sas_issuer, sku_catalog, topology, tracing
 from . import generate_setup
 from . import html_email
 from . import html_email_send
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+dns = bootstrap.lazy_module('dns.resolver')
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+BlobServiceClient, generate_blob_sas, BlobSasPermissions = bootstrap.lazy(
+    'azure.storage.blob', 'BlobServiceClient', 'generate_blob_sas', 'BlobSasPermissions'
+)
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+NetworkSecurityGroup, SecurityRule = bootstrap.lazy('azure.mgmt.network.models', 'NetworkSecurityGroup', 'SecurityRule')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+(
+    VirtualMachine, HardwareProfile, StorageProfile, OSProfile, NetworkProfile,
+    NetworkInterfaceReference, LinuxConfiguration
+) = bootstrap.lazy(
+    'azure.mgmt.compute.models',
+    'VirtualMachine', 'HardwareProfile', 'StorageProfile', 'OSProfile', 'NetworkProfile',
+    'NetworkInterfaceReference', 'LinuxConfiguration'
 )
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+StorageManagementClient = bootstrap.lazy('azure.mgmt.storage', 'StorageManagementClient')
+aiohttp = bootstrap.lazy_module('aiohttp')
+
+# Configure logging
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting application initialization...")
 
@@ -76,6 +77,8 @@ async def run_azure_operation(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, func, *args, **kwargs)
  
+@arm_usage.metered
+@idempotency.idempotent('create')
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing create_vm request...')
     try:
@@ -146,8 +149,8 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
         else:
-            if not check_vm_size_compatibility(vm_size):
-                compatible_sizes = get_compatible_vm_sizes()
+            size_ok, compatible_sizes = await run_azure_operation(check_vm_size_compatibility, vm_size, location)
+            if not size_ok:
                 return func.HttpResponse(
                     json.dumps({
                         "error": f"VmSize {vm_size} is incompatible. Please select a size from the list: {compatible_sizes}"
@@ -231,7 +234,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             )
 
             # Start background provisioning
-            asyncio.create_task(
+            idempotency.start(
                 provision_vm_background(
                     credentials,
                     username, password, vm_name, resource_group, 
@@ -290,6 +293,7 @@ async def provision_vm_background(
     storage_account_base, OS_DISK_SSD_GB, RECIPIENT_EMAILS, 
     hook_url, ADMIN_EMAIL, ADMIN_PASSWORD, FRONTEND_PORT, BACKEND_PORT
 ):
+    tracing.start("provision", vm_name)
     try:
         # Initial status update
         await post_status_update(
@@ -310,10 +314,10 @@ async def provision_vm_background(
         subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
         
         # Initialize Azure clients
-        compute_client = ComputeManagementClient(credentials, subscription_id)
-        storage_client = StorageManagementClient(credentials, subscription_id)
-        network_client = NetworkManagementClient(credentials, subscription_id)
-        dns_client = DnsManagementClient(credentials, subscription_id)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        storage_client = StorageManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
 
         # Create storage account
         storage_account_name = f"{storage_account_base}{int(time.time()) % 10000}"
@@ -367,10 +371,14 @@ async def provision_vm_background(
         sh_script = generate_setup.generate_setup(
             fqdn, ADMIN_EMAIL, ADMIN_PASSWORD, FRONTEND_PORT
         )
+        # Pre-issued certificate from the cert service; the VM then skips ACME
+        certificate = await run_azure_operation(cert_service.certificate_for, dns_client, resource_group, domain, fqdn)
+        if certificate:
+            sh_script = cert_service.inject_bash(sh_script, fqdn, certificate)
         record_name = subdomain.rstrip('.') if subdomain else '@'
         a_records = [record_name]
         
-        blob_service_client = BlobServiceClient(account_url=AZURE_STORAGE_URL, credential=credentials)
+        blob_service_client = BlobServiceClient(account_url=AZURE_STORAGE_URL, credential=credentials, **arm_recorder.blob_kwargs())
         container_name = 'vm-startup-scripts'
         blob_name = f"{vm_name}-setup.sh"
 
@@ -416,7 +424,9 @@ async def provision_vm_background(
             )
             return
 
-        # Network infrastructure setup
+        # Network infrastructure setup; everything created below carries one
+        # provisioning ID so delete_vm can sweep it by tag
+        resource_tags = topology.tags(vm_name, topology.new_provisioning_id())
         vnet_name = f'{vm_name}-vnet'
         subnet_name = f'{vm_name}-subnet'
         public_ip_name = f'{vm_name}-public-ip'
@@ -430,7 +440,8 @@ async def provision_vm_background(
                 {
                     'location': location,
                     'address_space': {'address_prefixes': ['10.1.0.0/16']},
-                    'subnets': [{'name': subnet_name, 'address_prefix': '10.1.0.0/24'}]
+                    'subnets': [{'name': subnet_name, 'address_prefix': '10.1.0.0/24'}],
+                    'tags': resource_tags
                 }
             )
             await run_azure_operation(vnet_operation.result)
@@ -471,7 +482,9 @@ async def provision_vm_background(
         try:
             public_ip_params = {
                 'location': location,
-                'public_ip_allocation_method': 'Dynamic'
+                'public_ip_allocation_method': 'Dynamic',
+                'delete_option': 'Delete',
+                'tags': resource_tags
             }
             ip_operation = network_client.public_ip_addresses.begin_create_or_update(
                 resource_group,
@@ -538,7 +551,7 @@ async def provision_vm_background(
                     }
                 )
             except Exception:
-                nsg_params = NetworkSecurityGroup(location=location, security_rules=[])
+                nsg_params = NetworkSecurityGroup(location=location, security_rules=[], tags=resource_tags)
                 nsg_operation = network_client.network_security_groups.begin_create_or_update(
                     resource_group, 
                     nsg_name, 
@@ -651,7 +664,8 @@ async def provision_vm_background(
                     'subnet': {'id': subnet_id},
                     'public_ip_address': {'id': public_ip_id}
                 }],
-                'network_security_group': {'id': nsg.id}
+                'network_security_group': {'id': nsg.id},
+                'tags': resource_tags
             }
             nic_operation = network_client.network_interfaces.begin_create_or_update(
                 resource_group, 
@@ -698,6 +712,7 @@ async def provision_vm_background(
                 'name': f'{vm_name}-os-disk',
                 'managed_disk': {'storage_account_type': 'Standard_LRS'},
                 'create_option': 'FromImage',
+                'delete_option': 'Delete',
                 'disk_size_gb': OS_DISK_SSD_GB
             }
             os_profile = OSProfile(
@@ -713,8 +728,9 @@ async def provision_vm_background(
                 hardware_profile=HardwareProfile(vm_size=vm_size),
                 storage_profile=StorageProfile(os_disk=os_disk, image_reference=image_reference),
                 os_profile=os_profile,
-                network_profile=NetworkProfile(network_interfaces=[NetworkInterfaceReference(id=nic.id)]),
-                zones=None
+                network_profile=NetworkProfile(network_interfaces=[NetworkInterfaceReference(id=nic.id, delete_option='Delete')]),
+                zones=None,
+                tags=resource_tags
             )
             vm_operation = compute_client.virtual_machines.begin_create_or_update(
                 resource_group, 
@@ -914,20 +930,10 @@ async def provision_vm_background(
                 )
                 return
 
-            # Create DNS A records
-            for a_record in a_records:
-                a_record_set = RecordSet(
-                    ttl=3600, 
-                    a_records=[{'ipv4_address': public_ip}]
-                )
-                await run_azure_operation(
-                    dns_client.record_sets.create_or_update,
-                    resource_group, 
-                    domain, 
-                    a_record, 
-                    'A', 
-                    a_record_set
-                )
+            # Create DNS A records (unchanged ones are skipped)
+            await run_azure_operation(
+                dns_manager.set_records, dns_client, resource_group, domain, a_records, public_ip
+            )
                 
             await post_status_update(
                 hook_url=hook_url,
@@ -1140,7 +1146,7 @@ async def provision_vm_background(
                     "location": location,
                     "details": {
                         "step": "email_sent",
-                        "message": "Completion email sent"
+                        "message": "Completion email queued"
                     }
                 }
             )
@@ -1236,9 +1242,10 @@ def create_storage_account(storage_client, resource_group_name, storage_name, lo
             )
             poller.result()
             print_success(f"Storage account '{storage_name}' created.")
+            # A re-created account has new keys
+            sas_issuer.invalidate(resource_group_name, storage_name)
 
-        keys = storage_client.storage_accounts.list_keys(resource_group_name, storage_name)
-        storage_key = keys.keys[0].value
+        storage_key = sas_issuer.account_key(storage_client, resource_group_name, storage_name)
         storage_url = f"https://{storage_name}.blob.core.windows.net"
 
         return {
@@ -1277,20 +1284,16 @@ def upload_blob_and_generate_sas(blob_service_client, container_name, blob_name,
     return f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
 
 # ====================== VM_SIZE COMPATIBILITY FUNCTIONS ======================
+# ===== General purpose x64 instances (B/D/E/F series, 3.5 GB+) =====
+VM_SIZE_REQUIREMENTS = {"gpu": False, "arm64": False, "families": ["standardB", "standardD", "standardE", "standardF"], "min_memory_gb": 3.5, "max_vcpus": 16}
 
-def get_compatible_vm_sizes():
-    """Return list of compatible VM sizes"""
-    return [
-        'Standard_B2s', 'Standard_B4ms', 'Standard_D2s_v3', 'Standard_D4s_v3',
-        'Standard_D8s_v3', 'Standard_D16s_v3', 'Standard_DS1_v2', 'Standard_DS2_v2',
-        'Standard_DS3_v2', 'Standard_DS4_v2', 'Standard_F2s_v2', 'Standard_F4s_v2',
-        'Standard_F8s_v2', 'Standard_F16s_v2', 'Standard_E2s_v3', 'Standard_E4s_v3',
-        'Standard_E8s_v3', 'Standard_E16s_v3'
-    ]
+def get_compatible_vm_sizes(location):
+    """Return the sizes offered in location that meet VM_SIZE_REQUIREMENTS"""
+    return [size["name"] for size in sku_catalog.get_catalog().query(location, **VM_SIZE_REQUIREMENTS)]
 
-def check_vm_size_compatibility(vm_size):
-    """Check if VM size is compatible"""
-    return vm_size in get_compatible_vm_sizes()
+def check_vm_size_compatibility(vm_size, location):
+    """Return (compatible, suggested_sizes) using the live SKU catalog"""
+    return sku_catalog.check_vm_size(location, vm_size, **VM_SIZE_REQUIREMENTS)
 
 def check_ns_delegation_with_retries(dns_client, resource_group, domain, retries=5, delay=10):
     """Check NS delegation with retries"""
@@ -1381,18 +1384,15 @@ async def cleanup_resources_on_failure(
         pass
     
     # Delete DNS records
-    for record_name in a_records:
-        record_to_delete = record_name if record_name else '@'
-        try:
-            dns_client.record_sets.delete(resource_group, domain, record_to_delete, 'A')
-        except Exception:
-            pass
+    dns_manager.delete_records(dns_client, resource_group, domain, a_records)
     
     print_success("Cleanup completed.")
 
 # ====================== STATUS UPDATE FUNCTION ======================
 async def post_status_update(hook_url: str, status_data: dict) -> dict:
     """Send status update to webhook with retry logic"""
+    tracing.record(status_data)
+    idempotency.registry.record_status(status_data)
     if not hook_url:
         return {"success": True, "status_url": ""}
     
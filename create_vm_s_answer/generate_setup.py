@@ -1,4 +1,4 @@
-import textwrap
+from shared_code import setup_template
 
 def generate_setup(
     DOMAIN_NAME,
@@ -47,7 +47,7 @@ def generate_setup(
     }
 
     # ========== BASE TEMPLATE ==========
-    script_template = textwrap.dedent(r"""
+    script_template = setup_template.parse(r"""
     #!/bin/bash
     set -euo pipefail
 
@@ -738,7 +738,7 @@ EOF_SUMMARY
 
     # ========== WEBHOOK FUNCTION HANDLING ==========
     if WEBHOOK_URL:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
         notify_webhook() {
             local status="$1"
             local step="$2"
@@ -762,27 +762,14 @@ JSON_EOF
         }
 """)
     else:
-        webhook_fn = textwrap.dedent("""
+        webhook_fn = setup_template.parse("""
         notify_webhook() {
             return 0
         }
         """)
 
     # ========== TOKEN REPLACEMENT ==========
-    # Replace webhook function first
-    final = script_template.replace("__WEBHOOK_FUNCTION__", webhook_fn)
-
-    # Replace all other tokens
-    for token, value in tokens.items():
-        final = final.replace(token, value)
-
-    # Replace webhook-specific tokens in the webhook function
-    final = final.replace("__LOCATION__", tokens["__LOCATION__"])
-    final = final.replace("__RESOURCE_GROUP__", tokens["__RESOURCE_GROUP__"])
-    final = final.replace("__WEBHOOK_URL__", tokens["__WEBHOOK_URL__"])
-    
-    # Replace SSL configuration URLs
-    final = final.replace("__LET_OPTIONS_URL__", tokens["__LET_OPTIONS_URL__"])
-    final = final.replace("__SSL_DHPARAMS_URL__", tokens["__SSL_DHPARAMS_URL__"])
-
-    return final
\ No newline at end of file
+    return script_template.render({
+        **tokens,
+        "__WEBHOOK_FUNCTION__": webhook_fn,
+    })
\ No newline at end of file
@@ -1,4 +1,4 @@
-import textwrap
+from shared_code import setup_template
 
 def generate_apprise_setup(
     DOMAIN_NAME,
@@ -32,7 +32,7 @@ def generate_apprise_setup(
     }
 
     # ========== BASE TEMPLATE ==========
-    script_template = textwrap.dedent(r"""
+    script_template = setup_template.parse(r"""
     #!/bin/bash
     set -euo pipefail
 
@@ -491,7 +491,7 @@ EOF_FINAL
 
     # ========== WEBHOOK FUNCTION HANDLING ==========
     if tokens["__WEBHOOK_URL__"]:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
         notify_webhook() {
             local status="$1"
             local step="$2"
@@ -526,36 +526,18 @@ EOF_FINAL
         }
         """)
     else:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
         notify_webhook() {
             # Webhook disabled - stub function
             return 0
         }
         """)
 
-    # ========== TOKEN REPLACEMENT ==========
-    # Replace webhook function first
-    final = script_template.replace("__WEBHOOK_FUNCTION__", webhook_fn)
-
-    # Replace all other tokens
-    for token, value in tokens.items():
-        final = final.replace(token, value)
-
-    # Replace webhook-specific tokens in the webhook function
-    final = final.replace("__LOCATION__", tokens["__LOCATION__"])
-    final = final.replace("__RESOURCE_GROUP__", tokens["__RESOURCE_GROUP__"])
-    final = final.replace("__WEBHOOK_URL__", tokens["__WEBHOOK_URL__"])
-    # Replace SSL configuration URLs
-    final = final.replace("__LET_OPTIONS_URL__", tokens["__LET_OPTIONS_URL__"])
-    final = final.replace("__SSL_DHPARAMS_URL__", tokens["__SSL_DHPARAMS_URL__"])
-
-    # Replace CERTBOT_CRON token
     certbot_cron = "0 3 * * * /usr/bin/certbot renew --quiet --post-hook 'systemctl reload nginx'"
-    final = final.replace("__CERTBOT_CRON__", certbot_cron)
-
-    # Replace remaining tokens for admin email, domain, port
-    final = final.replace("__ADMIN_EMAIL__", tokens["__ADMIN_EMAIL__"])
-    final = final.replace("__DOMAIN__", tokens["__DOMAIN__"])
-    final = final.replace("__PORT__", tokens["__PORT__"])
 
-    return final
\ No newline at end of file
+    # ========== TOKEN REPLACEMENT ==========
+    return script_template.render({
+        **tokens,
+        "__WEBHOOK_FUNCTION__": webhook_fn,
+        "__CERTBOT_CRON__": certbot_cron,
+    })
\ No newline at end of file
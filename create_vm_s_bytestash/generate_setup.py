@@ -1,4 +1,4 @@
-import textwrap
+from shared_code import setup_template
 
 def generate_setup(
     DOMAIN_NAME,
@@ -32,7 +32,7 @@ def generate_setup(
     }
 
     # ------------------ SCRIPT TEMPLATE ------------------
-    script_template = textwrap.dedent(r"""
+    script_template = setup_template.parse(r"""
     #!/bin/bash
     set -euo pipefail
 
@@ -645,7 +645,7 @@ EOF_SSL
 
     # ------------------ WEBHOOK FUNCTION HANDLING ------------------
     if tokens["__WEBHOOK_URL__"]:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
             notify_webhook() {
                 local status="$1"
                 local step="$2"
@@ -671,7 +671,7 @@ JSON_EOF
             }
         """)
     else:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
             notify_webhook() {
                 # Webhook disabled - stub function
                 return 0
@@ -679,19 +679,7 @@ JSON_EOF
         """)
 
     # ========== TOKEN REPLACEMENT ==========
-    # Replace webhook function first
-    final = script_template.replace("__WEBHOOK_FUNCTION__", webhook_fn)
-
-    # Replace all other tokens
-    for token, value in tokens.items():
-        final = final.replace(token, value)
-
-    # Replace webhook-specific tokens in the webhook function
-    final = final.replace("__LOCATION__", tokens["__LOCATION__"])
-    final = final.replace("__RESOURCE_GROUP__", tokens["__RESOURCE_GROUP__"])
-    final = final.replace("__WEBHOOK_URL__", tokens["__WEBHOOK_URL__"])
-    # Replace SSL configuration URLs
-    final = final.replace("__LET_OPTIONS_URL__", tokens["__LET_OPTIONS_URL__"])
-    final = final.replace("__SSL_DHPARAMS_URL__", tokens["__SSL_DHPARAMS_URL__"])
-
-    return final
\ No newline at end of file
+    return script_template.render({
+        **tokens,
+        "__WEBHOOK_FUNCTION__": webhook_fn,
+    })
\ No newline at end of file
@@ -1,4 +1,4 @@
-import textwrap
+from shared_code import setup_template
 
 def generate_huly_setup(
     DOMAIN_NAME,
@@ -35,7 +35,7 @@ def generate_huly_setup(
     }
 
     # ========== BASE TEMPLATE ==========
-    script_template = textwrap.dedent(r"""
+    script_template = setup_template.parse(r"""
     #!/bin/bash
     set -euo pipefail
 
@@ -1589,7 +1589,7 @@ EOF_SUMMARY
 
     # ========== WEBHOOK FUNCTION HANDLING ==========
     if WEBHOOK_URL:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
         notify_webhook() {
             local status="$1"
             local step="$2"
@@ -1613,33 +1613,14 @@ JSON_EOF
         }
 """)
     else:
-        webhook_fn = textwrap.dedent("""
+        webhook_fn = setup_template.parse("""
         notify_webhook() {
             return 0
         }
         """)
 
     # ========== TOKEN REPLACEMENT ==========
-    # Replace webhook function first
-    final = script_template.replace("__WEBHOOK_FUNCTION__", webhook_fn)
-
-    # Replace all other tokens
-    for token, value in tokens.items():
-        final = final.replace(token, value)
-
-    # Replace webhook-specific tokens in the webhook function
-    final = final.replace("__LOCATION__", tokens["__LOCATION__"])
-    final = final.replace("__RESOURCE_GROUP__", tokens["__RESOURCE_GROUP__"])
-    final = final.replace("__WEBHOOK_URL__", tokens["__WEBHOOK_URL__"])
-
-    # Replace SSL configuration URLs
-    final = final.replace("__LET_OPTIONS_URL__", tokens["__LET_OPTIONS_URL__"])
-    final = final.replace("__SSL_DHPARAMS_URL__", tokens["__SSL_DHPARAMS_URL__"])
-
-    # Replace remaining tokens
-    final = final.replace("__ADMIN_PASSWORD__", tokens["__ADMIN_PASSWORD__"])
-    final = final.replace("__ADMIN_EMAIL__", tokens["__ADMIN_EMAIL__"])
-    final = final.replace("__DOMAIN__", tokens["__DOMAIN__"])
-    final = final.replace("__PORT__", tokens["__PORT__"])
-
-    return final
\ No newline at end of file
+    return script_template.render({
+        **tokens,
+        "__WEBHOOK_FUNCTION__": webhook_fn,
+    })
\ No newline at end of file
@@ -1,4 +1,4 @@
-import textwrap
+from shared_code import setup_template
 
 def generate_setup(
     DOMAIN_NAME,
@@ -65,7 +65,7 @@ def generate_setup(
 
     ext_block = "\n".join([f'    "{ext}"' for ext in extensions])
     # Bash template using tokens; tokens will be replaced below to avoid f-string brace problems.
-    script_template = textwrap.dedent(r"""
+    script_template = setup_template.parse(r"""
     #!/bin/bash
     set -euo pipefail
 
@@ -604,7 +604,7 @@ EOF_FINAL
     # Build webhook function snippet (inlined) or a stub
     if tokens["__WEBHOOK_URL__"]:
         # escape double quotes for JSON heredoc safe insertion
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
         notify_webhook() {
           local status="$1"
           local step="$2"
@@ -639,45 +639,19 @@ EOF_FINAL
         }
         """)
     else:
-        webhook_fn = textwrap.dedent(r"""
+        webhook_fn = setup_template.parse(r"""
         notify_webhook() {
           # Webhook disabled/stub
           return 0
         }
         """)
 
-    # Now replace tokens inside script_template
-    final = script_template.replace("__WEBHOOK_FUNCTION__", webhook_fn)
-
-    # Replace the rest of simple tokens
-    for tk, val in tokens.items():
-        # Skip webhook_url token here because webhook_fn included it as placeholders
-        if tk == "__WEBHOOK_URL__":
-            continue
-        final = final.replace(tk, val)
-
-    # Replace webhook placeholders in webhook_fn portion (location/resource_group/webhook_url)
-    final = final.replace("__LOCATION__", tokens["__LOCATION__"])
-    final = final.replace("__RESOURCE_GROUP__", tokens["__RESOURCE_GROUP__"])
-    final = final.replace("__WEBHOOK_URL__", tokens["__WEBHOOK_URL__"])
-    final = final.replace("__LET_OPTIONS_URL__", tokens["__LET_OPTIONS_URL__"])
-    final = final.replace("__SSL_DHPARAMS_URL__", tokens["__SSL_DHPARAMS_URL__"])
-
-    # Replace CERTBOT_CRON token
     certbot_cron = "0 3 * * * /usr/bin/certbot renew --quiet --post-hook 'systemctl reload nginx'"
-    final = final.replace("__CERTBOT_CRON__", certbot_cron)
-
-    # Small safety: ensure files under VOLUME_DIR exist and are substituted
-    final = final.replace("__VOLUME_DIR__", tokens["__VOLUME_DIR__"])
-
-    # Replace extensions
-    final = final.replace("__EXTENSIONS__", ext_block)
-    # Replace remaining tokens for service user, password, admin email, domain, port
-    final = final.replace("__SERVICE_USER__", tokens["__SERVICE_USER__"])
-    final = final.replace("__ADMIN_PASSWORD__", tokens["__ADMIN_PASSWORD__"])
-    final = final.replace("__ADMIN_EMAIL__", tokens["__ADMIN_EMAIL__"])
-    final = final.replace("__DOMAIN__", tokens["__DOMAIN__"])
-    final = final.replace("__PORT__", tokens["__PORT__"])
-
-    # Return the final script string
-    return final
+
+    # ========== TOKEN REPLACEMENT ==========
+    return script_template.render({
+        **tokens,
+        "__WEBHOOK_FUNCTION__": webhook_fn,
+        "__CERTBOT_CRON__": certbot_cron,
+        "__EXTENSIONS__": ext_block,
+    })
@@ -4,51 +4,45 @@ import os
 import time
 import re
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()
 import logging
 from azure.core.exceptions import ClientAuthenticationError, ResourceNotFoundError
-from azure.identity import ClientSecretCredential
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
-from azure.mgmt.cognitiveservices.models import (
-    CognitiveServicesAccount,
-    Sku,
-    CognitiveServicesAccountProperties,
-    ApiProperties,
-    Deployment,
-    DeploymentProperties,
-    DeploymentModel,
-    DeploymentScaleSettings
-)
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import (
-    SearchIndex,
-    SimpleField,
-    SearchFieldDataType,
-    VectorSearch,
-    VectorSearchProfile,
-    HnswAlgorithmConfiguration,
-    SearchField,
-    SemanticSearch,
-    SemanticConfiguration,
-    SemanticPrioritizedFields,
-    SemanticField
-)
-from azure.mgmt.storage import StorageManagementClient
-from azure.mgmt.search import SearchManagementClient
-from azure.mgmt.search.models import SearchService, Sku as SearchSku
 import azure.functions as func
-import aiohttp
+from shared_code import arm_throttle, arm_usage, bootstrap, idempotency, sas_issuer
 from . import html_email
 from . import html_email_send
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+BlobServiceClient, generate_blob_sas, BlobSasPermissions = bootstrap.lazy(
+    'azure.storage.blob', 'BlobServiceClient', 'generate_blob_sas', 'BlobSasPermissions'
+)
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+CognitiveServicesManagementClient = bootstrap.lazy('azure.mgmt.cognitiveservices', 'CognitiveServicesManagementClient')
+(
+    CognitiveServicesAccount, Sku, CognitiveServicesAccountProperties, ApiProperties, Deployment,
+    DeploymentProperties, DeploymentModel, DeploymentScaleSettings
+) = bootstrap.lazy(
+    'azure.mgmt.cognitiveservices.models',
+    'CognitiveServicesAccount', 'Sku', 'CognitiveServicesAccountProperties', 'ApiProperties',
+    'Deployment', 'DeploymentProperties', 'DeploymentModel', 'DeploymentScaleSettings'
 )
+SearchIndexClient = bootstrap.lazy('azure.search.documents.indexes', 'SearchIndexClient')
+(
+    SearchIndex, SimpleField, SearchFieldDataType, VectorSearch, VectorSearchProfile,
+    HnswAlgorithmConfiguration, SearchField, SemanticSearch, SemanticConfiguration,
+    SemanticPrioritizedFields, SemanticField
+) = bootstrap.lazy(
+    'azure.search.documents.indexes.models',
+    'SearchIndex', 'SimpleField', 'SearchFieldDataType', 'VectorSearch', 'VectorSearchProfile',
+    'HnswAlgorithmConfiguration', 'SearchField', 'SemanticSearch', 'SemanticConfiguration',
+    'SemanticPrioritizedFields', 'SemanticField'
+)
+StorageManagementClient = bootstrap.lazy('azure.mgmt.storage', 'StorageManagementClient')
+SearchManagementClient = bootstrap.lazy('azure.mgmt.search', 'SearchManagementClient')
+SearchService, SearchSku = bootstrap.lazy('azure.mgmt.search.models', 'SearchService', 'Sku')
+aiohttp = bootstrap.lazy_module('aiohttp')
+
+# Configure logging
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting LLM deployment application initialization...")
 
@@ -283,6 +277,8 @@ async def run_azure_operation(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, func, *args, **kwargs)
  
+@arm_usage.metered
+@idempotency.idempotent('create')
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing LLM deployment request...')
     try:
@@ -454,7 +450,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             )
 
             # Start background deployment
-            asyncio.create_task(
+            idempotency.start(
                 deploy_llm_background(
                     credentials,
                     deployment_name, resource_group, location, model_type,
@@ -542,7 +538,7 @@ async def deploy_llm_background(
         
         # Initialize Azure clients
         cognitive_client = CognitiveServicesManagementClient(credentials, subscription_id)
-        storage_client = StorageManagementClient(credentials, subscription_id)
+        storage_client = StorageManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
         search_mgmt_client = SearchManagementClient(credentials, subscription_id)
 
         # Get model configurations - BOTH MAIN MODEL AND EMBEDDING MODEL
@@ -982,7 +978,7 @@ async def deploy_llm_background(
                         "model_type": model_type,
                         "details": {
                             "step": "email_sent",
-                            "message": "Completion email sent"
+                            "message": "Completion email queued"
                         }
                     }
                 )
@@ -1106,9 +1102,10 @@ def create_storage_account(storage_client, resource_group_name, storage_name, lo
             )
             poller.result()
             print_success(f"Storage account '{storage_name}' created.")
+            # A re-created account has new keys
+            sas_issuer.invalidate(resource_group_name, storage_name)
 
-        keys = storage_client.storage_accounts.list_keys(resource_group_name, storage_name)
-        storage_key = keys.keys[0].value
+        storage_key = sas_issuer.account_key(storage_client, resource_group_name, storage_name)
         storage_url = f"https://{storage_name}.blob.core.windows.net"
 
         return {
@@ -1344,8 +1341,8 @@ def get_storage_connection_string(storage_client, resource_group, storage_accoun
     """Get storage account connection string"""
     print_info(f"Fetching connection string for storage account '{storage_account_name}'...")
     try:
-        keys = storage_client.storage_accounts.list_keys(resource_group, storage_account_name)
-        connection_string = f"DefaultEndpointsProtocol=https;AccountName={storage_account_name};AccountKey={keys.keys[0].value};EndpointSuffix=core.windows.net"
+        account_key = sas_issuer.account_key(storage_client, resource_group, storage_account_name)
+        connection_string = f"DefaultEndpointsProtocol=https;AccountName={storage_account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
         return connection_string
     except Exception as e:
         print_error(f"Failed to get storage connection string: {str(e)}")
@@ -1426,6 +1423,7 @@ async def cleanup_llm_resources_on_failure(
 # ====================== STATUS UPDATE FUNCTION ======================
 async def post_status_update(hook_url: str, status_data: dict) -> dict:
     """Send status update to webhook with retry logic"""
+    idempotency.registry.record_status(status_data)
     if not hook_url:
         return {"success": True, "status_url": ""}
     
@@ -2,15 +2,17 @@ import os
 import json
 import logging
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap
 import asyncio
 import concurrent.futures
-import aiohttp
 from datetime import datetime
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+aiohttp = bootstrap.lazy_module('aiohttp')
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
 executor = concurrent.futures.ThreadPoolExecutor()
@@ -50,6 +52,7 @@ def print_error(msg):
     logging.info(f"{bcolors.FAIL}[ERROR]{bcolors.ENDC} {msg}")
 
 
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info("Processing request to delete snapshots.")
 
@@ -136,7 +139,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
         response_log = []
 
         # Start background deletion
@@ -2,13 +2,9 @@ import os
 import json
 import logging
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.dns import DnsManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap, dns_manager, idempotency, topology, tracing, warm_pool
 import asyncio
 import concurrent.futures
-import aiohttp
 from datetime import datetime
 # Use relative imports to load local modules from the same function folder.
 # This ensures Python finds these files (generate_setup.py, html_email.py, html_email_send.py)
@@ -17,12 +13,22 @@ from datetime import datetime
 from . import html_email
 from . import html_email_send
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+aiohttp = bootstrap.lazy_module('aiohttp')
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
 executor = concurrent.futures.ThreadPoolExecutor()
 
+# Bulk teardown: deletes of one phase running at once
+BULK_DELETE_MAX_PARALLEL = int(os.environ.get('BULK_DELETE_MAX_PARALLEL', 10))
+
 async def run_blocking(func, *args, **kwargs):
     """
     Helper to run blocking function in thread pool asynchronously.
@@ -59,6 +65,8 @@ def print_error(msg):
 
 
 
+@arm_usage.metered
+@idempotency.idempotent('delete', supersedes=('create',))
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info("Processing request to delete VM and related resources.")
 
@@ -75,7 +83,34 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
         RECIPIENT_EMAILS = req_body.get('recipient_emails') or req.params.get('recipient_emails')
         hook_url = req_body.get('hook_url') or req.params.get('hook_url') or ''
         ##
-        a_records = req_body.get('a_records') or req.params.get('a_records') or [vm_name, f"drop.{vm_name}", f"pin.{vm_name}", f"web.{vm_name}"]
+        a_records = req_body.get('a_records') or req.params.get('a_records') or dns_manager.all_record_names(vm_name)
+
+        # Bulk mode: a list of VMs, a tag selector or the whole resource group
+        vm_names = req_body.get('vm_names') or req.params.get('vm_names')
+        tag = req_body.get('tag') or req.params.get('tag')
+        scope = req_body.get('scope') or req.params.get('scope')
+        delete_resource_group = str(req_body.get('delete_resource_group') or req.params.get('delete_resource_group') or '').lower() == 'true'
+        bulk = bool(vm_names or tag or scope == 'resource_group')
+        if isinstance(vm_names, str):
+            vm_names = [name.strip() for name in vm_names.split(",") if name.strip()]
+        if tag:
+            try:
+                tag = topology.parse_tag_selector(tag)
+            except ValueError as e:
+                return func.HttpResponse(
+                    json.dumps({"error": str(e)}),
+                    status_code=400,
+                    mimetype="application/json"
+                )
+        if delete_resource_group and scope != 'resource_group':
+            return func.HttpResponse(
+                json.dumps({"error": "'delete_resource_group' requires scope 'resource_group'"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        if bulk and not vm_name:
+            # Label of the consolidated status document
+            vm_name = f"{resource_group}-teardown"
 
         if not vm_name:
             return func.HttpResponse(
@@ -190,16 +225,38 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        compute_client = ComputeManagementClient(credentials, subscription_id)
-        network_client = NetworkManagementClient(credentials, subscription_id)
-        dns_client = DnsManagementClient(credentials, subscription_id)
+        # Clients created from here on count their ARM calls against this run
+        tracing.start("delete", vm_name)
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+        resource_client = ResourceManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
 
         response_log = []
 
+        if bulk:
+            idempotency.start(
+                bulk_delete_background(
+                    compute_client, dns_client, resource_client,
+                    resource_group, location, vm_name, vm_names, tag, delete_resource_group,
+                    RECIPIENT_EMAILS, domain, hook_url
+                )
+            )
+            return func.HttpResponse(
+                json.dumps({
+                    "message": "Bulk VM deletion started",
+                    "status_url": status_url,
+                    "vm_name": vm_name,
+                    "mode": "resource_group" if scope == 'resource_group' else "bulk"
+                }),
+                status_code=202,
+                mimetype="application/json"
+            )
+
         # Start background deletion
-        asyncio.create_task(
+        idempotency.start(
             delete_vm_and_resources(
-                compute_client, network_client, dns_client,
+                compute_client, network_client, dns_client, resource_client,
                 resource_group, location, vm_name, RECIPIENT_EMAILS, domain, a_records_list, 
                 response_log, hook_url
             )
@@ -238,7 +295,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json"
         )
 
-async def delete_vm_and_resources(compute_client, network_client, dns_client, resource_group, location, vm_name, RECIPIENT_EMAILS, domain, a_records_list, response_log, hook_url):
+async def delete_vm_and_resources(compute_client, network_client, dns_client, resource_client, resource_group, location, vm_name, RECIPIENT_EMAILS, domain, a_records_list, response_log, hook_url):
     # Initial status update
     if hook_url:
         await post_status_update(
@@ -256,12 +313,19 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             }
         )
     
+    # A VM handed out from the warm pool keeps its pool name in Azure
+    resource_name = await run_blocking(warm_pool.resolve_vm_name, compute_client, resource_group, vm_name)
+
+    provisioning_id = None
+    fleet_id = None
     try:
         # Get VM details
-        vm = await run_blocking(compute_client.virtual_machines.get, resource_group, vm_name)
+        vm = await run_blocking(compute_client.virtual_machines.get, resource_group, resource_name)
         os_disk_name = None
         if vm.storage_profile and vm.storage_profile.os_disk:
             os_disk_name = vm.storage_profile.os_disk.name
+        provisioning_id = topology.provisioning_id_of(vm)
+        fleet_id = topology.fleet_id_of(vm)
     except Exception as e:
         response_log.append({"warning": f"Failed to get VM '{vm_name}': {str(e)}"})
         os_disk_name = None
@@ -269,7 +333,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
     # Define deletion coroutines
     async def delete_vm():
         try:
-            await run_blocking(compute_client.virtual_machines.begin_delete(resource_group, vm_name).result)
+            await run_blocking(compute_client.virtual_machines.begin_delete(resource_group, resource_name).result)
             response_log.append({"success": f"Deleted VM '{vm_name}'."})
             
             # Status update
@@ -301,7 +365,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             response_log.append({"warning": f"Failed to delete OS disk '{os_disk_name}': {str(e)}"})
 
     async def delete_nic():
-        nic_name = f"{vm_name}-nic"
+        nic_name = f"{resource_name}-nic"
         try:
             await run_blocking(network_client.network_interfaces.begin_delete(resource_group, nic_name).result)
             response_log.append({"success": f"Deleted NIC '{nic_name}'."})
@@ -309,7 +373,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             response_log.append({"warning": f"Failed to delete NIC '{nic_name}': {str(e)}"})
 
     async def delete_nsg():
-        nsg_name = f"{vm_name}-nsg"
+        nsg_name = f"{resource_name}-nsg"
         try:
             await run_blocking(network_client.network_security_groups.begin_delete(resource_group, nsg_name).result)
             response_log.append({"success": f"Deleted NSG '{nsg_name}'."})
@@ -317,7 +381,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             response_log.append({"warning": f"Failed to delete NSG '{nsg_name}': {str(e)}"})
 
     async def delete_public_ip():
-        public_ip_name = f"{vm_name}-public-ip"
+        public_ip_name = f"{resource_name}-public-ip"
         try:
             await run_blocking(network_client.public_ip_addresses.begin_delete(resource_group, public_ip_name).result)
             response_log.append({"success": f"Deleted Public IP '{public_ip_name}'."})
@@ -325,7 +389,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             response_log.append({"warning": f"Failed to delete Public IP '{public_ip_name}': {str(e)}"})
 
     async def delete_vnet():
-        vnet_name = f"{vm_name}-vnet"
+        vnet_name = f"{resource_name}-vnet"
         try:
             await run_blocking(network_client.virtual_networks.begin_delete(resource_group, vnet_name).result)
             response_log.append({"success": f"Deleted VNet '{vnet_name}'."})
@@ -333,43 +397,61 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             response_log.append({"warning": f"Failed to delete VNet '{vnet_name}': {str(e)}"})
 
     async def delete_dns_records():
-        for record_name in a_records_list:
-            record_to_delete = record_name if record_name else '@'
-            try:
-                await run_blocking(dns_client.record_sets.delete, resource_group, domain, record_to_delete, 'A')
-                response_log.append({"success": f"Deleted DNS A record '{record_to_delete}' in zone '{domain}'."})
-                
-                # Status update for each DNS record
-                if hook_url:
-                    await post_status_update(
-                        hook_url=hook_url,
-                        status_data={
-                            "vm_name": vm_name,
-                            "status": "deleting",
-                            "resource_group": resource_group,
-                            "location": location,
-                            "details": {
-                                "step": "dns_record_deleted",
-                                "message": f"DNS record {record_to_delete} deleted",
-                                "timestamp": datetime.utcnow().isoformat()
-                            }
-                        }
-                    )
-            except Exception as e:
-                response_log.append({"warning": f"Failed to delete DNS A record '{record_to_delete}' in zone '{domain}': {str(e)}"})
+        # Only records that exist are deleted, all at once
+        entries = await run_blocking(dns_manager.delete_records, dns_client, resource_group, domain, a_records_list)
+        response_log.extend(entries)
+        deleted = [entry["success"] for entry in entries if "success" in entry]
+        if hook_url and deleted:
+            await post_status_update(
+                hook_url=hook_url,
+                status_data={
+                    "vm_name": vm_name,
+                    "status": "deleting",
+                    "resource_group": resource_group,
+                    "location": location,
+                    "details": {
+                        "step": "dns_record_deleted",
+                        "message": f"{len(deleted)} DNS records deleted",
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+                }
+            )
+
+    async def sweep_tagged():
+        try:
+            response_log.extend(await run_blocking(topology.sweep, resource_client, resource_group, provisioning_id))
+        except Exception as e:
+            response_log.append({"warning": f"Failed to sweep resources of '{vm_name}': {str(e)}"})
+        if not fleet_id:
+            return
+        try:
+            response_log.extend(await run_blocking(topology.sweep_fleet, resource_client, resource_group, fleet_id))
+        except Exception as e:
+            response_log.append({"warning": f"Failed to sweep the shared network of fleet '{fleet_id}': {str(e)}"})
 
     # Run deletions
     await delete_vm()
-    await delete_os_disk()
-
-    # Run network related deletes concurrently
-    await asyncio.gather(
-        delete_nic(),
-        delete_nsg(),
-        delete_public_ip(),
-        delete_vnet(),
-        delete_dns_records()
-    )
+
+    if provisioning_id:
+        # The VM delete took its OS disk, NIC and public IP with it; sweep the
+        # NSG, VNet and anything else tagged with its provisioning ID, then a
+        # fleet's shared network if this was its last member
+        await asyncio.gather(
+            sweep_tagged(),
+            delete_dns_records()
+        )
+    else:
+        # Created before resources were tagged: delete by naming convention
+        await delete_os_disk()
+
+        # Run network related deletes concurrently
+        await asyncio.gather(
+            delete_nic(),
+            delete_nsg(),
+            delete_public_ip(),
+            delete_vnet(),
+            delete_dns_records()
+        )
     
      # Send completion email
     try:
@@ -423,7 +505,7 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
                 "location": location,
                 "details": {
                     "step": "email_sent",
-                    "message": "Completion email sent"
+                    "message": "Completion email queued"
                 }
             }
         )
@@ -465,9 +547,128 @@ async def delete_vm_and_resources(compute_client, network_client, dns_client, re
             }
         )
 
+async def bulk_delete_background(compute_client, dns_client, resource_client, resource_group, location, label, vm_names, tag, delete_resource_group, RECIPIENT_EMAILS, domain, hook_url):
+    """Tear down many VMs from one plan: VMs, then disks, then network, then DNS"""
+    report = {"vms": [], "missing": [], "deleted": [], "warnings": [], "resource_group_deleted": False}
+
+    async def status(state, step, **extra):
+        await post_status_update(
+            hook_url=hook_url,
+            status_data={
+                "vm_name": label,
+                "status": state,
+                "resource_group": resource_group,
+                "location": location,
+                "details": {
+                    "step": step,
+                    **extra,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            }
+        )
+
+    # A delete supersedes the matching creates: stop the ones still building
+    # in this group first, so the plan sees everything they left behind
+    superseded = await idempotency.registry.cancel_all(resource_group, ('create',), vm_names)
+    if superseded:
+        report["superseded"] = superseded
+        await status("deleting", "creates_cancelled", vms=superseded)
+
+    try:
+        plan = await run_blocking(topology.deletion_plan, compute_client, resource_client, resource_group, vm_names, tag)
+    except Exception as e:
+        error_msg = f"Failed to build deletion plan: {str(e)}"
+        print_error(error_msg)
+        await status("failed", "plan_failed", error=error_msg)
+        return
+
+    report["vms"] = plan["vm_names"]
+    report["missing"] = plan["missing"]
+    await status(
+        "deleting", "plan_ready",
+        vms=plan["vm_names"],
+        missing=plan["missing"],
+        resources=len(plan["vms"]) + len(plan["disks"]) + sum(len(p) for p in plan["network"])
+    )
+
+    semaphore = asyncio.Semaphore(BULK_DELETE_MAX_PARALLEL)
+
+    async def delete_one(resource):
+        async with semaphore:
+            entry = await run_blocking(topology.delete_resource, resource_client, resource)
+        if "success" in entry:
+            report["deleted"].append(entry["success"])
+        else:
+            report["warnings"].append(entry["warning"])
+
+    if delete_resource_group and not plan["unplanned"]:
+        # Nothing else lives in the group: one ARM call takes everything
+        try:
+            await status("deleting", "deleting_resource_group")
+            await run_blocking(resource_client.resource_groups.begin_delete(resource_group).result)
+            report["resource_group_deleted"] = True
+            report["deleted"].append(f"Deleted resource group '{resource_group}'.")
+        except Exception as e:
+            report["warnings"].append(f"Failed to delete resource group '{resource_group}': {str(e)}")
+    else:
+        if delete_resource_group:
+            report["warnings"].append(
+                f"Kept resource group '{resource_group}': {len(plan['unplanned'])} resources are not part of any VM "
+                f"({', '.join(sorted({r.type for r in plan['unplanned']}))})"
+            )
+        for step, resources in [("vms_deleted", plan["vms"]), ("disks_deleted", plan["disks"])] + [
+            ("network_deleted", resources) for resources in plan["network"]
+        ]:
+            await asyncio.gather(*(delete_one(resource) for resource in resources))
+            await status("deleting", step, deleted=len(report["deleted"]), warnings=len(report["warnings"]))
+
+    # DNS: one listing of the zone, then only the records that exist
+    if domain and not report["resource_group_deleted"]:
+        names = []
+        for name in plan["vm_names"]:
+            names.extend(dns_manager.all_record_names(name))
+        try:
+            for entry in await run_blocking(dns_manager.delete_records, dns_client, resource_group, domain, names):
+                if "success" in entry:
+                    report["deleted"].append(entry["success"])
+                else:
+                    report["warnings"].append(entry["warning"])
+            await status("deleting", "dns_records_deleted")
+        except Exception as e:
+            report["warnings"].append(f"Failed to clean up DNS zone '{domain}': {str(e)}")
+
+    # One email for the whole teardown
+    try:
+        html_content = html_email.HTMLBulkEmail(
+            label,
+            datetime.utcnow().isoformat(),
+            report,
+            "https://rtxdevstation.xyz/requestvm",
+            "https://rtxdevstation.xyz"
+        )
+        await html_email_send.send_html_email_smtp(
+            smtp_host=os.environ.get('SMTP_HOST'),
+            smtp_port=int(os.environ.get('SMTP_PORT', 587)),
+            smtp_user=os.environ.get('SMTP_USER'),
+            smtp_password=os.environ.get('SMTP_PASS'),
+            sender_email=os.environ.get('SENDER_EMAIL'),
+            recipient_emails=[e.strip() for e in RECIPIENT_EMAILS.split(',')],
+            subject=f"{len(report['vms'])} VMs deleted from '{resource_group}'",
+            html_content=html_content,
+            use_tls=True
+        )
+    except Exception as e:
+        print_warn(f"Failed to send email: {str(e)}")
+        report["warnings"].append(f"Failed to send email: {str(e)}")
+
+    print_success(f"Bulk delete in {resource_group}: {len(report['vms'])} VMs, {len(report['deleted'])} deletions, {len(report['warnings'])} warnings")
+    await status("completed", "completed", message=f"{len(report['vms'])} VMs and their resources deleted", report=report)
+
 # ====================== STATUS UPDATE FUNCTION ======================
 async def post_status_update(hook_url: str, status_data: dict) -> dict:
     """Send status update to webhook with retry logic"""
+    tracing.record(status_data)
+    idempotency.registry.record_status(status_data)
     if not hook_url:
         return {"success": True, "status_url": ""}
     
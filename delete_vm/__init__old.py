@@ -2,10 +2,6 @@ import os
 import json
 import logging
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.dns import DnsManagementClient
 import asyncio
 import concurrent.futures
 
@@ -15,9 +11,15 @@ import concurrent.futures
 # which prevents ModuleNotFoundError in Azure Functions environment.
 from . import html_email
 from . import html_email_send
+from shared_code import bootstrap
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
 executor = concurrent.futures.ThreadPoolExecutor()
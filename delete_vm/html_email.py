@@ -231,4 +231,50 @@ def HTMLEmail(vm_name: str,
     </div>
 </body>
 
-</html>"""
\ No newline at end of file
+</html>"""
+
+def HTMLBulkEmail(label: str,
+                  deletion_time: str,
+                  report: dict,
+                  new_vm_url: str,
+                  dash_url: str):
+    """One summary email for a bulk teardown"""
+    vm_rows = "".join(
+        f'<tr><td style="padding:6px;border-bottom:1px solid #ddd;">{name}</td>'
+        f'<td style="padding:6px;border-bottom:1px solid #ddd;color:#1a7c48;">deleted</td></tr>'
+        for name in report.get("vms", [])
+    ) + "".join(
+        f'<tr><td style="padding:6px;border-bottom:1px solid #ddd;">{name}</td>'
+        f'<td style="padding:6px;border-bottom:1px solid #ddd;color:#999;">not found</td></tr>'
+        for name in report.get("missing", [])
+    )
+    warnings = "".join(f"<li>{warning}</li>" for warning in report.get("warnings", []))
+    warnings_block = f"<h3>Warnings</h3><ul>{warnings}</ul>" if warnings else ""
+    group_note = "<p>The resource group was deleted.</p>" if report.get("resource_group_deleted") else ""
+
+    return f"""<!DOCTYPE html>
+<html lang="en">
+
+<head>
+    <meta charset="UTF-8">
+    <title>Virtual Machine Deletion Confirmation</title>
+</head>
+
+<body style="margin:0;padding:20px;background:#f4f4f4;font-family:'Segoe UI',Tahoma,Geneva,Verdana,sans-serif;color:#333;">
+    <div style="max-width:700px;margin:0 auto;background:#fff;border-radius:12px;padding:24px;">
+        <h1 style="color:#0a504c;">{label}</h1>
+        <p>{len(report.get("vms", []))} virtual machines and {len(report.get("deleted", []))} resources deleted at {deletion_time}.</p>
+        {group_note}
+        <table style="width:100%;border-collapse:collapse;font-size:14px;">
+            <tr>
+                <th style="text-align:left;padding:6px;border-bottom:2px solid #1a7c48;">VM</th>
+                <th style="text-align:left;padding:6px;border-bottom:2px solid #1a7c48;">Status</th>
+            </tr>{vm_rows}
+        </table>
+        {warnings_block}
+        <p style="margin-top:24px;"><a href="{new_vm_url}" style="color:#1a7c48;">Request a new VM</a> &middot;
+           <a href="{dash_url}" style="color:#1a7c48;">Dashboard</a></p>
+    </div>
+</body>
+
+</html>"""
@@ -0,0 +1,48 @@
+import logging
+import os
+import azure.functions as func
+from shared_code import arm_throttle, bootstrap, dns_manager
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+
+
+def main(timer: func.TimerRequest) -> None:
+    """Remove per-VM A records that point at IPs no VM owns anymore.
+
+    Off unless DNS_RECONCILE_ENABLED=true, and only for the zones listed in
+    DNS_RECONCILE_ZONES. Only records written by dns_manager are removed.
+    """
+    if os.environ.get('DNS_RECONCILE_ENABLED', 'false').lower() != 'true':
+        return
+    # Explicit allow-list of zone names; zones shared with other services must never be walked by default
+    only = {z.strip().lower() for z in os.environ.get('DNS_RECONCILE_ZONES', '').split(',') if z.strip()}
+    if not only:
+        logging.warning("DNS reconcile enabled but DNS_RECONCILE_ZONES is empty; nothing to do")
+        return
+
+    try:
+        credentials = ClientSecretCredential(
+            client_id=os.environ['AZURE_APP_CLIENT_ID'],
+            client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+            tenant_id=os.environ['AZURE_APP_TENANT_ID']
+        )
+        subscription_id = os.environ['AZURE_SUBSCRIPTION_ID']
+    except KeyError as e:
+        logging.error(f"DNS reconcile skipped, missing environment variable: {e}")
+        return
+
+    # Background work: paced as low priority
+    dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+    network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+
+    for zone in dns_client.zones.list():
+        if zone.name.lower() not in only:
+            continue
+        resource_group = zone.id.split('/')[4]
+        try:
+            removed = dns_manager.reconcile(dns_client, network_client, resource_group, zone.name)
+            logging.info(f"DNS reconcile {resource_group}/{zone.name}: {len(removed)} stale records removed")
+        except Exception as e:
+            logging.warning(f"DNS reconcile {resource_group}/{zone.name} failed: {e}")
@@ -4,12 +4,9 @@ import os
 import time
 import logging
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()  # This loads environment variables from a .env file in the current directory
 import asyncio
-from azure.identity import ClientSecretCredential
-from azure.mgmt.network import NetworkManagementClient
 import azure.functions as func
+from shared_code import arm_throttle, arm_usage, bootstrap
 
 # Use relative imports to load local modules from the same function folder.
 # This ensures Python finds these files (generate_setup.py, html_email.py, html_email_send.py)
@@ -18,8 +15,11 @@ import azure.functions as func
 from . import html_email
 from . import html_email_send
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
 # Console colors for logs
@@ -58,6 +58,7 @@ smtp_password = os.environ.get('SMTP_PASS')
 sender_email = os.environ.get('SENDER_EMAIL')
 
 
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         try:
@@ -98,7 +99,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             tenant_id=os.environ['AZURE_APP_TENANT_ID']
         )
         subscription_id = os.environ.get('AZURE_SUBSCRIPTION_ID')
-        network_client = NetworkManagementClient(credential, subscription_id)
+        network_client = NetworkManagementClient(credential, subscription_id, **arm_throttle.client_kwargs())
 
         nic_name = f"{vm_name}-nic"
         public_ip = get_public_ip(network_client, resource_group, nic_name)
@@ -124,7 +125,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             form_link="https://forms.gle/QgFZQhaehZLs9sySA"
         )
 
-        # Send email in background
+        # Sending the email is this endpoint's job, so wait for delivery and report its outcome
         await html_email_send.send_html_email_smtp(
             smtp_host=smtp_host,
             smtp_port=smtp_port,
@@ -134,7 +135,8 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             recipient_emails=recipient_email_addresses,
             subject=f"Azure VM '{vm_name}' Completed",
             html_content=html_content,
-            use_tls=True
+            use_tls=True,
+            wait=True
         )
             
 
@@ -0,0 +1,84 @@
+import json
+import os
+import logging
+
+import azure.functions as func
+from shared_code import arm_usage, bootstrap, function_keys
+
+# Configure logging
+bootstrap.configure()
+logger = logging.getLogger(__name__)
+
+# Environment variables
+API_RESOURCE_GROUP = os.getenv("API_RESOURCE_GROUP")
+API_NAME = os.getenv("API_NAME")
+
+# Most functions one request may ask for
+MAX_FUNCTIONS = int(os.getenv("FUNCTION_KEYS_BATCH_MAX", "50"))
+
+
+@arm_usage.metered
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """Keys of several functions in one call, e.g. everything a page needs on load.
+
+    function_names is a JSON list or a comma-separated string. With key_name
+    only that key is returned per function (like api_gateway). Keys come from
+    the worker's cache; pass refresh=true after rotating them.
+    """
+    logger.info("Processing request to retrieve keys of several functions")
+
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        req_body = {}
+
+    function_names = req_body.get('function_names') or req.params.get('function_names') or []
+    if isinstance(function_names, str):
+        function_names = function_names.split(',')
+    function_names = [name.strip() for name in function_names if isinstance(name, str) and name.strip()]
+    key_name = req_body.get('key_name') or req.params.get('key_name')
+    refresh = str(req_body.get('refresh') or req.params.get('refresh') or '').lower() in ('1', 'true', 'yes')
+
+    if not function_names:
+        return func.HttpResponse(
+            json.dumps({"error": "Please provide a function_names parameter"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    if len(function_names) > MAX_FUNCTIONS:
+        return func.HttpResponse(
+            json.dumps({"error": f"At most {MAX_FUNCTIONS} functions per request"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+
+    missing_vars = [var for var in ["AZURE_SUBSCRIPTION_ID", "API_RESOURCE_GROUP", "API_NAME", "AZURE_APP_CLIENT_ID", "AZURE_APP_CLIENT_SECRET", "AZURE_TENANT_ID"]
+                    if not os.getenv(var)]
+    if missing_vars:
+        err = f"Missing required environment variables: {', '.join(missing_vars)}"
+        logger.error(err)
+        return func.HttpResponse(
+            json.dumps({"error": err}),
+            status_code=400,
+            mimetype="application/json"
+        )
+
+    keys, errors = {}, {}
+    for function_name, result in function_keys.get_many(API_RESOURCE_GROUP, API_NAME, function_names, refresh).items():
+        if isinstance(result, Exception):
+            errors[function_name] = str(result)
+        elif not result:
+            errors[function_name] = "No keys found"
+        elif key_name:
+            if result.get(key_name):
+                keys[function_name] = result[key_name]
+            else:
+                errors[function_name] = f"Key '{key_name}' not found"
+        else:
+            keys[function_name] = result
+
+    return func.HttpResponse(
+        json.dumps({"keys": keys, "errors": errors}),
+        status_code=200 if keys else 404,
+        mimetype="application/json"
+    )
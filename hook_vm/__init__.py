@@ -2,22 +2,21 @@ import json
 import os
 import time
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()  # This loads environment variables from a .env file in the current directory
 from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import ClientSecretCredential
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
 import logging
-from azure.mgmt.storage import StorageManagementClient
 import azure.functions as func
+from shared_code import arm_recorder, arm_throttle, arm_usage, bootstrap, sas_issuer
 import asyncio
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+BlobServiceClient, generate_blob_sas, BlobSasPermissions = bootstrap.lazy(
+    'azure.storage.blob', 'BlobServiceClient', 'generate_blob_sas', 'BlobSasPermissions'
+)
+StorageManagementClient = bootstrap.lazy('azure.mgmt.storage', 'StorageManagementClient')
+
  
 # Configure logging first
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting application initialization...")
  
@@ -50,6 +49,7 @@ def print_error(msg):
     logging.info(f"{bcolors.FAIL}[ERROR]{bcolors.ENDC} {msg}")
 
  
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing hook_vm request...')
  
@@ -118,7 +118,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        storage_client = StorageManagementClient(credentials, subscription_id)
+        storage_client = StorageManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
  
         # Container storage(storage cant contains _ or - just numbers and letters)
         storage_account_name = f"{storage_account_base}hook" 
@@ -137,7 +137,7 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             "details": details
         }
 
-        blob_service_client = BlobServiceClient(account_url=AZURE_STORAGE_URL, credential=credentials)
+        blob_service_client = BlobServiceClient(account_url=AZURE_STORAGE_URL, credential=credentials, **arm_recorder.blob_kwargs())
         container_name = 'vm-webhook-json'
         blob_name = f"{vm_name}-webhook.json"
 
@@ -195,9 +195,10 @@ async def create_storage_account(storage_client, resource_group_name, storage_na
             )
             poller.result()
             print_success(f"Storage account '{storage_name}' created.")
+            # A re-created account has new keys
+            sas_issuer.invalidate(resource_group_name, storage_name)
 
-        keys = storage_client.storage_accounts.list_keys(resource_group_name, storage_name)
-        storage_key = keys.keys[0].value
+        storage_key = sas_issuer.account_key(storage_client, resource_group_name, storage_name)
         storage_url = f"https://{storage_name}.blob.core.windows.net"
 
         return {
@@ -1,16 +1,13 @@
 import json
-import requests
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv()  # This loads environment variables from a .env file in the current directory
 import logging
 import azure.functions as func
+from shared_code import arm_usage, bootstrap
+
+requests = bootstrap.lazy_module('requests')
  
 # Configure logging first
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 logger.info("Starting application initialization...")
  
@@ -43,6 +40,7 @@ def print_error(msg):
     logging.info(f"{bcolors.FAIL}[ERROR]{bcolors.ENDC} {msg}")
 
  
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing create_vm request...')
  
@@ -2,11 +2,40 @@ import logging
 import os
 import json
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.dns import DnsManagementClient
-from azure.mgmt.resource import ResourceManagementClient
-
-
+from shared_code import arm_throttle, arm_usage, bootstrap
+from azure.core.exceptions import ResourceNotFoundError
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+DnsManagementClient = bootstrap.lazy('azure.mgmt.dns', 'DnsManagementClient')
+
+RECORD_TYPES = ("A", "AAAA", "CNAME", "MX", "NS", "PTR", "SRV", "TXT")
+
+
+def record_values(rtype, record):
+    """(response key, values) of a record set of type rtype"""
+    if rtype == "A":
+        return "ip_addresses", [r.ipv4_address for r in record.a_records] if record.a_records else []
+    if rtype == "AAAA":
+        return "ip_addresses", [r.ipv6_address for r in record.aaaa_records] if record.aaaa_records else []
+    if rtype == "CNAME":
+        return "cname", record.cname_record.cname if record.cname_record else None
+    if rtype == "MX":
+        return "exchange", [f"{r.exchange} (priority {r.preference})" for r in record.mx_records] if record.mx_records else []
+    if rtype == "NS":
+        return "ns_records", [r.nsdname for r in record.ns_records] if record.ns_records else []
+    if rtype == "PTR":
+        return "ptr_records", [r.ptrdname for r in record.ptr_records] if record.ptr_records else []
+    if rtype == "SRV":
+        return "srv_records", [
+            f"{r.target}:{r.port} (priority {r.priority}, weight {r.weight})"
+            for r in record.srv_records
+        ] if record.srv_records else []
+    if rtype == "TXT":
+        return "text_records", [" ".join(r.value) for r in record.txt_records] if record.txt_records else []
+    return "values", []
+
+
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to list DNS records for a zone.')
 
@@ -20,6 +49,20 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         resource_group = req_body.get('resource_group') or req.params.get('resource_group')
         domain = req_body.get('domain') or req.params.get('domain')
         record_type = req_body.get('record_type') or req.params.get('record_type')  # optional
+        name_suffix = req_body.get('name_suffix') or req.params.get('name_suffix')  # optional
+        name_prefix = (req_body.get('name_prefix') or req.params.get('name_prefix') or '').lower()  # optional
+        # Compact: [name, values] pairs and no pretty-printing
+        compact = str(req_body.get('compact') or req.params.get('compact') or '').lower() in ('1', 'true', 'yes')
+        continuation_token = req_body.get('page') or req.params.get('page')
+        try:
+            page_size = int(req_body.get('page_size') or req.params.get('page_size') or 0) or None
+        except ValueError:
+            return func.HttpResponse(
+                json.dumps({"error": "'page_size' must be an integer"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        record_types = [record_type.upper()] if record_type else list(RECORD_TYPES)
 
         if not resource_group or not domain:
             return func.HttpResponse(
@@ -54,14 +97,41 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-        dns_client = DnsManagementClient(credentials, subscription_id)
+        dns_client = DnsManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
 
-        # Check if resource group exists
+        # One zone-wide pass (or one typed pass); ARM filters by suffix, prefix is applied here
         try:
-            _ = resource_client.resource_groups.get(resource_group)
-        except Exception as e:
-            err = f"Resource group '{resource_group}' not found or inaccessible: {e}"
+            pager = (
+                dns_client.record_sets.list_by_type(
+                    resource_group, domain, record_type.upper(),
+                    top=page_size, recordsetnamesuffix=name_suffix
+                )
+                if record_type
+                else dns_client.record_sets.list_all_by_dns_zone(
+                    resource_group, domain,
+                    top=page_size, record_set_name_suffix=name_suffix
+                )
+            )
+            # page_size: one ARM page per call, resumed with the returned next_page token
+            if page_size:
+                pages = pager.by_page(continuation_token=continuation_token)
+                record_sets = next(pages, [])
+            else:
+                record_sets = pager
+            all_records = {rtype: [] for rtype in record_types}
+            for record in record_sets:
+                rtype = record.type.split('/')[-1].upper()
+                if rtype not in all_records:
+                    continue
+                if name_prefix and not record.name.lower().startswith(name_prefix):
+                    continue
+                values_key, values = record_values(rtype, record)
+                if compact:
+                    all_records[rtype].append([record.name, values])
+                else:
+                    all_records[rtype].append({"name": record.name, "ttl": record.ttl, values_key: values})
+        except ResourceNotFoundError as e:
+            err = f"DNS zone '{domain}' in resource group '{resource_group}' not found or inaccessible: {e}"
             logging.error(err)
             return func.HttpResponse(
                 json.dumps({"error": err}),
@@ -69,63 +139,21 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        # If no specific record type requested, fetch multiple types
-        record_types = (
-            [record_type.upper()]
-            if record_type
-            else ["A", "AAAA", "CNAME", "MX", "NS", "PTR", "SRV", "TXT"]
-        )
-
-        all_records = {}
-
-        for rtype in record_types:
-            try:
-                record_sets = dns_client.record_sets.list_by_type(
-                    resource_group_name=resource_group,
-                    zone_name=domain,
-                    record_type=rtype
-                )
-            except Exception as e:
-                logging.warning(f"Could not fetch {rtype} records: {e}")
-                continue
-
-            record_list = []
-            for record in record_sets:
-                entry = {"name": record.name, "ttl": record.ttl}
-
-                if rtype == "A":
-                    entry["ip_addresses"] = [r.ipv4_address for r in record.a_records] if record.a_records else []
-                elif rtype == "AAAA":
-                    entry["ip_addresses"] = [r.ipv6_address for r in record.aaaa_records] if record.aaaa_records else []
-                elif rtype == "CNAME":
-                    entry["cname"] = record.cname_record.cname if record.cname_record else None
-                elif rtype == "MX":
-                    entry["exchange"] = [f"{r.exchange} (priority {r.preference})" for r in record.mx_records] if record.mx_records else []
-                elif rtype == "NS":
-                    entry["ns_records"] = [r.nsdname for r in record.ns_records] if record.ns_records else []
-                elif rtype == "PTR":
-                    entry["ptr_records"] = [r.ptrdname for r in record.ptr_records] if record.ptr_records else []
-                elif rtype == "SRV":
-                    entry["srv_records"] = [
-                        f"{r.target}:{r.port} (priority {r.priority}, weight {r.weight})"
-                        for r in record.srv_records
-                    ] if record.srv_records else []
-                elif rtype == "TXT":
-                    entry["text_records"] = [" ".join(r.value) for r in record.txt_records] if record.txt_records else []
-
-                record_list.append(entry)
-
-            all_records[rtype] = record_list
-
         result = {
             "resource_group": resource_group,
             "domain": domain,
             "record_types_requested": record_types,
             "records": all_records
         }
+        if page_size:
+            result["next_page"] = pages.continuation_token
 
+        if compact:
+            body = json.dumps(result, separators=(',', ':'))
+        else:
+            body = json.dumps(result, indent=2)
         return func.HttpResponse(
-            json.dumps(result, indent=2),
+            body,
             status_code=200,
             mimetype="application/json"
         )
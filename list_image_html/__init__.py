@@ -1,42 +1,18 @@
+import asyncio
 import os
 import json
 import logging
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap, image_catalog
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
-def version_key(version_str):
-    """
-    Parse a semantic version string like '1.0.0' into a tuple of integers (1, 0, 0)
-    to allow proper comparison for max().
-    Handles versions that may have fewer parts, e.g. '1.0' -> (1, 0, 0)
-    or suffixes like '1.0.0-alpha' by ignoring non-numeric parts.
-    """
-    # Split by dots
-    parts = version_str.split('.')
-    version_nums = []
-    for p in parts:
-        # Extract leading numeric part only, ignore suffixes after dash or letters
-        num_str = ''
-        for c in p:
-            if c.isdigit():
-                num_str += c
-            else:
-                break
-        if num_str == '':
-            # No numeric part, treat as 0
-            version_nums.append(0)
-        else:
-            version_nums.append(int(num_str))
-    # Pad to 3 parts
-    while len(version_nums) < 3:
-        version_nums.append(0)
-    return tuple(version_nums)
-
+@arm_usage.metered
 async def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info("Processing cloned_vm_list request...")
 
@@ -75,47 +51,13 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             )
 
         credentials = ClientSecretCredential(client_id=client_id, client_secret=client_secret, tenant_id=tenant_id)
-        compute_client = ComputeManagementClient(credentials, subscription_id)
-
-        # List all gallery images (image definitions) in the gallery
-        image_definitions = list(compute_client.gallery_images.list_by_gallery(gallery_resource_group, gallery_name))
-
-        result = []
-        for image_def in image_definitions:
-            # List all versions for this image definition
-            versions = list(compute_client.gallery_image_versions.list_by_gallery_image(
-                gallery_resource_group,
-                gallery_name,
-                image_def.name
-            ))
-            versions_info = [{"name": v.name, "location": v.location} for v in versions]
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
 
-            latest_version = None
-            if versions_info:
-                # Filter out versions with missing or invalid names
-                valid_versions = [v for v in versions_info if isinstance(v.get("name"), str) and v["name"].strip() != ""]
-                if valid_versions:
-                    try:
-                        latest_version = max(valid_versions, key=lambda x: version_key(x["name"]))["name"]
-                    except Exception as e:
-                        logger.warning(f"Failed to parse version strings for image {image_def.name}: {e}")
-                        # fallback to lexicographical max if parsing fails
-                        latest_version = max(valid_versions, key=lambda x: x["name"])["name"]
-
-            else:
-                latest_version = None
-
-            result.append({
-                "image_definition_name": image_def.name,
-                "version": latest_version or "",
-                "gallery_resource_group":gallery_resource_group,
-                "gallery_name": gallery_name,
-                "os_type": image_def.os_type.value if hasattr(image_def.os_type, 'value') else image_def.os_type,
-                # publisher, offer, sku are not attributes of image definition; remove them here
-                "hyper_v_generation": image_def.hyper_v_generation,
-                # "security_type": image_def.security_profile.security_type if image_def.security_profile else None,
-                "versions": versions_info
-            })
+        # Image definitions with their versions, fetched concurrently and cached
+        refresh = str(req_body.get("refresh") or req.params.get("refresh") or "").lower() in ("1", "true", "yes")
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, image_catalog.gallery_images, compute_client, gallery_resource_group, gallery_name, refresh
+        )
 
         return func.HttpResponse(
             json.dumps(result),
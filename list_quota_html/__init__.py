@@ -1,214 +1,192 @@
+import collections
 import logging
 import os
 import json
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.resource import ResourceManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap, html_page
 
-def generate_quota_html(quota_data):
-    """Generate HTML from quota data"""
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Azure Resource Quotas</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                margin: 0;
-                padding: 20px;
-                background-color: #f5f5f5;
-                color: #242424;
-            }}
-            .container {{
-                max-width: 1200px;
-                margin: 0 auto;
-                background-color: white;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-            }}
-            h1 {{
-                color: #0078d4;
-                border-bottom: 2px solid #0078d4;
-                padding-bottom: 10px;
-            }}
-            .location-info {{
-                background-color: #e3f2fd;
-                padding: 15px;
-                border-radius: 4px;
-                margin-bottom: 20px;
-            }}
-            .quota-header {{
-                display: grid;
-                grid-template-columns: 2fr 1fr 1fr 1fr;
-                font-weight: bold;
-                background-color: #0078d4;
-                color: white;
-                padding: 12px;
-                border-radius: 4px;
-                margin-bottom: 10px;
-            }}
-            .quota-item {{
-                display: grid;
-                grid-template-columns: 2fr 1fr 1fr 1fr;
-                padding: 12px;
-                border-bottom: 1px solid #e0e0e0;
-                align-items: center;
-            }}
-            .quota-item:nth-child(even) {{
-                background-color: #f9f9f9;
-            }}
-            .usage-bar {{
-                height: 20px;
-                background-color: #e0e0e0;
-                border-radius: 10px;
-                margin-top: 5px;
-                overflow: hidden;
-            }}
-            .usage-fill {{
-                height: 100%;
-                background-color: #0078d4;
-                border-radius: 10px;
-            }}
-            .high-usage {{
-                background-color: #ff5722;
-            }}
-            .medium-usage {{
-                background-color: #ff9800;
-            }}
-            .low-usage {{
-                background-color: #4caf50;
-            }}
-            .refresh-btn {{
-                background-color: #0078d4;
-                color: white;
-                border: none;
-                padding: 10px 15px;
-                border-radius: 4px;
-                cursor: pointer;
-                margin-bottom: 20px;
-                font-size: 16px;
-            }}
-            .refresh-btn:hover {{
-                background-color: #106ebe;
-            }}
-            .summary-card {{
-                display: flex;
-                justify-content: space-around;
-                margin-bottom: 20px;
-            }}
-            .card {{
-                background-color: #e3f2fd;
-                padding: 15px;
-                border-radius: 4px;
-                text-align: center;
-                flex: 1;
-                margin: 0 10px;
-            }}
-            .card h3 {{
-                margin-top: 0;
-                color: #0078d4;
-            }}
-            .card-value {{
-                font-size: 24px;
-                font-weight: bold;
-                color: #0078d4;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Azure Resource Quotas</h1>
-            <button class="refresh-btn" onclick="window.location.reload()">Refresh Quotas</button>
-            
-            <div class="location-info">
-                <strong>Resource Group:</strong> {quota_data['resource_group']} <br>
-                <strong>Location:</strong> {quota_data['location']} <br>
-                <strong>Total Quotas:</strong> {len(quota_data['quotas'])}
-            </div>
-            
-            <div class="summary-card">
-                <div class="card">
-                    <h3>High Usage</h3>
-                    <div class="card-value" id="high-usage-count">0</div>
-                    <div>> 80% utilized</div>
-                </div>
-                <div class="card">
-                    <h3>Medium Usage</h3>
-                    <div class="card-value" id="medium-usage-count">0</div>
-                    <div>50-80% utilized</div>
-                </div>
-                <div class="card">
-                    <h3>Low Usage</h3>
-                    <div class="card-value" id="low-usage-count">0</div>
-                    <div>< 50% utilized</div>
-                </div>
-            </div>
-            
-            <div class="quota-header">
-                <span>Resource Type</span>
-                <span>Current Usage</span>
-                <span>Limit</span>
-                <span>Utilization</span>
-            </div>
-    """
-    
-    # Counters for summary cards
-    high_usage = 0
-    medium_usage = 0
-    low_usage = 0
-    
-    # Add each quota to the HTML
-    for quota in quota_data['quotas']:
-        # Calculate utilization percentage
-        if quota['limit'] > 0:
-            utilization = (quota['current_value'] / quota['limit']) * 100
-        else:
-            utilization = 0
-            
-        # Determine usage class for coloring
-        if utilization > 80:
-            usage_class = "high-usage"
-            high_usage += 1
-        elif utilization > 50:
-            usage_class = "medium-usage"
-            medium_usage += 1
-        else:
-            usage_class = "low-usage"
-            low_usage += 1
-        
-        html_content += f"""
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+
+_PAGE = html_page.Page('Azure Resource Quotas', """
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background-color: #f5f5f5;
+            color: #242424;
+        }
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            background-color: white;
+            padding: 20px;
+            border-radius: 8px;
+            box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
+        }
+        h1 {
+            color: #0078d4;
+            border-bottom: 2px solid #0078d4;
+            padding-bottom: 10px;
+        }
+        .location-info {
+            background-color: #e3f2fd;
+            padding: 15px;
+            border-radius: 4px;
+            margin-bottom: 20px;
+        }
+        .quota-header {
+            display: grid;
+            grid-template-columns: 2fr 1fr 1fr 1fr;
+            font-weight: bold;
+            background-color: #0078d4;
+            color: white;
+            padding: 12px;
+            border-radius: 4px;
+            margin-bottom: 10px;
+        }
+        .quota-item {
+            display: grid;
+            grid-template-columns: 2fr 1fr 1fr 1fr;
+            padding: 12px;
+            border-bottom: 1px solid #e0e0e0;
+            align-items: center;
+        }
+        .quota-item:nth-child(even) {
+            background-color: #f9f9f9;
+        }
+        .usage-bar {
+            height: 20px;
+            background-color: #e0e0e0;
+            border-radius: 10px;
+            margin-top: 5px;
+            overflow: hidden;
+        }
+        .usage-fill {
+            height: 100%;
+            background-color: #0078d4;
+            border-radius: 10px;
+        }
+        .high-usage {
+            background-color: #ff5722;
+        }
+        .medium-usage {
+            background-color: #ff9800;
+        }
+        .low-usage {
+            background-color: #4caf50;
+        }
+        .refresh-btn {
+            background-color: #0078d4;
+            color: white;
+            border: none;
+            padding: 10px 15px;
+            border-radius: 4px;
+            cursor: pointer;
+            margin-bottom: 20px;
+            font-size: 16px;
+        }
+        .refresh-btn:hover {
+            background-color: #106ebe;
+        }
+        .summary-card {
+            display: flex;
+            justify-content: space-around;
+            margin-bottom: 20px;
+        }
+        .card {
+            background-color: #e3f2fd;
+            padding: 15px;
+            border-radius: 4px;
+            text-align: center;
+            flex: 1;
+            margin: 0 10px;
+        }
+        .card h3 {
+            margin-top: 0;
+            color: #0078d4;
+        }
+        .card-value {
+            font-size: 24px;
+            font-weight: bold;
+            color: #0078d4;
+        }
+""", pager=True)
+
+
+def _utilization(quota):
+    """Utilization percentage and the class used to color it"""
+    utilization = (quota['current_value'] / quota['limit']) * 100 if quota['limit'] > 0 else 0
+    if utilization > 80:
+        return utilization, "high-usage"
+    if utilization > 50:
+        return utilization, "medium-usage"
+    return utilization, "low-usage"
+
+
+def _quota_rows(rows):
+    for quota, (utilization, usage_class) in rows:
+        unit = html_page.escape(quota['unit'])
+        yield f"""
             <div class="quota-item">
-                <span>{quota['name']}</span>
-                <span>{quota['current_value']} {quota['unit']}</span>
-                <span>{quota['limit']} {quota['unit']}</span>
+                <span>{html_page.escape(quota['name'])}</span>
+                <span>{quota['current_value']} {unit}</span>
+                <span>{quota['limit']} {unit}</span>
                 <span>
                     {utilization:.1f}%
                     <div class="usage-bar">
-                        <div class="usage-fill {usage_class}" style="width: {utilization}%"></div>
+                        <div class="usage-fill {usage_class}" style="width: {utilization:.1f}%"></div>
                     </div>
                 </span>
+            </div>"""
+
+
+def generate_quota_html(quota_data):
+    """Generate HTML from quota data"""
+    rows = [(quota, _utilization(quota)) for quota in quota_data['quotas']]
+    counts = collections.Counter(usage_class for _, (_, usage_class) in rows)
+
+    header = f"""
+    <div class="container">
+        <h1>Azure Resource Quotas</h1>
+        <button class="refresh-btn" onclick="window.location.reload()">Refresh Quotas</button>
+
+        <div class="location-info">
+            <strong>Resource Group:</strong> {html_page.escape(quota_data['resource_group'])} <br>
+            <strong>Location:</strong> {html_page.escape(quota_data['location'])} <br>
+            <strong>Total Quotas:</strong> {len(quota_data['quotas'])}
+        </div>
+
+        <div class="summary-card">
+            <div class="card">
+                <h3>High Usage</h3>
+                <div class="card-value">{counts['high-usage']}</div>
+                <div>&gt; 80% utilized</div>
+            </div>
+            <div class="card">
+                <h3>Medium Usage</h3>
+                <div class="card-value">{counts['medium-usage']}</div>
+                <div>50-80% utilized</div>
+            </div>
+            <div class="card">
+                <h3>Low Usage</h3>
+                <div class="card-value">{counts['low-usage']}</div>
+                <div>&lt; 50% utilized</div>
             </div>
-        """
-    
-    # Add JavaScript to update summary cards
-    html_content += f"""
         </div>
-        <script>
-            document.getElementById('high-usage-count').textContent = '{high_usage}';
-            document.getElementById('medium-usage-count').textContent = '{medium_usage}';
-            document.getElementById('low-usage-count').textContent = '{low_usage}';
-        </script>
-    </body>
-    </html>
-    """
-    
-    return html_content
 
+        <div class="quota-header">
+            <span>Resource Type</span>
+            <span>Current Usage</span>
+            <span>Limit</span>
+            <span>Utilization</span>
+        </div>
+        <div{html_page.paged()}>"""
+
+    return _PAGE.render(header, _quota_rows(rows), "\n        </div>\n    </div>\n")
+
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to list Azure subscription quotas.')
 
@@ -256,8 +234,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        resource_client = ResourceManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
 
         # Get resource group to find location
         try:
@@ -2,10 +2,13 @@ import logging
 import os
 import json
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.resource import ResourceManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap
 
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to list Azure snapshots.')
 
@@ -50,8 +53,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        resource_client = ResourceManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
 
         # Check if resource group exists
         try:
@@ -2,169 +2,163 @@ import logging
 import os
 import json
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.resource import ResourceManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap, html_page
 from datetime import datetime, timezone
 
-def generate_snapshots_html(snapshot_data):
-    """Generate HTML from snapshot data"""
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Azure Snapshots</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                margin: 0;
-                padding: 20px;
-                background-color: #f5f5f5;
-                color: #242424;
-            }}
-            .container {{
-                max-width: 1400px;
-                margin: 0 auto;
-                background-color: white;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-            }}
-            h1 {{
-                color: #0078d4;
-                border-bottom: 2px solid #0078d4;
-                padding-bottom: 10px;
-            }}
-            .summary-info {{
-                background-color: #e3f2fd;
-                padding: 15px;
-                border-radius: 4px;
-                margin-bottom: 20px;
-            }}
-            .snapshot-header {{
-                display: grid;
-                grid-template-columns: 2fr 1fr 1fr 1fr 1fr 1fr;
-                font-weight: bold;
-                background-color: #0078d4;
-                color: white;
-                padding: 12px;
-                border-radius: 4px;
-                margin-bottom: 10px;
-            }}
-            .snapshot-item {{
-                display: grid;
-                grid-template-columns: 2fr 1fr 1fr 1fr 1fr 1fr;
-                padding: 12px;
-                border-bottom: 1px solid #e0e0e0;
-                align-items: center;
-            }}
-            .snapshot-item:nth-child(even) {{
-                background-color: #f9f9f9;
-            }}
-            .refresh-btn {{
-                background-color: #0078d4;
-                color: white;
-                border: none;
-                padding: 10px 15px;
-                border-radius: 4px;
-                cursor: pointer;
-                margin-bottom: 20px;
-                font-size: 16px;
-            }}
-            .refresh-btn:hover {{
-                background-color: #106ebe;
-            }}
-            .size-badge {{
-                background-color: #e3f2fd;
-                padding: 4px 8px;
-                border-radius: 12px;
-                font-size: 12px;
-                color: #0078d4;
-            }}
-            .state-active {{
-                color: #4caf50;
-                font-weight: bold;
-            }}
-            .state-inactive {{
-                color: #ff5722;
-            }}
-            .action-btn {{
-                background-color: #0078d4;
-                color: white;
-                border: none;
-                padding: 6px 12px;
-                border-radius: 4px;
-                cursor: pointer;
-                margin-right: 5px;
-                font-size: 12px;
-            }}
-            .action-btn:hover {{
-                background-color: #106ebe;
-            }}
-            .delete-btn {{
-                background-color: #ff5722;
-            }}
-            .delete-btn:hover {{
-                background-color: #e64a19;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Azure Snapshots</h1>
-            <button class="refresh-btn" onclick="window.location.reload()">Refresh Snapshots</button>
-            
-            <div class="summary-info">
-                <strong>Resource Group:</strong> {snapshot_data['resource_group']} <br>
-                <strong>Total Snapshots:</strong> {snapshot_data['snapshot_count']} <br>
-                <strong>Total Size:</strong> {snapshot_data['total_size_gb']} GB
-            </div>
-            
-            <div class="snapshot-header">
-                <span>Snapshot Name</span>
-                <span>Size (GB)</span>
-                <span>SKU</span>
-                <span>Created Time</span>
-                <span>Status</span>
-                <span>Actions</span>
-            </div>
-    """
-    
-    # Add each snapshot to the HTML
-    for snapshot in snapshot_data['snapshots']:
-        # Format created time
-        created_time = snapshot.get('time_created', 'N/A')
-        if created_time != 'N/A':
-            try:
-                created_dt = datetime.fromisoformat(created_time.replace('Z', '+00:00'))
-                created_time = created_dt.strftime('%Y-%m-%d %H:%M:%S')
-            except:
-                pass
-        
-        html_content += f"""
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+
+_PAGE = html_page.Page('Azure Snapshots', """
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background-color: #f5f5f5;
+            color: #242424;
+        }
+        .container {
+            max-width: 1400px;
+            margin: 0 auto;
+            background-color: white;
+            padding: 20px;
+            border-radius: 8px;
+            box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
+        }
+        h1 {
+            color: #0078d4;
+            border-bottom: 2px solid #0078d4;
+            padding-bottom: 10px;
+        }
+        .summary-info {
+            background-color: #e3f2fd;
+            padding: 15px;
+            border-radius: 4px;
+            margin-bottom: 20px;
+        }
+        .snapshot-header {
+            display: grid;
+            grid-template-columns: 2fr 1fr 1fr 1fr 1fr 1fr;
+            font-weight: bold;
+            background-color: #0078d4;
+            color: white;
+            padding: 12px;
+            border-radius: 4px;
+            margin-bottom: 10px;
+        }
+        .snapshot-item {
+            display: grid;
+            grid-template-columns: 2fr 1fr 1fr 1fr 1fr 1fr;
+            padding: 12px;
+            border-bottom: 1px solid #e0e0e0;
+            align-items: center;
+        }
+        .snapshot-item:nth-child(even) {
+            background-color: #f9f9f9;
+        }
+        .refresh-btn {
+            background-color: #0078d4;
+            color: white;
+            border: none;
+            padding: 10px 15px;
+            border-radius: 4px;
+            cursor: pointer;
+            margin-bottom: 20px;
+            font-size: 16px;
+        }
+        .refresh-btn:hover {
+            background-color: #106ebe;
+        }
+        .size-badge {
+            background-color: #e3f2fd;
+            padding: 4px 8px;
+            border-radius: 12px;
+            font-size: 12px;
+            color: #0078d4;
+        }
+        .state-active {
+            color: #4caf50;
+            font-weight: bold;
+        }
+        .state-inactive {
+            color: #ff5722;
+        }
+        .action-btn {
+            background-color: #0078d4;
+            color: white;
+            border: none;
+            padding: 6px 12px;
+            border-radius: 4px;
+            cursor: pointer;
+            margin-right: 5px;
+            font-size: 12px;
+        }
+        .action-btn:hover {
+            background-color: #106ebe;
+        }
+        .delete-btn {
+            background-color: #ff5722;
+        }
+        .delete-btn:hover {
+            background-color: #e64a19;
+        }
+""", pager=True)
+
+
+def _created(snapshot):
+    created_time = snapshot.get('time_created', 'N/A')
+    if created_time != 'N/A':
+        try:
+            created_dt = datetime.fromisoformat(created_time.replace('Z', '+00:00'))
+            created_time = created_dt.strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    return created_time
+
+
+def _snapshot_rows(snapshots):
+    for snapshot in snapshots:
+        name = html_page.escape(snapshot['name'])
+        yield f"""
             <div class="snapshot-item">
-                <span>{snapshot['name']}</span>
+                <span>{name}</span>
                 <span><div class="size-badge">{snapshot['disk_size_gb']} GB</div></span>
-                <span>{snapshot['sku']}</span>
-                <span>{created_time}</span>
-                <span class="state-active">{snapshot['provisioning_state']}</span>
+                <span>{html_page.escape(snapshot['sku'])}</span>
+                <span>{html_page.escape(_created(snapshot))}</span>
+                <span class="state-active">{html_page.escape(snapshot['provisioning_state'])}</span>
                 <span>
-                    <button class="action-btn" onclick="alert('Create VM from {snapshot['name']}')">Create VM</button>
-                    <button class="action-btn delete-btn" onclick="alert('Delete {snapshot['name']}')">Delete</button>
+                    <button class="action-btn" onclick="alert({html_page.js('Create VM from ' + snapshot['name'])})">Create VM</button>
+                    <button class="action-btn delete-btn" onclick="alert({html_page.js('Delete ' + snapshot['name'])})">Delete</button>
                 </span>
-            </div>
-        """
-    
-    html_content += """
+            </div>"""
+
+
+def generate_snapshots_html(snapshot_data):
+    """Generate HTML from snapshot data"""
+    header = f"""
+    <div class="container">
+        <h1>Azure Snapshots</h1>
+        <button class="refresh-btn" onclick="window.location.reload()">Refresh Snapshots</button>
+
+        <div class="summary-info">
+            <strong>Resource Group:</strong> {html_page.escape(snapshot_data['resource_group'])} <br>
+            <strong>Total Snapshots:</strong> {snapshot_data['snapshot_count']} <br>
+            <strong>Total Size:</strong> {snapshot_data['total_size_gb']} GB
+        </div>
+
+        <div class="snapshot-header">
+            <span>Snapshot Name</span>
+            <span>Size (GB)</span>
+            <span>SKU</span>
+            <span>Created Time</span>
+            <span>Status</span>
+            <span>Actions</span>
         </div>
-    </body>
-    </html>
-    """
-    
-    return html_content
+        <div{html_page.paged()}>"""
+
+    return _PAGE.render(header, _snapshot_rows(snapshot_data['snapshots']), "\n        </div>\n    </div>\n")
 
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to list Azure snapshots.')
 
@@ -212,8 +206,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        resource_client = ResourceManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
 
         # Check if resource group exists
         try:
@@ -2,9 +2,12 @@ import logging
 import os
 import json
 import azure.functions as func
-from azure.storage.blob import BlobServiceClient
 from urllib.parse import quote, unquote
 
+from shared_code import arm_recorder, arm_usage, bootstrap, html_page
+
+BlobServiceClient = bootstrap.lazy('azure.storage.blob', 'BlobServiceClient')
+
 def generate_folder_icon():
     """Generate a simple folder icon using SVG"""
     return """
@@ -67,9 +70,9 @@ def generate_breadcrumb(current_container, current_path):
     if current_container:
         breadcrumb.append(f'<span class="separator">/</span>')
         if current_path:
-            breadcrumb.append(f'<a href="?container={quote(current_container)}">{current_container}</a>')
+            breadcrumb.append(f'<a href="?container={quote(current_container)}">{html_page.escape(current_container)}</a>')
         else:
-            breadcrumb.append(f'<span class="current">{current_container}</span>')
+            breadcrumb.append(f'<span class="current">{html_page.escape(current_container)}</span>')
     
     if current_path:
         parts = current_path.strip('/').split('/')
@@ -77,9 +80,9 @@ def generate_breadcrumb(current_container, current_path):
         for i, part in enumerate(parts):
             current_path_so_far += f"/{part}" if current_path_so_far else part
             if i == len(parts) - 1:
-                breadcrumb.append(f'<span class="separator">/</span><span class="current">{part}</span>')
+                breadcrumb.append(f'<span class="separator">/</span><span class="current">{html_page.escape(part)}</span>')
             else:
-                breadcrumb.append(f'<span class="separator">/</span><a href="?container={quote(current_container)}&path={quote(current_path_so_far)}">{part}</a>')
+                breadcrumb.append(f'<span class="separator">/</span><a href="?container={quote(current_container)}&amp;path={quote(current_path_so_far)}">{html_page.escape(part)}</a>')
     
     breadcrumb.append('</div>')
     return ''.join(breadcrumb)
@@ -87,7 +90,7 @@ def generate_breadcrumb(current_container, current_path):
 def list_containers(connection_string):
     """List all containers in the storage account"""
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = BlobServiceClient.from_connection_string(connection_string, **arm_recorder.blob_kwargs())
         containers = blob_service_client.list_containers()
         
         container_list = []
@@ -106,7 +109,7 @@ def list_containers(connection_string):
 def list_container_items(connection_string, container_name, prefix=""):
     """List blobs and virtual folders in a container"""
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = BlobServiceClient.from_connection_string(connection_string, **arm_recorder.blob_kwargs())
         container_client = blob_service_client.get_container_client(container_name)
         
         # Ensure container exists
@@ -149,323 +152,285 @@ def list_container_items(connection_string, container_name, prefix=""):
         logging.error(f"Error listing container items: {e}")
         return None, None, str(e)
 
+_ACCOUNT_PAGE = html_page.Page('Azure Storage Account', """
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background-color: #f5f5f5;
+            color: #242424;
+        }
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            background-color: white;
+            padding: 20px;
+            border-radius: 8px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }
+        h1 {
+            color: #0078d4;
+            border-bottom: 2px solid #0078d4;
+            padding-bottom: 10px;
+        }
+        .stats {
+            background: #f8f9fa;
+            padding: 15px;
+            border-radius: 4px;
+            margin-bottom: 20px;
+            font-size: 14px;
+            color: #6c757d;
+        }
+        .file-list {
+            list-style: none;
+            padding: 0;
+        }
+        .file-item {
+            display: flex;
+            align-items: center;
+            padding: 12px 15px;
+            border-bottom: 1px solid #e0e0e0;
+            transition: background-color 0.2s;
+            text-decoration: none;
+            color: inherit;
+        }
+        .file-item:hover {
+            background-color: #f8f9fa;
+        }
+        .file-item.container-item:hover {
+            background-color: #e3f2fd;
+        }
+        .file-icon {
+            margin-right: 12px;
+            flex-shrink: 0;
+        }
+        .file-info {
+            flex-grow: 1;
+        }
+        .file-name {
+            font-weight: 500;
+            margin-bottom: 2px;
+            color: #0078d4;
+        }
+        .file-details {
+            font-size: 12px;
+            color: #6c757d;
+        }
+        .empty-state {
+            text-align: center;
+            padding: 40px 20px;
+            color: #6c757d;
+        }
+""", pager=True)
+
+_CONTAINER_PAGE = html_page.Page('Azure Storage', """
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background-color: #f5f5f5;
+            color: #242424;
+        }
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            background-color: white;
+            padding: 20px;
+            border-radius: 8px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }
+        h1 {
+            color: #0078d4;
+            border-bottom: 2px solid #0078d4;
+            padding-bottom: 10px;
+        }
+        .breadcrumb {
+            background: #f8f9fa;
+            padding: 15px;
+            border-radius: 4px;
+            margin-bottom: 20px;
+            font-size: 14px;
+        }
+        .breadcrumb a {
+            color: #0078d4;
+            text-decoration: none;
+        }
+        .breadcrumb a:hover {
+            text-decoration: underline;
+        }
+        .breadcrumb .separator {
+            margin: 0 8px;
+            color: #6c757d;
+        }
+        .breadcrumb .current {
+            color: #495057;
+            font-weight: bold;
+        }
+        .stats {
+            background: #f8f9fa;
+            padding: 15px;
+            border-radius: 4px;
+            margin-bottom: 20px;
+            font-size: 14px;
+            color: #6c757d;
+        }
+        .file-list {
+            list-style: none;
+            padding: 0;
+        }
+        .file-item {
+            display: flex;
+            align-items: center;
+            padding: 12px 15px;
+            border-bottom: 1px solid #e0e0e0;
+            transition: background-color 0.2s;
+        }
+        .file-item.folder {
+            text-decoration: none;
+            color: inherit;
+        }
+        .file-item:hover {
+            background-color: #f8f9fa;
+        }
+        .file-item.folder:hover {
+            background-color: #e3f2fd;
+        }
+        .file-icon {
+            margin-right: 12px;
+            flex-shrink: 0;
+        }
+        .file-info {
+            flex-grow: 1;
+        }
+        .file-name {
+            font-weight: 500;
+            margin-bottom: 2px;
+            color: #0078d4;
+        }
+        .file-details {
+            font-size: 12px;
+            color: #6c757d;
+        }
+        .file-size {
+            font-family: 'Courier New', monospace;
+            color: #495057;
+            margin-right: 15px;
+        }
+        .file-date {
+            color: #6c757d;
+        }
+        .download-btn {
+            background: #28a745;
+            color: white;
+            border: none;
+            padding: 6px 12px;
+            border-radius: 4px;
+            cursor: pointer;
+            text-decoration: none;
+            font-size: 12px;
+            transition: background-color 0.2s;
+        }
+        .download-btn:hover {
+            background: #218838;
+        }
+        .empty-state {
+            text-align: center;
+            padding: 40px 20px;
+            color: #6c757d;
+        }
+""", pager=True)
+
+_FOLDER_ICON = generate_folder_icon()
+_CONTAINER_ICON = generate_container_icon()
+
+
+def _container_rows(containers):
+    for container in containers:
+        yield f"""
+                <a href="?container={quote(container['name'])}" class="file-item container-item">
+                    <div class="file-icon">{_CONTAINER_ICON}</div>
+                    <div class="file-info">
+                        <div class="file-name">{html_page.escape(container['name'])}</div>
+                        <div class="file-details">Container • Last modified: {html_page.escape(container['last_modified'])}</div>
+                    </div>
+                </a>"""
+
+
+def _item_rows(folders, files, current_container, container_url):
+    for folder in folders:
+        yield f"""
+                <a href="?container={quote(current_container)}&amp;path={quote(folder['path'])}" class="file-item folder">
+                    <div class="file-icon">{_FOLDER_ICON}</div>
+                    <div class="file-info">
+                        <div class="file-name">{html_page.escape(folder['name'])}</div>
+                        <div class="file-details">Folder</div>
+                    </div>
+                </a>"""
+    for blob in files:
+        file_extension = os.path.splitext(blob['name'])[1].lower()
+        name = html_page.escape(blob['name'])
+        # Same URL BlobClient.url would give, without building a client per blob
+        download_url = f"{container_url}/{quote(blob['full_path'], safe='~/')}"
+        yield f"""
+                <div class="file-item">
+                    <div class="file-icon">{generate_file_icon(file_extension)}</div>
+                    <div class="file-info">
+                        <div class="file-name">{name}</div>
+                        <div class="file-details">
+                            <span class="file-size">{format_file_size(blob['size'])}</span>
+                            <span class="file-date">{html_page.escape(blob['last_modified'])}</span>
+                        </div>
+                    </div>
+                    <a href="{html_page.escape(download_url)}" class="download-btn" download="{name}">Download</a>
+                </div>"""
+
+
 def generate_storage_html(containers, folders, files, current_container, current_path, connection_string):
     """Generate HTML for storage browser"""
-    
+
     # If no container specified, show storage account view
     if not current_container:
-        html_content = """
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Azure Storage Account</title>
-            <style>
-                body {
-                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    margin: 0;
-                    padding: 20px;
-                    background-color: #f5f5f5;
-                    color: #242424;
-                }
-                .container {
-                    max-width: 1200px;
-                    margin: 0 auto;
-                    background-color: white;
-                    padding: 20px;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                }
-                h1 {
-                    color: #0078d4;
-                    border-bottom: 2px solid #0078d4;
-                    padding-bottom: 10px;
-                }
-                .stats {
-                    background: #f8f9fa;
-                    padding: 15px;
-                    border-radius: 4px;
-                    margin-bottom: 20px;
-                    font-size: 14px;
-                    color: #6c757d;
-                }
-                .file-list {
-                    list-style: none;
-                    padding: 0;
-                }
-                .file-item {
-                    display: flex;
-                    align-items: center;
-                    padding: 12px 15px;
-                    border-bottom: 1px solid #e0e0e0;
-                    transition: background-color 0.2s;
-                    text-decoration: none;
-                    color: inherit;
-                }
-                .file-item:hover {
-                    background-color: #f8f9fa;
-                }
-                .file-item.container-item:hover {
-                    background-color: #e3f2fd;
-                }
-                .file-icon {
-                    margin-right: 12px;
-                    flex-shrink: 0;
-                }
-                .file-info {
-                    flex-grow: 1;
-                }
-                .file-name {
-                    font-weight: 500;
-                    margin-bottom: 2px;
-                    color: #0078d4;
-                }
-                .file-details {
-                    font-size: 12px;
-                    color: #6c757d;
-                }
-                .empty-state {
-                    text-align: center;
-                    padding: 40px 20px;
-                    color: #6c757d;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Azure Storage Account</h1>
-                <div class="stats">
-                    📊 Total Containers: {container_count}
-                </div>
-        """.format(container_count=len(containers))
-        
+        header = f"""
+    <div class="container">
+        <h1>Azure Storage Account</h1>
+        <div class="stats">
+            📊 Total Containers: {len(containers)}
+        </div>"""
         if containers:
-            html_content += '<ul class="file-list">'
-            for container in containers:
-                html_content += f"""
-                    <a href="?container={quote(container['name'])}" class="file-item container-item">
-                        <div class="file-icon">{generate_container_icon()}</div>
-                        <div class="file-info">
-                            <div class="file-name">{container['name']}</div>
-                            <div class="file-details">Container • Last modified: {container['last_modified']}</div>
-                        </div>
-                    </a>
-                """
-            html_content += '</ul>'
+            body = (f'\n        <ul class="file-list"{html_page.paged()}>', _container_rows(containers), '\n        </ul>')
         else:
-            html_content += """
-                <div class="empty-state">
-                    <p>No containers found in this storage account</p>
-                </div>
-            """
-        
-        html_content += """
-            </div>
-        </body>
-        </html>
-        """
-    
-    else:
-        # Show container view
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Azure Storage - {current_container}</title>
-            <style>
-                body {{
-                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    margin: 0;
-                    padding: 20px;
-                    background-color: #f5f5f5;
-                    color: #242424;
-                }}
-                .container {{
-                    max-width: 1200px;
-                    margin: 0 auto;
-                    background-color: white;
-                    padding: 20px;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                }}
-                h1 {{
-                    color: #0078d4;
-                    border-bottom: 2px solid #0078d4;
-                    padding-bottom: 10px;
-                }}
-                .breadcrumb {{
-                    background: #f8f9fa;
-                    padding: 15px;
-                    border-radius: 4px;
-                    margin-bottom: 20px;
-                    font-size: 14px;
-                }}
-                .breadcrumb a {{
-                    color: #0078d4;
-                    text-decoration: none;
-                }}
-                .breadcrumb a:hover {{
-                    text-decoration: underline;
-                }}
-                .breadcrumb .separator {{
-                    margin: 0 8px;
-                    color: #6c757d;
-                }}
-                .breadcrumb .current {{
-                    color: #495057;
-                    font-weight: bold;
-                }}
-                .stats {{
-                    background: #f8f9fa;
-                    padding: 15px;
-                    border-radius: 4px;
-                    margin-bottom: 20px;
-                    font-size: 14px;
-                    color: #6c757d;
-                }}
-                .file-list {{
-                    list-style: none;
-                    padding: 0;
-                }}
-                .file-item {{
-                    display: flex;
-                    align-items: center;
-                    padding: 12px 15px;
-                    border-bottom: 1px solid #e0e0e0;
-                    transition: background-color 0.2s;
-                }}
-                .file-item.folder {{
-                    text-decoration: none;
-                    color: inherit;
-                }}
-                .file-item:hover {{
-                    background-color: #f8f9fa;
-                }}
-                .file-item.folder:hover {{
-                    background-color: #e3f2fd;
-                }}
-                .file-icon {{
-                    margin-right: 12px;
-                    flex-shrink: 0;
-                }}
-                .file-info {{
-                    flex-grow: 1;
-                }}
-                .file-name {{
-                    font-weight: 500;
-                    margin-bottom: 2px;
-                    color: #0078d4;
-                }}
-                .file-details {{
-                    font-size: 12px;
-                    color: #6c757d;
-                }}
-                .file-size {{
-                    font-family: 'Courier New', monospace;
-                    color: #495057;
-                    margin-right: 15px;
-                }}
-                .file-date {{
-                    color: #6c757d;
-                }}
-                .download-btn {{
-                    background: #28a745;
-                    color: white;
-                    border: none;
-                    padding: 6px 12px;
-                    border-radius: 4px;
-                    cursor: pointer;
-                    text-decoration: none;
-                    font-size: 12px;
-                    transition: background-color 0.2s;
-                }}
-                .download-btn:hover {{
-                    background: #218838;
-                }}
-                .empty-state {{
-                    text-align: center;
-                    padding: 40px 20px;
-                    color: #6c757d;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Azure Storage Container: {current_container}</h1>
-                {generate_breadcrumb(current_container, current_path)}
-                <div class="stats">
-                    📊 Statistics: {folder_count} folder(s), {file_count} file(s), Total size: {total_size}
-                </div>
-        """.format(
-            folder_count=len(folders),
-            file_count=len(files),
-            total_size=format_file_size(sum(blob['size'] for blob in files))
-        )
-        
-        # Add folders first
-        if folders:
-            html_content += '<ul class="file-list">'
-            for folder in folders:
-                encoded_path = quote(folder['path'])
-                html_content += f"""
-                    <a href="?container={quote(current_container)}&path={encoded_path}" class="file-item folder">
-                        <div class="file-icon">{generate_folder_icon()}</div>
-                        <div class="file-info">
-                            <div class="file-name">{folder['name']}</div>
-                            <div class="file-details">Folder</div>
-                        </div>
-                    </a>
-                """
-        
-        # Add files
+            body = ("""
+        <div class="empty-state">
+            <p>No containers found in this storage account</p>
+        </div>""",)
+        return _ACCOUNT_PAGE.render(header, *body, "\n    </div>\n")
+
+    # Show container view
+    header = f"""
+    <div class="container">
+        <h1>Azure Storage Container: {html_page.escape(current_container)}</h1>
+        {generate_breadcrumb(current_container, current_path)}
+        <div class="stats">
+            📊 Statistics: {len(folders)} folder(s), {len(files)} file(s), Total size: {format_file_size(sum(blob['size'] for blob in files))}
+        </div>"""
+    if folders or files:
+        container_url = ''
         if files:
-            if not folders:  # Only add list if we haven't already started one
-                html_content += '<ul class="file-list">'
-            
-            for blob in files:
-                file_extension = os.path.splitext(blob['name'])[1].lower()
-                file_size = format_file_size(blob['size'])
-                
-                # Generate download URL
-                blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-                blob_client = blob_service_client.get_blob_client(container=current_container, blob=blob['full_path'])
-                download_url = blob_client.url
-                
-                html_content += f"""
-                    <div class="file-item">
-                        <div class="file-icon">{generate_file_icon(file_extension)}</div>
-                        <div class="file-info">
-                            <div class="file-name">{blob['name']}</div>
-                            <div class="file-details">
-                                <span class="file-size">{file_size}</span>
-                                <span class="file-date">{blob['last_modified']}</span>
-                            </div>
-                        </div>
-                        <a href="{download_url}" class="download-btn" download="{blob['name']}">Download</a>
-                    </div>
-                """
-            
-            html_content += '</ul>'
-        
-        # Empty state
-        if not folders and not files:
-            html_content += """
-                <div class="empty-state">
-                    <p>This folder is empty</p>
-                </div>
-            """
-        
-        html_content += """
-            </div>
-        </body>
-        </html>
-        """
-    
-    return html_content
+            blob_service_client = BlobServiceClient.from_connection_string(connection_string, **arm_recorder.blob_kwargs())
+            container_url = blob_service_client.get_container_client(current_container).url
+        body = (
+            f'\n        <ul class="file-list"{html_page.paged()}>',
+            _item_rows(folders, files, current_container, container_url),
+            '\n        </ul>'
+        )
+    else:
+        body = ("""
+        <div class="empty-state">
+            <p>This folder is empty</p>
+        </div>""",)
+    return _CONTAINER_PAGE.render(header, *body, "\n    </div>\n", title=f"Azure Storage - {current_container}")
 
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to list Azure Storage containers and blobs.')
 
@@ -489,24 +454,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             err = "AZURE_STORAGE_CONNECTION_STRING environment variable is not set."
             logging.error(err)
             # Return HTML error
-            error_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error</title>
-                <style>
-                    body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                    .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-                </style>
-            </head>
-            <body>
-                <div class="error">
-                    <h2>Configuration Error</h2>
-                    <p>{err}</p>
-                </div>
-            </body>
-            </html>
-            """
+            error_html = html_page.error("Configuration Error", err)
             return func.HttpResponse(
                 error_html,
                 status_code=500,
@@ -520,24 +468,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 err = f"Error accessing storage account: {error}"
                 logging.error(err)
                 # Return HTML error
-                error_html = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Error</title>
-                    <style>
-                        body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                        .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="error">
-                        <h2>Storage Account Error</h2>
-                        <p>{err}</p>
-                    </div>
-                </body>
-                </html>
-                """
+                error_html = html_page.error("Storage Account Error", err)
                 return func.HttpResponse(
                     error_html,
                     status_code=500,
@@ -560,24 +491,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 err = f"Error accessing container '{container_name}': {error}"
                 logging.error(err)
                 # Return HTML error
-                error_html = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Error</title>
-                    <style>
-                        body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                        .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="error">
-                        <h2>Container Error</h2>
-                        <p>{err}</p>
-                    </div>
-                </body>
-                </html>
-                """
+                error_html = html_page.error("Container Error", err)
                 return func.HttpResponse(
                     error_html,
                     status_code=404,
@@ -595,24 +509,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     except Exception as ex:
         logging.exception("Unhandled error:")
         # Return HTML error
-        error_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Error</title>
-            <style>
-                body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-            </style>
-        </head>
-        <body>
-            <div class="error">
-                <h2>Unexpected Error</h2>
-                <p>{str(ex)}</p>
-            </div>
-        </body>
-        </html>
-        """
+        error_html = html_page.error("Unexpected Error", str(ex))
         return func.HttpResponse(
             error_html,
             status_code=500,
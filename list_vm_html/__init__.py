@@ -1,239 +1,245 @@
 import logging
 import os
+import re
 import json
+from urllib.parse import quote
 import azure.functions as func
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.network import NetworkManagementClient
+from shared_code import arm_throttle, arm_usage, bootstrap, html_page
 
-def get_ip_from_vm_name(credentials, subscription_id, vm_name, resource_group):
-    """Get the private and public IP addresses for a VM"""
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+ResourceManagementClient = bootstrap.lazy('azure.mgmt.resource', 'ResourceManagementClient')
+NetworkManagementClient = bootstrap.lazy('azure.mgmt.network', 'NetworkManagementClient')
+
+# Constants for the links (same as in your Tampermonkey script)
+LOGO_URL = "https://i.postimg.cc/L8kDTTsb/96252163.png"
+CONNECT_URL = "https://cdn.sdappnet.cloud/rtx/rtxvm.html?url="
+FORM_URL = 'https://forms.gle/QgFZQhaehZLs9sySA'
+DUMBDROP_URL = "https://i.postimg.cc/RF5FDjQx/icon.png"
+DUMBDROP_PORT = "3475"
+RDP_URL = "https://i.postimg.cc/VsCWBLfm/rdp.png"
+
+IPV4_REGEX = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$')
+
+_PAGE = html_page.Page('Azure Virtual Machines', """
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background-color: #f5f5f5;
+            color: #242424;
+        }
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            background-color: white;
+            padding: 10px;
+        }
+        h1 {
+            color: #0078d4;
+            border-bottom: 2px solid #0078d4;
+            padding-bottom: 10px;
+        }
+        .vm-header {
+            display: grid;
+            grid-template-columns: 1fr 1fr;
+            font-weight: bold;
+            background-color: #0078d4;
+            color: white;
+            padding: 10px;
+            border-radius: 4px;
+            margin-bottom: 10px;
+        }
+        .vm-item {
+            margin-bottom: 15px;
+            padding: 15px;
+            border: 1px solid #e0e0e0;
+            border-radius: 4px;
+            background-color: #f9f9f9;
+        }
+        .vm-name {
+            font-weight: bold;
+            color: #0078d4;
+            margin-bottom: 5px;
+        }
+        .vm-link {
+            display: inline-block;
+            background-color: #0078d4;
+            color: white;
+            padding: 8px 15px;
+            text-decoration: none;
+            border-radius: 4px;
+            margin-top: 8px;
+            transition: background-color 0.3s;
+        }
+        .vm-link:hover {
+            background-color: #106ebe;
+        }
+        .vm-instance {
+            color: #505050;
+            font-style: italic;
+        }
+        .ip-info {
+            margin-top: 5px;
+            font-size: 0.9em;
+        }
+        .refresh-btn {
+            background-color: #0078d4;
+            color: white;
+            border: none;
+            padding: 10px 15px;
+            border-radius: 4px;
+            cursor: pointer;
+            margin-bottom: 20px;
+        }
+        .refresh-btn:hover {
+            background-color: #106ebe;
+        }
+        .ip-link-container {
+            margin-top: 8px;
+            display: flex;
+            align-items: center;
+            gap: 10px;
+        }
+        .ip-logo {
+            height: 16px;
+            vertical-align: middle;
+        }
+        .ip-link {
+            color: #0078d4;
+            text-decoration: none;
+            font-size: 0.9em;
+            margin-left: 6px;
+        }
+        .ip-link:hover {
+            text-decoration: underline;
+        }
+        .ip-address {
+            font-weight: bold;
+            color: #242424;
+        }
+""", pager=True)
+
+_RESOURCES_PAGE = html_page.Page('Azure Resources', """
+        body { font-family: 'Segoe UI', sans-serif; padding: 20px; }
+        .container { max-width: 1200px; margin: 0 auto; }
+        h1 { color: #0078d4; }
+        .resource-item { padding: 10px; border-bottom: 1px solid #eee; }
+        .resource-name { font-weight: bold; color: #0078d4; }
+        .resource-type { color: #666; font-style: italic; }
+""", pager=True)
+
+
+def get_vm_ips(credentials, subscription_id, resource_group):
+    """Private and public IP addresses of every VM in the resource group, keyed by lower-case VM name.
+
+    Two list calls for the whole group (network interfaces and public IPs)
+    instead of three lookups per VM.
+    """
+    ips = {}
     try:
-        network_client = NetworkManagementClient(credentials, subscription_id)
-        
-        # Get the VM to find its network interfaces
-        compute_client = ComputeManagementClient(credentials, subscription_id)
-        vm = compute_client.virtual_machines.get(resource_group, vm_name)
-        
-        # Get network interfaces
-        network_interface_refs = vm.network_profile.network_interfaces
-        ips = {"private": "N/A", "public": "N/A"}
-        
-        for interface_ref in network_interface_refs:
-            # Extract interface name from ID
-            interface_name = interface_ref.id.split('/')[-1]
-            
-            # Get the network interface
-            network_interface = network_client.network_interfaces.get(
-                resource_group, interface_name
-            )
-            
-            # Get private IP
-            if network_interface.ip_configurations:
-                private_ip = network_interface.ip_configurations[0].private_ip_address
-                ips["private"] = private_ip if private_ip else "N/A"
-                
-                # Check for public IP
-                public_ip_ref = network_interface.ip_configurations[0].public_ip_address
-                if public_ip_ref:
-                    public_ip_name = public_ip_ref.id.split('/')[-1]
-                    public_ip = network_client.public_ip_addresses.get(
-                        resource_group, public_ip_name
-                    )
-                    ips["public"] = public_ip.ip_address if public_ip.ip_address else "N/A"
-        
-        return ips
-        
+        network_client = NetworkManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+        public_ips = {
+            ip.id.lower(): ip.ip_address
+            for ip in network_client.public_ip_addresses.list(resource_group) if ip.id
+        }
+        for network_interface in network_client.network_interfaces.list(resource_group):
+            if not network_interface.virtual_machine or not network_interface.ip_configurations:
+                continue
+            vm_name = network_interface.virtual_machine.id.split('/')[-1].lower()
+            ip_configuration = network_interface.ip_configurations[0]
+            public_ip_ref = ip_configuration.public_ip_address
+            public_ip = public_ips.get(public_ip_ref.id.lower()) if public_ip_ref and public_ip_ref.id else None
+            # Keep the first interface that has an address, like the primary NIC
+            if vm_name not in ips or ips[vm_name]["public"] == "N/A":
+                ips[vm_name] = {
+                    "private": ip_configuration.private_ip_address or "N/A",
+                    "public": public_ip or "N/A"
+                }
     except Exception as e:
-        logging.error(f"Error getting IP for VM {vm_name}: {e}")
-        return {"private": "N/A", "public": "N/A"}
+        logging.error(f"Error getting IP addresses in resource group {resource_group}: {e}")
+    return ips
+
 
 def is_valid_ip(ip):
     """Check if the IP address is valid (simple IPv4 check)"""
-    import re
     if ip == "N/A":
         return False
-    ipv4_regex = r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$'
-    return re.match(ipv4_regex, ip) is not None
+    return IPV4_REGEX.match(ip) is not None
 
-def generate_html(vm_data, credentials, subscription_id):
-    """Generate HTML from VM data with enhanced IP links"""
-    # Constants for the links (same as in your Tampermonkey script)
-    logoURL = "https://i.postimg.cc/L8kDTTsb/96252163.png"
-    baseURL = "https://cdn.sdappnet.cloud/rtx/rtxvm.html?url="
-    formURL = 'https://forms.gle/QgFZQhaehZLs9sySA'
-    dumbdropURL = "https://i.postimg.cc/RF5FDjQx/icon.png"
-    dumbdropPort = "3475"
-    rdpURL = "https://i.postimg.cc/VsCWBLfm/rdp.png"
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Azure Virtual Machines</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                margin: 0;
-                padding: 20px;
-                background-color: #f5f5f5;
-                color: #242424;
-            }}
-            .container {{
-                max-width: 1200px;
-                margin: 0 auto;
-                background-color: white;
-                padding: 10px;
-            }}
-            h1 {{
-                color: #0078d4;
-                border-bottom: 2px solid #0078d4;
-                padding-bottom: 10px;
-            }}
-            .vm-header {{
-                display: grid;
-                grid-template-columns: 1fr 1fr;
-                font-weight: bold;
-                background-color: #0078d4;
-                color: white;
-                padding: 10px;
-                border-radius: 4px;
-                margin-bottom: 10px;
-            }}
-            .vm-item {{
-                margin-bottom: 15px;
-                padding: 15px;
-                border: 1px solid #e0e0e0;
-                border-radius: 4px;
-                background-color: #f9f9f9;
-            }}
-            .vm-name {{
-                font-weight: bold;
-                color: #0078d4;
-                margin-bottom: 5px;
-            }}
-            .vm-link {{
-                display: inline-block;
-                background-color: #0078d4;
-                color: white;
-                padding: 8px 15px;
-                text-decoration: none;
-                border-radius: 4px;
-                margin-top: 8px;
-                transition: background-color 0.3s;
-            }}
-            .vm-link:hover {{
-                background-color: #106ebe;
-            }}
-            .vm-instance {{
-                color: #505050;
-                font-style: italic;
-            }}
-            .ip-info {{
-                margin-top: 5px;
-                font-size: 0.9em;
-            }}
-            .refresh-btn {{
-                background-color: #0078d4;
-                color: white;
-                border: none;
-                padding: 10px 15px;
-                border-radius: 4px;
-                cursor: pointer;
-                margin-bottom: 20px;
-            }}
-            .refresh-btn:hover {{
-                background-color: #106ebe;
-            }}
-            .ip-link-container {{
-                margin-top: 8px;
-                display: flex;
-                align-items: center;
-                gap: 10px;
-            }}
-            .ip-logo {{
-                height: 16px;
-                vertical-align: middle;
-            }}
-            .ip-link {{
-                color: #0078d4;
-                text-decoration: none;
-                font-size: 0.9em;
-                margin-left: 6px;
-            }}
-            .ip-link:hover {{
-                text-decoration: underline;
-            }}
-            .ip-address {{
-                font-weight: bold;
-                color: #242424;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Azure Virtual Machines</h1>
-            <button class="refresh-btn" onclick="window.location.reload()">Refresh IP Addresses</button>
-            
-            <div class="vm-header">
-                <span>Group Name | Location</span>
-                <span>IP Addresses</span>
-            </div>
-    """
-    
-    # Add each VM to the HTML
-    for vm in vm_data['vms']:
-        # Get IP addresses for this VM
-        ips = get_ip_from_vm_name(credentials, subscription_id, vm['name'], vm_data['resource_group'])
 
-        # Determine which IP to use for connection (prefer public, fallback to private)
-        connect_ip = ips['public'] if ips['public'] != "N/A" else ips['private']
+def _vm_links(vm_name, public_ip):
+    """Connect, Files and RDP links for a VM with a public IP"""
+    rdp_link = f"https://cdn.sdappnet.cloud/rtx/rdpgen.html?ip={public_ip}&user=source&vm_name={quote(vm_name)}"
+    return f"""
+                    <div class="ip-link-container">
+                        <img src="{LOGO_URL}" alt="logo" class="ip-logo">
+                        <a class="ip-link" href="{CONNECT_URL}{public_ip}&amp;form={FORM_URL}" target="_blank">[Connect]</a>
+                        <img src="{DUMBDROP_URL}" alt="files" class="ip-logo">
+                        <a class="ip-link" href="https://{public_ip}:{DUMBDROP_PORT}" target="_blank">[Files]</a>
+                        <img src="{RDP_URL}" alt="rdp" class="ip-logo">
+                        <a class="ip-link" href="{html_page.escape(rdp_link)}" target="_blank">RDP Windows</a>
+                    </div>"""
+
 
-        # Start the VM HTML block
-        html_content += f"""
+def _vm_rows(vm_data, vm_ips):
+    resource_group = html_page.escape(vm_data['resource_group'])
+    for vm in vm_data['vms']:
+        ips = vm_ips.get(vm['name'].lower(), {"private": "N/A", "public": "N/A"})
+        public_ip = ips['public']
+        # Enhanced IP links only for a valid public IP, which needs no escaping
+        links = _vm_links(vm['name'], public_ip) if is_valid_ip(public_ip) else ""
+        yield f"""
             <div class="vm-item">
-                <div class="vm-name">{vm['name']}</div>
-                <div>{vm_data['resource_group']} | {vm['location']}</div>
-                <div class="vm-instance">{vm['vm_size']}</div>
+                <div class="vm-name">{html_page.escape(vm['name'])}</div>
+                <div>{resource_group} | {html_page.escape(vm['location'])}</div>
+                <div class="vm-instance">{html_page.escape(vm['vm_size'])}</div>
                 <div class="ip-info">
-        """
+                    <strong>Public IP:</strong> <span class="ip-address">{html_page.escape(public_ip)}</span>{links}
+                </div>
+            </div>"""
 
-        # Always show the public IP
-        html_content += f"""
-                    <strong>Public IP:</strong> <span class="ip-address">{ips['public']}</span>
-        """
 
-        # Add enhanced IP links for public IP if it's a valid IP
-        if is_valid_ip(ips['public']):
-            html_content += f"""
-                    <div class="ip-link-container">
-                        <img src="{logoURL}" alt="logo" class="ip-logo">
-                        <a class="ip-link" href="{baseURL}{ips['public']}&form={formURL}" target="_blank">[Connect]</a>
-                        <img src="{dumbdropURL}" alt="files" class="ip-logo">
-                        <a class="ip-link" href="https://{ips['public']}:{dumbdropPort}" target="_blank">[Files]</a>
-                        <img src="{rdpURL}" alt="rdp" class="ip-logo">
-                        <a class="ip-link" href="https://cdn.sdappnet.cloud/rtx/rdpgen.html?ip={ips['public']}&user=source&vm_name={vm['name']}" target="_blank">RDP Windows</a>
-                    </div>
-            """
-
-        # Close the VM block
-        html_content += """
-                </div>
-            </div>
-        """
+def generate_html(vm_data, credentials, subscription_id):
+    """Generate HTML from VM data with enhanced IP links"""
+    vm_ips = get_vm_ips(credentials, subscription_id, vm_data['resource_group']) if vm_data['vms'] else {}
+    header = f"""
+    <div class="container">
+        <h1>Azure Virtual Machines</h1>
+        <button class="refresh-btn" onclick="window.location.reload()">Refresh IP Addresses</button>
 
-    # Close the HTML document
-    html_content += """
+        <div class="vm-header">
+            <span>Group Name | Location</span>
+            <span>IP Addresses</span>
         </div>
-    </body>
-    </html>
-    """
-    
-    return html_content
+        <div{html_page.paged()}>"""
+
+    return _PAGE.render(header, _vm_rows(vm_data, vm_ips), "\n        </div>\n    </div>\n")
+
+
+def _resource_rows(res_list):
+    for resource in res_list:
+        yield f"""
+            <div class="resource-item">
+                <div class="resource-name">{html_page.escape(resource['name'])}</div>
+                <div class="resource-type">{html_page.escape(resource['type'])} | {html_page.escape(resource['location'])}</div>
+            </div>"""
+
+
+def generate_resources_html(resource_group, res_list):
+    """Generate HTML listing every resource in the resource group"""
+    header = f"""
+    <div class="container">
+        <h1>All Resources in {html_page.escape(resource_group)}</h1>
+        <p>Total resources: {len(res_list)}</p>
+        <div{html_page.paged()}>"""
+
+    return _RESOURCES_PAGE.render(
+        header, _resource_rows(res_list), "\n        </div>\n    </div>\n",
+        title=f"Azure Resources - {resource_group}"
+    )
 
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Processing request to list Azure resources/VMs.')
 
@@ -247,25 +253,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         resource_group = req_body.get('resource_group') or req.params.get('resource_group')
         if not resource_group:
             # Return HTML error instead of JSON
-            error_html = """
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error</title>
-                <style>
-                    body { font-family: 'Segoe UI', sans-serif; padding: 20px; }
-                    .error { color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }
-                </style>
-            </head>
-            <body>
-                <div class="error">
-                    <h2>Error: Missing Resource Group</h2>
-                    <p>Please provide a 'resource_group' parameter in your request.</p>
-                    <p>Example: https://your-function.azurewebsites.net/api/your-function?resource_group=myResourceGroup</p>
-                </div>
-            </body>
-            </html>
-            """
+            error_html = html_page.error(
+                "Error: Missing Resource Group",
+                "Please provide a 'resource_group' parameter in your request.",
+                "Example: https://your-function.azurewebsites.net/api/your-function?resource_group=myResourceGroup",
+            )
             return func.HttpResponse(
                 error_html,
                 status_code=400,
@@ -289,24 +281,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             err = f"Missing environment variable: {e}"
             logging.error(err)
             # Return HTML error
-            error_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error</title>
-                <style>
-                    body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                    .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-                </style>
-            </head>
-            <body>
-                <div class="error">
-                    <h2>Configuration Error</h2>
-                    <p>{err}</p>
-                </div>
-            </body>
-            </html>
-            """
+            error_html = html_page.error("Configuration Error", err)
             return func.HttpResponse(
                 error_html,
                 status_code=500,
@@ -318,32 +293,15 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             err = "AZURE_SUBSCRIPTION_ID environment variable is not set."
             logging.error(err)
             # Return HTML error
-            error_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error</title>
-                <style>
-                    body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                    .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-                </style>
-            </head>
-            <body>
-                <div class="error">
-                    <h2>Configuration Error</h2>
-                    <p>{err}</p>
-                </div>
-            </body>
-            </html>
-            """
+            error_html = html_page.error("Configuration Error", err)
             return func.HttpResponse(
                 error_html,
                 status_code=500,
                 mimetype="text/html"
             )
 
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-        compute_client = ComputeManagementClient(credentials, subscription_id)
+        resource_client = ResourceManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
+        compute_client = ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs(arm_throttle.LOW))
 
         # Check if resource group exists
         try:
@@ -352,24 +310,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             err = f"Resource group '{resource_group}' not found or inaccessible: {e}"
             logging.error(err)
             # Return HTML error
-            error_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error</title>
-                <style>
-                    body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                    .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-                </style>
-            </head>
-            <body>
-                <div class="error">
-                    <h2>Resource Group Not Found</h2>
-                    <p>{err}</p>
-                </div>
-            </body>
-            </html>
-            """
+            error_html = html_page.error("Resource Group Not Found", err)
             return func.HttpResponse(
                 error_html,
                 status_code=404,
@@ -411,40 +352,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 })
             
             # Generate HTML for all resources
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Azure Resources - {resource_group}</title>
-                <style>
-                    body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                    .container {{ max-width: 1200px; margin: 0 auto; }}
-                    h1 {{ color: #0078d4; }}
-                    .resource-item {{ padding: 10px; border-bottom: 1px solid #eee; }}
-                    .resource-name {{ font-weight: bold; color: #0078d4; }}
-                    .resource-type {{ color: #666; font-style: italic; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1>All Resources in {resource_group}</h1>
-                    <p>Total resources: {len(res_list)}</p>
-            """
-            
-            for resource in res_list:
-                html_content += f"""
-                    <div class="resource-item">
-                        <div class="resource-name">{resource['name']}</div>
-                        <div class="resource-type">{resource['type']} | {resource['location']}</div>
-                    </div>
-                """
-            
-            html_content += """
-                </div>
-            </body>
-            </html>
-            """
-            
+            html_content = generate_resources_html(resource_group, res_list)
+
             return func.HttpResponse(
                 html_content,
                 status_code=200,
@@ -454,24 +363,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     except Exception as ex:
         logging.exception("Unhandled error:")
         # Return HTML error
-        error_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Error</title>
-            <style>
-                body {{ font-family: 'Segoe UI', sans-serif; padding: 20px; }}
-                .error {{ color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }}
-            </style>
-        </head>
-        <body>
-            <div class="error">
-                <h2>Unexpected Error</h2>
-                <p>{str(ex)}</p>
-            </div>
-        </body>
-        </html>
-        """
+        error_html = html_page.error("Unexpected Error", str(ex))
         return func.HttpResponse(
             error_html,
             status_code=500,
@@ -0,0 +1,100 @@
+import logging
+import os
+import json
+import azure.functions as func
+from shared_code import arm_usage, sku_catalog
+
+
+def parse_bool(value):
+    """'true'/'false' query strings (or JSON booleans) -> True/False/None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+@arm_usage.metered
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Processing request to list VM sizes from the SKU catalog.')
+
+    try:
+        try:
+            req_body = req.get_json()
+        except ValueError:
+            req_body = {}
+
+        def param(name):
+            value = req_body.get(name)
+            return value if value is not None else req.params.get(name)
+
+        location = param('location')
+        if not location:
+            return func.HttpResponse(
+                json.dumps({"error": "Missing 'location' parameter"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+
+        missing = [var for var in ['AZURE_APP_CLIENT_ID', 'AZURE_APP_CLIENT_SECRET',
+                                   'AZURE_APP_TENANT_ID', 'AZURE_SUBSCRIPTION_ID'] if not os.environ.get(var)]
+        if missing:
+            err = f"Missing environment variables: {', '.join(missing)}"
+            logging.error(err)
+            return func.HttpResponse(
+                json.dumps({"error": err}),
+                status_code=500,
+                mimetype="application/json"
+            )
+
+        # Capability filters, e.g. ?location=uksouth&gpu=true&min_vcpus=8
+        flags = {flag: parse_bool(param(flag)) for flag in sku_catalog.FLAGS}
+        try:
+            min_vcpus = int(param('min_vcpus')) if param('min_vcpus') else None
+            max_vcpus = int(param('max_vcpus')) if param('max_vcpus') else None
+        except ValueError:
+            return func.HttpResponse(
+                json.dumps({"error": "'min_vcpus' and 'max_vcpus' must be integers"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+
+        catalog = sku_catalog.get_catalog()
+        try:
+            if parse_bool(param('refresh')):
+                catalog.refresh(location)
+            sizes = catalog.query(
+                location,
+                family=param('family'),
+                min_vcpus=min_vcpus,
+                max_vcpus=max_vcpus,
+                include_restricted=bool(parse_bool(param('include_restricted'))),
+                **flags
+            )
+        except Exception as e:
+            err = f"Error retrieving VM sizes: {e}"
+            logging.error(err)
+            return func.HttpResponse(
+                json.dumps({"error": err}),
+                status_code=500,
+                mimetype="application/json"
+            )
+
+        result = {
+            "location": sku_catalog.normalize_location(location),
+            "count": len(sizes),
+            "vm_sizes": [{k: v for k, v in size.items() if k != "capabilities"} for size in sizes]
+        }
+        return func.HttpResponse(
+            json.dumps(result),
+            status_code=200,
+            mimetype="application/json"
+        )
+
+    except Exception as ex:
+        logging.exception("Unhandled error:")
+        return func.HttpResponse(
+            json.dumps({"error": str(ex)}),
+            status_code=500,
+            mimetype="application/json"
+        )
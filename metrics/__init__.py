@@ -0,0 +1,24 @@
+import logging
+import json
+import azure.functions as func
+from shared_code import arm_throttle, arm_usage
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Processing request for ARM usage metrics.')
+
+    try:
+        # Counters are per worker process, like the throttling metrics
+        return func.HttpResponse(
+            arm_usage.prometheus(arm_throttle.scheduler.metrics()),
+            status_code=200,
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    except Exception as ex:
+        logging.exception("Unhandled error:")
+        return func.HttpResponse(
+            json.dumps({"error": str(ex)}),
+            status_code=500,
+            mimetype="application/json"
+        )
@@ -2,23 +2,80 @@ import sys
 import json
 import os
 import logging
+import threading
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from azure.identity import ClientSecretCredential
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.storage import StorageManagementClient
-from azure.storage.blob import generate_container_sas, ContainerSasPermissions
 import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+from shared_code import arm_throttle, arm_usage, bootstrap, sas_issuer
 
-load_dotenv()  # Load environment variables from .env file
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+StorageManagementClient = bootstrap.lazy('azure.mgmt.storage', 'StorageManagementClient')
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+bootstrap.configure()
 logger = logging.getLogger(__name__)
 
+# Most containers and blobs one request may sign
+MAX_ITEMS = int(os.environ.get('SAS_BATCH_MAX', '100'))
+
+_credential = None
+_credential_lock = threading.Lock()
+
+
+def get_credential():
+    """One credential per worker, so its token is reused across requests (KeyError if not configured)"""
+    global _credential
+    with _credential_lock:
+        if _credential is None:
+            _credential = ClientSecretCredential(
+                client_id=os.environ['AZURE_APP_CLIENT_ID'],
+                client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+                tenant_id=os.environ['AZURE_APP_TENANT_ID']
+            )
+        return _credential
+
+
+def expiry_hours(value, default=1):
+    """Expiry in hours from a request (string or int); invalid or non-positive values give the default"""
+    try:
+        hours = int(value)
+    except (TypeError, ValueError):
+        return default
+    return hours if hours > 0 else default
+
+
+def parse_items(req_body, req, default_hours):
+    """The containers and blobs to sign: the "items" list of a batch request, or the single
+    container_name (and blob_name) of the original form. Raises ValueError on bad input."""
+    items = req_body.get('items')
+    if items is None:
+        container_name = req_body.get('container_name') or req.params.get('container_name')
+        if not container_name:
+            raise ValueError("Missing 'container_name' parameter")
+        items = [{"container_name": container_name, "blob_name": req_body.get('blob_name') or req.params.get('blob_name')}]
+    if not isinstance(items, list) or not items:
+        raise ValueError("'items' must be a non-empty list")
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f"At most {MAX_ITEMS} items per request")
+
+    now = datetime.utcnow()
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('container_name'):
+            raise ValueError("Every item needs a 'container_name'")
+        blob_name = item.get('blob_name') or None
+        # Containers default to read/write/create/list as before; single blobs to read
+        permission = item.get('permissions') or ('r' if blob_name else 'rwcl')
+        parsed.append({
+            "container_name": item['container_name'],
+            "blob_name": blob_name,
+            "permission": sas_issuer.permissions(permission, blob=bool(blob_name)),
+            "expiry": now + timedelta(hours=expiry_hours(item.get('sas_expiry_hours'), default_hours))
+        })
+    return parsed
+
+
+@arm_usage.metered
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info('Processing SAS token generation request...')
 
@@ -31,21 +88,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         # Get parameters from JSON body or query parameters
         resource_group = req_body.get('resource_group') or req.params.get('resource_group')
         storage_account_name = req_body.get('storage_account_name') or req.params.get('storage_account_name')
-        container_name = req_body.get('container_name') or req.params.get('container_name')
-        # Parse expiry hours from request (string or int), default 24
-        expiry_hours_raw = req_body.get('sas_expiry_hours') or req.params.get('sas_expiry_hours') or '1'
-        try:
-            expiry_hours = int(expiry_hours_raw)
-            if expiry_hours <= 0:
-                expiry_hours = 1
-        except Exception:
-            expiry_hours = 1
-
-        # Then generate the SAS token expiry like this:
-        expiry_time = datetime.utcnow() + timedelta(hours=expiry_hours)
+        # Parse expiry hours from request (string or int), default 1; batch items may override it
+        default_hours = expiry_hours(req_body.get('sas_expiry_hours') or req.params.get('sas_expiry_hours'))
 
-        # Validate required parameters
-        if not resource_group:
+        # Validate required parameters (the resource group is only needed to look up the account key)
+        if not resource_group and not sas_issuer.USE_USER_DELEGATION:
             return func.HttpResponse(
                 json.dumps({"error": "Missing 'resource_group' parameter"}),
                 status_code=400,
@@ -57,20 +104,18 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 status_code=400,
                 mimetype="application/json"
             )
-        if not container_name:
+        try:
+            items = parse_items(req_body, req, default_hours)
+        except ValueError as e:
             return func.HttpResponse(
-                json.dumps({"error": "Missing 'container_name' parameter"}),
+                json.dumps({"error": str(e)}),
                 status_code=400,
                 mimetype="application/json"
             )
 
         # Authenticate using ClientSecretCredential
         try:
-            credentials = ClientSecretCredential(
-                client_id=os.environ['AZURE_APP_CLIENT_ID'],
-                client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
-                tenant_id=os.environ['AZURE_APP_TENANT_ID']
-            )
+            credentials = get_credential()
         except KeyError as e:
             err = f"Missing environment variable: {e}"
             logger.error(err)
@@ -90,29 +135,29 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        # Create clients
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-        storage_client = StorageManagementClient(credentials, subscription_id)
-
-        # Check if resource group exists
+        # Signing key, cached per account: usually no ARM or storage call at all.
+        # A missing resource group or account surfaces here as a 404 from list_keys.
         try:
-            _ = resource_client.resource_groups.get(resource_group)
-            logger.info(f"Resource group '{resource_group}' found.")
-        except Exception as e:
-            err = f"Resource group '{resource_group}' not found or inaccessible: {e}"
+            if sas_issuer.USE_USER_DELEGATION:
+                valid_until = max(item["expiry"] for item in items)
+                signing_key = {"user_delegation_key": sas_issuer.delegation_key(credentials, storage_account_name, valid_until)}
+            else:
+                storage_client = StorageManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+                signing_key = {"account_key": sas_issuer.account_key(storage_client, resource_group, storage_account_name)}
+        except ResourceNotFoundError as e:
+            err = f"Storage account '{storage_account_name}' not found in resource group '{resource_group}': {e}"
             logger.error(err)
             return func.HttpResponse(
                 json.dumps({"error": err}),
                 status_code=404,
                 mimetype="application/json"
             )
-
-        # Get storage account keys
-        try:
-            keys = storage_client.storage_accounts.list_keys(resource_group, storage_account_name)
-            storage_keys = {v.key_name: v.value for v in keys.keys}
-            storage_key = storage_keys.get('key1') or list(storage_keys.values())[0]
-            logger.info(f"Retrieved storage account key for '{storage_account_name}'.")
+        except ValueError as e:
+            return func.HttpResponse(
+                json.dumps({"error": str(e)}),
+                status_code=400,
+                mimetype="application/json"
+            )
         except Exception as e:
             err = f"Failed to get storage account keys: {e}"
             logger.error(err)
@@ -122,17 +167,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        # Generate SAS token for container with read, write, create, list permissions, valid for 1 day
+        # Generate the SAS tokens locally
         try:
-            sas_token = generate_container_sas(
-                account_name=storage_account_name,
-                container_name=container_name,
-                account_key=storage_key,
-                permission=ContainerSasPermissions(read=True, write=True, create=True, list=True),
-                expiry=expiry_time
-            )
-            full_url = f"https://{storage_account_name}.blob.core.windows.net/{container_name}?{sas_token}"
-            logger.info(f"SAS token generated for container '{container_name}'.")
+            signed = sas_issuer.sign(storage_account_name, items, **signing_key)
+            logger.info(f"Signed {len(signed)} SAS token(s) for '{storage_account_name}'.")
         except Exception as e:
             err = f"Failed to generate SAS token: {e}"
             logger.error(err)
@@ -142,12 +180,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
 
-        # Return SAS URL as JSON
+        # Return SAS URL as JSON: the original shape for one container, a list for a batch
+        if 'items' not in req_body:
+            result = {"sas_token": signed[0]["sas_token"]}
+            result["blob_sas_url" if signed[0]["blob_name"] else "container_sas_url"] = signed[0]["url"]
+        else:
+            result = {"items": [
+                {
+                    "container_name": item["container_name"],
+                    "blob_name": item["blob_name"],
+                    "permissions": str(item["permission"]),
+                    "expiry": item["expiry"].isoformat() + "Z",
+                    "sas_token": item["sas_token"],
+                    "url": item["url"]
+                }
+                for item in signed
+            ]}
         return func.HttpResponse(
-            json.dumps({
-                "sas_token": sas_token,
-                "container_sas_url": full_url
-            }),
+            json.dumps(result),
             status_code=200,
             mimetype="application/json"
         )
@@ -0,0 +1,3 @@
+# Helpers shared by the function folders.
+# This folder has no function.json, so the Functions host does not register it
+# as an endpoint; functions import it with `from shared_code import <module>`.
@@ -0,0 +1,169 @@
+import base64
+import hashlib
+import json
+import time
+
+from . import bootstrap
+
+requests = bootstrap.lazy_module('requests')
+x509 = bootstrap.lazy('cryptography', 'x509')
+hashes, serialization = bootstrap.lazy('cryptography.hazmat.primitives', 'hashes', 'serialization')
+ec, utils = bootstrap.lazy('cryptography.hazmat.primitives.asymmetric', 'ec', 'utils')
+NameOID = bootstrap.lazy('cryptography.x509.oid', 'NameOID')
+
+REQUEST_TIMEOUT = 30
+POLL_INTERVAL = 3
+POLL_TIMEOUT = 180
+
+
+class AcmeError(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def new_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def key_to_pem(key):
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+
+
+def key_from_pem(pem):
+    return serialization.load_pem_private_key(pem.encode(), password=None)
+
+
+class AcmeClient:
+    """Minimal RFC 8555 client for DNS-01 issuance with an ES256 account key"""
+
+    def __init__(self, directory_url, account_key):
+        self.session = requests.Session()
+        self.directory = self.session.get(directory_url, timeout=REQUEST_TIMEOUT).json()
+        self.key = account_key
+        self.kid = None
+        self._nonce = None
+
+    # ---------- JWS ----------
+
+    def _jwk(self):
+        numbers = self.key.public_key().public_numbers()
+        return {
+            "crv": "P-256",
+            "kty": "EC",
+            "x": _b64(numbers.x.to_bytes(32, 'big')),
+            "y": _b64(numbers.y.to_bytes(32, 'big'))
+        }
+
+    def thumbprint(self):
+        canonical = json.dumps(self._jwk(), sort_keys=True, separators=(',', ':'))
+        return _b64(hashlib.sha256(canonical.encode()).digest())
+
+    def _post(self, url, payload=None, accept=None):
+        """Signed POST; payload None is a POST-as-GET"""
+        for _ in range(3):
+            nonce = self._nonce or self.session.head(
+                self.directory["newNonce"], timeout=REQUEST_TIMEOUT
+            ).headers["Replay-Nonce"]
+            self._nonce = None
+            protected = {"alg": "ES256", "nonce": nonce, "url": url}
+            if self.kid:
+                protected["kid"] = self.kid
+            else:
+                protected["jwk"] = self._jwk()
+            protected64 = _b64(json.dumps(protected).encode())
+            payload64 = "" if payload is None else _b64(json.dumps(payload).encode())
+            r, s = utils.decode_dss_signature(
+                self.key.sign(f"{protected64}.{payload64}".encode(), ec.ECDSA(hashes.SHA256()))
+            )
+            headers = {"Content-Type": "application/jose+json"}
+            if accept:
+                headers["Accept"] = accept
+            response = self.session.post(
+                url,
+                data=json.dumps({
+                    "protected": protected64,
+                    "payload": payload64,
+                    "signature": _b64(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))
+                }),
+                headers=headers,
+                timeout=REQUEST_TIMEOUT
+            )
+            self._nonce = response.headers.get("Replay-Nonce")
+            if response.status_code == 400 and 'badNonce' in response.text:
+                continue
+            if response.status_code >= 400:
+                raise AcmeError(f"ACME {url} failed: {response.status_code} {response.text[:500]}")
+            return response
+        raise AcmeError(f"ACME {url} failed: nonce rejected 3 times")
+
+    def _poll(self, url, pending=('pending', 'processing', 'ready')):
+        deadline = time.monotonic() + POLL_TIMEOUT
+        while True:
+            body = self._post(url).json()
+            if body.get("status") not in pending or time.monotonic() > deadline:
+                return body
+            time.sleep(POLL_INTERVAL)
+
+    # ---------- protocol ----------
+
+    def register(self, email=None):
+        payload = {"termsOfServiceAgreed": True}
+        if email:
+            payload["contact"] = [f"mailto:{email}"]
+        response = self._post(self.directory["newAccount"], payload)
+        self.kid = response.headers["Location"]
+        return self.kid
+
+    def new_order(self, names):
+        response = self._post(self.directory["newOrder"], {
+            "identifiers": [{"type": "dns", "value": name} for name in names]
+        })
+        return response.headers["Location"], response.json()
+
+    def dns_challenges(self, order):
+        """[(txt_name, txt_value, challenge_url, authorization_url)] of a new order"""
+        challenges = []
+        for authorization_url in order["authorizations"]:
+            authorization = self._post(authorization_url).json()
+            if authorization.get("status") == "valid":
+                continue
+            challenge = next(c for c in authorization["challenges"] if c["type"] == "dns-01")
+            key_authorization = f"{challenge['token']}.{self.thumbprint()}"
+            challenges.append((
+                f"_acme-challenge.{authorization['identifier']['value']}",
+                _b64(hashlib.sha256(key_authorization.encode()).digest()),
+                challenge["url"],
+                authorization_url
+            ))
+        return challenges
+
+    def validate(self, challenges):
+        """Tell the CA the TXT records are in place and wait for every authorization"""
+        for _, _, challenge_url, _ in challenges:
+            self._post(challenge_url, {})
+        for txt_name, _, _, authorization_url in challenges:
+            authorization = self._poll(authorization_url, pending=('pending',))
+            if authorization.get("status") != "valid":
+                raise AcmeError(f"DNS-01 validation of {txt_name} failed: {json.dumps(authorization)[:500]}")
+
+    def finalize(self, order_url, order, names):
+        """Submit a CSR for names; returns (fullchain_pem, certificate_key)"""
+        certificate_key = new_key()
+        csr = x509.CertificateSigningRequestBuilder().subject_name(
+            x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])])
+        ).add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(name) for name in names]), critical=False
+        ).sign(certificate_key, hashes.SHA256())
+        self._post(order["finalize"], {"csr": _b64(csr.public_bytes(serialization.Encoding.DER))})
+        order = self._poll(order_url)
+        if order.get("status") != "valid":
+            raise AcmeError(f"ACME order not valid: {json.dumps(order)[:500]}")
+        fullchain = self._post(order["certificate"], accept="application/pem-certificate-chain").text
+        return fullchain, certificate_key
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from .sku_catalog import normalize_location
+
+# Subscription-wide caps. Counts are kept per worker process, so each worker
+# enforces its share: the cap divided by ADMISSION_WORKERS (at least 1)
+SUBSCRIPTION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 10))
+SUBSCRIPTION_MAX_PER_REGION = int(os.environ.get('ADMISSION_MAX_PER_REGION', 5))
+SUBSCRIPTION_MAX_PER_FAMILY = int(os.environ.get('ADMISSION_MAX_PER_FAMILY', 5))
+# Worker processes that may run provisioning jobs at once across all instances;
+# defaults to processes per instance times the scale-out limit of the app
+WORKERS = int(
+    os.environ.get('ADMISSION_WORKERS')
+    or int(os.environ.get('FUNCTIONS_WORKER_PROCESS_COUNT') or 1)
+    * int(os.environ.get('WEBSITE_MAX_DYNAMIC_APPLICATION_SCALE_OUT') or 1)
+)
+
+
+def worker_share(limit, workers=WORKERS):
+    """This worker's part of a subscription-wide cap (0 stays 0, i.e. unlimited)"""
+    if not limit:
+        return limit
+    return max(1, limit // max(1, workers))
+
+
+MAX_CONCURRENT = worker_share(SUBSCRIPTION_MAX_CONCURRENT)
+MAX_PER_REGION = worker_share(SUBSCRIPTION_MAX_PER_REGION)
+MAX_PER_FAMILY = worker_share(SUBSCRIPTION_MAX_PER_FAMILY)
+MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 100))
+# Starting estimate for how long one job holds its slot, refined as jobs finish
+DEFAULT_JOB_SECONDS = float(os.environ.get('ADMISSION_DEFAULT_JOB_SECONDS', 900))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, job_id, location, family, run, on_queued):
+        self.job_id = job_id
+        self.location = normalize_location(location)
+        self.family = (family or '').lower()
+        self.run = run
+        self.on_queued = on_queued
+        self.enqueued_at = time.monotonic()
+        self.position = None
+
+
+class AdmissionController:
+    """Limits how many provisioning jobs run at once in this worker.
+
+    There is no shared state between workers: the subscription-wide caps are
+    split evenly over ADMISSION_WORKERS, so they hold across the app only
+    when that setting is at least the real number of worker processes.
+    When a cap is smaller than the number of workers, each worker still
+    runs one job, so the cap can be exceeded.
+
+    Jobs are started in FIFO order. A job whose region or size family is at
+    its limit is skipped over (so it does not hold up jobs for other regions),
+    but nothing overtakes the queue while the global limit is reached.
+    Queued jobs are told their position through `on_queued` every time it
+    changes, until they start.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_per_region=MAX_PER_REGION,
+                 max_per_family=MAX_PER_FAMILY, max_queue=MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_per_region = max_per_region
+        self.max_per_family = max_per_family
+        self.max_queue = max_queue
+        self._pending = deque()
+        self._running = {}          # job_id -> _Job
+        self._tasks = set()
+        self._avg_job_seconds = DEFAULT_JOB_SECONDS
+
+    def _count(self, attr, value):
+        return sum(1 for job in self._running.values() if getattr(job, attr) == value)
+
+    def _can_start(self, job):
+        if len(self._running) >= self.max_concurrent:
+            return False
+        if self.max_per_region and self._count('location', job.location) >= self.max_per_region:
+            return False
+        if job.family and self.max_per_family and self._count('family', job.family) >= self.max_per_family:
+            return False
+        return True
+
+    def _start(self, job):
+        self._running[job.job_id] = job
+        started_at = time.monotonic()
+        task = asyncio.create_task(job.run())
+        self._tasks.add(task)
+
+        def done(finished):
+            self._tasks.discard(finished)
+            self._running.pop(job.job_id, None)
+            # Exponential moving average of how long a slot stays taken
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * (time.monotonic() - started_at)
+            if not finished.cancelled() and finished.exception():
+                logging.error(f"Provisioning job {job.job_id} failed: {finished.exception()}")
+            self._dispatch()
+
+        task.add_done_callback(done)
+
+    def _dispatch(self):
+        for job in list(self._pending):
+            if len(self._running) >= self.max_concurrent:
+                break
+            if self._can_start(job):
+                self._pending.remove(job)
+                self._start(job)
+        self._notify_positions()
+
+    def _estimated_start(self, position):
+        waves = math.ceil(position / max(1, self.max_concurrent))
+        return datetime.utcnow() + timedelta(seconds=waves * self._avg_job_seconds)
+
+    def _notify_positions(self):
+        for index, job in enumerate(self._pending, start=1):
+            if job.position != index:
+                job.position = index
+                if job.on_queued:
+                    task = asyncio.create_task(job.on_queued(index, self._estimated_start(index).isoformat()))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+    def is_active(self, job_id):
+        return job_id in self._running or any(job.job_id == job_id for job in self._pending)
+
+    def submit(self, job_id, location, family, run, on_queued=None):
+        """Start `run()` now or queue it.
+
+        `run` is a zero-argument coroutine function. `on_queued(position,
+        estimated_start)` is an optional coroutine function called while the
+        job waits. Returns {"queued", "queue_position", "estimated_start"}.
+        Raises QueueFull when the queue is at its limit.
+        """
+        job = _Job(job_id, location, family, run, on_queued)
+        if not self._pending and self._can_start(job):
+            self._start(job)
+            return {"queued": False, "queue_position": 0, "estimated_start": datetime.utcnow().isoformat()}
+
+        if len(self._pending) >= self.max_queue:
+            raise QueueFull(f"Provisioning queue is full ({self.max_queue} waiting)")
+        self._pending.append(job)
+        # The first notification is sent by the caller with the response
+        job.position = len(self._pending)
+        self._dispatch()
+        if job in self._pending:
+            return {
+                "queued": True,
+                "queue_position": job.position,
+                "estimated_start": self._estimated_start(job.position).isoformat()
+            }
+        return {"queued": False, "queue_position": 0, "estimated_start": datetime.utcnow().isoformat()}
+
+    def stats(self):
+        return {
+            "running": len(self._running),
+            "queued": len(self._pending),
+            "max_concurrent": self.max_concurrent,
+            "max_per_region": self.max_per_region,
+            "max_per_family": self.max_per_family,
+            "workers": WORKERS,
+            "avg_job_seconds": round(self._avg_job_seconds, 1)
+        }
+
+
+controller = AdmissionController()
@@ -0,0 +1,320 @@
+import base64
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from azure.core.pipeline.policies import HTTPPolicy
+
+# Set to a directory to record the ARM and blob traffic of every invocation, one JSON lines file each
+RECORD_DIR = os.environ.get('ARM_RECORD_DIR', '')
+# Set to a recording to serve every ARM and blob request from it instead of the network
+REPLAY_PATH = os.environ.get('ARM_REPLAY_PATH', '')
+# Factor applied to recorded latencies and Retry-After headers on replay (0 answers immediately)
+REPLAY_SPEED = float(os.environ.get('ARM_REPLAY_SPEED', 1.0))
+# Request bodies above this size, or not JSON, are only recorded by length
+MAX_REQUEST_BODY = 64 * 1024
+
+REDACTED = 'REDACTED'
+SECRET_HEADERS = {'authorization', 'x-ms-copy-source-authorization', 'x-ms-encryption-key', 'cookie', 'set-cookie'}
+SECRET_QUERY = {'sig', 'skoid', 'sktid', 'code'}
+# JSON properties holding credentials, matched case-insensitively anywhere in a body
+SECRET_KEY_PATTERN = re.compile(
+    r'password|secret|customdata|protectedsettings|connectionstring|accountkey|masterkey|functionkeys|systemkeys'
+    r'|(access|refresh|sas|id)_?token|privatekey',
+    re.IGNORECASE
+)
+# Credentials embedded in connection strings, SAS URLs and scripts
+SECRET_TEXT_PATTERN = re.compile(r'((?:AccountKey|SharedAccessKey|sig|password)=)([^;&\s"\'<]+)', re.IGNORECASE)
+SUBSCRIPTION_PATTERN = re.compile(r'/subscriptions/[^/?]+', re.IGNORECASE)
+
+_current = contextvars.ContextVar('rtx_arm_recording', default=None)
+
+
+def _scrub_url(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, REDACTED if k.lower() in SECRET_QUERY else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query, safe='/:$,')))
+
+
+def _scrub_headers(headers):
+    return {k: (REDACTED if k.lower() in SECRET_HEADERS else SECRET_TEXT_PATTERN.sub(r'\1' + REDACTED, str(v)))
+            for k, v in (headers or {}).items()}
+
+
+def _scrub_json(value, parent=None):
+    if isinstance(value, dict):
+        return {k: (REDACTED if SECRET_KEY_PATTERN.search(k) or (parent == 'keys' and k == 'value')
+                    else _scrub_json(v, k)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_scrub_json(v, parent) for v in value]
+    if isinstance(value, str):
+        return SECRET_TEXT_PATTERN.sub(r'\1' + REDACTED, value)
+    return value
+
+
+def _scrub_body(body):
+    """Body as (text, encoding) with credentials removed; binary bodies are kept as base64"""
+    if body is None:
+        return None, None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        return base64.b64encode(body).decode('ascii'), 'base64'
+    try:
+        return json.dumps(_scrub_json(json.loads(text))), None
+    except ValueError:
+        return SECRET_TEXT_PATTERN.sub(r'\1' + REDACTED, text), None
+
+
+def _request_body(http_request):
+    body = http_request.body if hasattr(http_request, 'body') else None
+    if body is None:
+        body = getattr(http_request, 'content', None)
+    if not isinstance(body, (bytes, str)):
+        return None  # streamed uploads are not recorded
+    if len(body) > MAX_REQUEST_BODY:
+        return {"omitted_bytes": len(body)}
+    try:
+        return json.dumps(_scrub_json(json.loads(body)))
+    except ValueError:
+        # Uploaded scripts and files can embed anything (passwords, private keys)
+        return {"omitted_bytes": len(body)}
+
+
+def match_key(method, url):
+    """What a request is matched on at replay: method, path and query, ignoring the host,
+    the subscription and redacted query values"""
+    parts = urlsplit(_scrub_url(url))
+    path = SUBSCRIPTION_PATTERN.sub('/subscriptions/-', parts.path).rstrip('/').lower()
+    query = sorted((k.lower(), v) for k, v in parse_qsl(parts.query, keep_blank_values=True))
+    return f"{method.upper()} {path}?{urlencode(query)}"
+
+
+class Recording:
+    """ARM and blob exchanges of one invocation, appended to a JSON lines file as they happen"""
+
+    def __init__(self, directory):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = os.path.join(directory, f"{datetime.utcnow():%Y%m%dT%H%M%S}-{self.id}.jsonl")
+        self.start = time.perf_counter()
+        self.count = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._write({"recording": self.id, "started": datetime.utcnow().isoformat()})
+
+    def _write(self, entry):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def add(self, http_request, http_response, started, duration):
+        try:
+            body, encoding = _scrub_body(http_response.body())
+        except Exception:
+            body, encoding = None, 'streamed'  # downloads read by the caller after the pipeline returns
+        entry = {
+            "offset_ms": round((started - self.start) * 1000, 1),
+            "duration_ms": round(duration * 1000, 1),
+            "method": http_request.method,
+            "url": _scrub_url(http_request.url),
+            "request_headers": _scrub_headers(http_request.headers),
+            "request_body": _request_body(http_request),
+            "status": http_response.status_code,
+            "response_headers": _scrub_headers(http_response.headers),
+            "response_body": body,
+            "response_encoding": encoding,
+        }
+        with self._lock:
+            self.count += 1
+            entry["seq"] = self.count
+            try:
+                self._write(entry)
+            except OSError as e:
+                logging.warning(f"Could not write ARM recording {self.path}: {e}")
+
+
+class RecordingPolicy(HTTPPolicy):
+    """Per-retry policy timing every attempt and adding it to a recording"""
+
+    def __init__(self, recording):
+        super().__init__()
+        self.recording = recording
+
+    def send(self, request):
+        started = time.perf_counter()
+        response = self.next.send(request)
+        self.recording.add(request.http_request, response.http_response, started, time.perf_counter() - started)
+        return response
+
+
+def current():
+    """Recording of the running invocation, started on first use when recording is enabled.
+
+    Functions create their clients in main(), so every client of one
+    invocation (and the background tasks it starts) shares one recording.
+    """
+    if not RECORD_DIR or REPLAY_PATH:
+        return None
+    recording = _current.get()
+    if recording is None:
+        recording = Recording(RECORD_DIR)
+        _current.set(recording)
+        logging.info(f"Recording ARM traffic to {recording.path}")
+    return recording
+
+
+def policy():
+    recording = current()
+    return RecordingPolicy(recording) if recording else None
+
+
+class Replay:
+    """Recorded exchanges served in order per request; the last one repeats once
+    a request has used up its recordings (e.g. LRO polls past the recorded end)"""
+
+    def __init__(self, path, speed=REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+        self.entries = {}
+        self._served = {}
+        self._lock = threading.Lock()
+        self.stats = {"served": 0, "repeated": 0, "missed": 0, "recorded_ms": 0.0, "missing": []}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if "recording" in entry:
+                    continue
+                self.entries.setdefault(match_key(entry["method"], entry["url"]), []).append(entry)
+
+    def next(self, method, url):
+        key = match_key(method, url)
+        with self._lock:
+            entries = self.entries.get(key)
+            if not entries:
+                self.stats["missed"] += 1
+                self.stats["missing"].append(key)
+                return None
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            self.stats["served"] += 1
+            if index >= len(entries):
+                self.stats["repeated"] += 1
+            entry = entries[min(index, len(entries) - 1)]
+            self.stats["recorded_ms"] += entry["duration_ms"]
+            return entry
+
+    def unused(self):
+        """Recorded exchanges the replayed run never asked for"""
+        with self._lock:
+            return {key: len(entries) - self._served.get(key, 0) for key, entries in self.entries.items()
+                    if self._served.get(key, 0) < len(entries)}
+
+
+class ReplaySession:
+    """Stands in for the requests session of the SDK's own RequestsTransport, which
+    then builds the responses exactly as it does for network traffic"""
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def request(self, method, url, **kwargs):
+        import requests
+
+        entry = self.replay.next(method, url)
+        response = requests.Response()
+        response.url = url
+        response.request = requests.Request(method, url).prepare()
+        if entry is None:
+            response.status_code = 404
+            response.reason = 'Not Recorded'
+            response.headers['Content-Type'] = 'application/json'
+            body = json.dumps({"error": {"code": "NotRecorded", "message": f"No recording for {method} {url}"}}).encode()
+        else:
+            if self.replay.speed:
+                time.sleep(entry["duration_ms"] / 1000 * self.replay.speed)
+            response.status_code = entry["status"]
+            response.reason = ''
+            response.headers.update(entry["response_headers"])
+            if 'Retry-After' in response.headers:
+                try:
+                    response.headers['Retry-After'] = str(float(response.headers['Retry-After']) * self.replay.speed)
+                except ValueError:
+                    pass
+            body = entry.get("response_body") or ''
+            body = base64.b64decode(body) if entry.get("response_encoding") == 'base64' else body.encode('utf-8')
+        # Recorded bodies are already decoded; never let requests inflate them again
+        response.headers.pop('Content-Encoding', None)
+        response.headers['Content-Length'] = str(len(body))
+        response._content = body
+        response._content_consumed = True
+        response.raw = _ReplayRaw(body)
+        return response
+
+
+class _ReplayRaw:
+    """Enough of a urllib3 response for RequestsTransport and streamed downloads"""
+
+    def __init__(self, body):
+        self._body = body
+        self._offset = 0
+        self.enforce_content_length = True
+
+    def read(self, amt=None, decode_content=None):
+        end = len(self._body) if amt is None else self._offset + amt
+        chunk = self._body[self._offset:end]
+        self._offset += len(chunk)
+        return chunk
+
+    def stream(self, amt=65536, decode_content=None):
+        while self._offset < len(self._body):
+            yield self.read(amt)
+
+    def close(self):
+        pass
+
+
+_replay = None
+_replay_lock = threading.Lock()
+
+
+def replay():
+    """Shared Replay of ARM_REPLAY_PATH, or None when not replaying"""
+    global _replay
+    if not REPLAY_PATH:
+        return None
+    with _replay_lock:
+        if _replay is None or _replay.path != REPLAY_PATH:
+            _replay = Replay(REPLAY_PATH)
+        return _replay
+
+
+def transport():
+    active = replay()
+    if not active:
+        return None
+    from azure.core.pipeline.transport import RequestsTransport
+    return RequestsTransport(session=ReplaySession(active), session_owner=False)
+
+
+def blob_kwargs():
+    """Keyword arguments recording or replaying a BlobServiceClient like the ARM clients, e.g.
+    BlobServiceClient(account_url=..., credential=..., **arm_recorder.blob_kwargs())
+    """
+    kwargs = {}
+    recording_policy = policy()
+    if recording_policy:
+        kwargs["_additional_pipeline_policies"] = [recording_policy]
+    replay_transport = transport()
+    if replay_transport:
+        kwargs["transport"] = replay_transport
+    return kwargs
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+
+from . import arm_recorder, arm_usage, idempotency, tracing
+
+HIGH = 'high'
+LOW = 'low'
+
+# Low-priority pacing per subscription and request kind (reads/writes)
+LOW_PRIORITY_RATE = float(os.environ.get('ARM_LOW_PRIORITY_RATE', 20))      # tokens per second
+LOW_PRIORITY_BURST = float(os.environ.get('ARM_LOW_PRIORITY_BURST', 50))
+# While high-priority calls are in flight, low-priority tokens refill this much slower
+HIGH_PRIORITY_SLOWDOWN = float(os.environ.get('ARM_HIGH_PRIORITY_SLOWDOWN', 4))
+HIGH_PRIORITY_ACTIVE_SECONDS = 2.0
+# Budget left for high-priority calls: low-priority calls hold back below it
+LOW_PRIORITY_RESERVE = int(os.environ.get('ARM_LOW_PRIORITY_RESERVE', 100))
+# Remaining-budget headers older than this are treated as unknown
+BUDGET_STALE_SECONDS = 60
+# Never hold a call longer than this, ARM's own retry policy takes over after that
+MAX_WAIT_SECONDS = float(os.environ.get('ARM_THROTTLE_MAX_WAIT_SECONDS', 30))
+
+REMAINING_HEADERS = {
+    'reads': 'x-ms-ratelimit-remaining-subscription-reads',
+    'writes': 'x-ms-ratelimit-remaining-subscription-writes',
+}
+SUBSCRIPTION_PATTERN = re.compile(r'/subscriptions/([^/?]+)', re.IGNORECASE)
+
+
+def _kind(method):
+    return 'reads' if method.upper() in ('GET', 'HEAD') else 'writes'
+
+
+def _subscription(url):
+    match = SUBSCRIPTION_PATTERN.search(url or '')
+    return match.group(1).lower() if match else 'global'
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, rate_divisor=1.0):
+        """Take a token if one is available; otherwise return seconds until one is"""
+        now = time.monotonic()
+        rate = self.rate / rate_divisor
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class _SubscriptionState:
+    def __init__(self):
+        self.remaining = {}              # kind -> (value, monotonic time seen)
+        self.blocked_until = 0.0         # Retry-After window
+        self.last_high_priority = 0.0
+        self.buckets = {kind: TokenBucket(LOW_PRIORITY_RATE, LOW_PRIORITY_BURST) for kind in REMAINING_HEADERS}
+        self.metrics = {
+            "requests": {HIGH: 0, LOW: 0},
+            "throttled": 0,
+            "retry_after_wait_ms": 0.0,
+            "low_priority_wait_ms": 0.0,
+            "last_throttled_at": None,
+            "unpaced_on_event_loop": 0,
+        }
+
+
+class ThrottleScheduler:
+    """Per-subscription view of the ARM request budget shared by every client in the worker.
+
+    High-priority calls (provisioning, deletes) only wait out a Retry-After
+    window. Low-priority calls (listing pages, cache refreshes) also go through
+    a token bucket, which refills slower while high-priority calls are active,
+    and hold back when the remaining budget reported by ARM runs low.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, subscription):
+        with self._lock:
+            state = self._states.get(subscription)
+            if state is None:
+                state = self._states[subscription] = _SubscriptionState()
+            return state
+
+    def _remaining(self, state, kind):
+        value, seen = state.remaining.get(kind, (None, 0.0))
+        if value is None or time.monotonic() - seen > BUDGET_STALE_SECONDS:
+            return None
+        return value
+
+    def acquire(self, subscription, kind, priority):
+        """Wait until the call may go out, at most MAX_WAIT_SECONDS.
+
+        A call made on a thread running an event loop (a begin_* issued
+        straight from a coroutine) is never held: sleeping there would freeze
+        every other task of the worker. It goes out at once and is counted in
+        unpaced_on_event_loop; a 429 is then left to the SDK's retry policy.
+        """
+        state = self._state(subscription)
+        on_event_loop = _on_event_loop()
+        deadline = time.monotonic() + MAX_WAIT_SECONDS
+        waited_retry_after = 0.0
+        waited_low = 0.0
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            with self._lock:
+                if priority == HIGH:
+                    state.last_high_priority = now
+                blocked_for = state.blocked_until - now
+                delay = 0.0
+                if blocked_for > 0:
+                    delay = blocked_for
+                elif priority == LOW:
+                    remaining = self._remaining(state, kind)
+                    if remaining is not None and remaining < LOW_PRIORITY_RESERVE:
+                        delay = 1.0
+                    else:
+                        busy = now - state.last_high_priority < HIGH_PRIORITY_ACTIVE_SECONDS
+                        delay = state.buckets[kind].take(HIGH_PRIORITY_SLOWDOWN if busy else 1.0)
+            if delay <= 0:
+                break
+            if on_event_loop:
+                with self._lock:
+                    state.metrics["unpaced_on_event_loop"] += 1
+                break
+            delay = min(delay, deadline - now)
+            time.sleep(delay)
+            if blocked_for > 0:
+                waited_retry_after += delay
+            else:
+                waited_low += delay
+
+        with self._lock:
+            state.metrics["requests"][priority] += 1
+            state.metrics["retry_after_wait_ms"] += waited_retry_after * 1000
+            state.metrics["low_priority_wait_ms"] += waited_low * 1000
+
+    def observe(self, subscription, kind, status_code, headers):
+        state = self._state(subscription)
+        now = time.monotonic()
+        with self._lock:
+            for header_kind, header in REMAINING_HEADERS.items():
+                value = headers.get(header)
+                if value is not None:
+                    try:
+                        state.remaining[header_kind] = (int(value), now)
+                    except ValueError:
+                        pass
+            if status_code == 429:
+                try:
+                    retry_after = float(headers.get('Retry-After', 0))
+                except ValueError:
+                    retry_after = 0.0
+                retry_after = min(max(retry_after, 1.0), MAX_WAIT_SECONDS)
+                state.blocked_until = max(state.blocked_until, now + retry_after)
+                state.metrics["throttled"] += 1
+                state.metrics["last_throttled_at"] = time.time()
+        if status_code == 429:
+            logging.warning(f"ARM throttled {kind} for subscription {subscription}, backing off {retry_after:.0f}s")
+
+    def metrics(self):
+        """Snapshot of the throttling metrics per subscription"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for subscription, state in self._states.items():
+                result[subscription] = {
+                    **{k: (dict(v) if isinstance(v, dict) else v) for k, v in state.metrics.items()},
+                    "remaining": {kind: self._remaining(state, kind) for kind in REMAINING_HEADERS},
+                    "blocked_for_seconds": round(max(0.0, state.blocked_until - now), 1),
+                }
+            return result
+
+
+scheduler = ThrottleScheduler()
+
+
+class ArmThrottlingPolicy(SansIOHTTPPolicy):
+    """Pipeline policy feeding every ARM request/response through the shared scheduler.
+
+    Installed per retry, so each attempt (including ones the SDK retries after
+    a 429) is paced and observed. Attempts are also counted on the tracing run
+    the client was created under, if any.
+    """
+
+    def __init__(self, priority=HIGH, trace=None):
+        super().__init__()
+        self.priority = priority
+        self.trace = trace
+
+    def on_request(self, request):
+        http_request = request.http_request
+        scheduler.acquire(_subscription(http_request.url), _kind(http_request.method), self.priority)
+        if self.trace is not None:
+            # The pipeline context is shared by every attempt of one request
+            attempt = request.context.get('rtx_attempt', 0)
+            request.context['rtx_attempt'] = attempt + 1
+            self.trace.arm_request(http_request.method, http_request.url, retry=attempt > 0)
+
+    def on_response(self, request, response):
+        http_request = request.http_request
+        scheduler.observe(
+            _subscription(http_request.url),
+            _kind(http_request.method),
+            response.http_response.status_code,
+            response.http_response.headers
+        )
+
+
+def client_kwargs(priority=HIGH, shared=False):
+    """Keyword arguments for any azure-mgmt client to join the shared scheduler, e.g.
+    ComputeManagementClient(credentials, subscription_id, **arm_throttle.client_kwargs())
+
+    The client's calls are also charged to the current invocation (arm_usage),
+    traced, and recorded or replayed when arm_recorder is enabled. Clients
+    kept across invocations pass shared=True so they are not tied to the
+    invocation that happened to create them. Clients of a provisioning job stop
+    making calls once the job is cancelled (idempotency.CancellationPolicy).
+    """
+    policies = [ArmThrottlingPolicy(priority, None if shared else tracing.current()), arm_usage.policy(shared)]
+    cancellation = None if shared else idempotency.policy()
+    if cancellation:
+        policies.insert(0, cancellation)
+    kwargs = {"per_retry_policies": policies}
+    recording_policy = None if shared else arm_recorder.policy()
+    if recording_policy:
+        policies.append(recording_policy)
+    replay_transport = arm_recorder.transport()
+    if replay_transport:
+        kwargs["transport"] = replay_transport
+    return kwargs
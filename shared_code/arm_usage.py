@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+from azure.core.pipeline.policies import HTTPPolicy
+
+from . import tracing
+
+# Per-endpoint ARM call budgets, e.g. "list_vm_html=40,hook_vm=5,*=200"; exceeding one logs a warning
+BUDGETS = os.environ.get('ARM_CALL_BUDGETS', '')
+# Calls made outside a metered invocation (timers, shared clients) are accounted here
+BACKGROUND = 'background'
+
+HEADERS = {
+    'calls': 'X-ARM-Calls',
+    'lro_polls': 'X-ARM-LRO-Polls',
+    'time_ms': 'X-ARM-Time-ms',
+    'bytes': 'X-ARM-Bytes',
+}
+
+_current = contextvars.ContextVar('rtx_arm_usage', default=None)
+
+
+def _parse_budgets(value):
+    budgets = {}
+    for item in value.split(','):
+        name, _, limit = item.partition('=')
+        try:
+            budgets[name.strip()] = int(limit)
+        except ValueError:
+            if item.strip():
+                logging.warning(f"Ignoring ARM call budget '{item.strip()}'")
+    return budgets
+
+
+_budgets = _parse_budgets(BUDGETS)
+
+
+def budget(endpoint):
+    return _budgets.get(endpoint, _budgets.get('*'))
+
+
+class Totals:
+    """Process-wide counters per endpoint, served by the metrics function"""
+
+    FIELDS = ('invocations', 'calls', 'lro_polls', 'retries', 'errors', 'bytes_sent', 'bytes_received', 'seconds', 'budget_exceeded')
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, **values):
+        with self._lock:
+            counters = self._endpoints.get(endpoint)
+            if counters is None:
+                counters = self._endpoints[endpoint] = dict.fromkeys(self.FIELDS, 0)
+            for name, value in values.items():
+                counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(counters) for endpoint, counters in self._endpoints.items()}
+
+
+totals = Totals()
+
+
+class Usage:
+    """ARM calls of one invocation, including the background work it starts"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.budget = budget(endpoint)
+        self.calls = 0
+        self.lro_polls = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self.exceeded = False
+        self._lock = threading.Lock()
+
+    def add(self, method, url, retry, status_code, sent, received, seconds):
+        poll = method.upper() == 'GET' and bool(tracing.POLL_PATTERN.search(url or ''))
+        with self._lock:
+            self.calls += 1
+            self.lro_polls += poll
+            self.retries += retry
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.seconds += seconds
+            exceeded = self.budget is not None and self.calls > self.budget and not self.exceeded
+            if exceeded:
+                self.exceeded = True
+        totals.add(
+            self.endpoint, calls=1, lro_polls=int(poll), retries=int(retry), errors=int(status_code >= 400),
+            bytes_sent=sent, bytes_received=received, seconds=seconds, budget_exceeded=int(exceeded)
+        )
+        if exceeded:
+            logging.warning(f"{self.endpoint} exceeded its ARM call budget of {self.budget} calls")
+
+    def headers(self):
+        with self._lock:
+            return {
+                HEADERS['calls']: str(self.calls),
+                HEADERS['lro_polls']: str(self.lro_polls),
+                HEADERS['time_ms']: str(round(self.seconds * 1000)),
+                HEADERS['bytes']: str(self.bytes_sent + self.bytes_received),
+            }
+
+
+_background = Usage(BACKGROUND)
+
+
+def current(shared=False):
+    """Usage the current invocation is charged for, or the background usage"""
+    usage = None if shared else _current.get()
+    return usage or _background
+
+
+def _body_length(message):
+    length = message.headers.get('Content-Length')
+    if length is not None:
+        try:
+            return int(length)
+        except ValueError:
+            pass
+    try:
+        body = message.body()
+    except Exception:
+        return 0  # streamed, not read yet
+    return len(body) if body else 0
+
+
+def _request_length(http_request):
+    length = http_request.headers.get('Content-Length')
+    if length is not None:
+        try:
+            return int(length)
+        except ValueError:
+            pass
+    body = getattr(http_request, 'body', None)
+    if body is None:
+        body = getattr(http_request, 'content', None)
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+class UsagePolicy(HTTPPolicy):
+    """Per-retry policy charging every attempt, its time and bytes to a Usage"""
+
+    def __init__(self, usage):
+        super().__init__()
+        self.usage = usage
+
+    def send(self, request):
+        http_request = request.http_request
+        attempt = request.context.get('rtx_usage_attempt', 0)
+        request.context['rtx_usage_attempt'] = attempt + 1
+        started = time.perf_counter()
+        response = self.next.send(request)
+        http_response = response.http_response
+        self.usage.add(
+            http_request.method, http_request.url, attempt > 0, http_response.status_code,
+            _request_length(http_request), _body_length(http_response), time.perf_counter() - started
+        )
+        return response
+
+
+def policy(shared=False):
+    return UsagePolicy(current(shared))
+
+
+def _finish(usage, response):
+    totals.add(usage.endpoint, invocations=1)
+    if response is not None and hasattr(response, 'headers'):
+        for name, value in usage.headers().items():
+            response.headers[name] = value
+    return response
+
+
+def metered(handler):
+    """Decorator for an HTTP main(): charges the ARM calls of the invocation to its
+    endpoint and reports them on the response as X-ARM-* headers"""
+    endpoint = handler.__module__.rsplit('.', 1)[-1]
+
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def wrapper(req):
+            usage = Usage(endpoint)
+            token = _current.set(usage)
+            try:
+                return _finish(usage, await handler(req))
+            finally:
+                _current.reset(token)
+    else:
+        @functools.wraps(handler)
+        def wrapper(req):
+            usage = Usage(endpoint)
+            token = _current.set(usage)
+            try:
+                return _finish(usage, handler(req))
+            finally:
+                _current.reset(token)
+    return wrapper
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus(throttle_metrics=None):
+    """Counters of every endpoint (and the ARM scheduler, if given) in Prometheus text format"""
+    snapshot = totals.snapshot()
+    metrics = [
+        ('rtx_invocations_total', 'counter', 'Metered invocations per endpoint', 'invocations'),
+        ('rtx_arm_calls_total', 'counter', 'ARM requests including retries and LRO polls', 'calls'),
+        ('rtx_arm_lro_polls_total', 'counter', 'ARM long-running operation polls', 'lro_polls'),
+        ('rtx_arm_retries_total', 'counter', 'ARM request retries', 'retries'),
+        ('rtx_arm_errors_total', 'counter', 'ARM responses with status 400 or above', 'errors'),
+        ('rtx_arm_bytes_sent_total', 'counter', 'ARM request body bytes', 'bytes_sent'),
+        ('rtx_arm_bytes_received_total', 'counter', 'ARM response body bytes', 'bytes_received'),
+        ('rtx_arm_request_seconds_total', 'counter', 'Time spent in ARM requests', 'seconds'),
+        ('rtx_arm_budget_exceeded_total', 'counter', 'Invocations that went over their ARM call budget', 'budget_exceeded'),
+    ]
+    lines = []
+    for name, kind, help_text, field in metrics:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for endpoint in sorted(snapshot):
+            value = snapshot[endpoint][field]
+            value = round(value, 6) if isinstance(value, float) else value
+            lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {value}')
+
+    lines += ["# HELP rtx_arm_call_budget Configured ARM call budget per invocation", "# TYPE rtx_arm_call_budget gauge"]
+    for endpoint, limit in sorted(_budgets.items()):
+        lines.append(f'rtx_arm_call_budget{{endpoint="{_escape(endpoint)}"}} {limit}')
+
+    if throttle_metrics:
+        lines += ["# HELP rtx_arm_scheduled_requests_total ARM requests through the throttle scheduler",
+                  "# TYPE rtx_arm_scheduled_requests_total counter"]
+        for subscription, state in sorted(throttle_metrics.items()):
+            for priority, count in sorted(state["requests"].items()):
+                lines.append(f'rtx_arm_scheduled_requests_total{{subscription="{_escape(subscription)}",priority="{priority}"}} {count}')
+        lines += ["# HELP rtx_arm_throttled_total ARM responses with status 429", "# TYPE rtx_arm_throttled_total counter"]
+        for subscription, state in sorted(throttle_metrics.items()):
+            lines.append(f'rtx_arm_throttled_total{{subscription="{_escape(subscription)}"}} {state["throttled"]}')
+        lines += ["# HELP rtx_arm_remaining_requests Remaining ARM request budget last reported by ARM",
+                  "# TYPE rtx_arm_remaining_requests gauge"]
+        for subscription, state in sorted(throttle_metrics.items()):
+            for kind, remaining in sorted(state["remaining"].items()):
+                if remaining is not None:
+                    lines.append(f'rtx_arm_remaining_requests{{subscription="{_escape(subscription)}",kind="{kind}"}} {remaining}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,100 @@
+import importlib
+import logging
+import threading
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure():
+    """Load .env and set up logging once per worker, however many function modules call it"""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+
+class _Lazy:
+    """Stand-in for a class, function or module that is imported on first use.
+
+    Calling it, reading an attribute or using it in isinstance() imports the
+    real object, so module-level names keep working unchanged:
+
+        ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+        client = ComputeManagementClient(credentials, subscription_id)   # imports azure.mgmt.compute here
+    """
+
+    __slots__ = ('_module', '_name', '_bound', '_target')
+
+    def __init__(self, module, name=None, bound=None):
+        self._module = module
+        self._name = name
+        self._bound = bound
+        self._target = None
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            module = importlib.import_module(self._module)
+            if self._name is not None:
+                try:
+                    target = getattr(module, self._name)
+                except AttributeError:
+                    # `from package import submodule`
+                    target = importlib.import_module(f"{self._module}.{self._name}")
+            elif self._bound is not None:
+                target = importlib.import_module(self._bound)
+            else:
+                target = module
+            self._target = target
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self._resolve())
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self._resolve())
+
+    def __mro_entries__(self, bases):
+        return (self._resolve(),)
+
+    def __repr__(self):
+        name = f"{self._module}.{self._name}" if self._name else self._module
+        state = 'loaded' if self._target is not None else 'not loaded'
+        return f"<lazy {name} ({state})>"
+
+
+def lazy(module, *names):
+    """Lazy stand-ins for `from module import name, ...`: one name gives one, several a tuple"""
+    proxies = tuple(_Lazy(module, name) for name in names)
+    return proxies[0] if len(proxies) == 1 else proxies
+
+
+def lazy_module(module):
+    """Lazy stand-in for `import module`. For a dotted name it stands for the top-level
+    package, like the import statement binds, with the submodule imported on first use."""
+    top = module.split('.')[0]
+    return _Lazy(module, bound=top if top != module else None)
+
+
+
+def preload(module):
+    """Import everything a module left lazy, e.g. to warm a worker before it takes traffic"""
+    for value in list(vars(module).values()):
+        if type(value) is _Lazy:
+            value._resolve()
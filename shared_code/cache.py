@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe in-memory cache whose entries expire after `ttl` seconds.
+
+    Azure SDK calls run in the default executor (see run_azure_operation), so
+    several threads may read and fill the cache at the same time.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+        return value
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` on a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.set(key, loader())
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when no key is given"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from . import acme_client, bootstrap
+
+x509 = bootstrap.lazy('cryptography', 'x509')
+
+# Off unless configured: the setup scripts then run certbot themselves
+ENABLED = os.environ.get('TLS_CERT_SERVICE', 'false').lower() == 'true'
+ACME_DIRECTORY_URL = os.environ.get('ACME_DIRECTORY_URL', 'https://acme-v02.api.letsencrypt.org/directory')
+# Cached certificates are reissued when less than this is left
+RENEW_DAYS = int(os.environ.get('CERT_RENEW_DAYS', 30))
+# How long to wait for the challenge TXT records on the zone's name servers
+DNS_TIMEOUT_SECONDS = int(os.environ.get('ACME_DNS_TIMEOUT_SECONDS', 120))
+
+# Encrypted certificate store in the artifact storage account
+STORE_CONTAINER = os.environ.get('CERT_STORE_CONTAINER', 'tls-certs')
+ACCOUNT_BLOB = 'acme-account.json.enc'
+
+
+def names_for(fqdn, zone):
+    """Certificate names covering fqdn and its service subdomains.
+
+    A host directly under the zone gets the zone's wildcard, shared by every
+    VM of the domain; deeper hosts (pin.vm.zone) get a wildcard for their VM.
+    """
+    fqdn = fqdn.rstrip('.').lower()
+    zone = zone.rstrip('.').lower()
+    if fqdn == zone or fqdn.count('.') == zone.count('.') + 1:
+        return [zone, f"*.{zone}"]
+    return [fqdn, f"*.{fqdn}"]
+
+
+def _cache_key(names):
+    return hashlib.sha256(','.join(sorted(names)).encode()).hexdigest()[:32]
+
+
+def _not_after(fullchain):
+    return x509.load_pem_x509_certificate(fullchain.encode()).not_valid_after_utc
+
+
+def _fresh(bundle):
+    not_after = datetime.fromisoformat(bundle["not_after"])
+    return not_after - datetime.now(timezone.utc) > timedelta(days=RENEW_DAYS)
+
+
+class CertStore:
+    """Certificates and the ACME account key as Fernet-encrypted blobs.
+
+    Needs AZURE_STORAGE_CONNECTION_STRING and CERT_STORE_KEY (a Fernet key);
+    without them certificates are only cached in memory.
+    """
+
+    def __init__(self):
+        self._container = None
+        self._fernet = None
+        connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
+        key = os.environ.get('CERT_STORE_KEY')
+        if not connection_string or not key:
+            logging.warning("Certificate store not configured, caching certificates in memory only")
+            return
+        from cryptography.fernet import Fernet
+        from azure.storage.blob import BlobServiceClient
+        self._fernet = Fernet(key.encode())
+        self._container = BlobServiceClient.from_connection_string(connection_string).get_container_client(STORE_CONTAINER)
+        try:
+            self._container.create_container()
+        except Exception:
+            pass  # already exists
+
+    def load(self, blob_name):
+        if self._container is None:
+            return None
+        try:
+            data = self._container.download_blob(blob_name).readall()
+        except Exception:
+            return None
+        try:
+            return json.loads(self._fernet.decrypt(data))
+        except Exception as e:
+            logging.warning(f"Unreadable certificate store entry {blob_name}: {e}")
+            return None
+
+    def save(self, blob_name, value):
+        if self._container is None:
+            return
+        self._container.upload_blob(blob_name, self._fernet.encrypt(json.dumps(value).encode()), overwrite=True)
+
+
+class CertService:
+    """Wildcard certificates issued via DNS-01 against our Azure DNS zones"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._memory = {}    # cache key -> bundle
+        self._store = None
+        self._acme = None
+
+    def _store_client(self):
+        if self._store is None:
+            self._store = CertStore()
+        return self._store
+
+    def _lock_for(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _acme_client(self):
+        """Account reused across issuances; its key is kept in the store"""
+        with self._lock:
+            if self._acme is not None:
+                return self._acme
+            store = self._store_client()
+            account = store.load(ACCOUNT_BLOB)
+            if account and account.get("directory") == ACME_DIRECTORY_URL:
+                key = acme_client.key_from_pem(account["key"])
+            else:
+                key = acme_client.new_key()
+                store.save(ACCOUNT_BLOB, {"directory": ACME_DIRECTORY_URL, "key": acme_client.key_to_pem(key)})
+            client = acme_client.AcmeClient(ACME_DIRECTORY_URL, key)
+            client.register(os.environ.get('ACME_EMAIL') or os.environ.get('SENDER_EMAIL'))
+            self._acme = client
+            return client
+
+    def get(self, dns_client, resource_group, zone, names):
+        """Bundle {"names", "fullchain", "key", "not_after"} for names, issued if needed"""
+        key = _cache_key(names)
+        with self._lock_for(key):
+            bundle = self._memory.get(key)
+            if bundle and _fresh(bundle):
+                return bundle
+            blob_name = f"{zone.lower()}/{key}.json.enc"
+            bundle = self._store_client().load(blob_name)
+            if bundle and _fresh(bundle):
+                self._memory[key] = bundle
+                return bundle
+            bundle = self._issue(dns_client, resource_group, zone, names)
+            self._store_client().save(blob_name, bundle)
+            self._memory[key] = bundle
+            return bundle
+
+    def _issue(self, dns_client, resource_group, zone, names):
+        from azure.mgmt.dns.models import RecordSet
+
+        logging.info(f"Issuing certificate for {', '.join(names)}")
+        client = self._acme_client()
+        order_url, order = client.new_order(names)
+        challenges = client.dns_challenges(order)
+
+        # *.x and x share one _acme-challenge.x record with two values
+        txt = {}
+        for txt_name, value, _, _ in challenges:
+            relative = txt_name[:-len(zone) - 1] if txt_name.lower().endswith(f".{zone.lower()}") else txt_name
+            txt.setdefault(relative, []).append(value)
+        try:
+            for relative, values in txt.items():
+                dns_client.record_sets.create_or_update(
+                    resource_group, zone, relative, 'TXT',
+                    RecordSet(ttl=60, txt_records=[{'value': [value]} for value in values])
+                )
+            self._wait_for_txt(dns_client, resource_group, zone, txt)
+            client.validate(challenges)
+            fullchain, certificate_key = client.finalize(order_url, order, names)
+        finally:
+            for relative in txt:
+                try:
+                    dns_client.record_sets.delete(resource_group, zone, relative, 'TXT')
+                except Exception:
+                    pass
+
+        return {
+            "names": names,
+            "fullchain": fullchain,
+            "key": acme_client.key_to_pem(certificate_key),
+            "not_after": _not_after(fullchain).isoformat(),
+            "issued_at": datetime.now(timezone.utc).isoformat()
+        }
+
+    @staticmethod
+    def _wait_for_txt(dns_client, resource_group, zone, txt):
+        """Poll the zone's own name servers until every challenge value is served"""
+        import dns.resolver
+
+        try:
+            name_servers = dns_client.zones.get(resource_group, zone).name_servers or []
+            resolver = dns.resolver.Resolver(configure=False)
+            resolver.nameservers = [socket.gethostbyname(ns.rstrip('.')) for ns in name_servers]
+        except Exception as e:
+            logging.warning(f"Cannot query {zone} name servers, waiting blindly: {e}")
+            time.sleep(min(30, DNS_TIMEOUT_SECONDS))
+            return
+
+        deadline = time.monotonic() + DNS_TIMEOUT_SECONDS
+        pending = dict(txt)
+        while pending and time.monotonic() < deadline:
+            for relative, values in list(pending.items()):
+                try:
+                    answer = resolver.resolve(f"{relative}.{zone}", 'TXT')
+                    served = {b''.join(r.strings).decode() for r in answer}
+                    if set(values) <= served:
+                        del pending[relative]
+                except Exception:
+                    pass
+            if pending:
+                time.sleep(5)
+        if pending:
+            logging.warning(f"Challenge TXT records not visible yet for {', '.join(pending)}; asking the CA anyway")
+
+
+service = CertService()
+
+
+def certificate_for(dns_client, resource_group, zone, fqdn):
+    """Bundle for fqdn, or None when the service is off or issuance failed.
+
+    Callers fall back to on-VM issuance on None, so a failure here never
+    fails a provision.
+    """
+    if not ENABLED or not zone:
+        return None
+    try:
+        return service.get(dns_client, resource_group, zone, names_for(fqdn, zone))
+    except Exception as e:
+        logging.warning(f"Pre-issued certificate for {fqdn} unavailable, VM will use ACME: {e}")
+        return None
+
+
+def _split_chain(fullchain):
+    marker = '-----END CERTIFICATE-----'
+    parts = [p.strip() + '\n' + marker + '\n' for p in fullchain.split(marker) if p.strip()]
+    return parts[0], ''.join(parts[1:])
+
+
+def inject_bash(script, fqdn, bundle):
+    """Install the certificate where certbot would, and make certbot only install it"""
+    cert, chain = _split_chain(bundle["fullchain"])
+    block = (
+        '\n# ========== PRE-ISSUED TLS CERTIFICATE ==========\n'
+        '# Issued by the provisioning service; certbot only installs it\n'
+        f'RTX_CERT_DIR="/etc/letsencrypt/live/{fqdn}"\n'
+        'mkdir -p "$RTX_CERT_DIR"\n'
+        "cat > \"$RTX_CERT_DIR/fullchain.pem\" <<'RTX_CERT_EOF'\n" + bundle["fullchain"].strip() + '\nRTX_CERT_EOF\n'
+        "cat > \"$RTX_CERT_DIR/cert.pem\" <<'RTX_CERT_EOF'\n" + cert.strip() + '\nRTX_CERT_EOF\n'
+        "cat > \"$RTX_CERT_DIR/chain.pem\" <<'RTX_CERT_EOF'\n" + chain.strip() + '\nRTX_CERT_EOF\n'
+        "(umask 077; cat > \"$RTX_CERT_DIR/privkey.pem\" <<'RTX_CERT_EOF'\n" + bundle["key"].strip() + '\nRTX_CERT_EOF\n)\n'
+        'certbot() {\n'
+        '    case " $* " in\n'
+        '        *" certonly "*)\n'
+        '            echo "certbot: using the pre-issued certificate in $RTX_CERT_DIR"\n'
+        '            return 0 ;;\n'
+        '        *" --nginx "*)\n'
+        '            local redirect=""\n'
+        '            case " $* " in *" --redirect "*) redirect="--redirect" ;; esac\n'
+        f'            command certbot install --nginx --non-interactive -d "{fqdn}" $redirect \\\n'
+        '                --cert-path "$RTX_CERT_DIR/cert.pem" --key-path "$RTX_CERT_DIR/privkey.pem" \\\n'
+        '                --fullchain-path "$RTX_CERT_DIR/fullchain.pem" --chain-path "$RTX_CERT_DIR/chain.pem" \\\n'
+        '                || command certbot "$@" ;;\n'
+        '        *) command certbot "$@" ;;\n'
+        '    esac\n'
+        '}\n'
+    )
+    if script.lstrip().startswith('#!'):
+        # Keep the shebang first (some templates start with a blank line)
+        leading = script[:len(script) - len(script.lstrip())]
+        first_line, _, rest = script.lstrip().partition('\n')
+        return f"{leading}{first_line}\n{block}{rest}"
+    return block + script
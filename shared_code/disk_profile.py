@@ -0,0 +1,79 @@
+import logging
+import os
+
+from . import sku_catalog
+
+# auto: ephemeral when the SKU can hold it, managed SSD otherwise; managed: never ephemeral
+OS_DISK_MODE = os.environ.get('OS_DISK_MODE', 'auto').lower()
+
+# Ephemeral placements in order of preference; the cache keeps the temp disk free
+PLACEMENTS = (
+    ('CacheDisk', 'CachedDiskBytes', 1024 ** 3),
+    ('ResourceDisk', 'MaxResourceVolumeMB', 1024),
+)
+
+
+def choose(location, vm_size, disk_size_gb, min_disk_gb=30):
+    """Pick the OS disk for a disposable Linux VM from the size's SKU capabilities.
+
+    An ephemeral OS disk (on the VM's cache or resource disk) is used when the
+    SKU supports it and the placement holds at least min_disk_gb; the disk is
+    then sized to fit, up to disk_size_gb. Otherwise a Premium SSD (or
+    Standard SSD on sizes without premium IO) of max(disk_size_gb, min_disk_gb).
+    """
+    info = None
+    try:
+        info = sku_catalog.get_catalog().get(location, vm_size)
+    except Exception as e:
+        logging.warning(f"SKU catalog unavailable, using a managed OS disk for {vm_size}: {e}")
+
+    if info and OS_DISK_MODE != 'managed' and info.get("ephemeral_os"):
+        capabilities = info.get("capabilities", {})
+        for placement, capability, per_gb in PLACEMENTS:
+            try:
+                capacity_gb = int(float(capabilities.get(capability, 0))) // per_gb
+            except (TypeError, ValueError):
+                capacity_gb = 0
+            if capacity_gb >= min_disk_gb:
+                return {
+                    "ephemeral": True,
+                    "placement": placement,
+                    "storage_account_type": 'Standard_LRS',
+                    "disk_size_gb": min(disk_size_gb, capacity_gb),
+                    "capacity_gb": capacity_gb
+                }
+
+    premium = bool(info and info.get("premium_io"))
+    return {
+        "ephemeral": False,
+        "placement": None,
+        "storage_account_type": 'Premium_LRS' if premium else 'StandardSSD_LRS',
+        "disk_size_gb": max(disk_size_gb, min_disk_gb)
+    }
+
+
+def os_disk(name, profile):
+    """StorageProfile os_disk for a profile from choose()"""
+    disk = {
+        'name': name,
+        'managed_disk': {'storage_account_type': profile["storage_account_type"]},
+        'create_option': 'FromImage',
+        'delete_option': 'Delete',
+        'disk_size_gb': profile["disk_size_gb"]
+    }
+    if profile["ephemeral"]:
+        disk['caching'] = 'ReadOnly'
+        disk['diff_disk_settings'] = {'option': 'Local', 'placement': profile["placement"]}
+    return disk
+
+
+def is_ephemeral(vm):
+    """Whether an existing VM runs on an ephemeral OS disk (which cannot be snapshotted)"""
+    os_disk = vm.storage_profile.os_disk if vm.storage_profile else None
+    return bool(os_disk and os_disk.diff_disk_settings)
+
+
+def describe(profile):
+    if profile["ephemeral"]:
+        return f"ephemeral {profile['disk_size_gb']} GB on {profile['placement']}"
+    return f"{profile['storage_account_type']} {profile['disk_size_gb']} GB"
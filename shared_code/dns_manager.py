@@ -0,0 +1,178 @@
+import concurrent.futures
+import logging
+import os
+import re
+import threading
+import time
+
+from . import bootstrap
+
+RecordSet = bootstrap.lazy('azure.mgmt.dns.models', 'RecordSet')
+
+# One `*.{vm}` record per VM instead of one per service subdomain
+WILDCARD = os.environ.get('DNS_WILDCARD', 'false').lower() == 'true'
+RECORD_TTL = int(os.environ.get('DNS_RECORD_TTL', 3600))
+# Zone listings are trusted for this long; our own writes keep them current
+INDEX_TTL_SECONDS = int(os.environ.get('DNS_INDEX_TTL_SECONDS', 300))
+# The reconciler never removes more than this per zone and run
+RECONCILE_MAX_DELETES = int(os.environ.get('DNS_RECONCILE_MAX_DELETES', 50))
+
+SERVICES = ('pin', 'drop', 'web')
+# Records the reconciler may remove: per-VM service and wildcard names only
+MANAGED_RECORD = re.compile(r'^(\*|pin|drop|web)\.[^.]+$', re.IGNORECASE)
+# Record-set metadata set on every record written here; the reconciler only removes records carrying it
+OWNER_METADATA_KEY = 'provisioner'
+OWNER = os.environ.get('DNS_RECORD_OWNER', 'rtxapi')
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='dns')
+
+
+def record_names(subdomain, services=SERVICES):
+    """A records a VM with per-service subdomains needs"""
+    if WILDCARD:
+        return [f"*.{subdomain}"]
+    return [f"{service}.{subdomain}" for service in services]
+
+
+def all_record_names(subdomain, services=SERVICES):
+    """Every name a VM may have, in either mode; for teardown"""
+    return [subdomain, f"*.{subdomain}"] + [f"{service}.{subdomain}" for service in services]
+
+
+class ZoneIndex:
+    """A records per zone, name -> sorted IPs, from one list call per zone.
+
+    Writes that would not change a record are skipped, and deletes of
+    records that do not exist never reach ARM.
+    """
+
+    def __init__(self, ttl=INDEX_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._zones = {}   # (resource_group, zone) -> {"fetched_at", "records"}
+
+    @staticmethod
+    def _key(resource_group, zone):
+        return (resource_group.lower(), zone.lower())
+
+    def records(self, dns_client, resource_group, zone, refresh=False):
+        key = self._key(resource_group, zone)
+        with self._lock:
+            entry = self._zones.get(key)
+            if entry and not refresh and time.time() - entry["fetched_at"] < self.ttl:
+                return dict(entry["records"])
+        records = {}
+        for record_set in dns_client.record_sets.list_by_type(resource_group, zone, 'A'):
+            records[record_set.name.lower()] = sorted(a.ipv4_address for a in (record_set.a_records or []))
+        with self._lock:
+            self._zones[key] = {"fetched_at": time.time(), "records": records}
+        return dict(records)
+
+    def update(self, resource_group, zone, name, ips):
+        with self._lock:
+            entry = self._zones.get(self._key(resource_group, zone))
+            if entry is None:
+                return
+            if ips is None:
+                entry["records"].pop(name.lower(), None)
+            else:
+                entry["records"][name.lower()] = sorted(ips)
+
+    def invalidate(self, resource_group, zone):
+        with self._lock:
+            self._zones.pop(self._key(resource_group, zone), None)
+
+
+index = ZoneIndex()
+
+
+def _records_or_none(dns_client, resource_group, zone):
+    try:
+        return index.records(dns_client, resource_group, zone)
+    except Exception as e:
+        logging.warning(f"DNS zone index for {zone} unavailable: {e}")
+        return None
+
+
+def set_records(dns_client, resource_group, zone, names, ip, ttl=RECORD_TTL):
+    """Point every name at ip, concurrently; names already pointing there are skipped.
+
+    Returns the names written. Raises if any write fails.
+    """
+    current = _records_or_none(dns_client, resource_group, zone) or {}
+    pending = [name or '@' for name in names if current.get((name or '@').lower()) != [ip]]
+
+    def write(name):
+        dns_client.record_sets.create_or_update(
+            resource_group, zone, name, 'A',
+            RecordSet(ttl=ttl, a_records=[{'ipv4_address': ip}], metadata={OWNER_METADATA_KEY: OWNER})
+        )
+        index.update(resource_group, zone, name, [ip])
+        return name
+
+    return list(_executor.map(write, pending))
+
+
+def delete_records(dns_client, resource_group, zone, names):
+    """Delete the names that exist, concurrently; returns a response_log style list"""
+    current = _records_or_none(dns_client, resource_group, zone)
+    pending = []
+    for name in dict.fromkeys(name or '@' for name in names):
+        if current is None or name.lower() in current:
+            pending.append(name)
+
+    def delete(name):
+        try:
+            dns_client.record_sets.delete(resource_group, zone, name, 'A')
+            index.update(resource_group, zone, name, None)
+            return {"success": f"Deleted DNS A record '{name}' in zone '{zone}'."}
+        except Exception as e:
+            return {"warning": f"Failed to delete DNS A record '{name}' in zone '{zone}': {str(e)}"}
+
+    return list(_executor.map(delete, pending))
+
+
+def owned(record_set):
+    """Whether a record set was written by this service (see set_records)"""
+    return (record_set.metadata or {}).get(OWNER_METADATA_KEY) == OWNER
+
+
+def reconcile(dns_client, network_client, resource_group, zone):
+    """Remove per-VM A records whose IPs no public IP of the resource group owns.
+
+    Only names matching MANAGED_RECORD and carrying our owner metadata are
+    considered, and at most RECONCILE_MAX_DELETES are removed per run. Each
+    candidate is re-read before it is deleted, and the delete is conditional
+    on that read (if_match), so a record another worker just rewrote is kept.
+    Returns the names removed.
+    """
+    records = index.records(dns_client, resource_group, zone, refresh=True)
+    assigned = {ip.ip_address for ip in network_client.public_ip_addresses.list(resource_group) if ip.ip_address}
+    candidates = sorted(
+        name for name, ips in records.items()
+        if MANAGED_RECORD.match(name) and ips and not assigned.intersection(ips)
+    )
+    removed = []
+    for name in candidates:
+        if len(removed) >= RECONCILE_MAX_DELETES:
+            logging.warning(f"DNS reconcile {zone}: {len(candidates)} candidates, stopped after {RECONCILE_MAX_DELETES} deletes")
+            break
+        try:
+            record_set = dns_client.record_sets.get(resource_group, zone, name, 'A')
+        except Exception:
+            index.update(resource_group, zone, name, None)
+            continue
+        ips = [a.ipv4_address for a in (record_set.a_records or [])]
+        if not owned(record_set) or not ips or assigned.intersection(ips):
+            continue
+        try:
+            dns_client.record_sets.delete(resource_group, zone, name, 'A', if_match=record_set.etag)
+        except Exception as e:
+            logging.warning(f"Failed to delete DNS A record '{name}' in zone '{zone}': {str(e)}")
+            index.invalidate(resource_group, zone)
+            continue
+        index.update(resource_group, zone, name, None)
+        removed.append(name)
+    if removed:
+        logging.info(f"DNS reconcile {zone}: removed {', '.join(removed)}")
+    return removed
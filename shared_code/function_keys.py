@@ -0,0 +1,102 @@
+import concurrent.futures
+import logging
+import os
+import threading
+
+from . import arm_throttle, bootstrap
+from .cache import TTLCache
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+WebSiteManagementClient = bootstrap.lazy('azure.mgmt.web', 'WebSiteManagementClient')
+
+# Function key maps are served from memory for this long; refresh=True or invalidate() drops them after a rotation
+TTL_SECONDS = int(os.environ.get('FUNCTION_KEYS_TTL_SECONDS', 300))
+# Functions whose keys are listed at the same time by a batch lookup
+MAX_PARALLEL = int(os.environ.get('FUNCTION_KEYS_MAX_PARALLEL', 8))
+
+_cache = TTLCache(TTL_SECONDS)
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL, thread_name_prefix='function-keys')
+_credential = None
+_credential_lock = threading.Lock()
+
+
+def _key(resource_group, app_name, function_name):
+    return (resource_group.lower(), app_name.lower(), function_name.lower())
+
+
+def _client():
+    """A web client on the worker's credential, so its token is reused across requests.
+
+    The client itself is cheap and built per lookup, which charges its calls to
+    the invocation (see arm_throttle.client_kwargs).
+    """
+    global _credential
+    with _credential_lock:
+        if _credential is None:
+            _credential = ClientSecretCredential(
+                client_id=os.environ['AZURE_APP_CLIENT_ID'],
+                client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+                tenant_id=os.environ['AZURE_TENANT_ID']
+            )
+        credential = _credential
+    return WebSiteManagementClient(credential, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs())
+
+
+def _list_keys(client, resource_group, app_name, function_name):
+    keys = client.web_apps.list_function_keys(resource_group, app_name, function_name)
+    # keys is a dict-like object, get keys as dict
+    if not keys:
+        return {}
+    if hasattr(keys, 'additional_properties'):
+        return dict(keys.additional_properties)
+    return dict(keys)
+
+
+def get(resource_group, app_name, function_name, refresh=False):
+    """{key name: key value} of one function (cached). Errors from ARM are raised."""
+    keys = get_many(resource_group, app_name, [function_name], refresh)[function_name]
+    if isinstance(keys, Exception):
+        raise keys
+    return keys
+
+
+def get_many(resource_group, app_name, function_names, refresh=False):
+    """{function name: {key name: key value}} for several functions of one app.
+
+    Cached functions are answered from memory; the rest are listed
+    concurrently, at most MAX_PARALLEL at a time, over one client. A function
+    whose keys could not be listed maps to the exception instead. The returned
+    dicts are shared between callers; do not modify them.
+    """
+    results = {}
+    missing = []
+    for function_name in dict.fromkeys(function_names):
+        keys = None if refresh else _cache.get(_key(resource_group, app_name, function_name))
+        if keys is None:
+            missing.append(function_name)
+        else:
+            results[function_name] = keys
+    if not missing:
+        return results
+
+    client = _client()
+
+    def load(function_name):
+        try:
+            keys = _list_keys(client, resource_group, app_name, function_name)
+        except Exception as e:
+            logging.warning(f"Listing keys of function '{function_name}' failed: {e}")
+            return e
+        return _cache.set(_key(resource_group, app_name, function_name), keys)
+
+    loaded = [load(missing[0])] if len(missing) == 1 else _executor.map(load, missing)
+    results.update(zip(missing, loaded))
+    return results
+
+
+def invalidate(resource_group=None, app_name=None, function_name=None):
+    """Forget one function's keys (e.g. after rotating them), or every cached key map"""
+    if resource_group and app_name and function_name:
+        _cache.invalidate(_key(resource_group, app_name, function_name))
+    else:
+        _cache.invalidate()
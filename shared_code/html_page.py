@@ -0,0 +1,118 @@
+import html
+import json
+import os
+
+# Rows per page on the HTML dashboards; longer lists are paged in the browser (0 shows every row)
+PAGE_SIZE = int(os.environ.get('HTML_PAGE_SIZE', '100'))
+
+# Lists marked with paged() get Previous/Next controls once they have more than PAGE_SIZE rows.
+# All rows are in the document; the browser only lays out the current page.
+_PAGER_STYLE = """
+        [data-page-size] > [hidden] { display: none !important; }
+        .pager { display: flex; align-items: center; justify-content: center; gap: 12px; margin: 15px 0; }
+        .pager button { background-color: #0078d4; color: white; border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; }
+        .pager button:disabled { background-color: #c8c8c8; cursor: default; }
+"""
+
+_PAGER_SCRIPT = """
+    <script>
+        document.querySelectorAll('[data-page-size]').forEach(function (list) {
+            var size = parseInt(list.getAttribute('data-page-size'), 10);
+            var rows = Array.prototype.slice.call(list.children);
+            if (!size || rows.length <= size) return;
+            var pages = Math.ceil(rows.length / size), page = 0;
+            var nav = document.createElement('div'), prev = document.createElement('button'),
+                next = document.createElement('button'), label = document.createElement('span');
+            nav.className = 'pager';
+            prev.textContent = '\\u2039 Previous';
+            next.textContent = 'Next \\u203a';
+            function show(p) {
+                page = Math.max(0, Math.min(pages - 1, p));
+                rows.forEach(function (row, i) { row.hidden = Math.floor(i / size) !== page; });
+                label.textContent = 'Page ' + (page + 1) + ' of ' + pages + ' (' + rows.length + ' items)';
+                prev.disabled = page === 0;
+                next.disabled = page === pages - 1;
+            }
+            prev.onclick = function () { show(page - 1); window.scrollTo(0, 0); };
+            next.onclick = function () { show(page + 1); window.scrollTo(0, 0); };
+            nav.appendChild(prev);
+            nav.appendChild(label);
+            nav.appendChild(next);
+            list.parentNode.insertBefore(nav, list.nextSibling);
+            show(0);
+        });
+    </script>
+"""
+
+
+def escape(value):
+    """Text or attribute value, HTML-escaped"""
+    value = str(value)
+    # Most names and sizes need no escaping; skip html.escape's five replaces for them
+    if '&' in value or '<' in value or '>' in value or '"' in value or "'" in value:
+        return html.escape(value, quote=True)
+    return value
+
+
+def js(value):
+    """A JavaScript string literal for an inline handler, e.g. onclick="alert({js(name)})" """
+    value = str(value)
+    if value.isascii() and value.isprintable() and '\\' not in value and '"' not in value:
+        # What json.dumps would produce, without its overhead on every row
+        return '&quot;' + escape(value) + '&quot;'
+    return escape(json.dumps(value))
+
+
+def paged(page_size=None):
+    """Attribute marking a list element whose children are paged in the browser"""
+    return f' data-page-size="{PAGE_SIZE if page_size is None else page_size}"'
+
+
+class Page:
+    """Static shell of a dashboard page: doctype, <head> with the stylesheet, and the closing tags.
+
+    It is assembled once per process when the function module is imported.
+    render() joins it with the body chunks in one go, so building a page is
+    linear in its size. Chunks are strings or iterables of strings, e.g. a
+    generator yielding one row at a time. Only the title varies per request.
+    """
+
+    def __init__(self, title, style, pager=False, lang='en'):
+        self.title = title
+        self._before_title = (
+            f'<!DOCTYPE html>\n<html lang="{lang}">\n<head>\n'
+            '    <meta charset="UTF-8">\n'
+            '    <meta name="viewport" content="width=device-width, initial-scale=1.0">\n'
+            '    <title>'
+        )
+        self._after_title = (
+            f'</title>\n    <style>{style}{_PAGER_STYLE if pager else ""}    </style>\n</head>\n<body>\n'
+        )
+        self._tail = f'{_PAGER_SCRIPT if pager else ""}</body>\n</html>\n'
+        self._default_head = self._before_title + escape(title) + self._after_title
+
+    def render(self, *chunks, title=None):
+        head = self._default_head if title is None else self._before_title + escape(title) + self._after_title
+        parts = [head]
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                parts.append(chunk)
+            else:
+                parts.extend(chunk)
+        parts.append(self._tail)
+        return ''.join(parts)
+
+
+_ERROR_PAGE = Page('Error', """
+        body { font-family: 'Segoe UI', sans-serif; padding: 20px; }
+        .error { color: #d13438; background: #fdf2f2; padding: 15px; border-radius: 4px; }
+""")
+
+
+def error(heading, *paragraphs):
+    """The small error page the HTML endpoints return instead of JSON"""
+    return _ERROR_PAGE.render(
+        f'    <div class="error">\n        <h2>{escape(heading)}</h2>\n',
+        (f'        <p>{escape(text)}</p>\n' for text in paragraphs),
+        '    </div>\n',
+    )
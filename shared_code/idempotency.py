@@ -0,0 +1,368 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import azure.functions as func
+from azure.core.pipeline.policies import HTTPPolicy
+
+# Completed jobs are replayed to retries for this long
+RETENTION_SECONDS = int(os.environ.get('IDEMPOTENCY_RETENTION_SECONDS', 3600))
+# How long a duplicate waits for the original request to hand out its status_url
+ATTACH_TIMEOUT_SECONDS = 60
+# How long a delete waits for a cancelled provision to unwind
+CANCEL_TIMEOUT_SECONDS = float(os.environ.get('IDEMPOTENCY_CANCEL_TIMEOUT_SECONDS', 120))
+
+STARTING = 'starting'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Fields that never change what a request does
+IGNORED_FIELDS = ('idempotency_key',)
+
+_current = contextvars.ContextVar('idempotency_entry', default=None)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def derive_key(operation, vm_name, resource_group, payload):
+    """operation + resource_group/vm_name + hash of the canonical payload"""
+    canonical = json.dumps(
+        {k: v for k, v in payload.items() if k not in IGNORED_FIELDS},
+        sort_keys=True, default=str
+    )
+    digest = hashlib.sha256(canonical.encode()).hexdigest()[:32]
+    return f"{operation}:{resource_group.lower()}/{vm_name.lower()}:{digest}"
+
+
+class _Entry:
+    def __init__(self, key, operation, resource_group, vm_name):
+        self.key = key
+        self.operation = operation
+        self.resource_group = resource_group
+        self.vm_name = vm_name
+        self.state = STARTING
+        self.response = None       # body of the 202 handed to the first caller
+        self.last_status = None    # last status_data posted for this job
+        self.task = None
+        self.ready = asyncio.Event()
+        self.created_at = time.time()
+        self.finished_at = None
+        # Set when the job is cancelled; read by CancellationPolicy in executor threads
+        self.stop = threading.Event()
+        self.inflight = 0          # ARM requests of this job on the wire
+        self.lock = threading.Lock()
+
+
+class IdempotencyRegistry:
+    """In-flight and recently completed jobs of this worker, by idempotency key.
+
+    Only one job per (resource_group, vm_name) is active at a time. Everything
+    runs on the worker's event loop, so no locking is needed.
+    """
+
+    def __init__(self, retention=RETENTION_SECONDS):
+        self.retention = retention
+        self._entries = {}   # key -> _Entry
+        self._active = {}    # (resource_group, vm_name) -> _Entry
+
+    @staticmethod
+    def _vm(resource_group, vm_name):
+        return (resource_group.lower(), vm_name.lower())
+
+    def _purge(self):
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if entry.finished_at and now - entry.finished_at > self.retention:
+                del self._entries[key]
+
+    def get(self, key):
+        self._purge()
+        return self._entries.get(key)
+
+    def active(self, resource_group, vm_name):
+        return self._active.get(self._vm(resource_group, vm_name))
+
+    def claim(self, key, operation, resource_group, vm_name):
+        """Register a new job, or return None if the VM already has an active one"""
+        vm = self._vm(resource_group, vm_name)
+        if vm in self._active:
+            return None
+        # A new job changes the VM (create -> delete -> create), so results of
+        # earlier jobs on it must not be replayed any more
+        for old_key, old in list(self._entries.items()):
+            if self._vm(old.resource_group, old.vm_name) == vm:
+                del self._entries[old_key]
+        entry = _Entry(key, operation, resource_group, vm_name)
+        self._entries[key] = entry
+        self._active[vm] = entry
+        return entry
+
+    def accept(self, entry, response):
+        """The handler answered 202: the job exists and duplicates may attach to it"""
+        if entry.state == STARTING:
+            entry.state = RUNNING
+        entry.response = response
+        entry.ready.set()
+
+    def release(self, entry):
+        """The handler did not start a job: forget the claim so a retry starts afresh"""
+        self._entries.pop(entry.key, None)
+        if self._active.get(self._vm(entry.resource_group, entry.vm_name)) is entry:
+            del self._active[self._vm(entry.resource_group, entry.vm_name)]
+        entry.ready.set()
+
+    def finish(self, entry, state):
+        if state == CANCELLED:
+            entry.stop.set()
+        entry.state = state
+        entry.finished_at = time.time()
+        if self._active.get(self._vm(entry.resource_group, entry.vm_name)) is entry:
+            del self._active[self._vm(entry.resource_group, entry.vm_name)]
+        # Only successful jobs are replayed; a retry after a failure runs again
+        if state != COMPLETED:
+            self._entries.pop(entry.key, None)
+        entry.ready.set()
+
+    def record_status(self, status_data):
+        """Remember the latest status posted for the VM's active job"""
+        vm_name = status_data.get("vm_name")
+        resource_group = status_data.get("resource_group")
+        if vm_name and resource_group:
+            entry = self.active(resource_group, vm_name)
+            if entry:
+                entry.last_status = status_data
+
+    async def cancel(self, resource_group, vm_name):
+        """Cancel the VM's active job and wait for it to unwind. Returns the cancelled operation or None."""
+        entry = self.active(resource_group, vm_name)
+        if entry is None:
+            return None
+        logging.info(f"Cancelling in-flight {entry.operation} of {resource_group}/{vm_name}")
+        deadline = time.monotonic() + CANCEL_TIMEOUT_SECONDS
+        task = entry.task
+        self.finish(entry, CANCELLED)
+        if task and not task.done():
+            task.cancel()
+            done, _ = await asyncio.wait({task}, timeout=CANCEL_TIMEOUT_SECONDS)
+            if not done:
+                logging.warning(f"{entry.operation} of {resource_group}/{vm_name} did not stop within {CANCEL_TIMEOUT_SECONDS}s")
+        # Cancelling the task does not stop SDK calls already running in executor threads.
+        # CancellationPolicy refuses their next request; wait for the ones on the wire.
+        while entry.inflight and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if entry.inflight:
+            logging.warning(f"{entry.inflight} ARM request(s) of the cancelled {entry.operation} of {resource_group}/{vm_name} still running")
+        return entry.operation
+
+    async def cancel_all(self, resource_group, operations, vm_names=None):
+        """Cancel every active job of `operations` in a resource group (only those of
+        vm_names, if given) and wait for them to unwind. Returns the cancelled VM names."""
+        wanted = {name.lower() for name in vm_names} if vm_names else None
+        targets = [
+            entry for (group, vm), entry in list(self._active.items())
+            if group == resource_group.lower() and entry.operation in operations and (wanted is None or vm in wanted)
+        ]
+        await asyncio.gather(*(self.cancel(entry.resource_group, entry.vm_name) for entry in targets))
+        return [entry.vm_name for entry in targets]
+
+    def stats(self):
+        self._purge()
+        states = {}
+        for entry in self._entries.values():
+            states[entry.state] = states.get(entry.state, 0) + 1
+        return {"active": len(self._active), "retained": len(self._entries), "states": states}
+
+
+registry = IdempotencyRegistry()
+
+
+class CancellationPolicy(HTTPPolicy):
+    """Per-retry policy that fails every ARM request of a cancelled job.
+
+    SDK calls (including LRO polling in poller.result()) run in executor
+    threads that task.cancel() cannot reach; this stops them at their next
+    request and counts the requests still on the wire for cancel().
+    """
+
+    def __init__(self, entry):
+        super().__init__()
+        self.entry = entry
+
+    def send(self, request):
+        entry = self.entry
+        with entry.lock:
+            if entry.stop.is_set():
+                raise JobCancelled(f"{entry.operation} of {entry.resource_group}/{entry.vm_name} was cancelled")
+            entry.inflight += 1
+        try:
+            return self.next.send(request)
+        finally:
+            with entry.lock:
+                entry.inflight -= 1
+
+
+def policy():
+    """CancellationPolicy for clients created by the current request's job, or None outside one"""
+    entry = _current.get()
+    return CancellationPolicy(entry) if entry is not None else None
+
+
+def bind(run):
+    """Tie a zero-argument coroutine function to the job of the current request.
+
+    Use it for work started later (e.g. from the admission queue): a job
+    cancelled while it waits never starts.
+    """
+    entry = _current.get()
+
+    async def runner():
+        if entry is None:
+            return await run()
+        if entry.state == CANCELLED:
+            logging.info(f"Skipping cancelled {entry.operation} of {entry.resource_group}/{entry.vm_name}")
+            return None
+        entry.task = asyncio.current_task()
+        # Clients created by the job (e.g. when started from the admission queue) get its CancellationPolicy
+        token = _current.set(entry)
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            registry.finish(entry, CANCELLED)
+            raise
+        except Exception:
+            registry.finish(entry, FAILED)
+            raise
+        finally:
+            _current.reset(token)
+        status = (entry.last_status or {}).get("status")
+        registry.finish(entry, FAILED if status == FAILED else COMPLETED)
+        return result
+
+    return runner
+
+
+def start(coro):
+    """asyncio.create_task(coro) tracked as the current request's job"""
+    runner = bind(lambda: coro)
+
+    async def guarded():
+        try:
+            return await runner()
+        finally:
+            # No-op once it ran; avoids a "never awaited" warning if cancelled first
+            coro.close()
+
+    return asyncio.create_task(guarded())
+
+
+def _payload(req):
+    payload = dict(req.params)
+    try:
+        body = req.get_json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict):
+        payload.update(body)
+    return payload
+
+
+def _replay(entry):
+    body = dict(entry.response or {})
+    body.update({"duplicate": True, "state": entry.state})
+    if entry.state == COMPLETED:
+        body["result"] = entry.last_status
+        return func.HttpResponse(json.dumps(body), status_code=200, mimetype="application/json")
+    return func.HttpResponse(json.dumps(body), status_code=202, mimetype="application/json")
+
+
+def idempotent(operation, supersedes=()):
+    """Decorator for an HTTP main() that starts a job for one VM.
+
+    The key is the request's `idempotency_key` or one derived from vm_name,
+    resource_group and the payload. A repeated request attaches to the
+    running job (same status_url) or gets the completed job's result; a
+    different request for a VM with an active job gets 409, unless that job's
+    operation is in `supersedes`, in which case it is cancelled first.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(req: func.HttpRequest) -> func.HttpResponse:
+            payload = _payload(req)
+            vm_name = payload.get('vm_name')
+            resource_group = payload.get('resource_group')
+            if not isinstance(vm_name, str) or not isinstance(resource_group, str) or not vm_name or not resource_group:
+                # Let the handler report the missing parameters
+                return await handler(req)
+
+            client_key = payload.get('idempotency_key') or req.headers.get('Idempotency-Key')
+            if client_key:
+                key = f"{operation}:{resource_group.lower()}/{vm_name.lower()}:{client_key}"
+            else:
+                key = derive_key(operation, vm_name, resource_group, payload)
+
+            deadline = time.monotonic() + ATTACH_TIMEOUT_SECONDS
+            while True:
+                entry = registry.get(key)
+                if entry is not None:
+                    if entry.state != STARTING:
+                        logging.info(f"Duplicate {operation} request for {resource_group}/{vm_name}, replaying {entry.state} job")
+                        return _replay(entry)
+                    # The original request is still starting the job
+                    try:
+                        await asyncio.wait_for(entry.ready.wait(), max(0.0, deadline - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        return func.HttpResponse(
+                            json.dumps({"error": f"A matching {operation} request for '{vm_name}' is still starting, retry later"}),
+                            status_code=409,
+                            mimetype="application/json"
+                        )
+                    continue
+
+                active = registry.active(resource_group, vm_name)
+                if active is not None:
+                    if active.operation in supersedes:
+                        await registry.cancel(resource_group, vm_name)
+                        continue
+                    return func.HttpResponse(
+                        json.dumps({
+                            "error": f"A different {active.operation} is already in progress for '{vm_name}'",
+                            "status_url": (active.response or {}).get("status_url", ""),
+                            "state": active.state
+                        }),
+                        status_code=409,
+                        mimetype="application/json"
+                    )
+                break
+
+            entry = registry.claim(key, operation, resource_group, vm_name)
+            token = _current.set(entry)
+            try:
+                response = await handler(req)
+            except BaseException:
+                registry.release(entry)
+                raise
+            finally:
+                _current.reset(token)
+
+            if response.status_code == 202:
+                try:
+                    body = json.loads(response.get_body() or b'{}')
+                except ValueError:
+                    body = {}
+                registry.accept(entry, body)
+            else:
+                registry.release(entry)
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,122 @@
+import concurrent.futures
+import logging
+import os
+
+from .cache import TTLCache
+from .preflight import invalidate_image, version_key
+from .sku_catalog import normalize_location
+
+# Gallery listings are served from memory for this long; clone_vm invalidates on publish
+TTL_SECONDS = int(os.environ.get('IMAGE_CATALOG_TTL_SECONDS', 300))
+# Image definitions whose versions are fetched at the same time
+MAX_PARALLEL = int(os.environ.get('IMAGE_CATALOG_MAX_PARALLEL', 8))
+
+_cache = TTLCache(TTL_SECONDS)
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL, thread_name_prefix='gallery')
+
+
+def _key(gallery_resource_group, gallery_name):
+    return (gallery_resource_group.lower(), gallery_name.lower())
+
+
+def _enum(value):
+    return value.value if hasattr(value, 'value') else value
+
+
+def version_info(version):
+    """JSON-serialisable summary of a GalleryImageVersion, with its sort key parsed once"""
+    profile = version.publishing_profile
+    return {
+        "name": version.name,
+        "location": version.location,
+        "key": list(version_key(version.name)),
+        "provisioning_state": _enum(version.provisioning_state),
+        "published_date": profile.published_date.isoformat() if profile and profile.published_date else None,
+        "exclude_from_latest": bool(profile and profile.exclude_from_latest),
+        "target_regions": [
+            normalize_location(region.name) for region in (profile.target_regions or [])
+        ] if profile else []
+    }
+
+
+def replication_status(version):
+    """{"aggregated_state", "regions": [{"region", "state", "progress", "details"}]}"""
+    status = version.replication_status
+    if status is None:
+        return None
+    return {
+        "aggregated_state": _enum(status.aggregated_state),
+        "regions": [
+            {
+                "region": normalize_location(region.region),
+                "state": _enum(region.state),
+                "progress": region.progress,
+                "details": region.details
+            }
+            for region in (status.summary or [])
+        ]
+    }
+
+
+def _image_entry(compute_client, gallery_resource_group, gallery_name, image_def):
+    versions = [
+        version_info(v) for v in compute_client.gallery_image_versions.list_by_gallery_image(
+            gallery_resource_group, gallery_name, image_def.name
+        )
+        if isinstance(v.name, str) and v.name.strip()
+    ]
+    versions.sort(key=lambda v: v["key"])
+
+    candidates = [v for v in versions if not v["exclude_from_latest"]] or versions
+    latest = candidates[-1]["name"] if candidates else None
+
+    # Per-region replication is only returned by a GET with $expand, so only for the latest version
+    replication = None
+    if latest:
+        try:
+            replication = replication_status(compute_client.gallery_image_versions.get(
+                gallery_resource_group, gallery_name, image_def.name, latest, expand='ReplicationStatus'
+            ))
+        except Exception as e:
+            logging.warning(f"Replication status of {image_def.name} {latest} unavailable: {e}")
+
+    return {
+        "image_definition_name": image_def.name,
+        "version": latest or "",
+        "gallery_resource_group": gallery_resource_group,
+        "gallery_name": gallery_name,
+        "os_type": _enum(image_def.os_type),
+        "hyper_v_generation": _enum(image_def.hyper_v_generation),
+        "replication": replication,
+        "versions": versions
+    }
+
+
+def gallery_images(compute_client, gallery_resource_group, gallery_name, refresh=False):
+    """Image definitions of a gallery with their versions (cached).
+
+    Versions of all definitions are listed concurrently, at most MAX_PARALLEL
+    at a time. The returned list is shared between callers; do not modify it.
+    """
+    key = _key(gallery_resource_group, gallery_name)
+
+    def load():
+        image_definitions = list(compute_client.gallery_images.list_by_gallery(gallery_resource_group, gallery_name))
+        return list(_executor.map(
+            lambda image_def: _image_entry(compute_client, gallery_resource_group, gallery_name, image_def),
+            image_definitions
+        ))
+
+    if refresh:
+        return _cache.set(key, load())
+    return _cache.get_or_load(key, load)
+
+
+def invalidate(gallery_resource_group=None, gallery_name=None, image_name=None):
+    """Forget a gallery's listing (e.g. after clone_vm published a version), or every gallery"""
+    if gallery_resource_group and gallery_name:
+        _cache.invalidate(_key(gallery_resource_group, gallery_name))
+        if image_name:
+            invalidate_image(gallery_resource_group, gallery_name, image_name)
+    else:
+        _cache.invalidate()
@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+import weakref
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from . import bootstrap
+
+aiosmtplib = bootstrap.lazy_module('aiosmtplib')
+
+logger = logging.getLogger(__name__)
+
+# SMTP connections kept open per server; also how many emails go out at once
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', '2'))
+# Seconds an unused connection stays open before it is closed
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', '60'))
+# Seconds allowed for connecting and for each SMTP command
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+# Delivery attempts per email; only temporary failures (network, 4xx replies) are retried
+SMTP_SEND_ATTEMPTS = int(os.environ.get('SMTP_SEND_ATTEMPTS', '4'))
+# Seconds before the first retry, doubled after every failed attempt
+SMTP_RETRY_DELAY = float(os.environ.get('SMTP_RETRY_DELAY', '5'))
+# Seconds the queue waits for more emails before sending, so bursts (fleet members) go out together
+SMTP_BATCH_WINDOW = float(os.environ.get('SMTP_BATCH_WINDOW', '0.2'))
+
+_mailers = weakref.WeakKeyDictionary()
+_mailers_lock = threading.Lock()
+
+
+def _message(sender, recipients, subject, html):
+    """The MIME text of an HTML email"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = ', '.join(recipients)
+    msg.attach(MIMEText(html, 'html'))
+    return msg.as_string()
+
+
+def _temporary(error):
+    """Whether a failed delivery is worth another attempt"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return error.code < 500
+    return True
+
+
+class _Email:
+    __slots__ = ('server', 'sender', 'recipients', 'subject', 'html', 'attempt', 'futures', 'message')
+
+    def __init__(self, server, sender, recipients, subject, html, future):
+        self.server = server
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.subject = subject
+        self.html = html
+        self.attempt = 0
+        self.futures = [future]
+        # Encoded on the first attempt and reused by retries; it goes away with
+        # the email, since the HTML may hold credentials
+        self.message = None
+
+    @property
+    def content(self):
+        return (self.server, self.sender, tuple(self.recipients), self.subject, self.html)
+
+    def resolve(self, error=None):
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(True)
+            else:
+                future.set_exception(error)
+
+
+def _coalesce(batch):
+    """Merge repeats of the same email (same server, sender, recipients, subject and body) into one.
+
+    Emails to different recipients are never merged: each recipient list gets
+    its own message, so nobody sees the addresses of another request.
+    """
+    merged = {}
+    for email in batch:
+        same = merged.get(email.content)
+        if same is None:
+            merged[email.content] = email
+            continue
+        same.futures.extend(email.futures)
+        same.attempt = min(same.attempt, email.attempt)
+    return list(merged.values())
+
+
+class _Pool:
+    """Logged-in SMTP connections to one server, reused across emails"""
+
+    def __init__(self, host, port, user, password, use_tls):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self._idle = []                 # (client, last used)
+        self._slots = asyncio.Semaphore(max(SMTP_POOL_SIZE, 1))
+
+    async def _connect(self):
+        client = aiosmtplib.SMTP(hostname=self.host, port=self.port, start_tls=self.use_tls, timeout=SMTP_TIMEOUT)
+        await client.connect()
+        try:
+            if self.user:
+                await client.login(self.user, self.password)
+        except Exception:
+            client.close()
+            raise
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return client
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        async with self._slots:
+            client = None
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if candidate.is_connected and time.monotonic() - last_used < SMTP_IDLE_TIMEOUT:
+                    client = candidate
+                    break
+                candidate.close()
+            if client is None:
+                client = await self._connect()
+            try:
+                yield client
+            except BaseException:
+                # The session may be mid-transaction or the server may have dropped it
+                client.close()
+                raise
+            self._idle.append((client, time.monotonic()))
+
+    def close_idle(self):
+        for client, _ in self._idle:
+            client.close()
+        self._idle = []
+
+
+class Mailer:
+    """Background delivery of HTML emails for one event loop.
+
+    send() only queues the email. A worker task takes what arrived within
+    SMTP_BATCH_WINDOW, drops repeats of the same email, and sends the rest
+    over pooled connections (no connect, STARTTLS and login per email),
+    one message per recipient list. Temporary failures are retried with
+    backoff without holding up the rest of the queue. Connections are per
+    loop because asyncio streams cannot move between loops.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._pools = {}
+        self._pending = set()
+        self._worker = None
+
+    def send(self, smtp_host, smtp_port, smtp_user, smtp_password, sender_email, recipient_emails, subject,
+             html_content, use_tls=True):
+        recipients = [r for r in recipient_emails if r]
+        if not smtp_host or not sender_email or not recipients:
+            raise ValueError("SMTP host, sender and at least one recipient are required to send an email")
+        future = self._loop.create_future()
+        future.add_done_callback(self._pending.discard)
+        self._pending.add(future)
+        server = (smtp_host, int(smtp_port), smtp_user, smtp_password, bool(use_tls))
+        self._queue.put_nowait(_Email(server, sender_email, recipients, subject, html_content, future))
+        if self._worker is None or self._worker.done():
+            self._worker = self._loop.create_task(self._run())
+        return future
+
+    async def flush(self):
+        """Wait until everything queued so far is delivered or given up"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            idle = any(pool._idle for pool in self._pools.values())
+            try:
+                first = await asyncio.wait_for(self._queue.get(), SMTP_IDLE_TIMEOUT if idle else None)
+            except asyncio.TimeoutError:
+                for pool in self._pools.values():
+                    pool.close_idle()
+                continue
+            if SMTP_BATCH_WINDOW > 0:
+                await asyncio.sleep(SMTP_BATCH_WINDOW)
+            batch = [first]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await asyncio.gather(*(self._deliver(email) for email in _coalesce(batch)))
+
+    async def _deliver(self, email):
+        pool = self._pools.get(email.server)
+        if pool is None:
+            pool = self._pools[email.server] = _Pool(*email.server)
+        try:
+            if email.message is None:
+                email.message = _message(email.sender, email.recipients, email.subject, email.html)
+            async with pool.connection() as client:
+                await client.sendmail(email.sender, email.recipients, email.message)
+        except Exception as e:
+            email.attempt += 1
+            if email.attempt >= SMTP_SEND_ATTEMPTS or not _temporary(e):
+                logger.error(f"Giving up on email '{email.subject}' to {', '.join(email.recipients)} "
+                             f"after {email.attempt} attempt(s): {e}")
+                email.resolve(e)
+                return
+            delay = SMTP_RETRY_DELAY * 2 ** (email.attempt - 1)
+            logger.warning(f"Email '{email.subject}' failed ({e}), retrying in {delay:.0f}s")
+            self._loop.call_later(delay, self._queue.put_nowait, email)
+            return
+        logger.info(f"Sent email '{email.subject}' to {', '.join(email.recipients)}")
+        email.resolve()
+
+
+def _mailer():
+    loop = asyncio.get_running_loop()
+    with _mailers_lock:
+        mailer = _mailers.get(loop)
+        if mailer is None:
+            mailer = _mailers[loop] = Mailer(loop)
+    return mailer
+
+
+def _log_failure(future):
+    # Nobody waits on a fire-and-forget email; retrieve its error so asyncio does not warn about it
+    if not future.cancelled():
+        future.exception()
+
+
+def send(smtp_host, smtp_port, smtp_user, smtp_password, sender_email, recipient_emails, subject, html_content,
+         use_tls=True):
+    """Queue an HTML email on this event loop's mailer.
+
+    Returns a future that resolves to True once the email is delivered, or
+    raises the last SMTP error when it is given up. Must be called from a
+    coroutine. Missing settings raise ValueError right away.
+    """
+    future = _mailer().send(smtp_host, smtp_port, smtp_user, smtp_password, sender_email, recipient_emails,
+                            subject, html_content, use_tls)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+async def flush():
+    """Wait for the emails queued on this event loop, e.g. before a script's loop closes"""
+    await _mailer().flush()
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+from . import preflight, sku_catalog
+from .sku_catalog import normalize_location
+
+# Allocation outcomes older than this no longer affect placement
+FAILURE_WINDOW_SECONDS = int(os.environ.get('PLACEMENT_FAILURE_WINDOW_SECONDS', 3600))
+# How much one unit of failure rate costs compared to one unit of free quota share
+FAILURE_PENALTY = float(os.environ.get('PLACEMENT_FAILURE_PENALTY', 2.0))
+# Score given up per step down the caller's preference order
+PREFERENCE_PENALTY = float(os.environ.get('PLACEMENT_PREFERENCE_PENALTY', 0.05))
+
+_outcomes = {}  # (location, vm_size) -> [(monotonic time, succeeded)]
+_outcomes_lock = threading.Lock()
+
+
+def record_allocation(location, vm_size, succeeded):
+    """Remember whether a VM create in location/vm_size went through"""
+    key = (normalize_location(location), vm_size)
+    with _outcomes_lock:
+        _outcomes.setdefault(key, []).append((time.monotonic(), bool(succeeded)))
+
+
+def failure_rate(location, vm_size):
+    """Share of failed allocations for location/vm_size within the failure window"""
+    key = (normalize_location(location), vm_size)
+    cutoff = time.monotonic() - FAILURE_WINDOW_SECONDS
+    with _outcomes_lock:
+        recent = [o for o in _outcomes.get(key, []) if o[0] >= cutoff]
+        _outcomes[key] = recent
+    if not recent:
+        return 0.0
+    return sum(1 for _, ok in recent if not ok) / len(recent)
+
+
+def _quota_share(result):
+    """Smallest share of quota left after the request across the quota checks"""
+    shares = [c["available"] / c["limit"] for c in result["checks"]
+              if c["check"].startswith("quota_") and c.get("limit")]
+    return min(shares) if shares else 0.5
+
+
+def choose_placement(compute_client, locations, vm_sizes, image=None, vm_count=1):
+    """Pick the best (location, vm_size) for a request out of the acceptable ones.
+
+    Every combination goes through the cached preflight checks (quota, SKU
+    restrictions, image replicas). Candidates that pass are ranked by how much
+    quota they leave, minus a penalty for recent allocation failures and a
+    small one for being further down the caller's preference order.
+    The winner's cores are reserved so a burst of requests spreads out.
+
+    Returns a decision dict; "passed" is False when no candidate is viable.
+    """
+    started = time.perf_counter()
+    candidates = []
+    preference = 0
+    for location in locations:
+        for vm_size in vm_sizes:
+            result = preflight.run_preflight(compute_client, location, vm_size, image=image, vm_count=vm_count)
+            rate = failure_rate(location, vm_size)
+            score = None
+            if result["passed"]:
+                score = round(_quota_share(result) - FAILURE_PENALTY * rate - PREFERENCE_PENALTY * preference, 4)
+            candidates.append({
+                "location": result["location"],
+                "vm_size": vm_size,
+                "passed": result["passed"],
+                "score": score,
+                "failure_rate": round(rate, 3),
+                "error": result["error"],
+                "result": result
+            })
+            preference += 1
+
+    viable = [c for c in candidates if c["passed"]]
+    requested = candidates[0] if candidates else None
+    decision = {
+        "passed": bool(viable),
+        "requested": {"location": requested["location"], "vm_size": requested["vm_size"]} if requested else None,
+        "candidates": [{k: v for k, v in c.items() if k != "result"} for c in candidates],
+        "duration_ms": None
+    }
+    if viable:
+        best = max(viable, key=lambda c: c["score"])
+        result = best["result"]
+        if result["vcpus"]:
+            preflight.reserve_cores(result["location"], result["family"], result["vcpus"] * vm_count)
+        decision.update({
+            "location": best["location"],
+            "vm_size": best["vm_size"],
+            "family": result["family"],
+            "score": best["score"],
+            "checks": result["checks"],
+            "error": None
+        })
+    else:
+        decision.update({
+            "location": requested["location"] if requested else None,
+            "vm_size": requested["vm_size"] if requested else None,
+            "family": requested["result"]["family"] if requested else None,
+            "checks": requested["result"]["checks"] if requested else [],
+            "error": requested["error"] if requested else "No candidate regions or sizes given"
+        })
+    decision["redirected"] = bool(requested) and (
+        decision["location"] != requested["location"] or decision["vm_size"] != requested["vm_size"]
+    )
+    decision["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return decision
+
+
+def expand_families(location, families, vm_size, **requirements):
+    """For each family, the catalog size closest in vCPUs to vm_size that meets the requirements"""
+    catalog = sku_catalog.get_catalog()
+    requested = catalog.get(location, vm_size)
+    sizes = []
+    for family in families:
+        matches = catalog.query(location, family=family, **requirements)
+        if not matches:
+            continue
+        if requested:
+            matches.sort(key=lambda i: (abs(i["vcpus"] - requested["vcpus"]), i["vcpus"]))
+        if matches[0]["name"] not in sizes:
+            sizes.append(matches[0]["name"])
+    return sizes
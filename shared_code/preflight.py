@@ -0,0 +1,204 @@
+import logging
+import os
+import threading
+import time
+
+from . import sku_catalog
+from .cache import TTLCache
+from .sku_catalog import normalize_location
+
+# Quota moves as VMs come and go, image metadata barely moves at all.
+# SKU data comes from the shared SKU catalog, which has its own refresh cycle.
+USAGE_TTL_SECONDS = int(os.environ.get('PREFLIGHT_USAGE_TTL_SECONDS', 60))
+IMAGE_TTL_SECONDS = int(os.environ.get('PREFLIGHT_IMAGE_TTL_SECONDS', 300))
+
+_usage_cache = TTLCache(USAGE_TTL_SECONDS)
+_image_cache = TTLCache(IMAGE_TTL_SECONDS)
+
+# Cores handed out by passed preflights that the cached usage does not show yet.
+# Entries are dropped once they are older than the usage cache TTL.
+_reservations = {}
+_reservations_lock = threading.Lock()
+
+
+def version_key(version_str):
+    """Parse '1.2.3' into (1, 2, 3) so versions sort numerically, not as strings"""
+    parts = []
+    for part in (version_str or '').split('.'):
+        digits = ''
+        for c in part:
+            if not c.isdigit():
+                break
+            digits += c
+        parts.append(int(digits) if digits else 0)
+    while len(parts) < 3:
+        parts.append(0)
+    return tuple(parts)
+
+
+# ====================== CACHED AZURE LOOKUPS ======================
+
+def get_usage(compute_client, location):
+    """Return {usage_name: {"current_value", "limit"}} for a region (cached)"""
+    location = normalize_location(location)
+
+    def load():
+        usage = {}
+        for item in compute_client.usage.list(location):
+            name = item.name.value if hasattr(item.name, 'value') else item.name
+            usage[name] = {"current_value": item.current_value, "limit": item.limit}
+        return usage
+
+    return _usage_cache.get_or_load(location, load)
+
+
+def get_skus(compute_client, location):
+    """Return {vm_size: sku_info} for the virtual machine SKUs of a region (cached)"""
+    return sku_catalog.get_catalog(compute_client).sizes(location)
+
+
+def get_image_version(compute_client, gallery_resource_group, gallery_name, image_name, image_version='latest'):
+    """Return {"name", "regions"} for a gallery image version (cached).
+
+    'latest' resolves to the highest version that is not excluded from latest.
+    Returns None when the image has no matching version.
+    """
+    key = (gallery_resource_group, gallery_name, image_name)
+
+    def load():
+        versions = {}
+        for version in compute_client.gallery_image_versions.list_by_gallery_image(
+            gallery_resource_group, gallery_name, image_name
+        ):
+            profile = version.publishing_profile
+            regions = {normalize_location(r.name) for r in (profile.target_regions or [])} if profile else set()
+            if not regions and version.location:
+                regions.add(normalize_location(version.location))
+            versions[version.name] = {
+                "name": version.name,
+                "regions": regions,
+                "exclude_from_latest": bool(profile and profile.exclude_from_latest)
+            }
+        return versions
+
+    versions = _image_cache.get_or_load(key, load)
+    if image_version and image_version.lower() != 'latest':
+        return versions.get(image_version)
+    candidates = [v for v in versions.values() if not v["exclude_from_latest"]] or list(versions.values())
+    if not candidates:
+        return None
+    return max(candidates, key=lambda v: version_key(v["name"]))
+
+
+def invalidate(location=None):
+    """Forget cached usage (e.g. after a quota increase or a failed allocation)"""
+    _usage_cache.invalidate(normalize_location(location) if location else None)
+
+
+def invalidate_image(gallery_resource_group, gallery_name, image_name):
+    """Forget cached versions of an image (e.g. after a new version was published)"""
+    _image_cache.invalidate((gallery_resource_group, gallery_name, image_name))
+
+
+# ====================== QUOTA RESERVATIONS ======================
+
+def reserve_cores(location, family, vcpus):
+    """Count cores of an accepted request against cached usage until it refreshes"""
+    now = time.monotonic()
+    with _reservations_lock:
+        for name in (family, 'cores'):
+            _reservations.setdefault((normalize_location(location), name), []).append((now, vcpus))
+
+
+def reserved_cores(location, name):
+    cutoff = time.monotonic() - USAGE_TTL_SECONDS
+    with _reservations_lock:
+        entries = [e for e in _reservations.get((normalize_location(location), name), []) if e[0] >= cutoff]
+        _reservations[(normalize_location(location), name)] = entries
+        return sum(vcpus for _, vcpus in entries)
+
+
+# ====================== PREFLIGHT ======================
+
+def _check(checks, name, passed, message, **extra):
+    checks.append({"check": name, "passed": passed, "message": message, **extra})
+    return passed
+
+
+def run_preflight(compute_client, location, vm_size, image=None, zone=None, vm_count=1):
+    """Check quota headroom, SKU availability and image replication for one region.
+
+    `image` is an optional dict with gallery_resource_group, gallery_name,
+    gallery_image_name and gallery_image_version. Checks that cannot be
+    evaluated (e.g. missing permissions) are reported as skipped and do not
+    block the request; ARM will still have the final word.
+    """
+    started = time.perf_counter()
+    location = normalize_location(location)
+    checks = []
+    sku = None
+
+    # SKU availability and restrictions
+    try:
+        sku = get_skus(compute_client, location).get(vm_size)
+        if sku is None:
+            _check(checks, "sku_available", False, f"{vm_size} is not offered in {location}")
+        elif sku["restricted"]:
+            _check(checks, "sku_restrictions", False,
+                   f"{vm_size} is restricted in {location}: {', '.join(sku['restriction_reasons']) or 'NotAvailableForSubscription'}")
+        elif zone and (str(zone) not in sku["zones"] or str(zone) in sku["restricted_zones"]):
+            _check(checks, "sku_restrictions", False, f"{vm_size} is not available in zone {zone} of {location}")
+        else:
+            _check(checks, "sku_restrictions", True, f"{vm_size} is not restricted in {location}")
+    except Exception as e:
+        logging.warning(f"Preflight SKU lookup failed for {location}: {e}")
+        checks.append({"check": "sku_available", "passed": True, "skipped": True, "message": str(e)})
+
+    # vCPU quota headroom (family and regional total)
+    if sku and sku["vcpus"]:
+        try:
+            usage = get_usage(compute_client, location)
+            needed = sku["vcpus"] * vm_count
+            for name, label in ((sku["family"], f"{sku['family']} vCPU quota"), ('cores', "Total regional vCPU quota")):
+                if name not in usage:
+                    continue
+                current = usage[name]["current_value"] + reserved_cores(location, name)
+                limit = usage[name]["limit"]
+                _check(checks, f"quota_{name}", current + needed <= limit,
+                       f"{label}: {current}/{limit} used, {needed} needed",
+                       available=limit - current - needed, limit=limit)
+        except Exception as e:
+            logging.warning(f"Preflight quota lookup failed for {location}: {e}")
+            checks.append({"check": "quota", "passed": True, "skipped": True, "message": str(e)})
+
+    # Gallery image replicated to the target region
+    if image:
+        try:
+            version = get_image_version(
+                compute_client,
+                image["gallery_resource_group"],
+                image["gallery_name"],
+                image["gallery_image_name"],
+                image.get("gallery_image_version") or 'latest'
+            )
+            if version is None:
+                _check(checks, "image_version", False,
+                       f"No version '{image.get('gallery_image_version') or 'latest'}' of image '{image['gallery_image_name']}'")
+            else:
+                _check(checks, "image_replication", location in version["regions"],
+                       f"Image version {version['name']} replicated to: {', '.join(sorted(version['regions'])) or 'none'}")
+        except Exception as e:
+            logging.warning(f"Preflight image lookup failed: {e}")
+            checks.append({"check": "image_replication", "passed": True, "skipped": True, "message": str(e)})
+
+    failures = [c for c in checks if not c["passed"]]
+    return {
+        "passed": not failures,
+        "location": location,
+        "vm_size": vm_size,
+        "vcpus": sku["vcpus"] if sku else None,
+        "family": sku["family"] if sku else None,
+        "checks": checks,
+        "error": "; ".join(c["message"] for c in failures) if failures else None,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
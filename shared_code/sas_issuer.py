@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from . import arm_recorder, bootstrap
+from .cache import TTLCache
+
+BlobServiceClient, generate_blob_sas, generate_container_sas, BlobSasPermissions, ContainerSasPermissions = bootstrap.lazy(
+    'azure.storage.blob',
+    'BlobServiceClient', 'generate_blob_sas', 'generate_container_sas', 'BlobSasPermissions', 'ContainerSasPermissions'
+)
+
+# Account keys are reused for this long before list_keys is called again; invalidate() after rotating them
+ACCOUNT_KEY_TTL_SECONDS = int(os.environ.get('SAS_ACCOUNT_KEY_TTL_SECONDS', 1800))
+# Sign with a user delegation key (Entra ID, needs Storage Blob Delegator on the account) instead of an account key
+USE_USER_DELEGATION = os.environ.get('SAS_USER_DELEGATION', 'false').lower() == 'true'
+# Hours a user delegation key is requested for; Azure allows at most 7 days
+DELEGATION_KEY_HOURS = int(os.environ.get('SAS_DELEGATION_KEY_HOURS', 24))
+# A cached delegation key is replaced once it has less than this many seconds left
+DELEGATION_REFRESH_SECONDS = int(os.environ.get('SAS_DELEGATION_REFRESH_SECONDS', 3600))
+
+MAX_DELEGATION_KEY_AGE = timedelta(days=7)
+
+_account_keys = TTLCache(ACCOUNT_KEY_TTL_SECONDS)
+_delegation_keys = TTLCache(DELEGATION_KEY_HOURS * 3600)
+
+
+def _key(resource_group, account_name):
+    return (resource_group.lower(), account_name.lower())
+
+
+def account_url(account_name):
+    return f"https://{account_name}.blob.core.windows.net"
+
+
+def account_key(storage_client, resource_group, account_name, refresh=False):
+    """key1 of a storage account (or its first key), cached for ACCOUNT_KEY_TTL_SECONDS"""
+    key = _key(resource_group, account_name)
+
+    def load():
+        keys = {k.key_name: k.value for k in storage_client.storage_accounts.list_keys(resource_group, account_name).keys}
+        return keys.get('key1') or next(iter(keys.values()))
+
+    if refresh:
+        return _account_keys.set(key, load())
+    return _account_keys.get_or_load(key, load)
+
+
+def delegation_key(credential, account_name, valid_until):
+    """A user delegation key for the account that is valid at least until `valid_until` (naive UTC).
+
+    Keys are requested for DELEGATION_KEY_HOURS (or up to `valid_until`, at most
+    7 days) and reused until DELEGATION_REFRESH_SECONDS before they expire.
+    """
+    cached = _delegation_keys.get(account_name.lower())
+    if cached is not None and cached[1] >= valid_until:
+        return cached[0]
+
+    now = datetime.utcnow()
+    if valid_until > now + MAX_DELEGATION_KEY_AGE:
+        raise ValueError("SAS signed with a user delegation key cannot be valid for more than 7 days")
+    expiry = min(max(valid_until, now + timedelta(hours=DELEGATION_KEY_HOURS)), now + MAX_DELEGATION_KEY_AGE)
+    service = BlobServiceClient(account_url=account_url(account_name), credential=credential, **arm_recorder.blob_kwargs())
+    # Start a little in the past so clock skew with the storage service does not reject fresh tokens
+    key = service.get_user_delegation_key(now - timedelta(minutes=5), expiry)
+    ttl = (expiry - now).total_seconds() - DELEGATION_REFRESH_SECONDS
+    if ttl > 0:
+        _delegation_keys.set(account_name.lower(), (key, expiry), ttl)
+    return key
+
+
+def invalidate(resource_group=None, account_name=None):
+    """Forget an account's keys (e.g. after rotating them or re-creating the account), or every cached key"""
+    if resource_group and account_name:
+        _account_keys.invalidate(_key(resource_group, account_name))
+        _delegation_keys.invalidate(account_name.lower())
+    else:
+        _account_keys.invalidate()
+        _delegation_keys.invalidate()
+
+
+def permissions(value, blob=False):
+    """Container or blob SAS permissions from a string such as "rwcl"; unknown letters raise ValueError"""
+    value = value or ''
+    parsed = (BlobSasPermissions if blob else ContainerSasPermissions).from_string(value)
+    if not value or len(str(parsed)) != len(set(value)):
+        kind = 'blob' if blob else 'container'
+        raise ValueError(f"Invalid {kind} SAS permissions '{value}'")
+    return parsed
+
+
+def sign(account_name, items, account_key=None, user_delegation_key=None):
+    """SAS tokens and URLs for containers and blobs of one account, signed locally.
+
+    Each item is {"container_name", "blob_name" (None for a container SAS),
+    "permission" (see permissions()), "expiry" (naive UTC datetime)}. Exactly
+    one of account_key and user_delegation_key signs them; no request is made.
+    Returns the items with "sas_token" and "url" added.
+    """
+    if (account_key is None) == (user_delegation_key is None):
+        raise ValueError("Sign with either an account key or a user delegation key")
+    base = account_url(account_name)
+    signed = []
+    for item in items:
+        container_name, blob_name = item["container_name"], item.get("blob_name")
+        if blob_name:
+            sas_token = generate_blob_sas(
+                account_name=account_name,
+                container_name=container_name,
+                blob_name=blob_name,
+                account_key=account_key,
+                user_delegation_key=user_delegation_key,
+                permission=item["permission"],
+                expiry=item["expiry"]
+            )
+            url = f"{base}/{container_name}/{quote(blob_name, safe='~/')}?{sas_token}"
+        else:
+            sas_token = generate_container_sas(
+                account_name=account_name,
+                container_name=container_name,
+                account_key=account_key,
+                user_delegation_key=user_delegation_key,
+                permission=item["permission"],
+                expiry=item["expiry"]
+            )
+            url = f"{base}/{container_name}?{sas_token}"
+        signed.append({**item, "sas_token": sas_token, "url": url})
+    return signed
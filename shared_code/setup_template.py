@@ -0,0 +1,232 @@
+import functools
+import os
+import re
+import textwrap
+import threading
+
+# Rendered scripts kept per worker, keyed by the template and its parameters (0 disables the memo)
+RENDER_CACHE_SIZE = int(os.environ.get('SETUP_RENDER_CACHE_SIZE', '32'))
+
+PLACEHOLDER = re.compile(r'__[A-Z][A-Z0-9]*(?:_[A-Z0-9]+)*__')
+_HEREDOC = re.compile(r'<<(-?)\s*([\'"]?)([A-Za-z_][A-Za-z0-9_]*)\2')
+# Characters the scanners act on; everything between them is skipped in one step
+_BASH_SPECIAL = re.compile(r'[_\'"\\#<]')
+_POWERSHELL_SPECIAL = re.compile(r'[_\'"`#<@]')
+
+# How a value is escaped depends on where its placeholder sits in the script.
+# Contexts without an entry (bare words, comments, quoted heredocs) get the value verbatim.
+_ESCAPES = {
+    'bash': {
+        'double': lambda value: re.sub(r'([\\"$`])', r'\\\1', value),
+        'single': lambda value: value.replace("'", "'\\''"),
+        'heredoc': lambda value: re.sub(r'([\\$`])', r'\\\1', value),
+    },
+    'powershell': {
+        'double': lambda value: re.sub(r'([`"$])', r'`\1', value),
+        'single': lambda value: value.replace("'", "''"),
+        'herestring': lambda value: re.sub(r'([`$])', r'`\1', value),
+    },
+}
+
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _bash_contexts(text):
+    """Quoting context of every placeholder in a bash script, as (start, end, context)"""
+    found = []
+    state = None            # None, 'single' or 'double'
+    heredocs = []           # (delimiter, quoted) opened on the current line
+    heredoc = None
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        end = pos + len(line)
+        if heredoc is not None:
+            delimiter, quoted = heredoc
+            if line.strip() == delimiter:
+                heredoc = heredocs.pop(0) if heredocs else None
+            else:
+                context = 'literal' if quoted else 'heredoc'
+                found.extend((pos + m.start(), pos + m.end(), context) for m in PLACEHOLDER.finditer(line))
+            pos = end
+            continue
+        i = 0
+        while True:
+            special = _BASH_SPECIAL.search(line, i)
+            if special is None:
+                break
+            i = special.start()
+            c = line[i]
+            match = PLACEHOLDER.match(line, i) if c == '_' else None
+            if match:
+                found.append((pos + i, pos + match.end(), state or 'bare'))
+                i = match.end()
+                continue
+            if state == 'single':
+                if c == "'":
+                    state = None
+            elif c == '\\':
+                i += 1
+            elif state == 'double':
+                if c == '"':
+                    state = None
+            elif c == "'":
+                state = 'single'
+            elif c == '"':
+                state = 'double'
+            elif c == '#' and (i == 0 or line[i - 1] in ' \t;'):
+                found.extend((pos + m.start(), pos + m.end(), 'comment') for m in PLACEHOLDER.finditer(line, i))
+                break
+            elif line.startswith('<<<', i):
+                i += 2      # here-string, not a heredoc
+            elif line.startswith('<<', i):
+                doc = _HEREDOC.match(line, i)
+                if doc:
+                    heredocs.append((doc.group(3), bool(doc.group(2))))
+                    i = doc.end()
+                    continue
+            i += 1
+        if heredocs:
+            heredoc = heredocs.pop(0)
+        pos = end
+    return found
+
+
+def _powershell_contexts(text):
+    """Quoting context of every placeholder in a PowerShell script, as (start, end, context)"""
+    found = []
+    state = None            # None, 'single', 'double' or 'comment'
+    herestring = None
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        end = pos + len(line)
+        if herestring is not None:
+            if line.lstrip().startswith(herestring + '@'):
+                herestring = None
+            else:
+                context = 'herestring' if herestring == '"' else 'literal'
+                found.extend((pos + m.start(), pos + m.end(), context) for m in PLACEHOLDER.finditer(line))
+            pos = end
+            continue
+        i = 0
+        while True:
+            special = _POWERSHELL_SPECIAL.search(line, i)
+            if special is None:
+                break
+            i = special.start()
+            c = line[i]
+            match = PLACEHOLDER.match(line, i) if c == '_' else None
+            if match:
+                found.append((pos + i, pos + match.end(), state or 'bare'))
+                i = match.end()
+                continue
+            if state == 'comment':
+                if line.startswith('#>', i):
+                    state = None
+                    i += 1
+            elif state == 'single':
+                if c == "'":
+                    state = None
+            elif c == '`':
+                i += 1
+            elif state == 'double':
+                if c == '"':
+                    state = None
+            elif line.startswith('<#', i):
+                state = 'comment'
+                i += 1
+            elif c == '#':
+                found.extend((pos + m.start(), pos + m.end(), 'comment') for m in PLACEHOLDER.finditer(line, i))
+                break
+            elif c == '@' and line[i + 1:].rstrip() in ('"', "'"):
+                herestring = line[i + 1]
+                break
+            elif c == "'":
+                state = 'single'
+            elif c == '"':
+                state = 'double'
+            i += 1
+        pos = end
+    return found
+
+
+class Template:
+    """A setup script split once into literal text and placeholders.
+
+    Placeholders look like __DOMAIN__. Rendering fills them in a single pass,
+    escaping each value for the quoting it sits in ("double", 'single',
+    heredoc or here-string). A value may itself be a Template (e.g. the
+    webhook function); it is rendered with the same values and inserted as is.
+    """
+
+    def __init__(self, text, shell='bash'):
+        if shell not in _ESCAPES:
+            raise ValueError(f"Unsupported shell '{shell}'")
+        self.shell = shell
+        scan = _bash_contexts if shell == 'bash' else _powershell_contexts
+        escapes = _ESCAPES[shell]
+        self._literals = []
+        self._slots = []
+        last = 0
+        for start, end, context in scan(text):
+            self._literals.append(text[last:start])
+            self._slots.append((text[start:end], escapes.get(context)))
+            last = end
+        self._literals.append(text[last:])
+        self.names = frozenset(name for name, _ in self._slots)
+
+    def render(self, values):
+        """Fill every placeholder from `values` ({'__DOMAIN__': ..., ...}); unknown names are ignored,
+        missing ones raise TemplateError. Results are memoized on the template and the values."""
+        missing = self.names.difference(values)
+        if missing:
+            raise TemplateError(f"Unresolved placeholders in {self.shell} script: {', '.join(sorted(missing))}")
+        if RENDER_CACHE_SIZE <= 0:
+            return self._render(values)
+        return _render_cached(self, tuple(sorted((name, values[name]) for name in self._relevant(values))))
+
+    def _relevant(self, values):
+        """Names this template and the templates nested in it read from `values`"""
+        names = set(self.names)
+        for name in self.names:
+            if isinstance(values[name], Template):
+                names.update(values[name]._relevant(values))
+        return names
+
+    def _render(self, values):
+        parts = [self._literals[0]]
+        for (name, escape), literal in zip(self._slots, self._literals[1:]):
+            value = values[name]
+            if isinstance(value, Template):
+                value = value.render(values)
+            else:
+                value = str(value)
+                if escape is not None:
+                    value = escape(value)
+            parts.append(value)
+            parts.append(literal)
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=max(RENDER_CACHE_SIZE, 0))
+def _render_cached(template, items):
+    return template._render(dict(items))
+
+
+def parse(text, shell='bash'):
+    """Dedent and parse a script template once per process.
+
+    Generators call this with their string literal on every request; the
+    literal is the same object each time, so the lookup costs no copy of it.
+    """
+    key = (text, shell)
+    template = _parsed.get(key)
+    if template is None:
+        template = Template(textwrap.dedent(text), shell)
+        with _parsed_lock:
+            template = _parsed.setdefault(key, template)
+    return template
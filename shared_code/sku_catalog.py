@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from . import arm_throttle, bootstrap
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+
+# Catalog entries are refreshed in the background once older than this,
+# and ignored entirely (reloaded synchronously) once older than the max age.
+REFRESH_SECONDS = int(os.environ.get('SKU_CATALOG_REFRESH_SECONDS', 6 * 3600))
+MAX_AGE_SECONDS = int(os.environ.get('SKU_CATALOG_MAX_AGE_SECONDS', 7 * 24 * 3600))
+CATALOG_PATH = os.environ.get(
+    'SKU_CATALOG_PATH',
+    os.path.join(tempfile.gettempdir(), 'rtxapi_sku_catalog.json')
+)
+
+# Boolean capabilities indexed per location for O(1) lookups
+FLAGS = ('gpu', 'nested_virtualization', 'ephemeral_os', 'accelerated_networking', 'premium_io', 'arm64')
+
+# Azure does not publish nested virtualization as a SKU capability. It is
+# supported on the v3+ D/E/M series (Intel and AMD) and on Fsv2.
+NESTED_VIRTUALIZATION_PATTERN = re.compile(r'^Standard_([DEM]\d+[a-z]*_v[3-9]|F\d+s_v2)$', re.IGNORECASE)
+
+
+def normalize_location(location):
+    """'UK South' / 'uksouth' -> 'uksouth'"""
+    return (location or '').replace(' ', '').lower()
+
+
+def _int_capability(capabilities, name):
+    try:
+        return int(float(capabilities.get(name, 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def sku_info(sku, location):
+    """Flatten a ResourceSku into the JSON-serialisable dict the catalog stores"""
+    capabilities = {c.name: c.value for c in (sku.capabilities or [])}
+    zones = []
+    for info in (sku.location_info or []):
+        if normalize_location(info.location) == location:
+            zones = list(info.zones or [])
+
+    restricted = False
+    restricted_zones = []
+    reasons = []
+    for restriction in (sku.restrictions or []):
+        restriction_type = getattr(restriction.type, 'value', restriction.type)
+        reason = getattr(restriction.reason_code, 'value', restriction.reason_code)
+        if restriction_type == 'Location':
+            restricted = True
+        elif restriction_type == 'Zone' and restriction.restriction_info:
+            restricted_zones.extend(restriction.restriction_info.zones or [])
+        if reason:
+            reasons.append(reason)
+
+    gpu = _int_capability(capabilities, 'GPUs') > 0
+    return {
+        "name": sku.name,
+        "family": sku.family,
+        "vcpus": _int_capability(capabilities, 'vCPUs'),
+        "memory_gb": float(capabilities.get('MemoryGB', 0) or 0),
+        "gpus": _int_capability(capabilities, 'GPUs'),
+        "zones": sorted(zones),
+        "restricted": restricted,
+        "restricted_zones": sorted(set(restricted_zones)),
+        "restriction_reasons": sorted(set(reasons)),
+        "gpu": gpu,
+        "nested_virtualization": not gpu and bool(NESTED_VIRTUALIZATION_PATTERN.match(sku.name or '')),
+        "ephemeral_os": capabilities.get('EphemeralOSDiskSupported') == 'True',
+        "accelerated_networking": capabilities.get('AcceleratedNetworkingEnabled') == 'True',
+        "premium_io": capabilities.get('PremiumIO') == 'True',
+        "arm64": capabilities.get('CpuArchitectureType') == 'Arm64',
+        "capabilities": capabilities
+    }
+
+
+class SkuCatalog:
+    """VM sizes per location from resource_skus.list, cached in memory and on disk.
+
+    Each location is loaded on first use (one filtered resource_skus.list call)
+    and indexed by family and by every flag in FLAGS, so capability queries
+    are set intersections instead of scans over hard-coded lists.
+    """
+
+    def __init__(self, compute_client=None, path=CATALOG_PATH):
+        self.compute_client = compute_client
+        self.path = path
+        self._locations = {}   # location -> {"fetched_at": epoch, "sizes": {name: info}}
+        self._index = {}       # (location, key, value) -> frozenset of size names
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._load_from_disk()
+
+    # ---------- loading ----------
+
+    def _client(self):
+        if self.compute_client is None:
+            credentials = ClientSecretCredential(
+                client_id=os.environ['AZURE_APP_CLIENT_ID'],
+                client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+                tenant_id=os.environ['AZURE_APP_TENANT_ID']
+            )
+            # Catalog loads and refreshes are background work: pace them as low priority
+            self.compute_client = ComputeManagementClient(
+                credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs(arm_throttle.LOW, shared=True)
+            )
+        return self.compute_client
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for location, entry in data.items():
+            if time.time() - entry.get("fetched_at", 0) < MAX_AGE_SECONDS:
+                self._store(location, entry)
+
+    def _save_to_disk(self):
+        with self._lock:
+            data = dict(self._locations)
+        try:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not persist SKU catalog to {self.path}: {e}")
+
+    def _store(self, location, entry):
+        index = {}
+        for name, info in entry["sizes"].items():
+            if info.get("family"):
+                index.setdefault((location, 'family', info["family"].lower()), set()).add(name)
+            for flag in FLAGS:
+                index.setdefault((location, flag, bool(info.get(flag))), set()).add(name)
+        with self._lock:
+            self._locations[location] = entry
+            for key in [k for k in self._index if k[0] == location]:
+                del self._index[key]
+            self._index.update({k: frozenset(v) for k, v in index.items()})
+
+    def _fetch(self, location):
+        sizes = {}
+        for sku in self._client().resource_skus.list(filter=f"location eq '{location}'"):
+            if sku.resource_type == 'virtualMachines':
+                sizes[sku.name] = sku_info(sku, location)
+        self._store(location, {"fetched_at": time.time(), "sizes": sizes})
+        self._save_to_disk()
+        logging.info(f"SKU catalog loaded {len(sizes)} VM sizes for {location}")
+
+    def _background_refresh(self, location):
+        try:
+            self._fetch(location)
+        except Exception as e:
+            logging.warning(f"SKU catalog refresh failed for {location}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(location)
+
+    def refresh(self, location):
+        """Reload a location now"""
+        self._fetch(normalize_location(location))
+
+    def sizes(self, location):
+        """Return {vm_size: info} for a location, loading or refreshing it as needed"""
+        location = normalize_location(location)
+        with self._lock:
+            entry = self._locations.get(location)
+        age = None if entry is None else time.time() - entry["fetched_at"]
+        if age is None or age > MAX_AGE_SECONDS:
+            # Missing or too old to serve: reload now, and let a failure reach the caller
+            self._fetch(location)
+            with self._lock:
+                return self._locations[location]["sizes"]
+
+        if age > REFRESH_SECONDS:
+            # Serve the stale entry and refresh behind it
+            with self._lock:
+                start = location not in self._refreshing
+                self._refreshing.add(location)
+            if start:
+                threading.Thread(target=self._background_refresh, args=(location,), daemon=True).start()
+        return entry["sizes"]
+
+    # ---------- queries ----------
+
+    def get(self, location, vm_size):
+        return self.sizes(location).get(vm_size)
+
+    @staticmethod
+    def _within(info, families=None, min_vcpus=None, max_vcpus=None, min_memory_gb=None):
+        """Bounds that are not indexed: family name prefixes, vCPU and memory ranges"""
+        if families and not (info["family"] or '').lower().startswith(tuple(f.lower() for f in families)):
+            return False
+        if min_vcpus is not None and info["vcpus"] < min_vcpus:
+            return False
+        if max_vcpus is not None and info["vcpus"] > max_vcpus:
+            return False
+        if min_memory_gb is not None and info["memory_gb"] < min_memory_gb:
+            return False
+        return True
+
+    def query(self, location, family=None, families=None, min_vcpus=None, max_vcpus=None, min_memory_gb=None,
+              include_restricted=False, **flags):
+        """Return size infos matching every given filter, smallest first.
+
+        `family` is an exact SKU family, `families` a list of family name
+        prefixes (e.g. ["standardNV"] for every NV generation). `flags` are
+        any of FLAGS set to True/False, e.g. gpu=True.
+        """
+        location = normalize_location(location)
+        sizes = self.sizes(location)
+        unknown = set(flags) - set(FLAGS)
+        if unknown:
+            raise ValueError(f"Unknown SKU capability filter(s): {', '.join(sorted(unknown))}")
+
+        keys = [(location, flag, bool(value)) for flag, value in flags.items() if value is not None]
+        if family:
+            keys.append((location, 'family', family.lower()))
+        with self._lock:
+            names = set(sizes) if not keys else set.intersection(*(set(self._index.get(k, ())) for k in keys))
+
+        result = []
+        for name in names:
+            info = sizes[name]
+            if info["restricted"] and not include_restricted:
+                continue
+            if not self._within(info, families, min_vcpus, max_vcpus, min_memory_gb):
+                continue
+            result.append(info)
+        return sorted(result, key=lambda i: (i["vcpus"], i["memory_gb"], i["name"]))
+
+    def matches(self, location, vm_size, family=None, families=None, min_vcpus=None, max_vcpus=None,
+                min_memory_gb=None, include_restricted=False, **flags):
+        """True when vm_size is offered in location and satisfies the requirements"""
+        info = self.get(location, vm_size)
+        if info is None or (info["restricted"] and not include_restricted):
+            return False
+        if family and (info["family"] or '').lower() != family.lower():
+            return False
+        if not self._within(info, families, min_vcpus, max_vcpus, min_memory_gb):
+            return False
+        return all(bool(info.get(flag)) == bool(value) for flag, value in flags.items() if value is not None)
+
+    def suggest(self, location, vm_size, limit=10, **requirements):
+        """Matching sizes ordered by closeness to the vCPU count of vm_size"""
+        candidates = self.query(location, **requirements)
+        requested = self.get(location, vm_size)
+        if requested:
+            candidates.sort(key=lambda i: (abs(i["vcpus"] - requested["vcpus"]), i["vcpus"], i["name"]))
+        return [i["name"] for i in candidates[:limit]]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(compute_client=None):
+    """Process-wide catalog; the first caller may supply the compute client"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = SkuCatalog(compute_client)
+        elif _catalog.compute_client is None and compute_client is not None:
+            _catalog.compute_client = compute_client
+        return _catalog
+
+
+def check_vm_size(location, vm_size, include_restricted=False, **requirements):
+    """Validate vm_size for a create flow.
+
+    Create flows declare VM_SIZE_REQUIREMENTS (capability flags plus family,
+    vCPU and memory bounds) and check sizes against this catalog, built from
+    resource_skus.list, instead of keeping hard-coded size lists. Returns
+    (ok, suggestions). With include_restricted a size the subscription
+    may not deploy in location still passes; flows with placement fallback
+    leave that to the preflight. If the catalog cannot be loaded the size is
+    accepted and left for ARM to judge, rather than blocking every request.
+    """
+    try:
+        catalog = get_catalog()
+        if catalog.matches(location, vm_size, include_restricted=include_restricted, **requirements):
+            return True, []
+        return False, catalog.suggest(location, vm_size, **requirements)
+    except Exception as e:
+        logging.warning(f"SKU catalog unavailable, skipping size validation for {vm_size}: {e}")
+        return True, []
@@ -0,0 +1,215 @@
+import logging
+import uuid
+
+from azure.core.exceptions import ResourceNotFoundError
+
+# Every resource a provisioning run creates carries these tags, so teardown can
+# find what is left by ID instead of by naming convention
+TAG_PROVISIONING_ID = 'rtx-provisioning-id'
+TAG_VM_NAME = 'rtx-vm-name'
+# Fleet members and the network they share carry the fleet's ID; the shared
+# resources use it as their provisioning ID too, so they are swept by it
+TAG_FLEET_ID = 'rtx-fleet-id'
+
+# Sweep order: things holding references go first
+DELETE_ORDER = (
+    'microsoft.compute/virtualmachines',
+    'microsoft.network/networkinterfaces',
+    'microsoft.network/publicipaddresses',
+    'microsoft.network/networksecuritygroups',
+    'microsoft.network/virtualnetworks',
+    'microsoft.compute/disks',
+)
+API_VERSIONS = {
+    'microsoft.compute/virtualmachines': '2023-09-01',
+    'microsoft.compute/disks': '2023-04-02',
+    'microsoft.network/networkinterfaces': '2023-09-01',
+    'microsoft.network/publicipaddresses': '2023-09-01',
+    'microsoft.network/networksecuritygroups': '2023-09-01',
+    'microsoft.network/virtualnetworks': '2023-09-01',
+}
+
+
+def new_provisioning_id():
+    return uuid.uuid4().hex
+
+
+def tags(vm_name, provisioning_id, **extra):
+    """Tags for every resource of one provisioning run"""
+    return {TAG_PROVISIONING_ID: provisioning_id, TAG_VM_NAME: vm_name, **extra}
+
+
+def provisioning_id_of(vm):
+    return (vm.tags or {}).get(TAG_PROVISIONING_ID)
+
+
+def fleet_id_of(vm):
+    return (vm.tags or {}).get(TAG_FLEET_ID)
+
+
+def tagged_resources(resource_client, resource_group, provisioning_id):
+    """Generic resources carrying the provisioning ID, in DELETE_ORDER"""
+    resources = list(resource_client.resources.list_by_resource_group(
+        resource_group,
+        filter=f"tagName eq '{TAG_PROVISIONING_ID}' and tagValue eq '{provisioning_id}'"
+    ))
+    rank = {resource_type: i for i, resource_type in enumerate(DELETE_ORDER)}
+    return sorted(resources, key=lambda r: rank.get(r.type.lower(), len(DELETE_ORDER)))
+
+
+def sweep(resource_client, resource_group, provisioning_id):
+    """Delete whatever a provisioning run left behind.
+
+    Resources are deleted one type at a time in DELETE_ORDER, all resources of
+    a type concurrently. Returns a response_log style list of results.
+    """
+    log = []
+    pending = {}
+    for resource in tagged_resources(resource_client, resource_group, provisioning_id):
+        pending.setdefault(resource.type.lower(), []).append(resource)
+
+    # tagged_resources() is sorted, so pending is in DELETE_ORDER too
+    for resource_type in pending:
+        api_version = API_VERSIONS.get(resource_type)
+        pollers = []
+        for resource in pending[resource_type]:
+            if api_version is None:
+                log.append({"warning": f"Not sweeping '{resource.name}': unknown type {resource.type}"})
+                continue
+            try:
+                pollers.append((resource, resource_client.resources.begin_delete_by_id(resource.id, api_version)))
+            except Exception as e:
+                log.append({"warning": f"Failed to delete {resource.type} '{resource.name}': {str(e)}"})
+        for resource, poller in pollers:
+            try:
+                poller.result()
+                log.append({"success": f"Deleted {resource.type.split('/')[-1]} '{resource.name}'."})
+            except Exception as e:
+                log.append({"warning": f"Failed to delete {resource.type} '{resource.name}': {str(e)}"})
+    if not pending:
+        logging.info(f"Nothing left to sweep for provisioning {provisioning_id} in {resource_group}")
+    return log
+
+
+def sweep_fleet(resource_client, resource_group, fleet_id):
+    """Delete a fleet's shared network once no member VM is left.
+
+    Members being deleted right now do not count, so the last two members
+    deleted concurrently both try; whichever finds the NICs gone succeeds.
+    Returns a response_log style list of results.
+    """
+    members = [
+        resource for resource in resource_client.resources.list_by_resource_group(
+            resource_group,
+            filter=f"tagName eq '{TAG_FLEET_ID}' and tagValue eq '{fleet_id}'",
+            expand='provisioningState'
+        )
+        if resource.type.lower() == 'microsoft.compute/virtualmachines'
+        and (resource.tags or {}).get(TAG_FLEET_ID) == fleet_id
+        and (resource.provisioning_state or '').lower() != 'deleting'
+    ]
+    if members:
+        logging.info(f"Keeping the shared network of fleet {fleet_id}: {len(members)} member VMs left")
+        return []
+    return sweep(resource_client, resource_group, fleet_id)
+
+
+def delete_resource(resource_client, resource):
+    """Delete one generic resource and wait; returns a response_log entry"""
+    api_version = API_VERSIONS.get(resource.type.lower())
+    if api_version is None:
+        return {"warning": f"Not deleting '{resource.name}': unknown type {resource.type}"}
+    kind = resource.type.split('/')[-1]
+    try:
+        resource_client.resources.begin_delete_by_id(resource.id, api_version).result()
+        return {"success": f"Deleted {kind} '{resource.name}'."}
+    except ResourceNotFoundError:
+        # Usually taken by a VM's cascade delete
+        return {"success": f"{kind} '{resource.name}' already deleted."}
+    except Exception as e:
+        return {"warning": f"Failed to delete {resource.type} '{resource.name}': {str(e)}"}
+
+
+def parse_tag_selector(tag):
+    """'key=value' or {"key": "value"} -> (key, value); value None matches any"""
+    if isinstance(tag, dict) and len(tag) == 1:
+        return next(iter(tag.items()))
+    if isinstance(tag, str) and tag:
+        key, _, value = tag.partition('=')
+        return key.strip(), (value.strip() or None)
+    raise ValueError("'tag' must be 'key=value' or a single-entry object")
+
+
+def handed_out_name(vm):
+    """Name the VM is known by to callers (differs from vm.name for warm pool VMs)"""
+    return (vm.tags or {}).get(TAG_VM_NAME) or vm.name
+
+
+def deletion_plan(compute_client, resource_client, resource_group, vm_names=None, tag=None):
+    """Global teardown plan for a set of VMs, from two list calls.
+
+    VMs are selected by handed-out name, by a (key, value) tag selector, or
+    all of the resource group when neither is given; in that case every
+    resource carrying a provisioning ID is included too. A fleet's shared
+    network is included once every member of the fleet is. Returns a dict of phases, each a list of generic
+    resources: "vms", "disks", "network" (list of passes in DELETE_ORDER),
+    plus "vm_names", "missing" (requested names not found) and "unplanned"
+    (resources of the group outside the plan).
+    """
+    resources = list(resource_client.resources.list_by_resource_group(resource_group))
+    vms = list(compute_client.virtual_machines.list(resource_group))
+
+    if vm_names:
+        wanted = {name.lower() for name in vm_names}
+        selected = [vm for vm in vms if handed_out_name(vm).lower() in wanted or vm.name.lower() in wanted]
+        found = {handed_out_name(vm).lower() for vm in selected} | {vm.name.lower() for vm in selected}
+        missing = [name for name in vm_names if name.lower() not in found]
+    elif tag:
+        key, value = tag
+        selected = [vm for vm in vms if key in (vm.tags or {}) and (value is None or vm.tags[key] == value)]
+        missing = []
+    else:
+        selected = vms
+        missing = []
+
+    ids = set()
+    names = set()
+    # A fleet's shared network goes with its last member
+    selected_ids = {vm.id.lower() for vm in selected}
+    kept_fleets = {fleet_id_of(vm) for vm in vms if vm.id.lower() not in selected_ids}
+    provisioning_ids = {fleet_id_of(vm) for vm in selected if fleet_id_of(vm)} - kept_fleets
+    for vm in selected:
+        ids.add(vm.id.lower())
+        os_disk = vm.storage_profile.os_disk if vm.storage_profile else None
+        if os_disk and os_disk.managed_disk and os_disk.managed_disk.id:
+            ids.add(os_disk.managed_disk.id.lower())
+        for nic in (vm.network_profile.network_interfaces if vm.network_profile else None) or []:
+            ids.add(nic.id.lower())
+        provisioning_id = provisioning_id_of(vm)
+        if provisioning_id:
+            provisioning_ids.add(provisioning_id)
+        else:
+            # Created before resources were tagged: match by naming convention
+            names.update(f"{vm.name}-{suffix}".lower() for suffix in ('nic', 'nsg', 'public-ip', 'vnet', 'os-disk'))
+
+    plan = {"vms": [], "disks": [], "network": [], "unplanned": [], "missing": missing,
+            "vm_names": [handed_out_name(vm) for vm in selected]}
+    network = {}
+    for resource in resources:
+        resource_type = resource.type.lower()
+        planned = (
+            resource.id.lower() in ids
+            or resource.name.lower() in names
+            or (resource.tags or {}).get(TAG_PROVISIONING_ID) in provisioning_ids
+            or (not vm_names and not tag and TAG_PROVISIONING_ID in (resource.tags or {}))
+        )
+        if not planned or resource_type not in API_VERSIONS:
+            plan["unplanned"].append(resource)
+        elif resource_type == 'microsoft.compute/virtualmachines':
+            plan["vms"].append(resource)
+        elif resource_type == 'microsoft.compute/disks':
+            plan["disks"].append(resource)
+        else:
+            network.setdefault(resource_type, []).append(resource)
+    plan["network"] = [network[t] for t in DELETE_ORDER if t in network]
+    return plan
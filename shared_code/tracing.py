@@ -0,0 +1,207 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+# Spans are exported to App Insights through OpenTelemetry when it is installed and configured
+EXPORT_ENABLED = os.environ.get('TRACING_EXPORT', 'true').lower() == 'true'
+
+# Status URLs of ARM long-running operations: GETs to these are LRO polls
+POLL_PATTERN = re.compile(r'/(operations|asyncoperations|operationresults|operationstatuses)/', re.IGNORECASE)
+
+_current = contextvars.ContextVar('rtx_trace_run', default=None)
+
+
+class Span:
+    """Time between two status updates, named after the step the second one reports"""
+
+    def __init__(self, start_ns):
+        self.name = None
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.arm_calls = 0
+        self.lro_polls = 0
+        self.retries = 0
+        self.error = False
+
+
+class Run:
+    """Timeline of one background operation (a provision, a delete, a snapshot...).
+
+    Steps are marked by the status updates the operation already posts, and
+    ARM requests made through clients created while the run is current are
+    counted against the open step (see arm_throttle.client_kwargs).
+    """
+
+    def __init__(self, operation, subject):
+        self.id = uuid.uuid4().hex[:16]
+        self.operation = operation
+        self.subject = subject
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.spans = []
+        self._open = Span(self.start_ns)
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.end_ns is not None
+
+    def arm_request(self, method, url, retry=False):
+        with self._lock:
+            if self.finished:
+                return
+            self._open.arm_calls += 1
+            if retry:
+                self._open.retries += 1
+            if method.upper() == 'GET' and POLL_PATTERN.search(url or ''):
+                self._open.lro_polls += 1
+
+    def mark(self, step, error=False):
+        """Close the open span as `step` and start the next one"""
+        now = time.time_ns()
+        with self._lock:
+            if self.finished:
+                return
+            span = self._open
+            span.name = step
+            span.end_ns = now
+            span.error = error
+            self.spans.append(span)
+            self._open = Span(now)
+
+    def finish(self):
+        with self._lock:
+            if self.finished:
+                return False
+            self.end_ns = time.time_ns()
+            return True
+
+    def timeline(self):
+        """Compact, JSON-serialisable view of the steps so far"""
+        with self._lock:
+            spans = list(self.spans)
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "run_id": self.id,
+            "operation": self.operation,
+            "total_ms": (end_ns - self.start_ns) // 1_000_000,
+            "arm_calls": sum(s.arm_calls for s in spans),
+            "lro_polls": sum(s.lro_polls for s in spans),
+            "retries": sum(s.retries for s in spans),
+            "steps": [
+                {
+                    "step": s.name,
+                    "at_ms": (s.start_ns - self.start_ns) // 1_000_000,
+                    "ms": (s.end_ns - s.start_ns) // 1_000_000,
+                    "arm": s.arm_calls,
+                    "polls": s.lro_polls,
+                    "retries": s.retries
+                }
+                for s in spans
+            ]
+        }
+
+
+def start(operation, subject):
+    """Begin a run for the calling task (and the tasks and clients it creates)"""
+    run = Run(operation, subject)
+    _current.set(run)
+    return run
+
+
+def current():
+    return _current.get()
+
+
+def record(status_data):
+    """Mark the step of a status update on the current run.
+
+    A "completed" status gets the run's timeline in its details and ends the
+    run; a "failed" one ends it too. Returns status_data.
+    """
+    run = _current.get()
+    if run is None or run.finished:
+        return status_data
+    details = status_data.get("details")
+    if not isinstance(details, dict):
+        details = {}
+    status = status_data.get("status")
+    run.mark(details.get("step", status or "unknown"), error=status == "failed")
+    if status in ("completed", "failed") and run.finish():
+        if status == "completed":
+            details["timeline"] = run.timeline()
+            status_data["details"] = details
+        export(run)
+    return status_data
+
+
+# ====================== OPENTELEMETRY EXPORT ======================
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def _get_tracer():
+    """OpenTelemetry tracer, configured for App Insights on first use; None without OpenTelemetry"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is not None:
+            return _tracer or None
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            logging.info("OpenTelemetry not installed, provisioning spans are not exported")
+            _tracer = False
+            return None
+        if os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING'):
+            try:
+                from azure.monitor.opentelemetry import configure_azure_monitor
+                configure_azure_monitor()
+            except Exception as e:
+                logging.warning(f"App Insights exporter not configured: {e}")
+        _tracer = trace.get_tracer('rtxapi.provisioning')
+        return _tracer
+
+
+def export(run):
+    """Emit a run as a root span with one child span per step"""
+    if not EXPORT_ENABLED:
+        return
+    try:
+        tracer = _get_tracer()
+        if tracer is None:
+            return
+        from opentelemetry import trace
+        from opentelemetry.trace import Status, StatusCode
+
+        root = tracer.start_span(
+            f"{run.operation} {run.subject}",
+            start_time=run.start_ns,
+            attributes={"rtx.run_id": run.id, "rtx.operation": run.operation, "rtx.subject": str(run.subject)}
+        )
+        context = trace.set_span_in_context(root)
+        failed = False
+        for span in run.spans:
+            child = tracer.start_span(
+                span.name or "unknown",
+                context=context,
+                start_time=span.start_ns,
+                attributes={
+                    "arm.calls": span.arm_calls,
+                    "arm.lro_polls": span.lro_polls,
+                    "arm.retries": span.retries
+                }
+            )
+            if span.error:
+                failed = True
+                child.set_status(Status(StatusCode.ERROR))
+            child.end(end_time=span.end_ns)
+        if failed:
+            root.set_status(Status(StatusCode.ERROR))
+        root.end(end_time=run.end_ns)
+    except Exception as e:
+        logging.warning(f"Exporting spans of {run.operation} {run.subject} failed: {e}")
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import secrets
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError
+
+from . import preflight, topology
+from .sku_catalog import normalize_location
+
+# Tags that make ARM the source of truth for the pool, across workers and restarts
+TAG_POOL = 'rtx-warm-pool'           # pool key the VM belongs to
+TAG_STATE = 'rtx-warm-pool-state'    # provisioning | ready | claimed
+TAG_VM_NAME = topology.TAG_VM_NAME  # name the VM was handed out as
+
+PROVISIONING = 'provisioning'
+READY = 'ready'
+CLAIMED = 'claimed'
+
+# Latencies kept for the claim latency percentiles
+LATENCY_SAMPLES = 100
+# Seconds a pool VM build may take; older builds that never became ready count as failed, not in flight
+PROVISION_TIMEOUT_SECONDS = int(os.environ.get('WARM_POOL_PROVISION_TIMEOUT_SECONDS', 3600))
+
+
+def targets():
+    """Pools to keep warm, from WARM_POOL_TARGETS (JSON list). Each target has
+    resource_group, domain, location, vm_size, gallery_image_resource_group,
+    gallery_name, gallery_image_name, optional gallery_image_version and count."""
+    raw = os.environ.get('WARM_POOL_TARGETS', '')
+    if not raw:
+        return []
+    try:
+        return [t for t in json.loads(raw) if int(t.get("count", 0)) > 0]
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.error(f"Invalid WARM_POOL_TARGETS: {e}")
+        return []
+
+
+def pool_key(location, vm_size, gallery_name, gallery_image_name, image_version):
+    """(region, size, image version) a pool VM is interchangeable within"""
+    return f"{normalize_location(location)}|{vm_size}|{gallery_name}/{gallery_image_name}/{image_version}"
+
+
+def target_key(compute_client, target):
+    """Pool key of a target (or request) with 'latest' resolved to a version; None if the image has none"""
+    version = preflight.get_image_version(
+        compute_client,
+        target["gallery_image_resource_group"],
+        target["gallery_name"],
+        target["gallery_image_name"],
+        target.get("gallery_image_version") or 'latest'
+    )
+    if version is None:
+        return None
+    return pool_key(target["location"], target["vm_size"], target["gallery_name"], target["gallery_image_name"], version["name"])
+
+
+def find_target(resource_group, location, vm_size, gallery_image_resource_group, gallery_name, gallery_image_name):
+    """The configured target a request could be served from, if any"""
+    for target in targets():
+        if (target.get("resource_group") == resource_group
+                and normalize_location(target.get("location")) == normalize_location(location)
+                and target.get("vm_size") == vm_size
+                and target.get("gallery_image_resource_group") == gallery_image_resource_group
+                and target.get("gallery_name") == gallery_name
+                and target.get("gallery_image_name") == gallery_image_name):
+            return target
+    return None
+
+
+def new_vm_name():
+    """Short enough to be a Windows computer name"""
+    return f"wp{secrets.token_hex(4)}"
+
+
+def _tags(vm):
+    return dict(vm.tags or {})
+
+
+class WarmPoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.handouts_failed = 0
+        self.replenished = 0
+        self.replenish_failed = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def record_claim_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "handouts_failed": self.handouts_failed,
+                "replenished": self.replenished,
+                "replenish_failed": self.replenish_failed,
+            }
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+        return {
+            **counters,
+            "claim_latency_seconds": {
+                "samples": len(latencies),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(latencies[-1], 1) if latencies else None
+            }
+        }
+
+
+metrics = WarmPoolMetrics()
+_claim_lock = threading.Lock()
+
+
+def list_pool(compute_client, resource_group):
+    """Pool VMs of a resource group: [{"name", "key", "state", "vm_name"}]"""
+    pool = []
+    for vm in compute_client.virtual_machines.list(resource_group):
+        tags = _tags(vm)
+        if TAG_POOL in tags:
+            pool.append({
+                "name": vm.name,
+                "key": tags[TAG_POOL],
+                "state": tags.get(TAG_STATE, PROVISIONING),
+                "vm_name": tags.get(TAG_VM_NAME)
+            })
+    return pool
+
+
+def depth(compute_client, resource_group, key):
+    """{"ready": n, "provisioning": n} for one pool"""
+    counts = {READY: 0, PROVISIONING: 0}
+    for vm in list_pool(compute_client, resource_group):
+        if vm["key"] == key and vm["state"] in counts:
+            counts[vm["state"]] += 1
+    return counts
+
+
+def set_state(compute_client, resource_group, name, state, **tags):
+    vm = compute_client.virtual_machines.get(resource_group, name)
+    new_tags = _tags(vm)
+    new_tags[TAG_STATE] = state
+    new_tags.update({k: v for k, v in tags.items() if v is not None})
+    compute_client.virtual_machines.begin_update(resource_group, name, {"tags": new_tags}).result()
+
+
+def in_flight(resource_client, resource_group, key):
+    """Pool VMs of one pool being built by any worker: names, from ARM tags.
+
+    provision_vm_background tags everything it creates (the VNet first) with
+    the pool key and one provisioning ID, so a build shows up here long before
+    its VM exists. A build is done once its VM left PROVISIONING; builds older
+    than PROVISION_TIMEOUT_SECONDS are left out.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=PROVISION_TIMEOUT_SECONDS)
+    builds = {}
+    for resource in resource_client.resources.list_by_resource_group(
+            resource_group,
+            filter=f"tagName eq '{TAG_POOL}' and tagValue eq '{key}'",
+            expand='createdTime'):
+        tags = resource.tags or {}
+        if tags.get(TAG_POOL) != key:
+            continue
+        build = builds.setdefault(tags.get(topology.TAG_PROVISIONING_ID) or resource.name, {"name": None, "done": False, "stale": False})
+        if resource.type.lower() == 'microsoft.compute/virtualmachines':
+            build["done"] = tags.get(TAG_STATE, PROVISIONING) != PROVISIONING
+        else:
+            build["name"] = build["name"] or tags.get(TAG_VM_NAME)
+        if resource.created_time and resource.created_time < cutoff:
+            build["stale"] = True
+    return {b["name"] for b in builds.values() if b["name"] and not b["done"] and not b["stale"]}
+
+
+def claim(compute_client, resource_group, key, vm_name):
+    """Take a ready VM out of the pool for vm_name; returns its name or None.
+
+    Workers race for the same ready VMs, so the tag flip is a conditional
+    write on the etag read just before it: a 412 means another worker changed
+    the VM first, and the next candidate is tried. The lock only keeps this
+    worker's own requests from losing races to each other.
+    """
+    with _claim_lock:
+        for candidate in list_pool(compute_client, resource_group):
+            if candidate["key"] != key or candidate["state"] != READY:
+                continue
+            vm = compute_client.virtual_machines.get(resource_group, candidate["name"])
+            new_tags = _tags(vm)
+            if new_tags.get(TAG_STATE) != READY:
+                continue
+            new_tags[TAG_STATE] = CLAIMED
+            new_tags[TAG_VM_NAME] = vm_name
+            try:
+                compute_client.virtual_machines.begin_update(
+                    resource_group, candidate["name"], {"tags": new_tags},
+                    etag=vm.etag, match_condition=MatchConditions.IfNotModified
+                ).result()
+            except HttpResponseError as e:
+                if e.status_code != 412:
+                    raise
+                logging.info(f"Warm pool: {candidate['name']} was claimed by another worker, trying the next VM")
+                continue
+            metrics.record("hits")
+            logging.info(f"Warm pool: claimed {candidate['name']} for {vm_name} ({key})")
+            return candidate["name"]
+    metrics.record("misses")
+    return None
+
+
+def resolve_vm_name(compute_client, resource_group, vm_name):
+    """Azure name of the VM handed out as vm_name (itself unless it came from the pool)"""
+    try:
+        compute_client.virtual_machines.get(resource_group, vm_name)
+        return vm_name
+    except Exception:
+        pass
+    try:
+        for vm in compute_client.virtual_machines.list(resource_group):
+            if _tags(vm).get(TAG_VM_NAME) == vm_name:
+                return vm.name
+    except Exception as e:
+        logging.warning(f"Warm pool lookup for {vm_name} failed: {e}")
+    return vm_name
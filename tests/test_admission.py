@@ -0,0 +1,125 @@
+import asyncio
+import unittest
+
+from shared_code import admission
+
+
+class AdmissionControllerTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.release = {}     # job_id -> Event that lets the job finish
+        self.started = []
+        self.controllers = []
+
+    async def asyncTearDown(self):
+        # Let every job run to completion so nothing is dispatched while the loop closes
+        for event in self.release.values():
+            event.set()
+        for controller in self.controllers:
+            while controller._tasks:
+                await asyncio.gather(*controller._tasks)
+
+    def controller(self, **limits):
+        controller = admission.AdmissionController(**limits)
+        self.controllers.append(controller)
+        return controller
+
+    def job(self, job_id):
+        """A run() that records its start and holds its slot until released"""
+        self.release[job_id] = asyncio.Event()
+
+        async def run():
+            self.started.append(job_id)
+            await self.release[job_id].wait()
+
+        return run
+
+    async def finish(self, job_id):
+        self.release[job_id].set()
+        # Let the job return and the done callback dispatch the queue
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    async def test_global_limit_queues_in_order(self):
+        controller = self.controller(max_concurrent=2, max_per_region=0, max_per_family=0)
+
+        tickets = [controller.submit(job_id, 'uksouth', None, self.job(job_id)) for job_id in ('a', 'b', 'c', 'd')]
+        await asyncio.sleep(0)
+
+        self.assertEqual([t["queued"] for t in tickets], [False, False, True, True])
+        self.assertEqual([t["queue_position"] for t in tickets], [0, 0, 1, 2])
+        self.assertEqual(self.started, ['a', 'b'])
+
+        await self.finish('a')
+        self.assertEqual(self.started, ['a', 'b', 'c'])
+        self.assertEqual(controller.stats()["queued"], 1)
+
+    async def test_region_at_its_limit_does_not_hold_up_other_regions(self):
+        controller = self.controller(max_concurrent=5, max_per_region=1, max_per_family=0)
+
+        controller.submit('a', 'UK South', None, self.job('a'))
+        blocked = controller.submit('b', 'uksouth', None, self.job('b'))
+        other = controller.submit('c', 'westeurope', None, self.job('c'))
+        await asyncio.sleep(0)
+
+        self.assertTrue(blocked["queued"])
+        self.assertFalse(other["queued"])
+        self.assertEqual(self.started, ['a', 'c'])
+
+        await self.finish('a')
+        self.assertEqual(self.started, ['a', 'c', 'b'])
+
+    async def test_family_limit(self):
+        controller = self.controller(max_concurrent=5, max_per_region=0, max_per_family=1)
+
+        controller.submit('a', 'uksouth', 'standardNVFamily', self.job('a'))
+        same = controller.submit('b', 'westeurope', 'StandardNVFamily', self.job('b'))
+        other = controller.submit('c', 'uksouth', 'standardDFamily', self.job('c'))
+        unknown = controller.submit('d', 'uksouth', None, self.job('d'))
+
+        self.assertTrue(same["queued"])
+        self.assertFalse(other["queued"])
+        self.assertFalse(unknown["queued"])
+
+    async def test_queue_full(self):
+        controller = self.controller(max_concurrent=1, max_per_region=0, max_per_family=0, max_queue=1)
+
+        controller.submit('a', 'uksouth', None, self.job('a'))
+        controller.submit('b', 'uksouth', None, self.job('b'))
+        with self.assertRaises(admission.QueueFull):
+            controller.submit('c', 'uksouth', None, self.job('c'))
+        self.assertFalse(controller.is_active('c'))
+
+    async def test_queued_jobs_are_told_when_their_position_changes(self):
+        controller = self.controller(max_concurrent=1, max_per_region=0, max_per_family=0)
+        positions = []
+
+        async def on_queued(position, estimated_start):
+            positions.append(position)
+
+        controller.submit('a', 'uksouth', None, self.job('a'))
+        controller.submit('b', 'uksouth', None, self.job('b'))
+        ticket = controller.submit('c', 'uksouth', None, self.job('c'), on_queued=on_queued)
+        self.assertEqual(ticket["queue_position"], 2)
+
+        await self.finish('a')
+        self.assertEqual(positions, [1])
+        await self.finish('b')
+        self.assertEqual(self.started, ['a', 'b', 'c'])
+        self.assertEqual(positions, [1])
+
+
+class WorkerShareTest(unittest.TestCase):
+
+    def test_cap_is_split_over_workers(self):
+        self.assertEqual(admission.worker_share(10, 4), 2)
+
+    def test_every_worker_may_run_at_least_one_job(self):
+        self.assertEqual(admission.worker_share(3, 8), 1)
+
+    def test_zero_stays_unlimited(self):
+        self.assertEqual(admission.worker_share(0, 4), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import azure.functions as func
+
+from shared_code import idempotency
+
+
+def request(**payload):
+    return func.HttpRequest(
+        method='POST',
+        url='/api/vm',
+        headers={'Content-Type': 'application/json'},
+        params={},
+        body=json.dumps(payload).encode()
+    )
+
+
+class IdempotentTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.registry = idempotency.IdempotencyRegistry()
+        patcher = mock.patch.object(idempotency, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.job_cancelled = False
+
+    async def asyncTearDown(self):
+        self.release.set()
+        for entry in list(self.registry._entries.values()) + list(self.registry._active.values()):
+            if entry.task:
+                await asyncio.gather(entry.task, return_exceptions=True)
+
+    def handler(self, operation, supersedes=(), status_code=202):
+        """An idempotent main() whose job runs until self.release is set"""
+        @idempotency.idempotent(operation, supersedes)
+        async def main(req):
+            self.calls += 1
+            if status_code != 202:
+                return func.HttpResponse(json.dumps({"error": "nope"}), status_code=status_code)
+
+            async def job():
+                try:
+                    await self.release.wait()
+                except asyncio.CancelledError:
+                    self.job_cancelled = True
+                    raise
+                self.registry.record_status({"vm_name": "vm1", "resource_group": "rg", "status": "completed"})
+
+            idempotency.start(job())
+            return func.HttpResponse(json.dumps({"status_url": f"https://status/{self.calls}"}), status_code=202)
+
+        return main
+
+    async def test_duplicate_attaches_to_the_running_job(self):
+        main = self.handler('create')
+
+        first = await main(request(vm_name='vm1', resource_group='rg', vm_size='Standard_NV6'))
+        second = await main(request(vm_name='vm1', resource_group='rg', vm_size='Standard_NV6'))
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        body = json.loads(second.get_body())
+        self.assertEqual(body["status_url"], "https://status/1")
+        self.assertTrue(body["duplicate"])
+        self.assertEqual(body["state"], idempotency.RUNNING)
+        self.assertEqual(self.calls, 1)
+
+    async def test_completed_job_is_replayed_with_its_result(self):
+        main = self.handler('create')
+
+        await main(request(vm_name='vm1', resource_group='rg', idempotency_key='abc'))
+        self.release.set()
+        await asyncio.sleep(0.01)
+        replay = await main(request(vm_name='vm1', resource_group='rg', idempotency_key='abc'))
+
+        self.assertEqual(replay.status_code, 200)
+        body = json.loads(replay.get_body())
+        self.assertEqual(body["state"], idempotency.COMPLETED)
+        self.assertEqual(body["result"]["status"], "completed")
+        self.assertEqual(self.calls, 1)
+
+    async def test_different_request_for_a_busy_vm_conflicts(self):
+        main = self.handler('create')
+
+        await main(request(vm_name='vm1', resource_group='rg', vm_size='Standard_NV6'))
+        conflict = await main(request(vm_name='vm1', resource_group='rg', vm_size='Standard_NV12'))
+
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(json.loads(conflict.get_body())["status_url"], "https://status/1")
+        self.assertEqual(self.calls, 1)
+
+    async def test_superseding_operation_cancels_the_running_job(self):
+        create = self.handler('create')
+        delete = self.handler('delete', supersedes=('create',))
+
+        await create(request(vm_name='vm1', resource_group='rg'))
+        await asyncio.sleep(0)
+        created = self.registry.active('rg', 'vm1')
+        response = await delete(request(vm_name='vm1', resource_group='rg'))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(self.job_cancelled)
+        self.assertEqual(created.state, idempotency.CANCELLED)
+        self.assertTrue(created.stop.is_set())
+        self.assertEqual(self.registry.active('rg', 'vm1').operation, 'delete')
+
+    async def test_rejected_request_is_not_remembered(self):
+        main = self.handler('create', status_code=400)
+
+        await main(request(vm_name='vm1', resource_group='rg'))
+        await main(request(vm_name='vm1', resource_group='rg'))
+
+        self.assertEqual(self.calls, 2)
+        self.assertIsNone(self.registry.active('rg', 'vm1'))
+
+    async def test_cancel_all_only_touches_matching_jobs(self):
+        for vm_name, operation in (('a', 'create'), ('b', 'create'), ('c', 'delete')):
+            self.registry.claim(f"{operation}:{vm_name}", operation, 'rg', vm_name)
+        self.registry.claim("create:other", 'create', 'other-rg', 'a')
+
+        cancelled = await self.registry.cancel_all('RG', ('create',), vm_names=['A', 'c'])
+
+        self.assertEqual(cancelled, ['a'])
+        self.assertIsNone(self.registry.active('rg', 'a'))
+        self.assertIsNotNone(self.registry.active('rg', 'b'))
+        self.assertIsNotNone(self.registry.active('rg', 'c'))
+        self.assertIsNotNone(self.registry.active('other-rg', 'a'))
+
+
+class DeriveKeyTest(unittest.TestCase):
+
+    def test_ignores_field_order_and_the_client_key(self):
+        self.assertEqual(
+            idempotency.derive_key('create', 'vm1', 'rg', {"a": 1, "b": 2}),
+            idempotency.derive_key('create', 'VM1', 'RG', {"b": 2, "a": 1, "idempotency_key": "x"})
+        )
+
+    def test_payload_changes_the_key(self):
+        self.assertNotEqual(
+            idempotency.derive_key('create', 'vm1', 'rg', {"vm_size": "Standard_NV6"}),
+            idempotency.derive_key('create', 'vm1', 'rg', {"vm_size": "Standard_NV12"})
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
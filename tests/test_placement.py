@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+from shared_code import placement, preflight
+
+
+def preflight_result(location, vm_size, passed=True, available=50, limit=100, vcpus=4, family='standardNVFamily'):
+    """What run_preflight returns for one candidate, with a single family quota check"""
+    return {
+        "passed": passed,
+        "location": location,
+        "vm_size": vm_size,
+        "vcpus": vcpus,
+        "family": family,
+        "checks": [{"check": f"quota_{family}", "passed": passed, "message": "", "available": available, "limit": limit}],
+        "error": None if passed else f"{vm_size} is not offered in {location}",
+        "duration_ms": 0.0
+    }
+
+
+class ChoosePlacementTest(unittest.TestCase):
+
+    def setUp(self):
+        placement._outcomes.clear()
+        self.reserve_cores = mock.patch.object(preflight, 'reserve_cores').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def choose(self, results, locations, vm_sizes, vm_count=1):
+        """choose_placement with run_preflight answering from {(location, vm_size): result}"""
+        def run_preflight(compute_client, location, vm_size, image=None, vm_count=1):
+            return results[(location, vm_size)]
+
+        with mock.patch.object(preflight, 'run_preflight', side_effect=run_preflight):
+            return placement.choose_placement(None, locations, vm_sizes, vm_count=vm_count)
+
+    def test_requested_candidate_wins_when_scores_tie(self):
+        decision = self.choose({
+            ("uksouth", "Standard_NV6"): preflight_result("uksouth", "Standard_NV6"),
+            ("westeurope", "Standard_NV6"): preflight_result("westeurope", "Standard_NV6"),
+        }, ["uksouth", "westeurope"], ["Standard_NV6"])
+
+        self.assertTrue(decision["passed"])
+        self.assertEqual((decision["location"], decision["vm_size"]), ("uksouth", "Standard_NV6"))
+        self.assertFalse(decision["redirected"])
+        self.assertEqual([c["score"] for c in decision["candidates"]], [0.5, 0.45])
+
+    def test_more_free_quota_outweighs_preference(self):
+        decision = self.choose({
+            ("uksouth", "Standard_NV6"): preflight_result("uksouth", "Standard_NV6", available=10),
+            ("westeurope", "Standard_NV6"): preflight_result("westeurope", "Standard_NV6", available=80),
+        }, ["uksouth", "westeurope"], ["Standard_NV6"])
+
+        self.assertEqual(decision["location"], "westeurope")
+        self.assertTrue(decision["redirected"])
+        self.assertEqual(decision["requested"], {"location": "uksouth", "vm_size": "Standard_NV6"})
+
+    def test_recent_allocation_failures_are_penalised(self):
+        placement.record_allocation("uksouth", "Standard_NV6", False)
+        placement.record_allocation("uksouth", "Standard_NV6", True)
+
+        decision = self.choose({
+            ("uksouth", "Standard_NV6"): preflight_result("uksouth", "Standard_NV6", available=90),
+            ("uksouth", "Standard_NV12"): preflight_result("uksouth", "Standard_NV12", available=50),
+        }, ["uksouth"], ["Standard_NV6", "Standard_NV12"])
+
+        self.assertEqual(decision["vm_size"], "Standard_NV12")
+        self.assertEqual(decision["candidates"][0]["failure_rate"], 0.5)
+        self.assertEqual(decision["candidates"][0]["score"], round(0.9 - placement.FAILURE_PENALTY * 0.5, 4))
+
+    def test_failing_candidates_are_never_chosen(self):
+        decision = self.choose({
+            ("uksouth", "Standard_NV6"): preflight_result("uksouth", "Standard_NV6", passed=False, available=99),
+            ("westeurope", "Standard_NV6"): preflight_result("westeurope", "Standard_NV6", available=1),
+        }, ["uksouth", "westeurope"], ["Standard_NV6"])
+
+        self.assertEqual(decision["location"], "westeurope")
+        self.assertIsNone(decision["candidates"][0]["score"])
+
+    def test_no_viable_candidate_reports_the_requested_one(self):
+        decision = self.choose({
+            ("uksouth", "Standard_NV6"): preflight_result("uksouth", "Standard_NV6", passed=False),
+            ("westeurope", "Standard_NV6"): preflight_result("westeurope", "Standard_NV6", passed=False),
+        }, ["uksouth", "westeurope"], ["Standard_NV6"])
+
+        self.assertFalse(decision["passed"])
+        self.assertEqual((decision["location"], decision["vm_size"]), ("uksouth", "Standard_NV6"))
+        self.assertEqual(decision["error"], "Standard_NV6 is not offered in uksouth")
+        self.assertFalse(decision["redirected"])
+        self.reserve_cores.assert_not_called()
+
+    def test_no_candidates(self):
+        decision = placement.choose_placement(None, [], ["Standard_NV6"])
+
+        self.assertFalse(decision["passed"])
+        self.assertEqual(decision["error"], "No candidate regions or sizes given")
+
+    def test_winner_cores_are_reserved(self):
+        self.choose({
+            ("uksouth", "Standard_NV6"): preflight_result("uksouth", "Standard_NV6", vcpus=6),
+        }, ["uksouth"], ["Standard_NV6"], vm_count=3)
+
+        self.reserve_cores.assert_called_once_with("uksouth", "standardNVFamily", 18)
+
+
+if __name__ == '__main__':
+    unittest.main()
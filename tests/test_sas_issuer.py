@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from shared_code import sas_issuer
+
+
+class PermissionsTest(unittest.TestCase):
+
+    def test_container_permissions(self):
+        parsed = sas_issuer.permissions("rwl")
+        self.assertTrue(parsed.read and parsed.write and parsed.list)
+        self.assertFalse(parsed.delete)
+
+    def test_blob_permissions(self):
+        parsed = sas_issuer.permissions("rc", blob=True)
+        self.assertTrue(parsed.read and parsed.create)
+
+    def test_repeated_letters_are_accepted(self):
+        self.assertTrue(sas_issuer.permissions("rr").read)
+
+    def test_unknown_letters_are_rejected(self):
+        with self.assertRaisesRegex(ValueError, "container SAS permissions 'rq'"):
+            sas_issuer.permissions("rq")
+
+    def test_unknown_blob_letters_are_rejected(self):
+        with self.assertRaisesRegex(ValueError, "blob SAS permissions 'rz'"):
+            sas_issuer.permissions("rz", blob=True)
+
+    def test_empty_permissions_are_rejected(self):
+        for value in ("", None):
+            with self.assertRaises(ValueError):
+                sas_issuer.permissions(value)
+
+
+class DelegationKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        sas_issuer.invalidate()
+        self.addCleanup(sas_issuer.invalidate)
+        self.requests = []      # (start, expiry) of every get_user_delegation_key call
+        requests = self.requests
+
+        class BlobServiceClient:
+            def __init__(self, account_url, credential, **kwargs):
+                pass
+
+            def get_user_delegation_key(self, key_start_time, key_expiry_time):
+                requests.append((key_start_time, key_expiry_time))
+                return f"key-{len(requests)}"
+
+        patcher = mock.patch.object(sas_issuer, 'BlobServiceClient', BlobServiceClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_covers_the_default_lifetime_and_starts_in_the_past(self):
+        now = datetime.utcnow()
+        sas_issuer.delegation_key(None, 'account', now + timedelta(hours=1))
+
+        start, expiry = self.requests[0]
+        self.assertLess(start, now)
+        self.assertGreaterEqual(expiry, now + timedelta(hours=sas_issuer.DELEGATION_KEY_HOURS))
+
+    def test_key_is_reused_while_it_covers_the_request(self):
+        valid_until = datetime.utcnow() + timedelta(hours=1)
+
+        first = sas_issuer.delegation_key(None, 'account', valid_until)
+        second = sas_issuer.delegation_key(None, 'ACCOUNT', valid_until + timedelta(hours=1))
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_key_is_replaced_when_the_request_outlives_it(self):
+        now = datetime.utcnow()
+        sas_issuer.delegation_key(None, 'account', now + timedelta(hours=1))
+        longer = now + timedelta(hours=sas_issuer.DELEGATION_KEY_HOURS, days=1)
+
+        key = sas_issuer.delegation_key(None, 'account', longer)
+
+        self.assertEqual(key, "key-2")
+        self.assertGreaterEqual(self.requests[1][1], longer)
+
+    def test_key_is_not_cached_inside_the_refresh_margin(self):
+        with mock.patch.object(sas_issuer, 'DELEGATION_REFRESH_SECONDS', sas_issuer.DELEGATION_KEY_HOURS * 3600):
+            sas_issuer.delegation_key(None, 'account', datetime.utcnow())
+            sas_issuer.delegation_key(None, 'account', datetime.utcnow())
+
+        self.assertEqual(len(self.requests), 2)
+
+    def test_expiry_is_capped_at_seven_days(self):
+        now = datetime.utcnow()
+        sas_issuer.delegation_key(None, 'account', now + timedelta(days=7) - timedelta(minutes=1))
+
+        self.assertLessEqual(self.requests[0][1], datetime.utcnow() + sas_issuer.MAX_DELEGATION_KEY_AGE)
+
+    def test_more_than_seven_days_is_rejected(self):
+        with self.assertRaises(ValueError):
+            sas_issuer.delegation_key(None, 'account', datetime.utcnow() + timedelta(days=8))
+        self.assertEqual(self.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import logging
+import json
+import azure.functions as func
+from shared_code import arm_throttle, arm_usage, bootstrap, warm_pool
+
+ClientSecretCredential = bootstrap.lazy('azure.identity', 'ClientSecretCredential')
+ComputeManagementClient = bootstrap.lazy('azure.mgmt.compute', 'ComputeManagementClient')
+
+
+@arm_usage.metered
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Processing request for warm pool status.')
+
+    try:
+        credentials = ClientSecretCredential(
+            client_id=os.environ['AZURE_APP_CLIENT_ID'],
+            client_secret=os.environ['AZURE_APP_CLIENT_SECRET'],
+            tenant_id=os.environ['AZURE_APP_TENANT_ID']
+        )
+
+        # POST tops every pool up now instead of waiting for the next create_vm request
+        started = []
+        if req.method == "POST":
+            from create_vm import replenish_warm_pool
+            started = await replenish_warm_pool(credentials, force=True)
+
+        compute_client = ComputeManagementClient(
+            credentials, os.environ['AZURE_SUBSCRIPTION_ID'], **arm_throttle.client_kwargs(arm_throttle.LOW)
+        )
+        pools = []
+        for target in warm_pool.targets():
+            key = warm_pool.target_key(compute_client, target)
+            pools.append({
+                "resource_group": target["resource_group"],
+                "location": target["location"],
+                "vm_size": target["vm_size"],
+                "image": f"{target['gallery_name']}/{target['gallery_image_name']}",
+                "key": key,
+                "target": int(target["count"]),
+                "depth": warm_pool.depth(compute_client, target["resource_group"], key) if key else None
+            })
+
+        # Counters and claim latency are per worker process
+        result = {
+            "pools": pools,
+            "metrics": warm_pool.metrics.snapshot(),
+            "provisioning_started": started
+        }
+        return func.HttpResponse(
+            json.dumps(result),
+            status_code=202 if started else 200,
+            mimetype="application/json"
+        )
+
+    except Exception as ex:
+        logging.exception("Unhandled error:")
+        return func.HttpResponse(
+            json.dumps({"error": str(ex)}),
+            status_code=500,
+            mimetype="application/json"
+        )